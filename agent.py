@@ -1,16 +1,24 @@
 import requests
 import json
+import gzip
 import time
-import platform
+import random
 import logging
 import os
 import sys
+from datetime import datetime
 from logging.handlers import RotatingFileHandler
 
 # Importa il nuovo modulo per la gestione sicura delle credenziali
 import credentials
-# Importa il nuovo modulo per la gestione SSL/TLS
-import ssl_manager
+# Connessione persistente (keep-alive e ripresa della sessione TLS)
+import agent_transport
+# Buffer su disco dei campioni non inviati
+import agent_buffer
+# Formati compatti dei report (agent_id + metriche)
+import wire_format
+# Campionamento non bloccante delle metriche
+import agent_sampler
 
 # Importa psutil solo se disponibile
 try:
@@ -56,27 +64,152 @@ logger = setup_agent_logging()
 
 class AgentError(Exception):
     """Eccezione personalizzata per errori specifici dell'agent."""
-    def __init__(self, message, error_code=None):
+    def __init__(self, message, error_code=None, retry_after=None):
         self.message = message
         self.error_code = error_code
+        self.retry_after = retry_after
         super().__init__(self.message)
 
+    @property
+    def retryable(self):
+        """True se l'invio può riuscire più tardi (rete, sovraccarico, errori del server)."""
+        return self.error_code is None or self.error_code == 429 or self.error_code >= 500
+
 # --- Funzioni di Raccolta Dati ---
 
-def get_system_info():
-    """Raccoglie le informazioni di base sul sistema."""
+# --- Collector delle metriche aggiuntive ---
+# Ogni collector dichiara costo e intervallo minimo (secondi, 0 = a ogni report);
+# intervalli e disattivazioni si possono cambiare con la chiave 'collectors' di config.json.
+
+collectors = agent_sampler.CollectorRegistry()
+collector = collectors.register
+
+# Numero di processi riportati da top_processes
+TOP_PROCESSES = 5
+
+_net_io_rates = agent_sampler.RateCounter()
+_disk_io_rates = agent_sampler.RateCounter()
+
+@collector('load_avg', cost='low')
+def collect_load_avg():
+    """Load average a 1, 5 e 15 minuti."""
+    return {'load_avg': [round(value, 2) for value in psutil.getloadavg()]}
+
+@collector('uptime', cost='low')
+def collect_uptime():
+    """Secondi dall'avvio dell'host."""
+    return {'uptime': int(time.time() - psutil.boot_time())}
+
+@collector('net_io', cost='low')
+def collect_net_io():
+    """Traffico di rete complessivo in byte e pacchetti al secondo."""
+    counters = psutil.net_io_counters()
+    rates = _net_io_rates.update({
+        'bytes_sent': counters.bytes_sent, 'bytes_recv': counters.bytes_recv,
+        'packets_sent': counters.packets_sent, 'packets_recv': counters.packets_recv,
+    })
+    return {'net_io': rates} if rates else {}
+
+@collector('processes', cost='medium', interval=60)
+def collect_process_count():
+    """Numero di processi in esecuzione."""
+    return {'processes': len(psutil.pids())}
+
+@collector('disk_io', cost='medium', interval=60)
+def collect_disk_io():
+    """Byte letti e scritti al secondo per ogni disco."""
+    counters = {}
+    for device, io in (psutil.disk_io_counters(perdisk=True) or {}).items():
+        counters[(device, 'read_bytes')] = io.read_bytes
+        counters[(device, 'write_bytes')] = io.write_bytes
+    devices = {}
+    for (device, field), rate in _disk_io_rates.update(counters).items():
+        devices.setdefault(device, {})[field] = rate
+    return {'disk_io': devices} if devices else {}
+
+@collector('mounts', cost='medium', interval=300)
+def collect_mounts():
+    """Occupazione percentuale di ogni punto di mount."""
+    mounts = {}
+    for partition in psutil.disk_partitions(all=False):
+        try:
+            mounts[partition.mountpoint] = psutil.disk_usage(partition.mountpoint).percent
+        except OSError:
+            # Unità non pronte (es. lettori ottici) o senza permessi
+            continue
+    return {'mounts': mounts}
+
+@collector('top_processes', cost='high', interval=300)
+def collect_top_processes():
+    """
+    I TOP_PROCESSES processi con più CPU dall'esecuzione precedente
+    (alla prima esecuzione l'ordine è dato dalla memoria).
+    """
+    processes = []
+    for proc in psutil.process_iter(['pid', 'name', 'memory_percent']):
+        try:
+            cpu = proc.cpu_percent(interval=None)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        processes.append({'pid': proc.info['pid'], 'name': proc.info['name'], 'cpu': cpu,
+                          'memory': round(proc.info['memory_percent'] or 0.0, 2)})
+    processes.sort(key=lambda p: (p['cpu'], p['memory']), reverse=True)
+    return {'top_processes': processes[:TOP_PROCESSES]}
+
+def log_collector_stats():
+    """Registra nel log esecuzioni, errori e tempo CPU medio di ogni collector."""
+    for name, stats in collectors.stats().items():
+        if stats['runs']:
+            logger.info(f"[COLLECTOR] {name} ({stats['cost']}, ogni {stats['interval']}s): "
+                        f"{stats['runs']} esecuzioni, {stats['errors']} errori, "
+                        f"CPU {stats['cpu_ms']} ms, tempo {stats['wall_ms']} ms")
+
+# Finestre consecutive oltre il budget prima di ridurre il costo dell'agent
+# (la prima finestra include l'avvio e l'handshake TLS)
+OVERHEAD_GRACE_CYCLES = 2
+
+def enforce_overhead_budget(overhead, usage, over_budget_cycles, sampler, ticker, config):
+    """
+    Confronta il costo misurato con il budget. Oltre il budget di CPU per
+    OVERHEAD_GRACE_CYCLES cicli consecutivi riduce il costo di un passo
+    (collector, campionamento, intervallo di raccolta); la memoria oltre il
+    budget viene solo segnalata, perché allungare gli intervalli non la riduce.
+    Restituisce il nuovo numero di cicli consecutivi oltre il budget.
+    """
+    exceeded = overhead.over_budget(usage)
+    if 'rss_mb' in exceeded:
+        logger.warning(f"[OVERHEAD] Memoria dell'agent {usage['rss_mb']} MB oltre il budget di {config['max_rss_mb']} MB")
+    if 'cpu_percent' not in exceeded:
+        return 0
+    over_budget_cycles += 1
+    if over_budget_cycles < OVERHEAD_GRACE_CYCLES:
+        return over_budget_cycles
+    action = overhead.reduce(collectors, sampler, ticker, config['collection_interval'])
+    if action:
+        logger.warning(f"[OVERHEAD] CPU dell'agent {usage['cpu_percent']}% oltre il budget di "
+                       f"{config['max_cpu_percent']}%: {action}")
+    return 0
+
+# Campionatore usato quando get_system_info() è chiamata senza argomenti
+_default_sampler = None
+
+def get_system_info(sampler=None):
+    """
+    Raccoglie le informazioni di base sul sistema senza bloccare: la CPU è la
+    media dall'ultima chiamata e i dati statici sono letti una volta sola.
+    Al report si aggiungono le metriche dei collector dovuti in questo ciclo.
+    """
+    global _default_sampler
     try:
-        return {
-            "cpu_usage": psutil.cpu_percent(interval=1),
-            "memory": psutil.virtual_memory().percent,
-            "disk": psutil.disk_usage('/').percent,
-            "system": platform.system(),
-            "node": platform.node(),
-            "release": platform.release(),
-            "version": platform.version(),
-        }
+        if sampler is None:
+            if _default_sampler is None:
+                _default_sampler = agent_sampler.MetricSampler()
+            sampler = _default_sampler
+        report = sampler.collect()
     except Exception as e:
         raise AgentError(f"Errore critico durante la raccolta dati di sistema: {e}")
+    report.update(collectors.collect())
+    return report
 
 # --- Funzioni di Configurazione e Comunicazione ---
 
@@ -106,7 +239,22 @@ def load_config():
         default_url = config.get('server_url', 'https://localhost:5000/api/report')
         final_config = {
             'server_url': default_url,
+            # Endpoint per i campioni accumulati durante le interruzioni
+            'batch_url': config.get('batch_url', default_url.rstrip('/') + '/batch'),
+            'batch_size': config.get('batch_size', 500),
+            # json (completo), compact (JSON con agent_id) o binary (frame a 19 byte)
+            'report_format': config.get('report_format', 'json'),
+            'register_url': config.get('register_url', default_url.rsplit('/report', 1)[0] + '/agents/register'),
+            'buffer_path': config.get('buffer_path', os.path.join('data', 'agent_buffer.db')),
+            'buffer_max_samples': config.get('buffer_max_samples', 50000),
             'collection_interval': config.get('collection_interval', 60),
+            # Secondi tra due campioni locali (None: uno per invio)
+            'sample_interval': config.get('sample_interval'),
+            # Intervallo (secondi) dei collector o false per disattivarli, es. {"top_processes": 600}
+            'collectors': config.get('collectors', {}),
+            # Budget dell'agent: CPU in percentuale di un core e memoria residente (null: nessun limite)
+            'max_cpu_percent': config.get('max_cpu_percent', 2.0),
+            'max_rss_mb': config.get('max_rss_mb', 150),
             'username': username,
             'password': password,
             'verify_ssl': config.get('verify_ssl', False)  # False per certificati auto-firmati
@@ -115,6 +263,23 @@ def load_config():
         # Validazione
         if not isinstance(final_config['collection_interval'], int) or final_config['collection_interval'] < 10:
             raise AgentError("L'intervallo di raccolta deve essere un numero intero >= 10.")
+        if not isinstance(final_config['batch_size'], int) or not 1 <= final_config['batch_size'] <= 1000:
+            raise AgentError("La dimensione dei batch deve essere un numero intero tra 1 e 1000.")
+        sample_interval = final_config['sample_interval']
+        if sample_interval is not None and (not isinstance(sample_interval, (int, float))
+                                            or not 0.1 <= sample_interval <= final_config['collection_interval']):
+            raise AgentError("L'intervallo di campionamento deve essere tra 0.1 e l'intervallo di raccolta.")
+        if not isinstance(final_config['collectors'], dict) or not all(
+                value is False or value is None
+                or (isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0)
+                for value in final_config['collectors'].values()):
+            raise AgentError("I collector vanno configurati come {nome: secondi >= 0 oppure false}.")
+        for budget in ('max_cpu_percent', 'max_rss_mb'):
+            value = final_config[budget]
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+                raise AgentError(f"Il budget '{budget}' deve essere un numero positivo o null.")
+        if final_config['report_format'] not in ('json', 'compact', 'binary'):
+            raise AgentError("Il formato dei report deve essere 'json', 'compact' o 'binary'.")
         
         logger.info(f"✅ Configurazione caricata per utente: {username}")
         logger.info(f"🌐 Server URL: {final_config['server_url']}")
@@ -128,57 +293,50 @@ def load_config():
         raise AgentError(f"❌ Errore imprevisto nel caricamento della configurazione: {e}")
 
 
-def send_data_to_server(data, config):
+# Trasporto condiviso da tutti gli invii, ricreato solo se cambia la configurazione TLS
+_transport = None
+_transport_verify_ssl = None
+
+def get_transport(config):
+    """Restituisce la connessione persistente verso il server."""
+    global _transport, _transport_verify_ssl
+    verify_ssl = config.get('verify_ssl', False)
+    if _transport is None or _transport_verify_ssl != verify_ssl:
+        if _transport is not None:
+            _transport.close()
+        _transport = agent_transport.AgentTransport(verify_ssl)
+        _transport_verify_ssl = verify_ssl
+        if config['server_url'].startswith('https://'):
+            logger.info(f"[HTTPS] Connessione sicura a {config['server_url']}")
+    return _transport
+
+def post_to_server(url, config, **kwargs):
     """
-    Invia i dati al server utilizzando l'autenticazione Basic con supporto HTTPS.
+    Esegue una POST autenticata verso il server sulla connessione persistente.
     Gestisce certificati auto-firmati per sviluppo e certificati validi per produzione.
+    Restituisce la risposta se lo stato è 200, altrimenti solleva AgentError.
     """
+    is_https = url.startswith('https://')
     try:
-        # Determina se usare HTTPS
-        is_https = config['server_url'].startswith('https://')
-        verify_ssl = config.get('verify_ssl', False)
-        
-        # Configurazione SSL per HTTPS
-        ssl_context = None
-        if is_https:
-            try:
-                ssl_mgr = ssl_manager.create_ssl_manager()
-                ssl_context = ssl_mgr.get_client_ssl_context(verify_cert=verify_ssl)
-                logger.info(f"[HTTPS] Connessione sicura a {config['server_url']}")
-                if not verify_ssl:
-                    logger.info("[HTTPS] Certificati auto-firmati accettati (sviluppo)")
-            except Exception as e:
-                logger.warning(f"[HTTPS] Errore configurazione SSL: {e}")
-                # Fallback: disabilita verifica SSL per certificati auto-firmati
-                verify_ssl = False
-        
-        # Configurazione della sessione requests
-        session = requests.Session()
-        if is_https:
-            session.verify = verify_ssl
-            if not verify_ssl:
-                # Disabilita warning per certificati non verificati
-                import urllib3
-                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        
-        # Invio dati al server
-        response = session.post(
-            config['server_url'],
-            json=data,
+        response = get_transport(config).post(
+            url,
             auth=(config['username'], config['password']),
-            headers={'Content-Type': 'application/json'},
-            timeout=15
+            timeout=15,
+            **kwargs
         )
 
         if response.status_code == 200:
-            protocol = "HTTPS" if is_https else "HTTP"
-            logger.info(f"[{protocol}] Dati inviati con successo a {config['server_url']}")
-            return True
+            return response
         elif response.status_code == 401:
             raise AgentError("[AUTH] Autenticazione fallita (401). Controllare username e password.", error_code=401)
         else:
-            raise AgentError(f"[SERVER] Errore dal server: {response.status_code} - {response.text}", error_code=response.status_code)
+            retry_after = response.headers.get('Retry-After')
+            raise AgentError(f"[SERVER] Errore dal server: {response.status_code} - {response.text}",
+                             error_code=response.status_code,
+                             retry_after=int(retry_after) if retry_after and retry_after.isdigit() else None)
 
+    except AgentError:
+        raise
     except requests.exceptions.SSLError as e:
         logger.error(f"[SSL] Errore SSL: {e}")
         if "certificate verify failed" in str(e).lower():
@@ -196,6 +354,103 @@ def send_data_to_server(data, config):
     except Exception as e:
         raise AgentError(f"[ERROR] Errore imprevisto durante l'invio dei dati: {e}")
 
+def log_transport_stats():
+    """Registra nel log richieste, riconnessioni e handshake TLS della connessione persistente."""
+    if _transport is None:
+        return
+    stats = _transport.stats()
+    logger.info(f"[STATS] Richieste: {stats['requests']}, sessioni: {stats['sessions']}, "
+                f"riconnessioni: {stats['reconnects']}, handshake TLS: {stats['tls_handshakes']} "
+                f"(completi: {stats['tls_full_handshakes']}, ripresi: {stats['tls_resumed']})")
+
+# Dati statici dell'host e agent_id assegnato dal server alla registrazione
+STATIC_FIELDS = ('system', 'node', 'release', 'version')
+_registration = None
+
+def register_agent(data, config):
+    """
+    Registra i dati statici dell'host e restituisce l'agent_id usato dai
+    report compatti. Si ripete solo se i dati statici cambiano.
+    """
+    global _registration
+    facts = {field: data[field] for field in STATIC_FIELDS}
+    key = tuple(facts.values())
+    if _registration is None or _registration[0] != key:
+        response = post_to_server(config['register_url'], config, json=facts,
+                                  headers={'Content-Type': 'application/json'})
+        _registration = (key, response.json()['agent_id'])
+        logger.info(f"[REGISTER] Agent registrato con agent_id={_registration[1]}")
+    return _registration[1]
+
+def build_report_request(data, config):
+    """Prepara corpo e header del report nel formato configurato."""
+    report_format = config.get('report_format', 'json')
+    if report_format == 'json':
+        return {'json': data, 'headers': {'Content-Type': 'application/json'}}
+    agent_id = register_agent(data, config)
+    if report_format == 'binary':
+        return {'data': wire_format.encode_frame(agent_id, data),
+                'headers': {'Content-Type': wire_format.CONTENT_TYPE_FRAME}}
+    # Il formato binario porta solo le metriche di base; quello compatto
+    # tutto il report tranne i dati statici e il timestamp
+    compact = {key: value for key, value in data.items()
+               if key not in STATIC_FIELDS and key != 'timestamp'}
+    compact['agent_id'] = agent_id
+    return {'json': compact, 'headers': {'Content-Type': 'application/json'}}
+
+def send_data_to_server(data, config):
+    """Invia un singolo campione all'endpoint /api/report."""
+    global _registration
+    try:
+        post_to_server(config['server_url'], config, **build_report_request(data, config))
+    except AgentError as e:
+        if e.error_code != 409:
+            raise
+        # Il server non conosce più l'agent_id (es. database ricreato): nuova registrazione
+        _registration = None
+        post_to_server(config['server_url'], config, **build_report_request(data, config))
+    protocol = "HTTPS" if config['server_url'].startswith('https://') else "HTTP"
+    logger.info(f"[{protocol}] Dati inviati con successo a {config['server_url']}")
+    return True
+
+def send_batch_to_server(samples, config):
+    """
+    Invia un blocco di campioni con timestamp all'endpoint batch, compresso gzip.
+    'sent_at' permette al server di correggere lo scarto tra gli orologi.
+    Restituisce la risposta del server ({'accepted': n, 'rejected': [...]}).
+    """
+    body = json.dumps({'sent_at': datetime.now().isoformat(), 'samples': samples},
+                      separators=(',', ':')).encode('utf-8')
+    response = post_to_server(config['batch_url'], config, data=gzip.compress(body),
+                              headers={'Content-Type': 'application/json',
+                                       'Content-Encoding': 'gzip'})
+    return response.json()
+
+def flush_buffer(buffer, config):
+    """
+    Svuota il buffer su disco a blocchi di config['batch_size'] campioni.
+    I blocchi rifiutati per intero dal server (400) vengono scartati per non
+    bloccare la coda; gli altri errori interrompono lo svuotamento.
+    """
+    while len(buffer):
+        pending = buffer.peek(config['batch_size'])
+        ids = [row_id for row_id, _ in pending]
+        try:
+            result = send_batch_to_server([sample for _, sample in pending], config)
+        except AgentError as e:
+            if e.retryable or e.error_code == 401:
+                raise
+            logger.error(f"[BUFFER] Blocco di {len(ids)} campioni scartato dal server: {e.message}")
+            buffer.remove(ids)
+            continue
+        buffer.remove(ids)
+        rejected = result.get('rejected') or []
+        if rejected:
+            logger.warning(f"[BUFFER] {len(rejected)} campioni scartati dal server, "
+                           f"primo errore: {rejected[0].get('error')}")
+        logger.info(f"[BUFFER] Inviati {result.get('accepted', 0)} campioni accumulati, "
+                    f"{len(buffer)} ancora in attesa")
+
 # --- Ciclo Principale dell'Agent ---
 
 def run_agent():
@@ -209,32 +464,77 @@ def run_agent():
         logger.critical(f"Errore fatale all'avvio: {e.message}")
         sys.exit(1)
 
+    # Campioni non inviati: conservati su disco e ricaricati a blocchi
+    buffer = agent_buffer.SampleBuffer(config['buffer_path'], config['buffer_max_samples'])
     consecutive_errors = 0
-    max_consecutive_errors = 5
+    next_attempt = 0.0
+    # Statistiche di connessione nel log circa una volta l'ora
+    stats_every = max(1, 3600 // config['collection_interval'])
+    cycles = 0
+    # Campionamento locale e invii a frequenza fissa
+    sampler = agent_sampler.MetricSampler(config['sample_interval'])
+    sampler.start()
+    collectors.configure(config['collectors'])
+    ticker = agent_sampler.FixedRateTicker(config['collection_interval'])
+    # Costo dell'agent stesso, riportato in ogni report e confrontato con il budget
+    overhead = agent_sampler.OverheadMonitor(config['max_cpu_percent'], config['max_rss_mb'])
+    over_budget_cycles = 0
 
     while True:
+        cycle_start = time.monotonic()
+        cycles += 1
+        if cycles % stats_every == 0:
+            log_transport_stats()
+            log_collector_stats()
+        system_info = None
+        buffered = False
         try:
-            system_info = get_system_info()
-            send_data_to_server(system_info, config)
-            consecutive_errors = 0  # Reset su successo
-            time.sleep(config['collection_interval'])
+            with overhead.measure('collect'):
+                system_info = get_system_info(sampler)
+            # Costo del ciclo precedente (raccolta, invio, CPU e memoria del processo)
+            usage = overhead.snapshot()
+            system_info['agent_overhead'] = usage
+            over_budget_cycles = enforce_overhead_budget(overhead, usage, over_budget_cycles,
+                                                         sampler, ticker, config)
+            if cycle_start < next_attempt:
+                # In attesa del prossimo tentativo: si raccoglie soltanto
+                buffer.append(system_info)
+                buffered = True
+            else:
+                with overhead.measure('send'):
+                    if not len(buffer):
+                        send_data_to_server(system_info, config)
+                    else:
+                        buffer.append(system_info)
+                        buffered = True
+                        flush_buffer(buffer, config)
+                consecutive_errors = 0  # Reset su successo
+                next_attempt = 0.0
 
         except AgentError as e:
-            consecutive_errors += 1
-            logger.error(f"Errore (tentativo {consecutive_errors}/{max_consecutive_errors}): {e.message}")
-
             if e.error_code == 401:
-                logger.critical("Errore di autenticazione. L'agent verrà arrestato.")
+                logger.critical(f"{e.message} L'agent verrà arrestato.")
                 break # Esce dal ciclo in caso di errore di autenticazione
 
-            if consecutive_errors >= max_consecutive_errors:
-                logger.critical("Raggiunto il numero massimo di errori consecutivi. L'agent si arresta.")
-                break
-
-            # Calcolo del ritardo con backoff esponenziale
-            retry_delay = min(300, config['collection_interval'] * (2 ** (consecutive_errors - 1)))
-            logger.info(f"Prossimo tentativo tra {retry_delay:.1f} secondi.")
-            time.sleep(retry_delay)
+            if system_info is None:
+                logger.error(f"Errore nella raccolta dati: {e.message}")
+            elif not e.retryable:
+                # Campione rifiutato dal server: ritentarlo non servirebbe
+                logger.error(f"Campione scartato: {e.message}")
+            else:
+                if not buffered:
+                    buffer.append(system_info)
+                consecutive_errors += 1
+
+                # Backoff esponenziale con jitter, per non far riconnettere
+                # tutti gli agent nello stesso istante quando il server torna
+                retry_delay = min(300, config['collection_interval'] * (2 ** min(consecutive_errors - 1, 8)))
+                retry_delay *= random.uniform(0.5, 1.0)
+                if e.retry_after:
+                    retry_delay = max(retry_delay, e.retry_after)
+                next_attempt = time.monotonic() + retry_delay
+                logger.error(f"Errore (tentativo {consecutive_errors}): {e.message}")
+                logger.info(f"{len(buffer)} campioni nel buffer, prossimo invio tra {retry_delay:.1f} secondi.")
 
         except KeyboardInterrupt:
             logger.info("Arresto dell'agent richiesto dall'utente.")
@@ -243,6 +543,22 @@ def run_agent():
             logger.critical(f"Errore non gestito nel ciclo principale: {e}", exc_info=True)
             break
 
+        try:
+            ticker.wait()
+        except KeyboardInterrupt:
+            logger.info("Arresto dell'agent richiesto dall'utente.")
+            break
+
+    sampler.stop()
+    if overhead.reductions:
+        logger.info(f"[OVERHEAD] Riduzioni applicate: {', '.join(overhead.reductions)}")
+    if ticker.skipped:
+        logger.info(f"[STATS] Cicli saltati per invii più lunghi dell'intervallo: {ticker.skipped}")
+    log_transport_stats()
+    log_collector_stats()
+    if _transport is not None:
+        _transport.close()
+    buffer.close()
     logger.info("Agent terminato.")
 
 
@@ -0,0 +1,91 @@
+"""
+Buffer su disco dei campioni dell'agent.
+Quando il server non è raggiungibile l'agent accumula i campioni in un
+database SQLite locale (buffer circolare: oltre la capacità massima vengono
+scartati i più vecchi) e li ricarica a blocchi su /api/report/batch appena
+il server torna disponibile. Il buffer sopravvive al riavvio dell'agent.
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import List, Tuple
+
+logger = logging.getLogger('agent')
+
+class SampleBuffer:
+    """Coda FIFO persistente e limitata di campioni (dict JSON)."""
+
+    def __init__(self, path: str = None, max_samples: int = None):
+        """
+        Inizializza il buffer.
+
+        Args:
+            path: File SQLite del buffer
+            max_samples: Campioni massimi conservati (i più vecchi vengono scartati)
+        """
+        self.path = path or os.getenv('NETMASTER_AGENT_BUFFER', os.path.join('data', 'agent_buffer.db'))
+        self.max_samples = max_samples or int(os.getenv('NETMASTER_AGENT_BUFFER_MAX', 50000))
+        self.dropped = 0
+
+        buffer_dir = os.path.dirname(self.path)
+        if buffer_dir:
+            os.makedirs(buffer_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS samples (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+        if self._count:
+            logger.info(f"[BUFFER] {self._count} campioni in attesa di invio da una sessione precedente")
+
+    def __len__(self):
+        return self._count
+
+    def append(self, sample: dict):
+        """Aggiunge un campione, scartando i più vecchi oltre la capacità massima."""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO samples (payload) VALUES (?)",
+                               (json.dumps(sample, separators=(',', ':')),))
+            self._count += 1
+            excess = self._count - self.max_samples
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM samples WHERE id IN (SELECT id FROM samples ORDER BY id LIMIT ?)",
+                    (excess,))
+                self._count -= excess
+                if not self.dropped:
+                    logger.warning(f"[BUFFER] Capacità raggiunta ({self.max_samples} campioni): "
+                                   f"scarto dei campioni più vecchi")
+                self.dropped += excess
+
+    def peek(self, limit: int) -> List[Tuple[int, dict]]:
+        """Restituisce fino a `limit` campioni più vecchi come [(id, campione), ...]."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, payload FROM samples ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def remove(self, ids: List[int]):
+        """Rimuove i campioni inviati con successo."""
+        if not ids:
+            return
+        with self._lock, self._conn:
+            removed = self._conn.executemany(
+                "DELETE FROM samples WHERE id = ?", [(row_id,) for row_id in ids]).rowcount
+            self._count -= removed
+
+    def close(self):
+        """Chiude il database del buffer."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,381 @@
+"""
+Campionamento delle metriche dell'agent.
+La CPU viene letta con psutil.cpu_percent(interval=None), cioè come
+utilizzo medio dall'ultima lettura, senza bloccare l'agent. Con un
+intervallo di campionamento inferiore al periodo di invio, un thread
+legge CPU e memoria a frequenza fissa e il report contiene media, minimo
+e massimo del periodo: più risoluzione senza più traffico di rete.
+I dati statici dell'host vengono letti una sola volta.
+Le metriche aggiuntive (rete, I/O, processi...) sono fornite da collector
+registrati in un CollectorRegistry: ognuno dichiara costo e intervallo, così
+quelli costosi girano meno spesso e il tempo CPU speso da ciascuno è misurato.
+L'OverheadMonitor misura il costo dell'agent stesso (CPU, RSS, durata di
+raccolta e invio) e, oltre il budget configurato, lo riduce un passo alla volta.
+"""
+
+import math
+import time
+import logging
+import platform
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict
+
+import psutil
+
+logger = logging.getLogger('agent')
+
+def read_static_info() -> dict:
+    """Legge i dati statici dell'host (invariati per tutta la vita dell'agent)."""
+    return {
+        "system": platform.system(),
+        "node": platform.node(),
+        "release": platform.release(),
+        "version": platform.version(),
+    }
+
+class FixedRateTicker:
+    """
+    Scandisce istanti a frequenza fissa sull'orologio monotono: il ritardo di
+    un ciclo non sposta i successivi e i tick persi vengono saltati.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_tick = time.monotonic() + interval
+        self.skipped = 0
+
+    def wait(self, stop_event: threading.Event = None) -> bool:
+        """Attende il prossimo tick. Restituisce False se stop_event è stato impostato."""
+        now = time.monotonic()
+        if now > self.next_tick:
+            # In ritardo di uno o più tick: si salta al primo tick futuro
+            missed = math.floor((now - self.next_tick) / self.interval) + 1
+            self.skipped += missed
+            self.next_tick += missed * self.interval
+        delay = self.next_tick - now
+        self.next_tick += self.interval
+        if stop_event is not None:
+            return not stop_event.wait(delay)
+        time.sleep(delay)
+        return True
+
+class MetricSampler:
+    """Campionatore non bloccante con aggregazione locale per periodo di invio."""
+
+    def __init__(self, sample_interval: float = None, disk_path: str = '/'):
+        """
+        Inizializza il campionatore.
+
+        Args:
+            sample_interval: Secondi tra due campioni; None per un solo campione
+                al momento dell'invio (utilizzo medio dell'intero periodo)
+            disk_path: Percorso di cui misurare l'occupazione del disco
+        """
+        self.sample_interval = sample_interval
+        self.disk_path = disk_path
+        self.static_info = read_static_info()
+
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._ticker = None
+        self._reset()
+        # La prima lettura di cpu_percent(None) fissa solo il riferimento
+        psutil.cpu_percent(interval=None)
+
+    def _reset(self):
+        self._count = 0
+        self._cpu = [0.0, math.inf, -math.inf]     # somma, minimo, massimo
+        self._memory = [0.0, math.inf, -math.inf]
+
+    def start(self):
+        """Avvia il campionamento in background (solo con sample_interval impostato)."""
+        if not self.sample_interval or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='agent-sampler', daemon=True)
+        self._thread.start()
+        logger.info(f"[SAMPLER] Campionamento ogni {self.sample_interval}s")
+
+    def stop(self, timeout: float = 5.0):
+        """Arresta il thread di campionamento."""
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def set_sample_interval(self, interval: float):
+        """Cambia l'intervallo di campionamento del thread in esecuzione."""
+        self.sample_interval = interval
+        if self._ticker is not None:
+            self._ticker.interval = interval
+
+    def sample(self):
+        """Legge CPU e memoria e le aggiunge agli aggregati del periodo corrente."""
+        cpu = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory().percent
+        with self._lock:
+            self._count += 1
+            for stats, value in ((self._cpu, cpu), (self._memory, memory)):
+                stats[0] += value
+                stats[1] = min(stats[1], value)
+                stats[2] = max(stats[2], value)
+
+    def collect(self) -> dict:
+        """
+        Chiude il periodo corrente e restituisce il report: cpu_usage e memory
+        sono le medie del periodo, con minimo, massimo e numero di campioni.
+        """
+        if self._thread is None or not self._count:
+            # Senza thread (o senza tick dall'ultimo report) si legge subito
+            self.sample()
+        with self._lock:
+            count, cpu, memory = self._count, self._cpu, self._memory
+            self._reset()
+
+        report = {
+            "timestamp": datetime.now().isoformat(),
+            "cpu_usage": round(cpu[0] / count, 2),
+            "memory": round(memory[0] / count, 2),
+            # L'occupazione del disco cambia lentamente: una lettura per report
+            "disk": psutil.disk_usage(self.disk_path).percent,
+        }
+        report.update(self.static_info)
+        if count > 1:
+            report.update({
+                "samples": count,
+                "cpu_min": cpu[1], "cpu_max": cpu[2],
+                "memory_min": memory[1], "memory_max": memory[2],
+            })
+        return report
+
+    def _run(self):
+        """Ciclo di campionamento a frequenza fissa."""
+        ticker = self._ticker = FixedRateTicker(self.sample_interval)
+        while ticker.wait(self._stopping):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"[SAMPLER] Errore nel campionamento: {e}")
+
+# Costi dichiarabili da un collector, in ordine crescente
+COLLECTOR_COSTS = ('low', 'medium', 'high')
+
+class Collector:
+    """Collector di metriche aggiuntive: una funzione che restituisce un dict."""
+
+    def __init__(self, name: str, func: Callable[[], dict], cost: str = 'low', interval: float = 0):
+        """
+        Args:
+            name: Nome del collector
+            func: Funzione senza argomenti che restituisce le metriche
+            cost: Costo dichiarato ('low', 'medium' o 'high')
+            interval: Secondi minimi tra due esecuzioni (0: a ogni report)
+        """
+        if cost not in COLLECTOR_COSTS:
+            raise ValueError(f"Costo non valido per il collector {name}: {cost}")
+        self.name = name
+        self.func = func
+        self.cost = cost
+        self.interval = interval
+        self.enabled = True
+        self.last_run = None
+        self.runs = 0
+        self.errors = 0
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+
+    def due(self, now: float) -> bool:
+        """Indica se il collector va eseguito all'istante monotono `now`."""
+        return self.enabled and (self.last_run is None or now - self.last_run >= self.interval)
+
+class CollectorRegistry:
+    """Registro dei collector, eseguiti a ogni report secondo il proprio intervallo."""
+
+    def __init__(self):
+        self._collectors: Dict[str, Collector] = {}
+
+    def __contains__(self, name):
+        return name in self._collectors
+
+    def __getitem__(self, name) -> Collector:
+        return self._collectors[name]
+
+    def __iter__(self):
+        return iter(self._collectors.values())
+
+    def register(self, name: str, cost: str = 'low', interval: float = 0):
+        """Decoratore che registra una funzione come collector."""
+        def decorator(func):
+            self._collectors[name] = Collector(name, func, cost, interval)
+            return func
+        return decorator
+
+    def configure(self, settings: dict):
+        """
+        Applica la configurazione dell'agent: {nome: secondi} cambia
+        l'intervallo, {nome: False} (o None) disattiva il collector.
+        """
+        for name, value in (settings or {}).items():
+            if name not in self._collectors:
+                logger.warning(f"[COLLECTOR] Collector sconosciuto nella configurazione: {name}")
+                continue
+            collector = self._collectors[name]
+            if value is False or value is None:
+                collector.enabled = False
+            else:
+                collector.enabled = True
+                collector.interval = value
+
+    def collect(self, now: float = None) -> dict:
+        """
+        Esegue i collector dovuti e ne unisce i risultati. Un collector che
+        fallisce viene registrato nel log e saltato, senza fermare gli altri.
+        """
+        now = time.monotonic() if now is None else now
+        metrics = {}
+        for collector in self._collectors.values():
+            if not collector.due(now):
+                continue
+            collector.last_run = now
+            cpu_start, wall_start = time.thread_time(), time.perf_counter()
+            try:
+                metrics.update(collector.func())
+            except Exception as e:
+                collector.errors += 1
+                logger.warning(f"[COLLECTOR] Errore nel collector {collector.name}: {e}")
+            finally:
+                collector.runs += 1
+                collector.cpu_time += time.thread_time() - cpu_start
+                collector.wall_time += time.perf_counter() - wall_start
+        return metrics
+
+    def stats(self) -> dict:
+        """Restituisce esecuzioni, errori e tempo CPU/reale medio (ms) di ogni collector."""
+        return {
+            collector.name: {
+                'cost': collector.cost,
+                'interval': collector.interval,
+                'enabled': collector.enabled,
+                'runs': collector.runs,
+                'errors': collector.errors,
+                'cpu_ms': round(collector.cpu_time * 1000 / collector.runs, 3) if collector.runs else 0.0,
+                'wall_ms': round(collector.wall_time * 1000 / collector.runs, 3) if collector.runs else 0.0,
+            }
+            for collector in self._collectors.values()
+        }
+
+class RateCounter:
+    """Converte contatori cumulativi (byte, operazioni) in velocità al secondo."""
+
+    def __init__(self):
+        self._previous = None
+
+    def update(self, counters: dict, now: float = None) -> dict:
+        """
+        Restituisce la velocità di ogni contatore dall'ultima chiamata; la
+        prima chiamata (o un contatore azzerato) non produce valori.
+        """
+        now = time.monotonic() if now is None else now
+        previous, self._previous = self._previous, (now, counters)
+        if previous is None or now <= previous[0]:
+            return {}
+        elapsed = now - previous[0]
+        rates = {}
+        for key, value in counters.items():
+            before = previous[1].get(key)
+            if before is not None and value >= before:
+                rates[key] = round((value - before) / elapsed, 2)
+        return rates
+
+class OverheadMonitor:
+    """
+    Misura il costo dell'agent: CPU del processo (tutti i thread) in
+    percentuale di un core, RSS e durata/CPU di ogni fase (raccolta, invio).
+    """
+
+    # Fattore massimo di allungamento dell'intervallo di raccolta
+    MAX_INTERVAL_FACTOR = 4
+
+    def __init__(self, max_cpu_percent: float = None, max_rss_mb: float = None):
+        """
+        Args:
+            max_cpu_percent: Budget di CPU (percentuale di un core); None per nessun limite
+            max_rss_mb: Budget di memoria residente in MB; None per nessun limite
+        """
+        self.max_cpu_percent = max_cpu_percent
+        self.max_rss_mb = max_rss_mb
+        self.reductions = []
+        self._process = psutil.Process()
+        self._window_start = (time.monotonic(), time.process_time())
+        self._phases = {}
+
+    @contextmanager
+    def measure(self, phase: str):
+        """Misura durata e CPU (del thread corrente) di una fase, es. 'collect' o 'send'."""
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            stats = self._phases.setdefault(phase, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += time.perf_counter() - wall_start
+            stats[2] += time.thread_time() - cpu_start
+
+    def snapshot(self) -> dict:
+        """
+        Chiude la finestra di misura corrente e ne restituisce il riepilogo:
+        CPU media del processo, RSS e durata/CPU medie di ogni fase (ms).
+        """
+        now, cpu_now = time.monotonic(), time.process_time()
+        start, cpu_start = self._window_start
+        self._window_start = (now, cpu_now)
+        elapsed = now - start
+        result = {
+            'cpu_percent': round((cpu_now - cpu_start) * 100 / elapsed, 3) if elapsed > 0 else 0.0,
+            'rss_mb': round(self._process.memory_info().rss / (1024 * 1024), 1),
+        }
+        for phase, (count, wall, cpu) in self._phases.items():
+            result[f'{phase}_ms'] = round(wall * 1000 / count, 2)
+            result[f'{phase}_cpu_ms'] = round(cpu * 1000 / count, 2)
+        self._phases = {}
+        return result
+
+    def over_budget(self, snapshot: dict) -> list:
+        """Restituisce le voci del riepilogo che superano il budget."""
+        exceeded = []
+        if self.max_cpu_percent is not None and snapshot['cpu_percent'] > self.max_cpu_percent:
+            exceeded.append('cpu_percent')
+        if self.max_rss_mb is not None and snapshot['rss_mb'] > self.max_rss_mb:
+            exceeded.append('rss_mb')
+        return exceeded
+
+    def reduce(self, registry: CollectorRegistry, sampler: MetricSampler,
+               ticker: FixedRateTicker, collection_interval: float):
+        """
+        Riduce il costo dell'agent di un passo, nell'ordine: disattiva il
+        collector non 'low' più costoso (costo dichiarato, poi CPU misurata),
+        raddoppia l'intervallo di campionamento locale fino a quello di
+        raccolta, raddoppia l'intervallo di raccolta fino a MAX_INTERVAL_FACTOR
+        volte quello configurato. Restituisce la descrizione del passo o None
+        se non c'è più nulla da ridurre.
+        """
+        candidates = [c for c in registry if c.enabled and c.cost != 'low']
+        if candidates:
+            victim = max(candidates, key=lambda c: (COLLECTOR_COSTS.index(c.cost),
+                                                    c.cpu_time / c.runs if c.runs else 0.0))
+            victim.enabled = False
+            action = f"collector {victim.name} disattivato"
+        elif sampler.sample_interval and sampler.sample_interval < collection_interval:
+            sampler.set_sample_interval(min(sampler.sample_interval * 2, collection_interval))
+            action = f"campionamento ogni {sampler.sample_interval}s"
+        elif ticker.interval < collection_interval * self.MAX_INTERVAL_FACTOR:
+            ticker.interval = min(ticker.interval * 2, collection_interval * self.MAX_INTERVAL_FACTOR)
+            action = f"raccolta ogni {ticker.interval}s"
+        else:
+            return None
+        self.reductions.append(action)
+        return action
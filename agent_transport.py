@@ -0,0 +1,172 @@
+"""
+Connessione persistente dell'agent verso il server.
+L'agent usa per tutta la sua vita una sola requests.Session (keep-alive) e un
+contesto SSL creato una volta sola; quando la connessione va riaperta, il
+contesto riprende la sessione TLS precedente (handshake abbreviato, senza
+scambio di certificati). Sessione e contesto vengono ricreati solo dopo un
+errore di connessione o un cambio di configurazione.
+"""
+
+import ssl
+import logging
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import ssl_manager
+
+logger = logging.getLogger('agent')
+
+class ResumableSSLContext(ssl.SSLContext):
+    """
+    Contesto SSL client che riprende l'ultima sessione TLS di ogni host
+    e conta gli handshake completi e quelli ripresi.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._sockets = weakref.WeakSet()
+        self.handshakes = 0
+        self.resumed = 0
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        self.remember_sessions()
+        if session is None and not server_side:
+            with self._lock:
+                session = self._sessions.get(server_hostname)
+        ssl_sock = super().wrap_socket(sock, server_side, do_handshake_on_connect,
+                                       suppress_ragged_eofs, server_hostname, session)
+        with self._lock:
+            self._sockets.add(ssl_sock)
+            if do_handshake_on_connect:
+                self.handshakes += 1
+                self.resumed += ssl_sock.session_reused
+        return ssl_sock
+
+    def remember_sessions(self):
+        """
+        Memorizza la sessione delle connessioni ancora aperte. Con TLS 1.3 il
+        ticket arriva dopo l'handshake, quindi va letta dopo ogni risposta.
+        """
+        with self._lock:
+            for ssl_sock in list(self._sockets):
+                session = ssl_sock.session
+                if session is not None:
+                    self._sessions[ssl_sock.server_hostname] = session
+
+class SSLContextAdapter(HTTPAdapter):
+    """Adapter requests che usa un contesto SSL già pronto per tutte le connessioni."""
+
+    def __init__(self, ssl_context, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+class AgentTransport:
+    """Sessione HTTP(S) persistente dell'agent."""
+
+    def __init__(self, verify_ssl: bool = False):
+        """
+        Inizializza il trasporto.
+
+        Args:
+            verify_ssl: Se verificare il certificato del server
+        """
+        self.verify_ssl = verify_ssl
+        self.ssl_context = None
+        self.session = None
+        self._stats = {'requests': 0, 'sessions': 0, 'ssl_contexts': 0, 'reconnects': 0}
+        self._closed_handshakes = 0
+        self._closed_resumed = 0
+
+    def _create_ssl_context(self):
+        """Crea il contesto SSL client una volta sola (include la lettura del CA)."""
+        try:
+            ssl_mgr = ssl_manager.create_ssl_manager()
+            context = ssl_mgr.get_client_ssl_context(verify_cert=self.verify_ssl,
+                                                     context_class=ResumableSSLContext)
+        except Exception as e:
+            logger.warning(f"[HTTPS] Errore configurazione SSL: {e}")
+            # Fallback: disabilita verifica SSL per certificati auto-firmati
+            self.verify_ssl = False
+            context = ResumableSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if not self.verify_ssl:
+            logger.info("[HTTPS] Certificati auto-firmati accettati (sviluppo)")
+        self._stats['ssl_contexts'] += 1
+        return context
+
+    def _get_session(self):
+        """Restituisce la sessione corrente, creandola se necessario."""
+        if self.session is None:
+            if self.ssl_context is None:
+                self.ssl_context = self._create_ssl_context()
+            session = requests.Session()
+            session.mount('https://', SSLContextAdapter(self.ssl_context, pool_connections=1, pool_maxsize=1))
+            session.verify = self.verify_ssl
+            if not self.verify_ssl:
+                # Disabilita warning per certificati non verificati
+                import urllib3
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+            self.session = session
+            self._stats['sessions'] += 1
+        return self.session
+
+    def post(self, url, **kwargs):
+        """
+        Esegue una POST sulla sessione persistente.
+        Dopo un errore di rete la sessione viene ricreata; dopo un errore SSL
+        anche il contesto SSL.
+        """
+        session = self._get_session()
+        self._stats['requests'] += 1
+        try:
+            # verify esplicito: altrimenti REQUESTS_CA_BUNDLE prevale su session.verify
+            return session.post(url, verify=self.verify_ssl, **kwargs)
+        except requests.exceptions.SSLError:
+            self.reset(ssl_context=True)
+            raise
+        except requests.exceptions.RequestException:
+            self.reset()
+            raise
+        finally:
+            if self.ssl_context is not None:
+                self.ssl_context.remember_sessions()
+
+    def reset(self, ssl_context: bool = False):
+        """Chiude la sessione (e opzionalmente il contesto SSL) per ricrearla al prossimo invio."""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+            self._stats['reconnects'] += 1
+        if ssl_context and self.ssl_context is not None:
+            self._closed_handshakes += self.ssl_context.handshakes
+            self._closed_resumed += self.ssl_context.resumed
+            self.ssl_context = None
+
+    def close(self):
+        """Chiude definitivamente il trasporto."""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def stats(self) -> dict:
+        """Restituisce richieste, sessioni create e handshake TLS (completi e ripresi)."""
+        result = dict(self._stats)
+        handshakes, resumed = self._closed_handshakes, self._closed_resumed
+        if self.ssl_context is not None:
+            handshakes += self.ssl_context.handshakes
+            resumed += self.ssl_context.resumed
+        result['tls_handshakes'] = handshakes
+        result['tls_resumed'] = resumed
+        result['tls_full_handshakes'] = handshakes - resumed
+        return result
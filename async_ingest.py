@@ -0,0 +1,360 @@
+"""
+Modulo per il server di ingestione asincrono (asyncio).
+Gli agent tengono aperte molte connessioni keep-alive, per lo più inattive:
+invece di un thread per connessione, un solo event loop gestisce tutte le
+connessioni e serve POST /api/report con lo stesso contratto dell'endpoint
+Flask (autenticazione Basic, rate limiting, validazione, risposte JSON). I
+campioni validati vengono passati alla coda di ingestione (ingest.IngestQueue),
+il cui writer salva i dati nel database fuori dall'event loop; anche la
+verifica bcrypt delle credenziali e la ricerca degli host dei report compatti
+non ancora in cache girano in un thread.
+
+Uso da riga di comando (processo separato dal server della dashboard):
+    python async_ingest.py --bind 0.0.0.0:5001
+"""
+
+import os
+import sys
+import json
+import base64
+import signal
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import database
+import ingest
+import security_validator
+import wire_format
+
+logger = logging.getLogger(__name__)
+
+REPORT_PATH = '/api/report'
+REPORT_ENDPOINT = 'report'  # stessa chiave di rate limiting dell'endpoint Flask
+
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 415: 'Unsupported Media Type',
+           429: 'Too Many Requests', 431: 'Request Header Fields Too Large',
+           500: 'Internal Server Error', 501: 'Not Implemented', 503: 'Service Unavailable'}
+
+def _json(payload) -> bytes:
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+SUCCESS_BODY = _json({'status': 'success', 'message': 'Dati ricevuti correttamente'})
+AUTH_HEADERS = (('WWW-Authenticate', 'Basic realm="NetMaster"'),)
+
+class AsyncIngestServer:
+    """Server HTTP/1.1 asyncio per /api/report."""
+
+    def __init__(self, backend=None, host: str = '0.0.0.0', port: int = 5001,
+                 idle_timeout: float = None, request_timeout: float = 30.0,
+                 max_connections: int = None, max_body: int = 64 * 1024,
+                 requests_per_minute: int = 120, requests_per_hour: int = 2000,
+                 ssl_context=None, auth_threads: int = 4):
+        """
+        Inizializza il server.
+
+        Args:
+            backend: Modulo server (default server_integrated) che fornisce
+                     ingest_queue, check_credentials, PASSWORD_HASH e validate_system_data
+            host: Indirizzo di ascolto
+            port: Porta di ascolto
+            idle_timeout: Secondi di inattività dopo i quali una connessione keep-alive viene chiusa
+            request_timeout: Secondi concessi per ricevere il corpo di una richiesta
+            max_connections: Connessioni contemporanee massime
+            max_body: Dimensione massima del corpo della richiesta (byte)
+            requests_per_minute: Limite per client come l'endpoint Flask
+            requests_per_hour: Limite orario per client come l'endpoint Flask
+            ssl_context: ssl.SSLContext lato server, o None per HTTP
+            auth_threads: Thread dedicati alla verifica bcrypt
+        """
+        if backend is None:
+            import server_integrated as backend
+        self.backend = backend
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout if idle_timeout is not None else \
+            float(os.getenv('NETMASTER_ASYNC_IDLE_TIMEOUT_S', 120))
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections or int(os.getenv('NETMASTER_ASYNC_MAX_CONNECTIONS', 50000))
+        self.max_body = max_body
+        self.requests_per_minute = requests_per_minute
+        self.requests_per_hour = requests_per_hour
+        self.ssl_context = ssl_context
+
+        self._auth_executor = ThreadPoolExecutor(max_workers=auth_threads, thread_name_prefix='ingest-auth')
+        # Ricerca degli host dei report compatti non ancora in cache (query SQLite)
+        self._lookup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ingest-lookup')
+        self._server = None
+        self._stopping = False
+        self._connections = set()
+        self._busy = set()  # connessioni con una richiesta in corso
+        self._stats = {'connections': 0, 'peak_connections': 0, 'requests': 0,
+                       'accepted': 0, 'rejected': 0, 'auth_offloaded': 0, 'lookup_offloaded': 0}
+
+    # --- Ciclo di vita ---
+
+    async def start(self):
+        """Apre il socket di ascolto."""
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port,
+            ssl=self.ssl_context, backlog=4096, reuse_address=True)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"[ASYNC] Ingestione in ascolto su {self.host}:{self.port} "
+                    f"(max {self.max_connections} connessioni)")
+        return self
+
+    async def stop(self, timeout: float = 10.0):
+        """Smette di accettare connessioni, attende le richieste in corso e chiude le altre."""
+        if self._server is None:
+            return
+        self._stopping = True
+        self._server.close()
+        self._server = None
+        # Le connessioni inattive vengono chiuse subito, quelle con una richiesta
+        # in corso terminano dopo aver inviato la risposta.
+        for task in self._connections - self._busy:
+            task.cancel()
+        if self._connections:
+            _, pending = await asyncio.wait(list(self._connections), timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self._auth_executor.shutdown(wait=False)
+        self._lookup_executor.shutdown(wait=False)
+        logger.info(f"[ASYNC] Ingestione arrestata. Statistiche: {self.stats()}")
+
+    async def serve_forever(self):
+        """Avvia il server e resta in esecuzione fino a SIGTERM/SIGINT."""
+        await self.start()
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopping.set)
+        await stopping.wait()
+        await self.stop()
+
+    def stats(self) -> dict:
+        """Restituisce connessioni (attuali e di picco), richieste ed esiti."""
+        result = dict(self._stats)
+        result['connections'] = len(self._connections)
+        return result
+
+    # --- Connessioni ---
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if len(self._connections) >= self.max_connections:
+            writer.close()
+            return
+        task = asyncio.current_task()
+        self._connections.add(task)
+        self._stats['peak_connections'] = max(self._stats['peak_connections'], len(self._connections))
+        peer = writer.get_extra_info('peername')
+        remote_addr = peer[0] if peer else 'unknown'
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idle_timeout)
+                except asyncio.LimitOverrunError:
+                    self._write(writer, 431, _json({'error': 'Header troppo grandi'}), False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+
+                self._busy.add(task)
+                request = self._parse_head(head)
+                if request is None:
+                    self._write(writer, 400, _json({'error': 'Richiesta malformata'}), False)
+                    break
+                method, path, headers, keep_alive = request
+
+                if 'chunked' in headers.get('transfer-encoding', '').lower():
+                    self._write(writer, 501, _json({'error': 'Transfer-Encoding chunked non supportato'}), False)
+                    break
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    self._write(writer, 400, _json({'error': 'Content-Length non valido'}), False)
+                    break
+                if length > self.max_body:
+                    self._write(writer, 413, _json({'error': 'Richiesta troppo grande'}), False)
+                    break
+                if length and headers.get('expect', '').lower() == '100-continue':
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                body = await asyncio.wait_for(reader.readexactly(length), self.request_timeout) \
+                    if length else b''
+
+                status, payload, extra_headers = await self._dispatch(method, path, headers, body, remote_addr)
+                keep_alive = keep_alive and not self._stopping
+                self._write(writer, status, payload, keep_alive, extra_headers)
+                await writer.drain()
+                self._busy.discard(task)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(task)
+            self._busy.discard(task)
+            writer.close()
+
+    @staticmethod
+    def _parse_head(head: bytes) -> Optional[Tuple[str, str, Dict[str, str], bool]]:
+        """Restituisce (metodo, percorso, header, keep-alive) o None se la richiesta è malformata."""
+        try:
+            lines = head[:-4].decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+        if not version.startswith('HTTP/1.'):
+            return None
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(':')
+            if not separator:
+                return None
+            headers[name.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        return method, target.split('?', 1)[0], headers, keep_alive
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, status: int, payload: bytes, keep_alive: bool,
+               extra_headers=()):
+        lines = [f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+                 'Server: NetMaster-ingest',
+                 'Content-Type: application/json',
+                 f'Content-Length: {len(payload)}',
+                 f'Connection: {"keep-alive" if keep_alive else "close"}']
+        lines.extend(f'{name}: {value}' for name, value in extra_headers)
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload)
+
+    # --- Richieste ---
+
+    async def _authenticate(self, authorization: str) -> bool:
+        """Verifica l'header Authorization Basic; bcrypt solo fuori dall'event loop."""
+        scheme, _, encoded = authorization.partition(' ')
+        if scheme.lower() != 'basic':
+            return False
+        try:
+            username, _, password = base64.b64decode(encoded).decode('utf-8').partition(':')
+        except (ValueError, UnicodeDecodeError):
+            return False
+        password_hash = self.backend.PASSWORD_HASH
+        if password_hash is None:
+            return False
+        if security_validator.credential_cache.cached(username, password, password_hash):
+            return True
+        self._stats['auth_offloaded'] += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._auth_executor, self.backend.check_credentials,
+                                          username, password)
+
+    async def _validate(self, data: dict):
+        """
+        Valida il report. Un report compatto con agent_id non in cache richiede
+        una query su agent_hosts: in quel caso la validazione gira nel pool di
+        ricerca, fuori dall'event loop.
+        """
+        agent_id = data.get('agent_id') if isinstance(data, dict) else None
+        if isinstance(agent_id, int) and not isinstance(agent_id, bool) \
+                and not database.is_agent_host_cached(agent_id):
+            self._stats['lookup_offloaded'] += 1
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._lookup_executor, self.backend.validate_report, data)
+        else:
+            self.backend.validate_report(data)
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes,
+                        remote_addr: str):
+        """Restituisce (stato, corpo JSON, header aggiuntivi) per una richiesta."""
+        self._stats['requests'] += 1
+        if path != REPORT_PATH:
+            return 404, _json({'error': 'Endpoint non trovato'}), ()
+        if method != 'POST':
+            return 405, _json({'error': 'Metodo non consentito'}), (('Allow', 'POST'),)
+
+        authorization = headers.get('authorization')
+        if not authorization:
+            logger.warning(f"Tentativo di accesso senza autenticazione da {remote_addr}")
+            return 401, _json({'error': 'Autenticazione richiesta'}), AUTH_HEADERS
+        if not await self._authenticate(authorization):
+            logger.warning(f"Tentativo di accesso con credenziali errate da {remote_addr}")
+            return 401, _json({'error': 'Autenticazione fallita',
+                               'message': 'Credenziali non valide'}), AUTH_HEADERS
+
+        client_ip = security_validator.client_address(remote_addr, headers.get('x-forwarded-for'))
+        limited, reason, retry_after = security_validator.rate_limiter.check(
+            client_ip, REPORT_ENDPOINT, self.requests_per_minute, self.requests_per_hour)
+        if limited:
+            logger.warning(f"[RATE_LIMIT] IP {client_ip} bloccato: {reason}")
+            return 429, _json({'error': 'Rate limit superato', 'message': reason,
+                               'retry_after': retry_after}), (('Retry-After', str(retry_after)),)
+
+        content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        if 'json' not in content_type and content_type != wire_format.CONTENT_TYPE_FRAME:
+            return 415, _json({'error': 'Content-Type deve essere application/json'}), ()
+        ValidationError = self.backend.ValidationError
+        try:
+            data = wire_format.decode_report(body, content_type, headers.get('content-encoding', ''),
+                                             self.backend.REPORT_MAX_BYTES)
+            if not data:
+                raise ValidationError("Dati JSON richiesti")
+            await self._validate(data)
+            self.backend.ingest_queue.submit(data, remote_addr)
+        except self.backend.UnknownAgentError as e:
+            self._stats['rejected'] += 1
+            return 409, _json({'error': 'Agent non registrato', 'message': str(e)}), ()
+        except ValidationError as e:
+            self._stats['rejected'] += 1
+            logger.warning(f"Errore di validazione: {e}")
+            return 400, _json({'error': 'Dati non validi', 'message': str(e)}), ()
+        except (ValueError, TypeError):
+            # Corpo non decodificabile (WireFormatError) o JSON che non è un oggetto
+            self._stats['rejected'] += 1
+            return 400, _json({'error': 'Richiesta malformata o JSON non valido'}), ()
+        except ingest.IngestQueueFull as e:
+            logger.warning(f"[INGEST] Richiesta rifiutata da {remote_addr}: {e.message}")
+            return 503, _json({'error': 'Server sovraccarico', 'message': e.message,
+                               'retry_after': e.retry_after}), (('Retry-After', str(e.retry_after)),)
+        except Exception as e:
+            logger.error(f"Errore nella ricezione dati: {e}", exc_info=True)
+            return 500, _json({'error': 'Errore interno del server'}), ()
+
+        self._stats['accepted'] += 1
+        logger.debug(f"Dati ricevuti da {remote_addr}: CPU={data.get('cpu_usage', 0):.1f}%")
+        return 200, SUCCESS_BODY, ()
+
+def main(argv=None):
+    """Avvio da riga di comando."""
+    parser = argparse.ArgumentParser(description='NetMaster - server di ingestione asincrono')
+    parser.add_argument('--bind', default='0.0.0.0:5001', help='Indirizzo host:porta')
+    parser.add_argument('--max-connections', type=int, default=None, help='Connessioni contemporanee massime')
+    parser.add_argument('--idle-timeout', type=float, default=None, help='Secondi di keep-alive inattivo')
+    parser.add_argument('--certfile', help='Certificato TLS (abilita HTTPS)')
+    parser.add_argument('--keyfile', help='Chiave privata TLS')
+    args = parser.parse_args(argv)
+
+    # La pulizia dei dati resta al server principale (vedi server_integrated)
+    os.environ.setdefault('NETMASTER_WORKER_ID', 'ingest')
+    sys.path.insert(0, os.getcwd())
+
+    ssl_context = None
+    if args.certfile:
+        import ssl_manager
+        ssl_mgr = ssl_manager.SSLManager(os.path.dirname(args.certfile) or '.')
+        ssl_mgr.cert_file = args.certfile
+        ssl_mgr.key_file = args.keyfile or args.certfile
+        ssl_context = ssl_mgr.get_ssl_context()
+
+    host, _, port = args.bind.rpartition(':')
+    server = AsyncIngestServer(host=host.strip('[]') or '0.0.0.0', port=int(port),
+                               idle_timeout=args.idle_timeout, max_connections=args.max_connections,
+                               ssl_context=ssl_context)
+    asyncio.run(server.serve_forever())
+
+if __name__ == '__main__':
+    main()
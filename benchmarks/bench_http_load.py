@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Benchmark di carico HTTP: server pre-fork (wsgi_server) e server di ingestione
+asincrono (async_ingest) contro app.run(threaded=True).
+
+Avvia server_integrated in ciascuna modalità su un database temporaneo, lo
+carica con più processi client (ognuno con più connessioni in parallelo, con
+keep-alive quando il server lo consente) e riporta richieste/s e latenze.
+Ogni richiesta usa un X-Forwarded-For diverso (il loopback è configurato come
+proxy fidato) per non misurare il rate limiter.
+Con --idle-connections vengono aperte in aggiunta N connessioni inattive (come
+agent tra un invio e l'altro) prima del carico; la colonna "inattive" riporta
+quante sono ancora aperte alla fine.
+
+Uso:
+    python benchmarks/bench_http_load.py [--duration 10] [--clients 4] [--connections 8]
+                                         [--workers 4] [--threads 8] [--path /api/report] [--tls]
+                                         [--modes threaded,prefork,async] [--idle-connections 10000]
+"""
+
+import os
+import sys
+import ssl
+import json
+import time
+import base64
+import socket
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+import http.client
+import multiprocessing
+
+import bcrypt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+REPORT = {
+    'cpu_usage': 12.5,
+    'memory': 40.0,
+    'disk': 55.0,
+    'system': 'Linux',
+    'node': 'BENCH',
+    'release': '6.0',
+    'version': '#1 SMP'
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def server_command(mode, port, args, cert_dir):
+    """Riga di comando del server nella modalità indicata."""
+    tls_args = ['--certfile', os.path.join(cert_dir, 'server.crt'),
+                '--keyfile', os.path.join(cert_dir, 'server.key')] if cert_dir else []
+    if mode == 'async':
+        return [sys.executable, os.path.join(ROOT, 'async_ingest.py'),
+                '--bind', f'127.0.0.1:{port}'] + tls_args
+    if mode == 'prefork':
+        command = [sys.executable, os.path.join(ROOT, 'wsgi_server.py'), 'server_integrated:app',
+                   '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+                   '--threads', str(args.threads)]
+        return command + tls_args
+    ssl_context = f"({os.path.join(cert_dir, 'server.crt')!r}, {os.path.join(cert_dir, 'server.key')!r})" \
+        if cert_dir else 'None'
+    return [sys.executable, '-c',
+            "import logging, server_integrated as s; logging.getLogger('werkzeug').setLevel(logging.WARNING); "
+            f"s.app.run(host='127.0.0.1', port={port}, threaded=True, ssl_context={ssl_context})"]
+
+def start_server(mode, args, workdir, cert_dir):
+    port = free_port()
+    env = dict(os.environ,
+               PYTHONPATH=ROOT,
+               NETMASTER_USERNAME=USERNAME,
+               NETMASTER_PASSWORD=PASSWORD,
+               NETMASTER_PASSWORD_HASH=bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode(),
+               # I client simulati passano dal loopback: X-Forwarded-For distingue i loro limiti
+               NETMASTER_TRUSTED_PROXIES='127.0.0.1')
+    process = subprocess.Popen(server_command(mode, port, args, cert_dir), cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Server {mode} non avviato")
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def client_process(index, port, args, deadline, results):
+    """Processo client: `connections` thread che inviano richieste fino a deadline."""
+    import threading
+
+    tls = ssl._create_unverified_context() if args.tls else None
+    auth = 'Basic ' + base64.b64encode(f'{USERNAME}:{PASSWORD}'.encode()).decode()
+    body = json.dumps(REPORT).encode() if args.path == '/api/report' else None
+    method = 'POST' if body else 'GET'
+    latencies, counters, lock = [], {'ok': 0, 'errors': 0, 'connections': 0}, threading.Lock()
+
+    def connect():
+        with lock:
+            counters['connections'] += 1
+        if tls:
+            return http.client.HTTPSConnection('127.0.0.1', port, timeout=10, context=tls)
+        return http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+
+    def worker(thread_index):
+        local, ok, errors = [], 0, 0
+        conn = connect()
+        sequence = 0
+        while time.time() < deadline:
+            sequence += 1
+            client_id = (index * 256 + thread_index) * 100000 + sequence
+            headers = {'Authorization': auth, 'Content-Type': 'application/json',
+                       'X-Forwarded-For': f'10.{client_id >> 16 & 255}.{client_id >> 8 & 255}.{client_id & 255}'}
+            begin = time.perf_counter()
+            try:
+                conn.request(method, args.path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                local.append(time.perf_counter() - begin)
+                if response.status < 400:
+                    ok += 1
+                else:
+                    errors += 1
+                if response.will_close:
+                    conn.close()
+                    conn = connect()
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+                conn = connect()
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            counters['ok'] += ok
+            counters['errors'] += errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((counters, latencies))
+
+def open_idle_connections(port, count):
+    """Apre `count` connessioni senza inviare richieste."""
+    idle = []
+    for _ in range(count):
+        try:
+            idle.append(socket.create_connection(('127.0.0.1', port), timeout=5))
+        except OSError:
+            break
+    return idle
+
+def count_open(sockets):
+    """Conta le connessioni non ancora chiuse dal server."""
+    open_count = 0
+    for sock in sockets:
+        sock.setblocking(False)
+        try:
+            open_count += bool(sock.recv(1, socket.MSG_PEEK))
+        except BlockingIOError:
+            open_count += 1  # nessun dato e nessuna chiusura
+        except OSError:
+            pass
+    return open_count
+
+def run_load(port, args):
+    """Esegue il carico e restituisce (richieste/s, p50 ms, p99 ms, errori, connessioni)."""
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    deadline = time.time() + args.duration
+    processes = [context.Process(target=client_process, args=(i, port, args, deadline, results))
+                 for i in range(args.clients)]
+    for process in processes:
+        process.start()
+    ok = errors = connections = 0
+    latencies = []
+    for _ in processes:
+        counters, process_latencies = results.get()
+        ok += counters['ok']
+        errors += counters['errors']
+        connections += counters['connections']
+        latencies.extend(process_latencies)
+    for process in processes:
+        process.join()
+    latencies.sort()
+    percentile = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else 0
+    return ok / args.duration, percentile(0.5), percentile(0.99), errors, connections
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark di carico HTTP dei modi di avvio del server")
+    parser.add_argument('--duration', type=float, default=10, help="Secondi di carico per modalità")
+    parser.add_argument('--clients', type=int, default=4, help="Processi client")
+    parser.add_argument('--connections', type=int, default=8, help="Connessioni parallele per processo client")
+    parser.add_argument('--workers', type=int, default=4, help="Worker del server pre-fork")
+    parser.add_argument('--threads', type=int, default=8, help="Thread per worker")
+    parser.add_argument('--path', default='/api/report', help="Endpoint (POST per /api/report, altrimenti GET)")
+    parser.add_argument('--tls', action='store_true', help="Usa HTTPS con certificato auto-firmato")
+    parser.add_argument('--modes', default='threaded,prefork,async', help="Modalità da confrontare")
+    parser.add_argument('--idle-connections', type=int, default=0,
+                        help="Connessioni inattive aperte durante il carico")
+    args = parser.parse_args()
+
+    print("=" * 87)
+    print(f"Carico HTTP su {args.path}: {args.clients} processi x {args.connections} connessioni, "
+          f"{args.duration:.0f}s{' (TLS)' if args.tls else ''}")
+    print("=" * 87)
+    print(f"{'Modalità':<28} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errori':>8} {'connessioni':>12} {'inattive':>8}")
+
+    for mode in args.modes.split(','):
+        workdir = tempfile.mkdtemp(prefix=f'netmaster_bench_{mode}_')
+        try:
+            cert_dir = None
+            if args.tls:
+                import ssl_manager
+                cert_dir = os.path.join(workdir, 'certificates')
+                ssl_manager.SSLManager(cert_dir).generate_self_signed_cert('localhost')
+            process, port = start_server(mode, args, workdir, cert_dir)
+            idle = []
+            try:
+                idle = open_idle_connections(port, args.idle_connections)
+                rate, p50, p99, errors, connections = run_load(port, args)
+                still_open = count_open(idle)
+            finally:
+                for sock in idle:
+                    sock.close()
+                stop_server(process)
+            label = f'prefork ({args.workers}x{args.threads})' if mode == 'prefork' else mode
+            print(f"{label:<28} {rate:>10,.0f} {p50:>9.2f} {p99:>9.2f} {errors:>8} {connections:>12} "
+                  f"{still_open:>8}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Benchmark riproducibile dell'ingestione: N agent virtuali su /api/report.
+
+Avvia server_integrated (threaded, prefork o async, come bench_http_load) su un
+database temporaneo e simula migliaia di agent che inviano un report ciascuno
+ogni --interval secondi, a carico aperto: ogni agent ha il proprio orario di
+invio (sfasato e con metriche generate da --seed), indipendente dalla
+velocità del server. Ogni agent usa un X-Forwarded-For diverso, come agent
+reali dietro lo stesso proxy, così il rate limiter lavora per agent.
+
+Riporta throughput, latenze p50/p95/p99, errori per codice, ritardo degli
+invii rispetto alla pianificazione (se alto, il client è saturo e i numeri
+vanno letti con cautela), crescita del database (righe e byte) e CPU/RSS del
+server. Con --save-baseline i risultati vengono salvati per scenario in
+benchmarks/baselines/ingest_load.json; con --check vengono confrontati con la
+baseline e lo script termina con codice 1 se una metrica peggiora oltre
+--tolerance, così le regressioni di database.py o server_integrated.py
+emergono come numeri.
+
+Uso:
+    python benchmarks/bench_ingest_load.py [--agents 1000] [--interval 10] [--duration 30]
+                                           [--modes threaded] [--clients 2] [--connections 16]
+                                           [--seed 1] [--save-baseline] [--check] [--tolerance 0.2]
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import http.client
+import multiprocessing
+from datetime import datetime
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_http_load import ROOT, USERNAME, PASSWORD, start_server, stop_server
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baselines', 'ingest_load.json')
+
+# Metriche confrontate con la baseline: (nome, True se più alto è meglio)
+CHECKED_METRICS = (
+    ('throughput', True),
+    ('p50_ms', False),
+    ('p95_ms', False),
+    ('p99_ms', False),
+    ('server_cpu_ms_per_request', False),
+    ('db_bytes_per_row', False),
+)
+# Scarti assoluti sotto cui le latenze non contano come regressione (rumore)
+LATENCY_FLOOR_MS = 1.0
+MAX_ERROR_RATE_INCREASE = 0.01
+
+def percentile(values, p):
+    """Percentile p (0-1) di una lista già ordinata."""
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+def agent_report(rng, state, index):
+    """Report di un agent virtuale: metriche con andamento casuale riproducibile."""
+    for field in ('cpu_usage', 'memory'):
+        state[field] = min(100.0, max(0.0, state[field] + rng.uniform(-5, 5)))
+    return {
+        'cpu_usage': round(state['cpu_usage'], 2),
+        'memory': round(state['memory'], 2),
+        'disk': state['disk'],
+        'system': 'Linux',
+        'node': f'VAGENT-{index:05d}',
+        'release': '6.0',
+        'version': '#1 SMP',
+    }
+
+def client_process(index, port, args, agents, start, deadline, results):
+    """
+    Processo client: simula gli agent indicati con `connections` thread
+    che prelevano da una coda a priorità l'agent con l'invio più vicino.
+    """
+    import base64
+
+    auth = 'Basic ' + base64.b64encode(f'{USERNAME}:{PASSWORD}'.encode()).decode()
+    rng = random.Random(args.seed * 1000 + index)
+    schedule, lock = [], threading.Lock()
+    states = {}
+    for agent in agents:
+        states[agent] = {'cpu_usage': rng.uniform(5, 60), 'memory': rng.uniform(20, 80),
+                         'disk': round(rng.uniform(10, 90), 2), 'rng': random.Random(args.seed * 100003 + agent)}
+        # Primo invio sfasato uniformemente nell'intervallo
+        heapq.heappush(schedule, (start + rng.uniform(0, args.interval), agent))
+    latencies, lags, statuses = [], [], {}
+
+    def worker():
+        local_latencies, local_lags, local_statuses = [], [], {}
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while True:
+            with lock:
+                due, agent = heapq.heappop(schedule)
+                if due >= deadline:
+                    heapq.heappush(schedule, (due, agent))
+                    break
+                heapq.heappush(schedule, (due + args.interval, agent))
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            state = states[agent]
+            body = json.dumps(agent_report(state['rng'], state, agent)).encode()
+            headers = {'Authorization': auth, 'Content-Type': 'application/json',
+                       'X-Forwarded-For': f'10.{agent >> 16 & 255}.{agent >> 8 & 255}.{agent & 255}'}
+            begin = time.time()
+            local_lags.append(max(0.0, begin - due))
+            try:
+                conn.request('POST', '/api/report', body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+                if response.will_close:
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            except (OSError, http.client.HTTPException):
+                status = 'connessione'
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            local_latencies.append(time.time() - begin)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            lags.extend(local_lags)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker) for _ in range(args.connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, lags, statuses))
+
+class ResourceMonitor(threading.Thread):
+    """Campiona CPU e RSS del server (processo principale e figli) durante il carico."""
+
+    def __init__(self, pid, period=0.5):
+        super().__init__(daemon=True)
+        self.process = psutil.Process(pid)
+        self.period = period
+        self.peak_rss = 0
+        self._cpu = {}
+        self._stopping = threading.Event()
+
+    def _sample(self):
+        rss = 0
+        for proc in [self.process] + self.process.children(recursive=True):
+            try:
+                times = proc.cpu_times()
+                rss += proc.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+            self._cpu[proc.pid] = times.user + times.system
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def run(self):
+        while not self._stopping.wait(self.period):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        self._baseline = dict(self._cpu)
+        super().start()
+
+    def stop(self):
+        """Arresta il campionamento e restituisce i secondi di CPU consumati dal server."""
+        self._stopping.set()
+        self.join()
+        self._sample()
+        return sum(cpu - self._baseline.get(pid, 0.0) for pid, cpu in self._cpu.items())
+
+def database_usage(workdir, checkpoint=False):
+    """
+    Righe grezze salvate e byte occupati dal database del server. Con
+    checkpoint il WAL viene prima riportato nel database e troncato, così i
+    byte misurano le pagine effettivamente occupate.
+    """
+    data_dir = os.path.join(workdir, 'data')
+    conn = sqlite3.connect(os.path.join(data_dir, 'monitoring.db'))
+    try:
+        if checkpoint:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size = sum(os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir)
+                   if name.startswith('monitoring.db'))
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND (name = 'system_data' OR name GLOB 'system_data_[dw][0-9]*')")]
+        rows = sum(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables)
+    finally:
+        conn.close()
+    return rows, size
+
+def wait_for_rows(workdir, expected, timeout=15.0):
+    """
+    Attende che la coda di scrittura del server abbia salvato i report
+    accettati (o che il conteggio smetta di crescere) e restituisce le righe.
+    """
+    deadline = time.time() + timeout
+    rows, stable_since = -1, time.time()
+    while time.time() < deadline:
+        current, _ = database_usage(workdir)
+        if current >= expected:
+            return current
+        if current != rows:
+            rows, stable_since = current, time.time()
+        elif time.time() - stable_since > 2.0:
+            break
+        time.sleep(0.1)
+    return rows
+
+def run_scenario(mode, args):
+    """Esegue uno scenario completo su un server appena avviato e ne restituisce le metriche."""
+    workdir = tempfile.mkdtemp(prefix=f'netmaster_ingest_{mode}_')
+    try:
+        process, port = start_server(mode, args, workdir, None)
+        try:
+            # Database inizializzato dal server: la crescita si misura da qui
+            _, initial_bytes = database_usage(workdir, checkpoint=True)
+            monitor = ResourceMonitor(process.pid)
+            monitor.start()
+
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            start = time.time() + 1.0
+            deadline = start + args.duration
+            processes = [context.Process(target=client_process,
+                                         args=(i, port, args, range(i, args.agents, args.clients),
+                                               start, deadline, results))
+                         for i in range(args.clients)]
+            for client in processes:
+                client.start()
+            latencies, lags, statuses = [], [], {}
+            for _ in processes:
+                client_latencies, client_lags, client_statuses = results.get()
+                latencies.extend(client_latencies)
+                lags.extend(client_lags)
+                for status, count in client_statuses.items():
+                    statuses[status] = statuses.get(status, 0) + count
+            for client in processes:
+                client.join()
+            ok = sum(count for status, count in statuses.items() if isinstance(status, int) and status < 400)
+            # Le righe si contano con il server attivo: il modo threaded non
+            # svuota la coda di scrittura su SIGTERM
+            rows = wait_for_rows(workdir, ok)
+            server_cpu = monitor.stop()
+        finally:
+            stop_server(process)
+        _, final_bytes = database_usage(workdir, checkpoint=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies.sort()
+    lags.sort()
+    total = len(latencies)
+    return {
+        'mode': mode,
+        'agents': args.agents,
+        'interval': args.interval,
+        'duration': args.duration,
+        'offered_rate': round(args.agents / args.interval, 1),
+        'requests': total,
+        'throughput': round(ok / args.duration, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'lag_p99_ms': round(percentile(lags, 0.99) * 1000, 2),
+        'error_rate': round((total - ok) / total, 4) if total else 0.0,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'db_rows': rows,
+        'db_growth_bytes': final_bytes - initial_bytes,
+        'db_bytes_per_row': round((final_bytes - initial_bytes) / rows, 1) if rows else 0.0,
+        'server_cpu_percent': round(server_cpu * 100 / args.duration, 1),
+        'server_cpu_ms_per_request': round(server_cpu * 1000 / total, 3) if total else 0.0,
+        'server_peak_rss_mb': round(monitor.peak_rss / (1024 * 1024), 1),
+    }
+
+def scenario_key(result):
+    return f"{result['mode']}-{result['agents']}a-{result['interval']:g}s"
+
+def host_info():
+    """Descrizione della macchina: le baseline sono confrontabili solo sullo stesso host."""
+    return {'cpus': os.cpu_count(), 'platform': platform.platform(), 'python': platform.python_version()}
+
+def load_baselines(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'host': None, 'scenarios': {}}
+
+def compare(result, baseline, tolerance):
+    """Restituisce le regressioni di `result` rispetto alla baseline dello stesso scenario."""
+    regressions = []
+    for metric, higher_is_better in CHECKED_METRICS:
+        before, after = baseline.get(metric), result[metric]
+        if not before:
+            continue
+        change = (after - before) / before
+        if metric.endswith('_ms') and abs(after - before) < LATENCY_FLOOR_MS:
+            continue
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{metric}: {before} -> {after} ({change:+.0%})")
+    if result['error_rate'] - baseline.get('error_rate', 0.0) > MAX_ERROR_RATE_INCREASE:
+        regressions.append(f"error_rate: {baseline.get('error_rate', 0.0)} -> {result['error_rate']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark di ingestione con agent virtuali")
+    parser.add_argument('--agents', type=int, default=1000, help="Agent virtuali")
+    parser.add_argument('--interval', type=float, default=10, help="Secondi tra due report di ogni agent")
+    parser.add_argument('--duration', type=float, default=30, help="Secondi di carico per modalità")
+    parser.add_argument('--modes', default='threaded', help="Modalità del server (threaded,prefork,async)")
+    parser.add_argument('--workers', type=int, default=4, help="Worker del server pre-fork")
+    parser.add_argument('--threads', type=int, default=8, help="Thread per worker")
+    parser.add_argument('--clients', type=int, default=2, help="Processi client")
+    parser.add_argument('--connections', type=int, default=16, help="Connessioni per processo client")
+    parser.add_argument('--seed', type=int, default=1, help="Seme di sfasamenti e metriche")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="File delle baseline")
+    parser.add_argument('--save-baseline', action='store_true', help="Salva i risultati come baseline")
+    parser.add_argument('--check', action='store_true', help="Esce con codice 1 se peggiora rispetto alla baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Peggioramento relativo tollerato")
+    parser.add_argument('--json', action='store_true', help="Stampa i risultati completi in JSON")
+    args = parser.parse_args()
+
+    baselines = load_baselines(args.baseline)
+    if args.check and baselines['host'] and baselines['host'] != host_info():
+        print(f"Attenzione: baseline registrata su un host diverso ({baselines['host']})")
+
+    print("=" * 100)
+    print(f"Ingestione: {args.agents} agent ogni {args.interval:g}s "
+          f"({args.agents / args.interval:,.0f} report/s offerti), {args.duration:.0f}s, seed {args.seed}")
+    print("=" * 100)
+    print(f"{'Modalità':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ritardo':>8} "
+          f"{'errori':>7} {'righe':>8} {'B/riga':>7} {'CPU srv':>8} {'RSS MB':>7}")
+
+    failed = False
+    for mode in args.modes.split(','):
+        result = run_scenario(mode, args)
+        key = scenario_key(result)
+        print(f"{mode:<10} {result['throughput']:>8,.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['lag_p99_ms']:>8.1f} {result['error_rate']:>7.2%} "
+              f"{result['db_rows']:>8} {result['db_bytes_per_row']:>7.0f} "
+              f"{result['server_cpu_percent']:>7.1f}% {result['server_peak_rss_mb']:>7.1f}")
+        if args.json:
+            print(json.dumps(result, indent=2))
+        if args.check:
+            baseline = baselines['scenarios'].get(key)
+            if baseline is None:
+                print(f"  nessuna baseline per {key}")
+            else:
+                regressions = compare(result, baseline, args.tolerance)
+                for regression in regressions:
+                    print(f"  REGRESSIONE {regression}")
+                failed |= bool(regressions)
+        if args.save_baseline:
+            baselines['scenarios'][key] = dict(result, recorded_at=datetime.now().isoformat(timespec='seconds'))
+
+    if args.save_baseline:
+        baselines['host'] = host_info()
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline salvata in {args.baseline}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del rate limiter di security_validator.
+
+Misura il costo medio di RateLimiter.check() al crescere della storia di
+richieste già registrate per la stessa chiave e del numero di client distinti:
+con i contatori a finestra scorrevole il costo per richiesta deve restare
+costante, così come la memoria occupata da ogni chiave.
+
+Uso:
+    python benchmarks/bench_rate_limiter.py [--calls 20000] [--threads 8]
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from security_validator import RateLimiter
+
+def time_checks(limiter, keys, calls, start_time):
+    """Restituisce i microsecondi medi per chiamata a check()."""
+    begin = time.perf_counter()
+    for i in range(calls):
+        limiter.check(keys[i % len(keys)], '/api/report', 10**9, 10**9, start_time + i * 0.001)
+    return (time.perf_counter() - begin) / calls * 1e6
+
+def bench_history(calls):
+    """Costo per richiesta dopo N richieste già registrate per lo stesso client."""
+    print("\nStoria per client   us/richiesta")
+    for history in (0, 1_000, 10_000, 100_000):
+        limiter = RateLimiter()
+        time_checks(limiter, ['10.0.0.1'], history or 1, 1000.0)
+        cost = time_checks(limiter, ['10.0.0.1'], calls, 1000.0 + history * 0.001)
+        print(f"{history:>16,}   {cost:12.2f}")
+
+def bench_clients(calls):
+    """Costo per richiesta e memoria per chiave al crescere dei client distinti."""
+    print("\nClient distinti     us/richiesta   byte/chiave")
+    for clients in (10, 1_000, 10_000):
+        keys = [f'10.{i // 65536}.{i // 256 % 256}.{i % 256}' for i in range(clients)]
+        cost = time_checks(RateLimiter(), keys, max(calls, clients), 1000.0)
+
+        # Memoria misurata a parte: tracemalloc rallenta le allocazioni
+        limiter = RateLimiter()
+        tracemalloc.start()
+        time_checks(limiter, keys, clients, 1000.0)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{clients:>15,}   {cost:12.2f}   {memory / clients:11.0f}")
+
+def bench_threads(calls, threads):
+    """Throughput con più thread sullo stesso limiter (come il server Flask threaded)."""
+    limiter = RateLimiter()
+    per_thread = calls // threads
+
+    def worker(index):
+        time_checks(limiter, [f'10.0.1.{index}'], per_thread, 1000.0)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    begin = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - begin
+    print(f"\n{threads} thread: {per_thread * threads / elapsed:,.0f} verifiche/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark del rate limiter")
+    parser.add_argument('--calls', type=int, default=20000, help="Chiamate misurate per scenario")
+    parser.add_argument('--threads', type=int, default=8, help="Thread per il test di concorrenza")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("Rate limiter a finestra scorrevole - microbenchmark")
+    print("=" * 50)
+    bench_history(args.calls)
+    bench_clients(args.calls)
+    bench_threads(args.calls, args.threads)
+
+if __name__ == '__main__':
+    main()
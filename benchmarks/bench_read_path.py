@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Benchmark del percorso di lettura della dashboard con budget di latenza.
+
+Sintetizza in una directory temporanea un monitoring.db realistico (di default
+1000 agent x 30 giorni di campioni ogni 60s, terminanti adesso): i dati grezzi
+vengono instradati nelle partizioni e gli aggregati 1m/5m/1h calcolati con le
+stesse funzioni di database.py e rollup.py, a blocchi di un'ora. Poi misura
+ogni endpoint di lettura (via test client Flask, autenticazione e
+serializzazione JSON comprese) e ogni funzione di query di database.py:
+- a freddo: connessioni del pool chiuse e cache del server svuotate;
+- a caldo: mediana di --repeat chiamate successive.
+
+I budget sono salvati per scala (agent, giorni, passo) in
+benchmarks/baselines/read_budgets.json; con --check lo script termina con
+codice 1 se una misura supera il proprio budget. --save-budgets registra i
+tempi misurati moltiplicati per --headroom. La scala completa richiede
+decine di GB e oltre un'ora di sintesi: per un controllo rapido usare ad
+esempio --agents 100 --days 7. Con --db si misura un database esistente (es.
+una copia di produzione) invece di sintetizzarlo.
+
+Uso:
+    python benchmarks/bench_read_path.py [--agents 1000] [--days 30] [--step 60] [--seed 1]
+                                         [--repeat 5] [--db PATH] [--keep DIR]
+                                         [--check] [--save-budgets] [--headroom 3]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+BUDGETS_PATH = os.path.join(ROOT, 'benchmarks', 'baselines', 'read_budgets.json')
+
+# Agent con carico alto (sopra le soglie di default) per avere avvisi realistici
+HOT_AGENT_RATIO = 0.05
+
+def agent_ip(index):
+    return f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}'
+
+def synthesize(agents, days, step, seed, now):
+    """
+    Popola il database corrente (database.DB_PATH) con `days` giorni di
+    campioni di `agents` agent fino a `now`. Restituisce le righe grezze scritte.
+    """
+    import database
+    import rollup
+
+    rng = random.Random(seed)
+    state = []
+    for index in range(agents):
+        hot = rng.random() < HOT_AGENT_RATIO
+        state.append({
+            'ip': agent_ip(index),
+            'node': f'HOST-{index:05d}',
+            'cpu': rng.uniform(60, 95) if hot else rng.uniform(5, 50),
+            'memory': rng.uniform(70, 97) if hot else rng.uniform(20, 70),
+            'disk': rng.uniform(30, 95),
+            # Ogni agent invia con un proprio sfasamento nel periodo
+            'offset': rng.randrange(step),
+        })
+
+    first_hour = (now - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    end = now.replace(microsecond=0)
+    written = 0
+    hour = first_hour
+    while hour < end:
+        rows = []
+        for tick in range(0, 3600, step):
+            for agent in state:
+                moment = hour + timedelta(seconds=tick + agent['offset'])
+                if moment > end or moment < end - timedelta(days=days):
+                    continue
+                agent['cpu'] = min(100.0, max(0.0, agent['cpu'] + rng.uniform(-4, 4)))
+                agent['memory'] = min(100.0, max(0.0, agent['memory'] + rng.uniform(-1, 1)))
+                rows.append((moment.isoformat(), agent['ip'], agent['node'],
+                             round(agent['cpu'], 2), round(agent['memory'], 2), round(agent['disk'], 2),
+                             'Linux', agent['node'], '6.1.0', '#1 SMP'))
+        rows.sort()
+        with database.pooled_connection() as conn:
+            database._insert_system_data(conn, rows)
+            # I blocchi sono allineati all'ora: nessun bucket 1m/5m/1h va fuso con uno già scritto
+            updates = []
+            for (tier, ip, start), aggregate in rollup.aggregate_rows(rows).items():
+                columns = rollup.to_columns(aggregate)
+                columns.update(tier=tier, agent_ip=ip, bucket_start=start)
+                updates.append(tuple(columns[name] for name in database.ROLLUP_COLUMNS))
+            conn.executemany(database.ROLLUP_UPSERT_SQL, updates)
+            if hour + timedelta(hours=1) >= end:
+                conn.executemany(database.AGENT_LATEST_UPSERT_SQL, database._latest_rows(rows))
+        written += len(rows)
+        hour += timedelta(hours=1)
+    return written
+
+def measure(func, repeat, reset):
+    """Restituisce (ms a freddo, mediana ms a caldo, risultato della chiamata a freddo)."""
+    reset()
+    begin = time.perf_counter()
+    result = func()
+    cold = (time.perf_counter() - begin) * 1000
+    warm = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        warm.append((time.perf_counter() - begin) * 1000)
+    return round(cold, 2), round(statistics.median(warm), 2), result
+
+def result_size(result):
+    """Righe (liste) o byte (risposte HTTP) restituiti."""
+    if hasattr(result, 'status_code'):
+        return f"{len(result.get_data())} B"
+    if isinstance(result, (list, dict)):
+        return f"{len(result)} righe"
+    return str(result)
+
+def read_targets(now):
+    """Endpoint e funzioni di query da misurare: [(nome, funzione)]."""
+    import base64
+    import database
+    import server_integrated
+
+    client = server_integrated.app.test_client()
+    auth = 'Basic ' + base64.b64encode(f'{USERNAME}:{PASSWORD}'.encode()).decode()
+    counter = iter(range(1, 10**9))
+
+    def get(path):
+        # Un indirizzo client diverso per ogni richiesta: il rate limiter non entra nelle misure
+        def call():
+            index = next(counter)
+            response = client.get(path, headers={'Authorization': auth},
+                                  environ_base={'REMOTE_ADDR': f'172.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}'})
+            if response.status_code != 200:
+                raise RuntimeError(f"{path}: HTTP {response.status_code}")
+            return response
+        return call
+
+    day_ago = (now - timedelta(hours=24)).isoformat()
+    week_ago = (now - timedelta(days=7)).isoformat()
+    sample_agent = agent_ip(0)
+    return [
+        ('GET /api/stats', get('/api/stats')),
+        ('GET /api/realtime?timespan=1h', get('/api/realtime?timespan=1h')),
+        ('GET /api/realtime?timespan=6h', get('/api/realtime?timespan=6h')),
+        ('GET /api/realtime?timespan=24h', get('/api/realtime?timespan=24h')),
+        ('GET /api/agents', get('/api/agents')),
+        ('GET /api/alerts', get('/api/alerts')),
+        ('GET /api/history', get('/api/history')),
+        ('GET /api/history?agent&start=24h', get(f'/api/history?agent={sample_agent}&start={day_ago}')),
+        ('GET /api/history?agent&start=7d', get(f'/api/history?agent={sample_agent}&start={week_ago}')),
+        ('database.get_system_stats', database.get_system_stats),
+        ('database.get_recent_data(1h)', lambda: database.get_recent_data(1)),
+        ('database.get_recent_data(24h)', lambda: database.get_recent_data(24)),
+        ('database.get_rollup_data(5m, 24h)', lambda: database.get_rollup_data('5m', day_ago)),
+        ('database.get_rollup_data(1h, 7d)', lambda: database.get_rollup_data('1h', week_ago)),
+        ('database.select_tier(24h)', lambda: database.select_tier(day_ago)),
+        ('database.count_agents', database.count_agents),
+        ('database.get_active_agents', database.get_active_agents),
+        ('database.generate_alerts_from_current_data', database.generate_alerts_from_current_data),
+        ('database.get_history(agent, 24h)', lambda: database.get_history(sample_agent, day_ago, limit=2000)),
+        ('database.get_history()', database.get_history),
+        ('database.get_all_thresholds', database.get_all_thresholds),
+    ]
+
+def reset_caches():
+    """Stato 'a freddo': connessioni (e relative cache di pagine SQLite) e cache del server."""
+    import database
+    import server_integrated
+    database.close_all_connections()
+    database.threshold_cache.clear()
+    server_integrated.response_cache.clear()
+
+def scale_key(args):
+    return f"{args.agents}a-{args.days}d-{args.step}s"
+
+def host_info():
+    return {'cpus': os.cpu_count(), 'platform': platform.platform(), 'python': platform.python_version()}
+
+def load_budgets(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'host': None, 'scales': {}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del percorso di lettura con budget di latenza")
+    parser.add_argument('--agents', type=int, default=1000, help="Agent sintetizzati")
+    parser.add_argument('--days', type=int, default=30, help="Giorni di storico")
+    parser.add_argument('--step', type=int, default=60, help="Secondi tra due campioni di un agent")
+    parser.add_argument('--seed', type=int, default=1, help="Seme dei dati sintetici")
+    parser.add_argument('--repeat', type=int, default=5, help="Chiamate a caldo per misura")
+    parser.add_argument('--db', help="Misura un monitoring.db esistente invece di sintetizzarlo")
+    parser.add_argument('--keep', help="Copia il database sintetizzato in questa directory")
+    parser.add_argument('--budgets', default=BUDGETS_PATH, help="File dei budget")
+    parser.add_argument('--check', action='store_true', help="Esce con codice 1 se un budget è superato")
+    parser.add_argument('--save-budgets', action='store_true', help="Salva i tempi misurati x headroom come budget")
+    parser.add_argument('--headroom', type=float, default=3.0, help="Margine dei budget salvati")
+    args = parser.parse_args()
+
+    import bcrypt
+    os.environ.update(NETMASTER_USERNAME=USERNAME, NETMASTER_PASSWORD=PASSWORD,
+                      NETMASTER_PASSWORD_HASH=bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode())
+
+    workdir = tempfile.mkdtemp(prefix='netmaster_read_')
+    cwd = os.getcwd()
+    db_source = os.path.abspath(args.db) if args.db else None
+    try:
+        # database.py e server_integrated usano percorsi relativi (data/, logs/)
+        os.chdir(workdir)
+        os.makedirs('data')
+        import database
+        now = datetime.now()
+        if db_source:
+            shutil.copy(db_source, os.path.join('data', 'monitoring.db'))
+            database.init_db()
+            scale = f"db {os.path.basename(db_source)}"
+        else:
+            database.init_db()
+            begin = time.perf_counter()
+            rows = synthesize(args.agents, args.days, args.step, args.seed, now)
+            database.close_all_connections()
+            elapsed = time.perf_counter() - begin
+            size = os.path.getsize(os.path.join('data', 'monitoring.db'))
+            scale = scale_key(args)
+            print(f"Sintetizzate {rows:,} righe ({args.agents} agent x {args.days} giorni, ogni {args.step}s) "
+                  f"in {elapsed:.0f}s: {size / 1024 ** 2:,.0f} MB")
+            if args.keep:
+                os.makedirs(os.path.join(cwd, args.keep), exist_ok=True)
+                shutil.copy(os.path.join('data', 'monitoring.db'), os.path.join(cwd, args.keep, f'monitoring_{scale}.db'))
+
+        import logging
+        import server_integrated
+        logging.getLogger().setLevel(logging.WARNING)
+        server_integrated.retention_manager.stop()
+
+        budgets = load_budgets(args.budgets)
+        scale_budgets = budgets['scales'].get(scale, {})
+        if args.check and not scale_budgets:
+            print(f"Nessun budget per la scala {scale}")
+
+        print("=" * 96)
+        print(f"{'Lettura':<48} {'freddo ms':>10} {'caldo ms':>10} {'budget ms':>15} {'risultato':>10}")
+        print("=" * 96)
+        measured, exceeded = {}, []
+        for name, func in read_targets(now):
+            cold, warm, result = measure(func, args.repeat, reset_caches)
+            measured[name] = {'cold_ms': cold, 'warm_ms': warm}
+            budget = scale_budgets.get(name)
+            label = f"{budget['cold_ms']:g}/{budget['warm_ms']:g}" if budget else '-'
+            flag = ''
+            if budget:
+                over = [kind for kind in ('cold_ms', 'warm_ms') if measured[name][kind] > budget[kind]]
+                if over:
+                    flag = '  FUORI BUDGET'
+                    exceeded.append(f"{name}: " + ', '.join(f"{kind} {measured[name][kind]} > {budget[kind]}"
+                                                            for kind in over))
+            print(f"{name:<48} {cold:>10.2f} {warm:>10.2f} {label:>15} {result_size(result):>10}{flag}")
+
+        server_integrated.ingest_queue.stop()
+        server_integrated.notification_dispatcher.stop()
+        database.close_all_connections()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_budgets:
+        budgets['host'] = host_info()
+        budgets['scales'][scale] = {
+            name: {kind: max(1, math.ceil(value * args.headroom)) for kind, value in values.items()}
+            for name, values in measured.items()
+        }
+        os.makedirs(os.path.dirname(args.budgets), exist_ok=True)
+        with open(args.budgets, 'w') as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Budget salvati in {args.budgets} (scala {scale}, margine x{args.headroom:g})")
+
+    if args.check and exceeded:
+        print(f"{len(exceeded)} letture oltre il budget:")
+        for line in exceeded:
+            print(f"  {line}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
-import sqlite3
 import os
 from datetime import datetime
 
+import database
+
 print("\n=== Verifica dati nel database ===")
 
 db_path = os.path.join('data', 'monitoring.db')
@@ -10,32 +11,22 @@ if not os.path.exists(db_path):
     exit(1)
 
 try:
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
     print("\nUltimi 5 record:")
-    cursor.execute("""
-        SELECT timestamp, agent_ip, cpu_usage, memory_usage, disk_usage 
-        FROM system_data 
-        ORDER BY timestamp DESC 
-        LIMIT 5
-    """)
-    
-    rows = cursor.fetchall()
+    # get_history legge le partizioni giornaliere di system_data dalla più recente
+    rows = database.get_history(limit=5)
     if not rows:
         print("Nessun dato trovato")
     else:
         for row in rows:
-            print(f"\nTimestamp: {row[0]}")
-            print(f"Agent IP: {row[1]}")
-            print(f"CPU: {row[2]}%")
-            print(f"Memory: {row[3]}%")
-            print(f"Disk: {row[4]}%")
+            print(f"\nTimestamp: {row['timestamp']}")
+            print(f"Agent IP: {row['agent_ip']}")
+            print(f"CPU: {row['cpu_usage']}%")
+            print(f"Memory: {row['memory_usage']}%")
+            print(f"Disk: {row['disk_usage']}%")
             
 except Exception as e:
     print(f"Errore: {str(e)}")
 finally:
-    if conn:
-        conn.close()
+    database.close_all_connections()
 
 input("\nPremi INVIO per chiudere...")
@@ -230,15 +230,11 @@ def fetch_and_update_data():
             conn = sqlite3.connect(db_path)
             cursor = conn.cursor()
 
-            # Recupera l'ultimo record per ogni agent
+            # Recupera l'ultimo record per ogni agent (tabella aggiornata dal server all'ingestione)
             cursor.execute("""
                 SELECT agent_ip, agent_name, cpu_usage, memory_usage, disk_usage, timestamp
-                FROM system_data
-                WHERE (agent_ip, timestamp) IN (
-                    SELECT agent_ip, MAX(timestamp) 
-                    FROM system_data 
-                    GROUP BY agent_ip
-                )
+                FROM agent_latest
+                ORDER BY timestamp DESC
             """)
             latest_records = cursor.fetchall()
             conn.close()
@@ -1,17 +1,384 @@
 import sqlite3
 import os
 import logging
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import json
 
+import rollup
+import partitioning
+from threshold_cache import ThresholdCache
+
 DB_PATH = os.path.join('data', 'monitoring.db')
 
-def get_db_connection():
-    """Crea e restituisce una connessione al database."""
-    conn = sqlite3.connect(DB_PATH)
+# Partizionamento dei dati grezzi: 'day', 'week' oppure 'none' (tabella unica)
+PARTITION_SCHEME = os.getenv('NETMASTER_PARTITION_SCHEME', 'day')
+
+# Pragma applicati a ogni connessione (WAL: i lettori non bloccano lo scrittore)
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # ~16MB di page cache per connessione
+    "PRAGMA mmap_size=268435456",    # 256MB di I/O memory-mapped
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Numero di prepared statement mantenuti in cache da ogni connessione
+STATEMENT_CACHE_SIZE = 256
+
+def _open_connection(db_path, check_same_thread=True):
+    """Apre una connessione SQLite configurata con i pragma di performance."""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=5.0,
+        check_same_thread=check_same_thread,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+class ConnectionPool:
+    """
+    Pool di connessioni SQLite persistenti.
+    
+    Ogni thread riceve la propria connessione (riutilizzata per tutte le
+    operazioni dello stesso thread); quando il thread termina la connessione
+    torna nel pool ed è riassegnata al thread successivo, così il server
+    Flask threaded non paga connect/close a ogni richiesta.
+    """
+    
+    def __init__(self, db_path, max_idle=16):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = []          # connessioni libere (LIFO)
+        self._in_use = {}        # {thread_ident: (thread, conn)}
+        self._local = threading.local()
+        self.created = 0
+    
+    def _reclaim_dead_threads(self):
+        """Recupera le connessioni assegnate a thread terminati (chiamata con lock)."""
+        for ident, (thread, conn) in list(self._in_use.items()):
+            if not thread.is_alive():
+                del self._in_use[ident]
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                else:
+                    conn.close()
+    
+    def acquire(self):
+        """Restituisce la connessione associata al thread corrente."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        
+        thread = threading.current_thread()
+        with self._lock:
+            self._reclaim_dead_threads()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = _open_connection(self.db_path, check_same_thread=False)
+                self.created += 1
+            self._in_use[thread.ident] = (thread, conn)
+        self._local.conn = conn
+        return conn
+    
+    def release(self):
+        """Restituisce al pool la connessione del thread corrente."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._in_use.pop(threading.get_ident(), None)
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+            else:
+                conn.close()
+    
+    def close_all(self):
+        """Chiude tutte le connessioni del pool (usato allo shutdown)."""
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            for _, conn in self._in_use.values():
+                try:
+                    conn.close()
+                except sqlite3.ProgrammingError:
+                    pass
+            self._idle = []
+            self._in_use = {}
+        self._local = threading.local()
+    
+    def stats(self):
+        """Statistiche del pool per diagnostica."""
+        with self._lock:
+            return {
+                'db_path': self.db_path,
+                'created': self.created,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use)
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Restituisce il pool per DB_PATH, ricreandolo se il percorso è cambiato."""
+    global _pool
+    pool = _pool
+    if pool is None or pool.db_path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.db_path != DB_PATH:
+                if _pool is not None:
+                    _pool.close_all()
+                _forget_partitions()
+                threshold_cache.clear()
+                _pool = ConnectionPool(DB_PATH)
+            pool = _pool
+    return pool
+
+@contextmanager
+def pooled_connection():
+    """
+    Context manager che fornisce la connessione persistente del thread corrente.
+    
+    Esegue commit all'uscita (rollback in caso di eccezione) senza chiudere la
+    connessione, che resta disponibile per le operazioni successive.
+    """
+    conn = get_pool().acquire()
+    with conn:
+        yield conn
+
+def close_all_connections():
+    """Chiude le connessioni persistenti del pool."""
+    if _pool is not None:
+        _pool.close_all()
+
+def get_db_connection():
+    """
+    Crea e restituisce una nuova connessione indipendente al database.
+    Il chiamante è responsabile della chiusura; le funzioni del modulo usano
+    invece pooled_connection().
+    """
+    return _open_connection(DB_PATH)
+
+# Schema comune alla tabella system_data e alle sue partizioni temporali
+SYSTEM_DATA_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME NOT NULL,
+        agent_ip TEXT NOT NULL,
+        agent_name TEXT,
+        cpu_usage REAL NOT NULL,
+        memory_usage REAL NOT NULL,
+        disk_usage REAL NOT NULL,
+        system TEXT NOT NULL,
+        node TEXT NOT NULL,
+        release TEXT NOT NULL,
+        version TEXT NOT NULL,
+        ingest_seq INTEGER NOT NULL DEFAULT 0
+    )
+'''
+
+SYSTEM_DATA_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_{table}_agent_ts ON {table}(agent_ip, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table}(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_{table}_seq ON {table}(ingest_seq)",
+)
+
+# --- Migrazioni dello schema ---
+
+# Oltre questa dimensione la migrazione 4 non esegue il VACUUM completo all'avvio,
+# che bloccherebbe il database (e l'avvio del server) per tutta la sua durata:
+# va eseguito in manutenzione con enable_incremental_vacuum()
+VACUUM_MIGRATION_MAX_BYTES = int(os.getenv('NETMASTER_VACUUM_MIGRATION_MAX_MB', 64)) * 1024 * 1024
+
+def _database_size(conn):
+    """Dimensione del file del database in byte (pagine x dimensione pagina)."""
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+def _set_incremental_vacuum(conn):
+    # Il cambio di auto_vacuum ha effetto solo dopo un VACUUM completo
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+def _migrate_incremental_vacuum(conn):
+    """
+    Migrazione 4: abilita il vacuum incrementale sui database piccoli (o nuovi).
+    Sui database più grandi di VACUUM_MIGRATION_MAX_BYTES registra un avviso e
+    lascia il passaggio alla manutenzione (enable_incremental_vacuum).
+    """
+    size = _database_size(conn)
+    if size > VACUUM_MIGRATION_MAX_BYTES:
+        logging.warning(f"Vacuum incrementale non abilitato: il VACUUM completo di un database di "
+                        f"{size / 1024 / 1024:.0f} MB bloccherebbe l'avvio. Eseguirlo in manutenzione "
+                        f"con 'python database.py --enable-incremental-vacuum' a server fermo.")
+        return
+    _set_incremental_vacuum(conn)
+
+def is_incremental_vacuum_enabled(conn):
+    """True se il database usa auto_vacuum = INCREMENTAL."""
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+def enable_incremental_vacuum():
+    """
+    Manutenzione: abilita il vacuum incrementale con un VACUUM completo.
+    Blocca il database per tutta la durata (e richiede spazio libero pari alla
+    sua dimensione): da eseguire a server fermo.
+
+    Returns:
+        bool: True se il VACUUM è stato eseguito, False se era già abilitato
+    """
+    with pooled_connection() as conn:
+        if is_incremental_vacuum_enabled(conn):
+            return False
+        logging.info(f"VACUUM completo di {_database_size(conn) / 1024 / 1024:.0f} MB in corso...")
+        _set_incremental_vacuum(conn)
+    return True
+
+# Ogni migrazione è una lista di statement SQL (o funzioni che ricevono la
+# connessione); la versione applicata è salvata in PRAGMA user_version,
+# quindi ogni migrazione viene eseguita una sola volta.
+MIGRATIONS = [
+    # 1: indici per le query time-series su system_data e notifications
+    [
+        "CREATE INDEX IF NOT EXISTS idx_system_data_agent_ts ON system_data(agent_ip, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_system_data_ts ON system_data(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_agent_metric_ts ON notifications(agent_ip, metric, timestamp)",
+        "ANALYZE",
+    ],
+    # 2: ultimo campione per agent, aggiornato all'ingestione
+    [
+        """
+        CREATE TABLE IF NOT EXISTS agent_latest (
+            agent_ip TEXT PRIMARY KEY,
+            timestamp DATETIME NOT NULL,
+            agent_name TEXT,
+            cpu_usage REAL NOT NULL,
+            memory_usage REAL NOT NULL,
+            disk_usage REAL NOT NULL,
+            system TEXT NOT NULL,
+            node TEXT NOT NULL,
+            release TEXT NOT NULL,
+            version TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_agent_latest_ts ON agent_latest(timestamp)",
+        """
+        INSERT OR REPLACE INTO agent_latest (
+            agent_ip, timestamp, agent_name, cpu_usage, memory_usage, disk_usage,
+            system, node, release, version
+        )
+        SELECT s1.agent_ip, s1.timestamp, s1.agent_name, s1.cpu_usage, s1.memory_usage,
+               s1.disk_usage, s1.system, s1.node, s1.release, s1.version
+        FROM system_data s1
+        INNER JOIN (
+            SELECT agent_ip, MAX(timestamp) as max_timestamp
+            FROM system_data
+            GROUP BY agent_ip
+        ) s2 ON s1.agent_ip = s2.agent_ip AND s1.timestamp = s2.max_timestamp
+        """,
+    ],
+    # 3: aggregati a 1m/5m/1h per agent, mantenuti all'ingestione
+    [
+        """
+        CREATE TABLE IF NOT EXISTS metrics_rollup (
+            tier TEXT NOT NULL,
+            agent_ip TEXT NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            samples INTEGER NOT NULL,
+            cpu_min REAL, cpu_max REAL, cpu_sum REAL, cpu_avg REAL, cpu_p95 REAL,
+            memory_min REAL, memory_max REAL, memory_sum REAL, memory_avg REAL, memory_p95 REAL,
+            disk_min REAL, disk_max REAL, disk_sum REAL, disk_avg REAL, disk_p95 REAL,
+            histogram TEXT NOT NULL,
+            PRIMARY KEY (tier, agent_ip, bucket_start)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_metrics_rollup_tier_bucket ON metrics_rollup(tier, bucket_start)",
+        lambda conn: _backfill_rollups(conn),
+    ],
+    # 4: abilita il vacuum incrementale (richiede un VACUUM completo una tantum,
+    # rimandato alla manutenzione sui database grandi)
+    [
+        lambda conn: _migrate_incremental_vacuum(conn),
+    ],
+    # 5: registro delle partizioni temporali di system_data
+    [
+        """
+        CREATE TABLE IF NOT EXISTS system_data_partitions (
+            name TEXT PRIMARY KEY,
+            period_start DATETIME NOT NULL,
+            period_end DATETIME NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_system_data_partitions_period ON system_data_partitions(period_start)",
+    ],
+    # 6: stato di consegna delle notifiche inviate dal dispatcher asincrono
+    [
+        "ALTER TABLE notifications ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE notifications ADD COLUMN delivered_at DATETIME",
+        "ALTER TABLE notifications ADD COLUMN error TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_status ON notifications(status)",
+    ],
+    # 7: dati statici degli host registrati, referenziati dai report compatti per agent_id
+    [
+        """
+        CREATE TABLE IF NOT EXISTS agent_hosts (
+            agent_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_ip TEXT NOT NULL,
+            system TEXT NOT NULL,
+            node TEXT NOT NULL,
+            release TEXT NOT NULL,
+            version TEXT NOT NULL,
+            registered_at DATETIME NOT NULL,
+            UNIQUE (agent_ip, system, node, release, version)
+        )
+        """,
+    ],
+    # 8: metriche aggiuntive dei collector dell'agent (JSON) nell'ultimo campione
+    [
+        "ALTER TABLE agent_latest ADD COLUMN extra TEXT",
+    ],
+    # 9: sequenza di scrittura (cursore delta indipendente dal timestamp dei campioni)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO ingest_state (id, seq) VALUES (1, 0)",
+        lambda conn: _add_ingest_seq(conn),
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn):
+    """Restituisce la versione dello schema registrata nel database."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(conn):
+    """Applica in ordine le migrazioni non ancora eseguite."""
+    current = get_schema_version(conn)
+    for version in range(current + 1, SCHEMA_VERSION + 1):
+        logging.info(f"Applicazione migrazione schema {version}...")
+        with conn:
+            for statement in MIGRATIONS[version - 1]:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+    return get_schema_version(conn)
+
 def init_db():
     """Crea il database e le tabelle necessarie se non esistono."""
     db_dir = os.path.dirname(DB_PATH)
@@ -20,25 +387,11 @@ def init_db():
         logging.info(f"Creata directory per il database: {db_dir}")
     
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             cursor = conn.cursor()
             
-            # Tabella per i dati di sistema
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS system_data (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME NOT NULL,
-                    agent_ip TEXT NOT NULL,
-                    agent_name TEXT,
-                    cpu_usage REAL NOT NULL,
-                    memory_usage REAL NOT NULL,
-                    disk_usage REAL NOT NULL,
-                    system TEXT NOT NULL,
-                    node TEXT NOT NULL,
-                    release TEXT NOT NULL,
-                    version TEXT NOT NULL
-                )
-            ''')
+            # Tabella per i dati di sistema (dati precedenti al partizionamento)
+            cursor.execute(SYSTEM_DATA_TABLE_SQL.format(table=partitioning.LEGACY_TABLE))
             
             # Tabella per le soglie
             cursor.execute('''
@@ -80,20 +433,262 @@ def init_db():
             ''')
             
             conn.commit()
+            apply_migrations(conn)
             logging.info("Database inizializzato con successo.")
     except Exception as e:
         logging.error(f"Errore durante l'inizializzazione del database: {e}", exc_info=True)
 
-def save_system_data(data, agent_ip):
-    """Salva i dati di sistema ricevuti da un agent nel database."""
-    sql = '''
-        INSERT INTO system_data (
-            timestamp, agent_ip, agent_name, cpu_usage, memory_usage, disk_usage,
-            system, node, release, version
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    '''
-    params = (
-        datetime.now().isoformat(),
+# Campi di una riga di system_data; le righe di build_system_data_row hanno in
+# più le metriche aggiuntive in JSON, salvate solo in agent_latest
+SYSTEM_DATA_FIELDS = 10
+
+SYSTEM_DATA_INSERT_SQL = '''
+    INSERT INTO {table} (
+        timestamp, agent_ip, agent_name, cpu_usage, memory_usage, disk_usage,
+        system, node, release, version, ingest_seq
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# --- Sequenza di scrittura ---
+
+# Ogni transazione di scrittura dei campioni incrementa ingest_state.seq e la
+# registra nelle righe (e negli aggregati) che scrive. SQLite ha un solo
+# scrittore alla volta, quindi la sequenza segue l'ordine di commit: un
+# client che chiede since=<seq> riceve anche le righe con timestamp vecchio
+# scritte dopo (backfill, altri worker, ingestione asincrona).
+INGEST_SEQ_BUMP_SQL = "UPDATE ingest_state SET seq = seq + 1 WHERE id = 1"
+INGEST_SEQ_QUERY = "SELECT seq FROM ingest_state WHERE id = 1"
+
+def _add_ingest_seq(conn):
+    """Aggiunge ingest_seq a system_data, alle partizioni e agli aggregati (migrazione 9)."""
+    tables = [partitioning.LEGACY_TABLE] + [
+        row['name'] for row in conn.execute("SELECT name FROM system_data_partitions")
+        if partitioning.is_partition(row['name'])
+    ]
+    for table in tables + ['metrics_rollup']:
+        columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if not columns:
+            continue
+        if 'ingest_seq' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN ingest_seq INTEGER NOT NULL DEFAULT 0")
+        if table != 'metrics_rollup':
+            conn.execute(SYSTEM_DATA_INDEX_SQL[2].format(table=table))
+
+def _next_ingest_seq(conn):
+    """Incrementa la sequenza di scrittura nella transazione corrente e la restituisce."""
+    conn.execute(INGEST_SEQ_BUMP_SQL)
+    return conn.execute(INGEST_SEQ_QUERY).fetchone()[0]
+
+def get_ingest_seq():
+    """
+    Ultimo valore della sequenza di scrittura: è il cursore da passare come
+    since per ricevere solo le righe scritte dopo questa lettura.
+    """
+    with pooled_connection() as conn:
+        row = conn.execute(INGEST_SEQ_QUERY).fetchone()
+    return row[0] if row else 0
+
+# --- Partizionamento temporale di system_data ---
+
+# Partizioni già create da questo processo (evita DDL a ogni scrittura)
+_known_partitions = set()
+_partitions_lock = threading.Lock()
+
+def _ensure_partition(conn, name):
+    """Crea la partizione (tabella, indici e voce di registro) se non esiste."""
+    with _partitions_lock:
+        if name in _known_partitions:
+            return
+    start, end = partitioning.partition_bounds(name)
+    conn.execute(SYSTEM_DATA_TABLE_SQL.format(table=name))
+    for statement in SYSTEM_DATA_INDEX_SQL:
+        conn.execute(statement.format(table=name))
+    conn.execute(
+        "INSERT OR IGNORE INTO system_data_partitions (name, period_start, period_end) VALUES (?, ?, ?)",
+        (name, start, end)
+    )
+    with _partitions_lock:
+        _known_partitions.add(name)
+
+def _forget_partitions():
+    """Svuota la cache delle partizioni (cambio database o transazione annullata)."""
+    with _partitions_lock:
+        _known_partitions.clear()
+
+def _insert_system_data(conn, rows, seq=0):
+    """
+    Inserisce righe grezze instradandole nella partizione del loro timestamp,
+    marcate con la sequenza di scrittura seq.
+    """
+    routed = {}
+    for row in rows:
+        table = partitioning.partition_name(row[0], PARTITION_SCHEME) or partitioning.LEGACY_TABLE
+        routed.setdefault(table, []).append(row)
+    for table, table_rows in routed.items():
+        if table != partitioning.LEGACY_TABLE:
+            _ensure_partition(conn, table)
+        # Le metriche aggiuntive (ultimo campo) vanno solo in agent_latest
+        conn.executemany(SYSTEM_DATA_INSERT_SQL.format(table=table),
+                         [row[:SYSTEM_DATA_FIELDS] + (seq,) for row in table_rows])
+
+PARTITIONS_IN_RANGE_QUERY = '''
+    SELECT name FROM system_data_partitions
+    WHERE (? IS NULL OR period_end > ?) AND (? IS NULL OR period_start <= ?)
+    ORDER BY period_start ASC
+'''
+
+def get_partition_tables(start_date=None, end_date=None, conn=None):
+    """
+    Restituisce le tabelle di system_data che intersecano l'intervallo indicato,
+    in ordine cronologico: prima la tabella non partizionata, poi le partizioni.
+    """
+    if conn is None:
+        with pooled_connection() as conn:
+            return get_partition_tables(start_date, end_date, conn)
+    rows = conn.execute(PARTITIONS_IN_RANGE_QUERY, (start_date, start_date, end_date, end_date)).fetchall()
+    return [partitioning.LEGACY_TABLE] + [row['name'] for row in rows if partitioning.is_partition(row['name'])]
+
+def drop_partition(name):
+    """Elimina una partizione di system_data con un DROP TABLE in una transazione breve."""
+    if not partitioning.is_partition(name):
+        raise ValueError(f"Nome di partizione non valido: {name}")
+    with pooled_connection() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {name}")
+        conn.execute("DELETE FROM system_data_partitions WHERE name = ?", (name,))
+    with _partitions_lock:
+        _known_partitions.discard(name)
+
+def drop_partitions_before(cutoff):
+    """
+    Elimina le partizioni interamente precedenti a cutoff (timestamp ISO).
+
+    Returns:
+        list: Nomi delle partizioni eliminate
+    """
+    with pooled_connection() as conn:
+        rows = conn.execute(
+            "SELECT name FROM system_data_partitions WHERE period_end <= ? ORDER BY period_start",
+            (cutoff,)
+        ).fetchall()
+    dropped = []
+    for row in rows:
+        if partitioning.is_partition(row['name']):
+            drop_partition(row['name'])
+            dropped.append(row['name'])
+    return dropped
+
+# Upsert dell'ultimo campione per agent; i parametri hanno lo stesso ordine
+# di SYSTEM_DATA_INSERT_SQL, così la stessa riga serve per entrambe le tabelle.
+# Le metriche aggiuntive vengono fuse (json_patch) con le precedenti: i
+# collector che girano meno spesso mantengono l'ultimo valore inviato
+AGENT_LATEST_UPSERT_SQL = '''
+    INSERT INTO agent_latest (
+        timestamp, agent_ip, agent_name, cpu_usage, memory_usage, disk_usage,
+        system, node, release, version, extra
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(agent_ip) DO UPDATE SET
+        extra = CASE WHEN excluded.extra IS NULL THEN agent_latest.extra
+                     ELSE json_patch(COALESCE(agent_latest.extra, '{}'), excluded.extra) END,
+        timestamp = excluded.timestamp,
+        agent_name = excluded.agent_name,
+        cpu_usage = excluded.cpu_usage,
+        memory_usage = excluded.memory_usage,
+        disk_usage = excluded.disk_usage,
+        system = excluded.system,
+        node = excluded.node,
+        release = excluded.release,
+        version = excluded.version
+    WHERE excluded.timestamp >= agent_latest.timestamp
+'''
+
+def _latest_rows(rows):
+    """Riduce un blocco di righe all'ultima riga di ciascun agent."""
+    latest = {}
+    for row in rows:
+        current = latest.get(row[1])
+        if current is None or row[0] >= current[0]:
+            latest[row[1]] = row
+    return [row if len(row) > SYSTEM_DATA_FIELDS else row + (None,) for row in latest.values()]
+
+ROLLUP_COLUMNS = (
+    'tier', 'agent_ip', 'bucket_start', 'samples',
+    'cpu_min', 'cpu_max', 'cpu_sum', 'cpu_avg', 'cpu_p95',
+    'memory_min', 'memory_max', 'memory_sum', 'memory_avg', 'memory_p95',
+    'disk_min', 'disk_max', 'disk_sum', 'disk_avg', 'disk_p95',
+    'histogram'
+)
+
+ROLLUP_SELECT_SQL = "SELECT * FROM metrics_rollup WHERE tier = ? AND agent_ip = ? AND bucket_start = ?"
+
+ROLLUP_UPSERT_SQL = "INSERT OR REPLACE INTO metrics_rollup ({}) VALUES ({})".format(
+    ', '.join(ROLLUP_COLUMNS), ', '.join('?' * len(ROLLUP_COLUMNS))
+)
+
+# Come ROLLUP_UPSERT_SQL, con la sequenza di scrittura del bucket aggiornato
+ROLLUP_SEQ_UPSERT_SQL = "INSERT OR REPLACE INTO metrics_rollup ({}, ingest_seq) VALUES ({}, ?)".format(
+    ', '.join(ROLLUP_COLUMNS), ', '.join('?' * len(ROLLUP_COLUMNS))
+)
+
+def _update_rollups(conn, rows, seq=None):
+    """
+    Fonde un blocco di righe negli aggregati 1m/5m/1h.
+    Va chiamata dentro la transazione di scrittura delle righe grezze, così
+    la lettura e l'aggiornamento di ogni bucket sono atomici. Con seq i bucket
+    aggiornati vengono marcati con la sequenza di scrittura (la migrazione 3,
+    precedente alla colonna, la omette).
+    """
+    updates = []
+    for (tier, agent_ip, start), aggregate in rollup.aggregate_rows(rows).items():
+        existing = conn.execute(ROLLUP_SELECT_SQL, (tier, agent_ip, start)).fetchone()
+        if existing is not None:
+            aggregate = rollup.merge(rollup.from_columns(existing), aggregate)
+        columns = rollup.to_columns(aggregate)
+        columns.update(tier=tier, agent_ip=agent_ip, bucket_start=start)
+        updates.append(tuple(columns[name] for name in ROLLUP_COLUMNS))
+    if seq is None:
+        conn.executemany(ROLLUP_UPSERT_SQL, updates)
+    else:
+        conn.executemany(ROLLUP_SEQ_UPSERT_SQL, [update + (seq,) for update in updates])
+
+def _backfill_rollups(conn, chunk_size=5000):
+    """Calcola gli aggregati per i dati grezzi già presenti (migrazione 3)."""
+    cursor = conn.execute(
+        "SELECT timestamp, agent_ip, agent_name, cpu_usage, memory_usage, disk_usage "
+        "FROM system_data ORDER BY id"
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        _update_rollups(conn, [tuple(row) for row in rows])
+
+# Campi del report che non sono metriche aggiuntive dei collector
+REPORT_CORE_FIELDS = frozenset(('timestamp', 'agent_id', 'cpu_usage', 'memory', 'disk',
+                                'system', 'node', 'release', 'version'))
+EXTRA_MAX_BYTES = 16 * 1024
+
+def build_agent_extra(data):
+    """
+    Serializza le metriche aggiuntive del report (load average, I/O, processi...).
+    Restituisce None se non ce ne sono o se superano EXTRA_MAX_BYTES.
+    """
+    extra = {key: value for key, value in data.items() if key not in REPORT_CORE_FIELDS}
+    if not extra:
+        return None
+    encoded = json.dumps(extra, separators=(',', ':'))
+    if len(encoded) > EXTRA_MAX_BYTES:
+        logging.warning(f"Metriche aggiuntive ignorate: {len(encoded)} byte (massimo {EXTRA_MAX_BYTES})")
+        return None
+    return encoded
+
+def build_system_data_row(data, agent_ip, timestamp=None):
+    """
+    Costruisce la tupla di parametri per l'inserimento in system_data, seguita
+    dalle metriche aggiuntive in JSON (vedi build_agent_extra).
+    Solleva KeyError se mancano campi obbligatori.
+    """
+    return (
+        timestamp or datetime.now().isoformat(),
         agent_ip,
         data.get('node', 'N/A'),
         data['cpu_usage'],
@@ -102,21 +697,99 @@ def save_system_data(data, agent_ip):
         data['system'],
         data['node'],
         data['release'],
-        data['version']
+        data['version'],
+        build_agent_extra(data)
     )
+
+# --- Registro degli host (report compatti) ---
+
+# Campi statici inviati una sola volta alla registrazione
+AGENT_HOST_FIELDS = ('system', 'node', 'release', 'version')
+
+# agent_id -> dati statici: immutabili, quindi la cache non scade mai
+_agent_hosts = {}
+_agent_hosts_lock = threading.Lock()
+
+def register_agent_host(agent_ip, facts):
+    """
+    Registra i dati statici di un host e restituisce il suo agent_id.
+    La registrazione è idempotente: gli stessi dati restituiscono lo stesso id.
+    Solleva KeyError se mancano campi obbligatori.
+    """
+    params = (agent_ip,) + tuple(str(facts[field]) for field in AGENT_HOST_FIELDS)
+    with pooled_connection() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO agent_hosts (agent_ip, system, node, release, version, registered_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)", params + (datetime.now().isoformat(),))
+        agent_id = conn.execute(
+            "SELECT agent_id FROM agent_hosts "
+            "WHERE agent_ip = ? AND system = ? AND node = ? AND release = ? AND version = ?",
+            params).fetchone()[0]
+    with _agent_hosts_lock:
+        _agent_hosts[agent_id] = dict(zip(AGENT_HOST_FIELDS, params[1:]))
+    return agent_id
+
+def is_agent_host_cached(agent_id):
+    """True se i dati statici dell'host sono in cache (get_agent_host non interroga il database)."""
+    with _agent_hosts_lock:
+        return agent_id in _agent_hosts
+
+def get_agent_host(agent_id):
+    """Restituisce i dati statici di un host registrato (None se sconosciuto)."""
+    with _agent_hosts_lock:
+        facts = _agent_hosts.get(agent_id)
+    if facts is not None:
+        return facts
+    with pooled_connection() as conn:
+        row = conn.execute(
+            "SELECT system, node, release, version FROM agent_hosts WHERE agent_id = ?",
+            (agent_id,)).fetchone()
+    if row is None:
+        return None
+    facts = dict(zip(AGENT_HOST_FIELDS, tuple(row)))
+    with _agent_hosts_lock:
+        _agent_hosts[agent_id] = facts
+    return facts
+
+def save_system_data(data, agent_ip):
+    """Salva i dati di sistema ricevuti da un agent nel database."""
     try:
-        with get_db_connection() as conn:
-            conn.execute(sql, params)
-            conn.commit()
+        params = build_system_data_row(data, agent_ip)
+        with pooled_connection() as conn:
+            seq = _next_ingest_seq(conn)
+            _insert_system_data(conn, [params], seq)
+            conn.execute(AGENT_LATEST_UPSERT_SQL, params)
+            _update_rollups(conn, [params], seq)
         return True
     except Exception as e:
+        _forget_partitions()
         logging.error(f"Errore durante il salvataggio dei dati: {e}", exc_info=True)
         return False
 
+def save_system_data_batch(rows):
+    """
+    Salva un blocco di righe (già costruite con build_system_data_row)
+    con un executemany per partizione in una sola transazione, aggiornando anche
+    l'ultimo campione di ogni agent in agent_latest e gli aggregati 1m/5m/1h.
+    """
+    if not rows:
+        return True
+    try:
+        with pooled_connection() as conn:
+            seq = _next_ingest_seq(conn)
+            _insert_system_data(conn, rows, seq)
+            conn.executemany(AGENT_LATEST_UPSERT_SQL, _latest_rows(rows))
+            _update_rollups(conn, rows, seq)
+        return True
+    except Exception as e:
+        _forget_partitions()
+        logging.error(f"Errore durante il salvataggio batch di {len(rows)} righe: {e}", exc_info=True)
+        return False
+
 def get_notification_config(config_type='email'):
     """Recupera la configurazione per un tipo di notifica."""
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             cursor = conn.execute("SELECT config FROM notification_config WHERE type = ? AND enabled = 1", (config_type,))
             row = cursor.fetchone()
         if row:
@@ -125,41 +798,76 @@ def get_notification_config(config_type='email'):
         logging.error(f"Errore nel recupero della config di notifica: {e}", exc_info=True)
     return None
 
+ACTIVE_THRESHOLDS_QUERY = "SELECT agent_ip, metric, threshold FROM thresholds WHERE enabled = 1"
+
+LAST_NOTIFICATION_QUERY = "SELECT MAX(timestamp) FROM notifications WHERE agent_ip = ? AND metric = ?"
+
+def _load_active_thresholds():
+    with pooled_connection() as conn:
+        return [tuple(row) for row in conn.execute(ACTIVE_THRESHOLDS_QUERY).fetchall()]
+
+def _load_last_notification(agent_ip, metric):
+    with pooled_connection() as conn:
+        return conn.execute(LAST_NOTIFICATION_QUERY, (agent_ip, metric)).fetchone()[0]
+
+# Cache in memoria delle soglie e dei cooldown, invalidata da save_threshold
+threshold_cache = ThresholdCache(_load_active_thresholds, _load_last_notification)
+
 def get_thresholds_for_agent(agent_ip):
-    """Recupera le soglie attive per un dato agent."""
+    """Recupera le soglie attive per un dato agent (dalla cache in memoria)."""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.execute("SELECT metric, threshold FROM thresholds WHERE agent_ip = ? AND enabled = 1", (agent_ip,))
-            return cursor.fetchall()
+        return threshold_cache.thresholds_for(agent_ip)
     except Exception as e:
         logging.error(f"Errore nel recupero delle soglie per l'agent {agent_ip}: {e}", exc_info=True)
         return []
 
-def has_recent_notification(agent_ip, metric):
-    """Verifica se è già stata inviata una notifica recente per una metrica."""
+def _cutoff(**delta):
+    """Timestamp ISO (stesso formato dei dati salvati) di un istante nel passato."""
+    return (datetime.now() - timedelta(**delta)).isoformat()
+
+def has_recent_notification(agent_ip, metric, hours=1):
+    """
+    Verifica se è già stata inviata una notifica recente per una metrica.
+    L'ultima notifica di ogni (agent_ip, metrica) è mantenuta in cache.
+    """
     try:
-        with get_db_connection() as conn:
-            cursor = conn.execute("SELECT id FROM notifications WHERE agent_ip = ? AND metric = ? AND timestamp > datetime('now', '-1 hour')", (agent_ip, metric))
-            return cursor.fetchone() is not None
+        return threshold_cache.is_in_cooldown(agent_ip, metric, _cutoff(hours=hours))
     except Exception as e:
         logging.error(f"Errore nel controllo delle notifiche recenti: {e}", exc_info=True)
         return False
 
-def save_notification(agent_ip, metric, value, threshold):
-    """Salva una notifica nel database."""
+def save_notification(agent_ip, metric, value, threshold, status='sent'):
+    """Salva una notifica nel database, avvia il cooldown in cache e ne restituisce l'id."""
     sql = "INSERT INTO notifications (agent_ip, metric, value, threshold, timestamp, status) VALUES (?, ?, ?, ?, ?, ?)"
-    params = (agent_ip, metric, value, threshold, datetime.now().isoformat(), 'sent')
+    timestamp = datetime.now().isoformat()
+    params = (agent_ip, metric, value, threshold, timestamp, status)
     try:
-        with get_db_connection() as conn:
-            conn.execute(sql, params)
+        with pooled_connection() as conn:
+            notification_id = conn.execute(sql, params).lastrowid
             conn.commit()
+        threshold_cache.record_notification(agent_ip, metric, timestamp)
+        return notification_id
     except Exception as e:
         logging.error(f"Errore nel salvataggio della notifica: {e}", exc_info=True)
+        return None
+
+def update_notification_status(notification_ids, status, attempts, error=None):
+    """Registra l'esito della consegna di una o più notifiche."""
+    delivered_at = datetime.now().isoformat() if status == 'sent' else None
+    sql = "UPDATE notifications SET status = ?, attempts = ?, delivered_at = ?, error = ? WHERE id = ?"
+    try:
+        with pooled_connection() as conn:
+            conn.executemany(sql, [(status, attempts, delivered_at, error, notification_id)
+                                   for notification_id in notification_ids])
+        return True
+    except Exception as e:
+        logging.error(f"Errore nell'aggiornamento dello stato delle notifiche: {e}", exc_info=True)
+        return False
 
 def get_all_thresholds():
     """Recupera tutte le soglie configurate."""
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             cursor = conn.execute("SELECT agent_ip, metric, threshold, enabled FROM thresholds ORDER BY agent_ip, metric")
             return [dict(row) for row in cursor.fetchall()]
     except Exception as e:
@@ -172,9 +880,10 @@ def save_threshold(agent_ip, metric, threshold, enabled):
     now = datetime.now().isoformat()
     params = (agent_ip, metric, threshold, enabled, now, now)
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             conn.execute(sql, params)
             conn.commit()
+        threshold_cache.invalidate()
         return True
     except Exception as e:
         logging.error(f"Errore nel salvataggio della soglia: {e}", exc_info=True)
@@ -183,7 +892,7 @@ def save_threshold(agent_ip, metric, threshold, enabled):
 def get_all_notification_configs():
     """Recupera tutte le configurazioni di notifica."""
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             cursor = conn.execute("SELECT type, config, enabled FROM notification_config")
             results = []
             for row in cursor.fetchall():
@@ -201,7 +910,7 @@ def save_notification_config(config_type, config, enabled):
     now = datetime.now().isoformat()
     params = (config_type, json.dumps(config), enabled, now, now)
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             conn.execute(sql, params)
             conn.commit()
         return True
@@ -209,57 +918,198 @@ def save_notification_config(config_type, config, enabled):
         logging.error(f"Errore nel salvataggio della config di notifica: {e}", exc_info=True)
         return False
 
-def get_history(agent_ip=None, start_date=None, end_date=None, limit=100):
-    """Recupera i dati storici con filtri opzionali."""
-    query = "SELECT * FROM system_data"
+def build_history_query(agent_ip=None, start_date=None, end_date=None, limit=100,
+                        table=partitioning.LEGACY_TABLE, since=None, until=None):
+    """
+    Costruisce la query (e i parametri) usata da get_history su una tabella di system_data.
+    Con since (sequenza di scrittura) restituisce solo i record scritti dopo,
+    fino a until compreso, in ordine di scrittura; limit=None non limita le righe.
+    """
+    query = f"SELECT * FROM {table}"
     params = []
     conditions = []
+    # In modalità delta le righe nuove sono poche: la ricerca parte dall'indice
+    # su ingest_seq e il + esclude gli altri filtri dalla scelta dell'indice
+    column = '+' if since is not None else ''
     
     if agent_ip:
-        conditions.append("agent_ip = ?")
+        conditions.append(f"{column}agent_ip = ?")
         params.append(agent_ip)
     if start_date:
-        conditions.append("timestamp >= ?")
+        conditions.append(f"{column}timestamp >= ?")
         params.append(start_date)
     if end_date:
-        conditions.append("timestamp <= ?")
+        conditions.append(f"{column}timestamp <= ?")
         params.append(end_date)
+    if since is not None:
+        conditions.append("ingest_seq > ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("ingest_seq <= ?")
+        params.append(until)
         
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
         
-    query += " ORDER BY timestamp DESC LIMIT ?"
-    params.append(limit)
-    
+    if since is not None:
+        query += " ORDER BY ingest_seq ASC"
+    else:
+        query += " ORDER BY timestamp DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+def get_history(agent_ip=None, start_date=None, end_date=None, limit=100):
+    """
+    Recupera i dati storici con filtri opzionali.
+    Legge solo le partizioni che intersecano l'intervallo, dalla più recente,
+    fermandosi appena raggiunto il limite.
+    """
     try:
-        with get_db_connection() as conn:
-            cursor = conn.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+        results = []
+        with pooled_connection() as conn:
+            for table in reversed(get_partition_tables(start_date, end_date, conn)):
+                query, params = build_history_query(agent_ip, start_date, end_date,
+                                                    limit - len(results), table)
+                results.extend(dict(row) for row in conn.execute(query, params).fetchall())
+                if len(results) >= limit:
+                    break
+        return results
     except Exception as e:
         logging.error(f"Errore nel recupero della cronologia: {e}", exc_info=True)
         return []
 
+def get_history_delta(agent_ip=None, start_date=None, end_date=None, limit=100, since=0):
+    """
+    Modalità delta di get_history: i record scritti dopo since (valore di
+    get_ingest_seq), qualunque sia il loro timestamp, in ordine di scrittura.
+
+    Restituisce (righe, cursore). Se i record nuovi sono più di limit arrivano
+    solo i primi, completati con il resto della loro ultima transazione (stessa
+    ingest_seq), e il cursore è l'ingest_seq dell'ultima riga: il delta
+    successivo riprende da lì senza saltare righe. Altrimenti il cursore è None
+    e vale la sequenza globale letta prima della query.
+    """
+    try:
+        with pooled_connection() as conn:
+            tables = get_partition_tables(start_date, end_date, conn)
+            # limit + 1 righe per partizione bastano a sapere se il totale supera limit
+            rows = []
+            for table in tables:
+                query, params = build_history_query(agent_ip, start_date, end_date,
+                                                    limit + 1, table, since)
+                rows.extend(dict(row) for row in conn.execute(query, params).fetchall())
+            rows.sort(key=lambda row: row['ingest_seq'])
+            if len(rows) <= limit:
+                return rows, None
+
+            last_seq = rows[limit - 1]['ingest_seq']
+            rows = []
+            for table in tables:
+                query, params = build_history_query(agent_ip, start_date, end_date,
+                                                    None, table, since, last_seq)
+                rows.extend(dict(row) for row in conn.execute(query, params).fetchall())
+            rows.sort(key=lambda row: row['ingest_seq'])
+            return rows, last_seq
+    except Exception as e:
+        logging.error(f"Errore nel recupero della cronologia (delta): {e}", exc_info=True)
+        return [], None
+
+RAW_METRIC_COLUMNS = {'cpu': 'cpu_usage', 'memory': 'memory_usage', 'disk': 'disk_usage'}
+
+def format_history_point(row):
+    """
+    Converte un record grezzo di system_data nello schema di get_rollup_data:
+    timestamp Unix e *_percent con min/max/p95 pari al valore del campione.
+    """
+    record = {
+        'timestamp': datetime.fromisoformat(row['timestamp']).timestamp(),
+        'agent_ip': row['agent_ip'],
+        'tier': 'raw',
+        'samples': 1
+    }
+    for metric in rollup.METRICS:
+        value = row[RAW_METRIC_COLUMNS[metric]]
+        record[f'{metric}_percent'] = value
+        record[f'{metric}_min'] = value
+        record[f'{metric}_max'] = value
+        record[f'{metric}_p95'] = value
+    return record
+
+def get_history_points(agent_ip=None, start_date=None, end_date=None, limit=100):
+    """
+    Come get_history, ma nello stesso schema degli aggregati e in ordine
+    cronologico crescente, così /api/history non cambia forma tra i livelli.
+    """
+    rows = get_history(agent_ip, start_date, end_date, limit)
+    return [format_history_point(row) for row in reversed(rows)]
+
+def get_history_delta_points(agent_ip=None, start_date=None, end_date=None, limit=100, since=0):
+    """
+    Come get_history_delta, con i record nello schema di get_history_points
+    (in ordine di scrittura). Restituisce (punti, cursore).
+    """
+    rows, cursor = get_history_delta(agent_ip, start_date, end_date, limit, since)
+    return [format_history_point(row) for row in rows], cursor
+
 
 # --- Nuove funzioni per supportare la dashboard web ---
 
+SYSTEM_STATS_QUERY = """
+    SELECT agent_ip, agent_name, cpu_usage, memory_usage, disk_usage, 
+           system, release, timestamp
+    FROM agent_latest 
+    WHERE timestamp > ?
+    ORDER BY timestamp DESC
+"""
+
+RECENT_DATA_QUERY = """
+    SELECT timestamp, agent_ip, agent_name, cpu_usage, memory_usage, disk_usage
+    FROM {table} 
+    WHERE timestamp > ?
+    ORDER BY timestamp ASC
+"""
+
+# Delta per sequenza di scrittura: la ricerca usa l'indice su ingest_seq
+# (poche righe nuove), non la finestra temporale
+RECENT_DATA_DELTA_QUERY = """
+    SELECT timestamp, agent_ip, agent_name, cpu_usage, memory_usage, disk_usage
+    FROM {table}
+    WHERE +timestamp > ? AND ingest_seq > ?
+    ORDER BY +timestamp ASC
+"""
+
+LATEST_SAMPLES_QUERY = """
+    SELECT timestamp, agent_ip, agent_name, cpu_usage, memory_usage, disk_usage
+    FROM agent_latest
+    WHERE timestamp > ?
+    ORDER BY timestamp ASC
+"""
+
+ACTIVE_AGENTS_QUERY = """
+    SELECT * FROM agent_latest
+    ORDER BY timestamp DESC
+"""
+
+def get_latest_samples_since(since):
+    """
+    Ultimo campione degli agent aggiornati dopo since, come tuple (timestamp,
+    agent_ip, agent_name, cpu, memoria, disco) ordinate per timestamp.
+    """
+    with pooled_connection() as conn:
+        return [tuple(row) for row in conn.execute(LATEST_SAMPLES_QUERY, (since,)).fetchall()]
+
 def get_system_stats():
     """
     Recupera le statistiche aggregate del sistema per la dashboard.
     """
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             cursor = conn.cursor()
             
-            # Recupera i dati più recenti per ogni agent (ultimi 5 minuti)
-            query = """
-                SELECT agent_ip, agent_name, cpu_usage, memory_usage, disk_usage, 
-                       system, release, timestamp
-                FROM system_data 
-                WHERE timestamp > datetime('now', '-5 minutes')
-                ORDER BY timestamp DESC
-            """
-            
-            cursor.execute(query)
+            # Recupera l'ultimo campione di ogni agent attivo negli ultimi 5 minuti
+            cursor.execute(SYSTEM_STATS_QUERY, (_cutoff(minutes=5),))
             rows = cursor.fetchall()
             
             # Converte in formato dict per compatibilità
@@ -267,7 +1117,7 @@ def get_system_stats():
             for row in rows:
                 stats.append({
                     'agent_ip': row['agent_ip'],
-                    'agent_name': row.get('agent_name', row['agent_ip']),
+                    'agent_name': row['agent_name'] or row['agent_ip'],
                     'cpu_percent': row['cpu_usage'],
                     'memory_percent': row['memory_usage'],
                     'disk_percent': row['disk_usage'],
@@ -282,23 +1132,24 @@ def get_system_stats():
         return []
 
 
-def get_recent_data(hours=6):
+def get_recent_data(hours=6, since=None):
     """
     Recupera i dati recenti per i grafici real-time.
+    Con since (sequenza di scrittura) restituisce solo i campioni della
+    finestra scritti dopo, anche se il loro timestamp è precedente.
     """
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             cursor = conn.cursor()
             
-            query = """
-                SELECT timestamp, agent_ip, agent_name, cpu_usage, memory_usage, disk_usage
-                FROM system_data 
-                WHERE timestamp > datetime('now', '-{} hours')
-                ORDER BY timestamp ASC
-            """.format(hours)
-            
-            cursor.execute(query)
-            rows = cursor.fetchall()
+            cutoff = _cutoff(hours=hours)
+            rows = []
+            for table in get_partition_tables(cutoff, None, conn):
+                if since is None:
+                    cursor.execute(RECENT_DATA_QUERY.format(table=table), (cutoff,))
+                else:
+                    cursor.execute(RECENT_DATA_DELTA_QUERY.format(table=table), (cutoff, since))
+                rows.extend(cursor.fetchall())
             
             # Converte timestamp in formato Unix per JavaScript
             import time
@@ -329,26 +1180,85 @@ def get_recent_data(hours=6):
         return []
 
 
+def build_rollup_query(tier, start, end=None, agent_ip=None, since=None):
+    """
+    Costruisce la query (e i parametri) sugli aggregati di un livello.
+    Con since restituisce solo i bucket aggiornati dopo quella sequenza di scrittura.
+    """
+    query = "SELECT * FROM metrics_rollup WHERE tier = ?"
+    params = [tier]
+    if agent_ip:
+        query += " AND agent_ip = ?"
+        params.append(agent_ip)
+    query += " AND bucket_start >= ?"
+    params.append(rollup.bucket_start(start, tier))
+    if end:
+        query += " AND bucket_start <= ?"
+        params.append(end)
+    if since is not None:
+        query += " AND ingest_seq > ?"
+        params.append(since)
+    query += " ORDER BY bucket_start ASC"
+    return query, params
+
+def get_rollup_data(tier, start, end=None, agent_ip=None, since=None):
+    """
+    Recupera gli aggregati di un livello (1m, 5m, 1h) nell'intervallo indicato.
+    Il campo *_percent contiene la media del bucket, affiancata da min/max/p95.
+    Con since solo i bucket aggiornati dopo quella sequenza di scrittura.
+    """
+    query, params = build_rollup_query(tier, start, end, agent_ip, since)
+    try:
+        with pooled_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        formatted_data = []
+        for row in rows:
+            record = {
+                'timestamp': datetime.fromisoformat(row['bucket_start']).timestamp(),
+                'agent_ip': row['agent_ip'],
+                'tier': tier,
+                'samples': row['samples']
+            }
+            for metric in rollup.METRICS:
+                record[f'{metric}_percent'] = row[f'{metric}_avg']
+                record[f'{metric}_min'] = row[f'{metric}_min']
+                record[f'{metric}_max'] = row[f'{metric}_max']
+                record[f'{metric}_p95'] = row[f'{metric}_p95']
+            formatted_data.append(record)
+        return formatted_data
+    except Exception as e:
+        logging.error(f"Errore nel recupero degli aggregati {tier}: {e}", exc_info=True)
+        return []
+
+def count_agents():
+    """Numero di agent noti (una riga per agent in agent_latest)."""
+    try:
+        with pooled_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM agent_latest").fetchone()[0]
+    except Exception as e:
+        logging.error(f"Errore nel conteggio degli agent: {e}", exc_info=True)
+        return 0
+
+def select_tier(start=None, end=None, max_points=2000, agent_ip=None):
+    """
+    Sceglie il livello di dettaglio ('raw', '1m', '5m', '1h') per un intervallo,
+    in base al numero stimato di punti rispetto al budget max_points.
+    """
+    agents = 1 if agent_ip else count_agents()
+    return rollup.choose_tier(rollup.span_seconds(start, end), agents, max_points)
+
+
 def get_active_agents():
     """
     Recupera la lista degli agent attivi con i loro ultimi dati.
     """
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             cursor = conn.cursor()
             
-            # Recupera l'ultimo record per ogni agent
-            query = """
-                SELECT s1.* FROM system_data s1
-                INNER JOIN (
-                    SELECT agent_ip, MAX(timestamp) as max_timestamp
-                    FROM system_data
-                    GROUP BY agent_ip
-                ) s2 ON s1.agent_ip = s2.agent_ip AND s1.timestamp = s2.max_timestamp
-                ORDER BY s1.timestamp DESC
-            """
-            
-            cursor.execute(query)
+            # Legge l'ultimo record di ogni agent da agent_latest (O(agent))
+            cursor.execute(ACTIVE_AGENTS_QUERY)
             rows = cursor.fetchall()
             
             # Converte in formato dict con timestamp Unix
@@ -364,17 +1274,24 @@ def get_active_agents():
                 except:
                     unix_timestamp = time.time()
                 
+                # Metriche aggiuntive dei collector (processi, uptime, load, I/O...)
+                try:
+                    extra = json.loads(row['extra']) if row['extra'] else {}
+                except ValueError:
+                    extra = {}
+                
                 agents.append({
                     'agent_ip': row['agent_ip'],
-                    'hostname': row.get('agent_name', row['agent_ip']),
+                    'hostname': row['agent_name'] or row['agent_ip'],
                     'cpu_percent': row['cpu_usage'],
                     'memory_percent': row['memory_usage'],
                     'disk_percent': row['disk_usage'],
                     'platform': f"{row['system']} {row['release']}",
-                    'architecture': row.get('version', 'Unknown'),
+                    'architecture': row['version'] or 'Unknown',
                     'timestamp': unix_timestamp,
-                    'processes': 0,  # Placeholder - da implementare se necessario
-                    'uptime': 0      # Placeholder - da implementare se necessario
+                    'processes': extra.get('processes', 0),
+                    'uptime': extra.get('uptime', 0),
+                    'metrics': extra
                 })
             
             return agents
@@ -531,3 +1448,78 @@ def dismiss_alert(alert_id):
     except Exception as e:
         logging.error(f"Errore nel dismiss dell'avviso {alert_id}: {e}", exc_info=True)
         return False
+
+
+# --- Diagnostica dei piani di esecuzione ---
+
+# Tabelle che crescono con lo storico: una scansione completa o un ordinamento
+# temporaneo su di esse è considerato una regressione.
+GROWING_TABLES = ('system_data', 'notifications', 'metrics_rollup')
+
+def get_query_plan_checks():
+    """
+    Restituisce le query del modulo da verificare con EXPLAIN QUERY PLAN,
+    nella forma {nome: (sql, parametri)}.
+    """
+    now = datetime.now().isoformat()
+    return {
+        'get_history': build_history_query(),
+        'get_history_agent': build_history_query('127.0.0.1'),
+        'get_history_range': build_history_query(None, now, now),
+        'get_history_agent_range': build_history_query('127.0.0.1', now, now),
+        'get_history_delta': build_history_query('127.0.0.1', now, None, 100, since=0),
+        'get_system_stats': (SYSTEM_STATS_QUERY, (now,)),
+        'get_recent_data': (RECENT_DATA_QUERY.format(table=partitioning.LEGACY_TABLE), (now,)),
+        'get_partition_tables': (PARTITIONS_IN_RANGE_QUERY, (now, now, now, now)),
+        'get_active_agents': (ACTIVE_AGENTS_QUERY, ()),
+        'has_recent_notification': (LAST_NOTIFICATION_QUERY, ('127.0.0.1', 'cpu')),
+        'get_rollup_data': build_rollup_query('5m', now, now),
+        'get_rollup_data_agent': build_rollup_query('1h', now, None, '127.0.0.1'),
+        'update_rollups': (ROLLUP_SELECT_SQL, ('1m', '127.0.0.1', now)),
+    }
+
+def explain_query_plan(sql, params=()):
+    """Restituisce le righe di dettaglio di EXPLAIN QUERY PLAN per una query."""
+    with pooled_connection() as conn:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [row['detail'] for row in rows]
+
+def find_query_plan_regressions():
+    """
+    Verifica i piani di esecuzione delle query del modulo.
+    
+    Returns:
+        dict: {nome_query: [dettagli problematici]} per le query che eseguono
+              una scansione completa senza indice o un ordinamento temporaneo
+              su una tabella che cresce nel tempo (vuoto se tutto è indicizzato)
+    """
+    regressions = {}
+    for name, (sql, params) in get_query_plan_checks().items():
+        problems = []
+        for detail in explain_query_plan(sql, params):
+            for table in GROWING_TABLES:
+                scanned = detail.startswith(f"SCAN {table}") and 'INDEX' not in detail
+                if scanned:
+                    problems.append(detail)
+            if 'USE TEMP B-TREE' in detail:
+                problems.append(detail)
+        if problems:
+            regressions[name] = problems
+    return regressions
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manutenzione del database NetMaster")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="abilita il vacuum incrementale con un VACUUM completo (a server fermo)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    init_db()
+    if args.enable_incremental_vacuum:
+        if enable_incremental_vacuum():
+            logging.info("Vacuum incrementale abilitato.")
+        else:
+            logging.info("Vacuum incrementale già abilitato.")
+    close_all_connections()
@@ -0,0 +1,355 @@
+"""
+Modulo per l'ingestione asincrona dei dati inviati dagli agent.
+Gli endpoint accodano i campioni validati e un thread di scrittura dedicato
+li salva a blocchi (executemany in un'unica transazione), così il costo di
+commit/fsync è pagato una volta per batch invece che una volta per campione.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+import database
+import wire_format
+
+logger = logging.getLogger(__name__)
+
+class IngestQueueFull(Exception):
+    """Eccezione sollevata quando la coda di ingestione è piena (back-pressure)."""
+    def __init__(self, message, retry_after=1):
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+class BatchError(Exception):
+    """Eccezione sollevata quando un batch di campioni non è interpretabile."""
+    pass
+
+# Limiti dell'endpoint batch (/api/report/batch)
+BATCH_MAX_SAMPLES = int(os.getenv('NETMASTER_BATCH_MAX_SAMPLES', 1000))
+BATCH_MAX_BYTES = int(os.getenv('NETMASTER_BATCH_MAX_BYTES', 4 * 1024 * 1024))
+# Campioni più vecchi di questa finestra sono salvati senza controllo soglie
+BATCH_ALERT_WINDOW_S = int(os.getenv('NETMASTER_BATCH_ALERT_WINDOW_S', 300))
+# Tolleranza per timestamp nel futuro dopo la correzione dell'orologio
+BATCH_MAX_FUTURE_S = 60
+
+def decode_batch_body(raw: bytes, content_encoding: str = '') -> object:
+    """
+    Decodifica il corpo di una richiesta batch (JSON, eventualmente gzip o deflate).
+    La decompressione è limitata a BATCH_MAX_BYTES per non espandere
+    in memoria payload malevoli.
+
+    Raises:
+        BatchError: Se il corpo è troppo grande, la codifica non è supportata
+            o il JSON non è valido
+    """
+    try:
+        return wire_format.decode_report(raw, wire_format.CONTENT_TYPE_JSON,
+                                         content_encoding, BATCH_MAX_BYTES)
+    except wire_format.WireFormatError as e:
+        raise BatchError(str(e))
+
+def parse_batch(payload, validate: Callable[[dict], None], now: datetime = None,
+                max_age_days: int = None):
+    """
+    Estrae i campioni validi da un batch inviato da un agent.
+
+    Il payload è una lista di campioni oppure {'sent_at': iso, 'samples': [...]}.
+    Ogni campione deve avere un 'timestamp' ISO 8601; se l'agent indica
+    'sent_at' i timestamp sono corretti dello scarto tra il suo orologio e
+    quello del server. I campioni non validi vengono scartati singolarmente.
+
+    Args:
+        payload: Corpo JSON già decodificato
+        validate: Funzione di validazione del singolo campione (solleva eccezione)
+        now: Ora di riferimento del server (default: datetime.now())
+        max_age_days: Età massima dei campioni (default: DATA_RETENTION_DAYS)
+
+    Returns:
+        Tuple ([(data, timestamp_iso), ...], [{'index': i, 'error': msg}, ...])
+
+    Raises:
+        BatchError: Se il payload non ha la forma attesa
+    """
+    now = now or datetime.now()
+    if max_age_days is None:
+        max_age_days = int(os.getenv('DATA_RETENTION_DAYS', 30))
+
+    offset = timedelta(0)
+    if isinstance(payload, dict):
+        sent_at = payload.get('sent_at')
+        payload = payload.get('samples')
+        if sent_at is not None:
+            try:
+                offset = now - datetime.fromisoformat(str(sent_at))
+            except ValueError:
+                raise BatchError("Campo 'sent_at' non valido")
+    if not isinstance(payload, list) or not payload:
+        raise BatchError("Il batch deve contenere una lista di campioni non vuota")
+    if len(payload) > BATCH_MAX_SAMPLES:
+        raise BatchError(f"Troppi campioni nel batch (massimo {BATCH_MAX_SAMPLES})")
+
+    oldest = now - timedelta(days=max_age_days)
+    newest = now + timedelta(seconds=BATCH_MAX_FUTURE_S)
+    samples, rejected = [], []
+    for index, sample in enumerate(payload):
+        try:
+            if not isinstance(sample, dict):
+                raise BatchError("Il campione deve essere un oggetto JSON")
+            try:
+                timestamp = datetime.fromisoformat(str(sample['timestamp'])) + offset
+            except KeyError:
+                raise BatchError("Campo richiesto mancante: 'timestamp'")
+            except ValueError:
+                raise BatchError("Campo 'timestamp' non valido")
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone().replace(tzinfo=None)
+            if not oldest <= timestamp <= newest:
+                raise BatchError("Timestamp fuori dalla finestra di conservazione")
+            validate(sample)
+            samples.append((sample, timestamp.isoformat()))
+        except Exception as e:
+            rejected.append({'index': index, 'error': str(e)})
+    return samples, rejected
+
+class IngestQueue:
+    """
+    Coda write-behind con writer in background.
+
+    Il writer svuota la coda ogni `batch_size` righe oppure ogni
+    `flush_interval` secondi, quale delle due condizioni arriva prima.
+    Un batch non scritto (es. "database is locked") viene ritentato con
+    backoff esponenziale; nel frattempo la coda si riempie e gli endpoint
+    rispondono 503, quindi i campioni già accettati non vanno persi.
+    """
+
+    def __init__(self, max_size: int = None, batch_size: int = None,
+                 flush_interval: float = None,
+                 on_flush: Optional[Callable[[List[Tuple[dict, str]]], None]] = None,
+                 on_write: Optional[Callable[[List[tuple]], None]] = None,
+                 max_retries: int = None, backoff: float = None):
+        """
+        Inizializza la coda di ingestione.
+
+        Args:
+            max_size: Numero massimo di campioni in attesa
+            batch_size: Righe massime per transazione
+            flush_interval: Attesa massima (secondi) prima di un flush
+            on_flush: Callback invocata dopo ogni flush con [(data, agent_ip), ...]
+                (esclusi i campioni di backfill accodati con submit_many)
+            on_write: Callback invocata dopo ogni scrittura riuscita con le righe
+                scritte (tuple di database.build_system_data_row, backfill compreso)
+            max_retries: Tentativi di scrittura di un batch prima di scartarlo
+            backoff: Attesa (secondi) prima del secondo tentativo, raddoppiata ai successivi
+        """
+        self.max_size = max_size or int(os.getenv('NETMASTER_INGEST_QUEUE_SIZE', 10000))
+        self.batch_size = batch_size or int(os.getenv('NETMASTER_INGEST_BATCH_SIZE', 500))
+        self.flush_interval = flush_interval or int(os.getenv('NETMASTER_INGEST_FLUSH_MS', 200)) / 1000.0
+        self.retry_after = max(1, int(self.flush_interval * 5))
+        self.max_retries = max_retries or int(os.getenv('NETMASTER_INGEST_RETRIES', 5))
+        self.backoff = backoff if backoff is not None else float(os.getenv('NETMASTER_INGEST_BACKOFF_S', 0.2))
+        self.on_flush = on_flush
+        self.on_write = on_write
+
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._submit_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'rejected': 0,
+            'failed': 0,
+            'retries': 0,
+            'batches': 0,
+            'last_flush_ms': 0.0
+        }
+
+    def start(self):
+        """Avvia il thread di scrittura."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+        logger.info(f"[INGEST] Writer avviato (batch={self.batch_size}, "
+                    f"flush={self.flush_interval * 1000:.0f}ms, coda={self.max_size})")
+
+    def stop(self, timeout: float = 30.0):
+        """Arresta il writer dopo aver svuotato la coda."""
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"[INGEST] Drain non completato: {self._queue.qsize()} campioni in coda")
+        else:
+            logger.info(f"[INGEST] Writer arrestato, coda svuotata. Statistiche: {self.stats()}")
+        self._thread = None
+
+    def submit(self, data: dict, agent_ip: str, timestamp: str = None):
+        """
+        Accoda un campione per il salvataggio.
+
+        Args:
+            data: Campione validato
+            agent_ip: Indirizzo dell'agent
+            timestamp: Istante del campione (ISO 8601, default: ora corrente)
+
+        Raises:
+            KeyError: Se mancano campi obbligatori
+            IngestQueueFull: Se la coda ha raggiunto la capacità massima
+        """
+        if self._stopping.is_set():
+            raise IngestQueueFull("Server in arresto", self.retry_after)
+        row = database.build_system_data_row(data, agent_ip, timestamp or datetime.now().isoformat())
+        with self._submit_lock:
+            try:
+                self._queue.put_nowait((row, data, agent_ip))
+            except queue.Full:
+                self._increment('rejected')
+                raise IngestQueueFull(
+                    f"Coda di ingestione piena ({self.max_size} campioni)", self.retry_after
+                )
+        self._increment('enqueued')
+
+    def submit_many(self, samples: List[Tuple[dict, str]], agent_ip: str,
+                    notify_after: str = None):
+        """
+        Accoda un batch di campioni con timestamp: o tutti o nessuno.
+
+        I campioni con timestamp precedente a `notify_after` (dati recuperati
+        dopo un'interruzione) vengono salvati senza passare dalla callback
+        post-flush, così il backfill non genera avvisi per valori passati.
+
+        Args:
+            samples: Lista di (data, timestamp_iso)
+            agent_ip: Indirizzo dell'agent
+            notify_after: Timestamp ISO minimo per il controllo soglie
+
+        Raises:
+            KeyError: Se mancano campi obbligatori
+            IngestQueueFull: Se la coda non ha spazio per l'intero batch
+        """
+        if self._stopping.is_set():
+            raise IngestQueueFull("Server in arresto", self.retry_after)
+        items = []
+        for data, timestamp in samples:
+            row = database.build_system_data_row(data, agent_ip, timestamp)
+            notify = notify_after is None or timestamp >= notify_after
+            items.append((row, data if notify else None, agent_ip))
+
+        with self._submit_lock:
+            if self._queue.qsize() + len(items) > self.max_size:
+                self._increment('rejected', len(items))
+                raise IngestQueueFull(
+                    f"Coda di ingestione senza spazio per {len(items)} campioni "
+                    f"({self.max_size} massimo)", self.retry_after
+                )
+            for item in items:
+                self._queue.put_nowait(item)
+        self._increment('enqueued', len(items))
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Attende che tutti i campioni accodati siano stati scritti."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._queue.all_tasks_done:
+                if not self._queue.unfinished_tasks:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self) -> dict:
+        """Restituisce le statistiche della coda."""
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['queue_size'] = self._queue.qsize()
+        result['max_size'] = self.max_size
+        return result
+
+    def _increment(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _collect_batch(self):
+        """Raccoglie fino a batch_size elementi entro flush_interval."""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if self._stopping.is_set() or remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, rows) -> bool:
+        """Salva le righe, ritentando con backoff esponenziale fino a max_retries volte."""
+        for attempt in range(1, self.max_retries + 1):
+            if database.save_system_data_batch(rows):
+                return True
+            if attempt < self.max_retries:
+                logger.warning(f"[INGEST] Scrittura di {len(rows)} campioni fallita "
+                               f"(tentativo {attempt}/{self.max_retries}), nuovo tentativo")
+                self._increment('retries')
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        agents = sorted({row[1] for row in rows})
+        logger.error(f"[INGEST] {len(rows)} campioni persi dopo {self.max_retries} tentativi "
+                     f"di scrittura (agent: {', '.join(agents)})")
+        return False
+
+    def _flush(self, batch):
+        """Scrive un batch nel database e invoca la callback post-flush."""
+        start = time.perf_counter()
+        try:
+            rows = [row for row, _, _ in batch]
+            ok = self._write(rows)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            with self._stats_lock:
+                self._stats['batches'] += 1
+                self._stats['last_flush_ms'] = round(elapsed_ms, 2)
+                if ok:
+                    self._stats['written'] += len(batch)
+                else:
+                    self._stats['failed'] += len(batch)
+
+            if ok and self.on_write:
+                try:
+                    self.on_write(rows)
+                except Exception as e:
+                    logger.error(f"[INGEST] Errore nella callback di scrittura: {e}", exc_info=True)
+
+            notify = [(data, agent_ip) for _, data, agent_ip in batch if data is not None]
+            if ok and self.on_flush and notify:
+                try:
+                    self.on_flush(notify)
+                except Exception as e:
+                    logger.error(f"[INGEST] Errore nella callback post-flush: {e}", exc_info=True)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _run(self):
+        """Ciclo principale del writer."""
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch = self._collect_batch()
+                if batch:
+                    self._flush(batch)
+            except Exception as e:
+                logger.error(f"[INGEST] Errore imprevisto nel writer: {e}", exc_info=True)
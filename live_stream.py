@@ -0,0 +1,359 @@
+"""
+Modulo per il canale push della dashboard (/api/stream, Server-Sent Events).
+Il writer di ingestione pubblica qui le righe appena salvate: ogni campione
+aggiorna in O(1) lo stato più recente della sua chiave (ultimo campione e
+stato dell'agent, ultimo avviso per agent e metrica) e un registro circolare
+delle modifiche. Ogni client tiene solo un cursore (numero di sequenza) e a
+ogni risveglio riceve l'ultimo valore delle chiavi cambiate: il costo per
+campione non dipende dal numero di dashboard aperte e nessuna dashboard
+interroga il database.
+
+Backpressure: un client lento blocca solo il proprio thread sulla scrittura
+del socket; nel frattempo le modifiche si accumulano coalescendo per chiave,
+e se il registro non copre più il suo cursore riceve lo stato più recente
+di tutte le chiavi cambiate. La memoria per client resta costante.
+
+Ogni processo ha il proprio hub: per vedere i campioni salvati da altri
+processi (worker pre-fork, async_ingest) l'hub legge anche agent_latest, al
+massimo una volta per poll_interval e solo con client connessi, qualunque sia
+il numero di client. Gli avvisi restano locali al processo che li genera.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Stato di un agent in base ai secondi dall'ultimo campione (come /api/agents)
+AGENT_WARNING_S = 120
+AGENT_OFFLINE_S = 300
+# Intervallo di aggiornamento dello stato degli agent che non inviano più campioni
+SWEEP_INTERVAL_S = 5.0
+# Thread del server WSGI che gli stream non possono occupare: restano liberi
+# per i report degli agent e le API REST anche con tutti gli stream aperti
+STREAM_RESERVED_THREADS = 2
+
+def stream_capacity(server_threads: int, max_clients: int) -> int:
+    """
+    Numero di stream ammessi per processo: al più max_clients e comunque
+    STREAM_RESERVED_THREADS in meno dei thread del server (0 li disattiva).
+    """
+    return max(0, min(max_clients, server_threads - STREAM_RESERVED_THREADS))
+
+def agent_status(age: float) -> str:
+    """Restituisce 'online', 'warning' o 'offline' dato il tempo dall'ultimo campione."""
+    if age < AGENT_WARNING_S:
+        return 'online'
+    if age < AGENT_OFFLINE_S:
+        return 'warning'
+    return 'offline'
+
+class StreamFull(Exception):
+    """Eccezione sollevata quando è stato raggiunto il numero massimo di client."""
+    def __init__(self, message, retry_after=30):
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+def format_event(event: str, payload, event_id: int = None) -> str:
+    """Codifica un evento nel formato text/event-stream."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(payload, separators=(',', ':')))
+    return "\n".join(lines) + "\n\n"
+
+class StreamSubscription:
+    """
+    Iteratore text/event-stream di un client. close() (chiamato dal server
+    WSGI alla fine della risposta) libera il posto anche se lo stream non è
+    mai stato letto.
+    """
+
+    def __init__(self, hub: 'StreamHub', cursor: int, resync: bool):
+        self._hub = hub
+        self._cursor = cursor
+        self._resync = resync
+        self._closed = False
+
+    def __iter__(self):
+        hub = self._hub
+        deadline = time.monotonic() + hub.max_duration
+        # Il client riprova dopo retry ms, con Last-Event-ID per riprendere dal cursore
+        yield f"retry: {int(hub.retry * 1000)}\n" + format_event(
+            'hello', {'resync': self._resync, 'coalesce_ms': int(hub.coalesce * 1000)}, self._cursor)
+        last_write = time.monotonic()
+        while not self._closed and not hub.stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            hub.maintain()
+            if not hub.wait(self._cursor, min(hub.wait_interval, remaining)):
+                if time.monotonic() - last_write >= hub.keepalive:
+                    last_write = time.monotonic()
+                    yield ": keepalive\n\n"
+                continue
+            self._cursor, events, overflow = hub.changes(self._cursor)
+            chunk = format_event('resync', {'reason': 'overflow'}) if overflow else ''
+            if events:
+                chunk += ''.join(format_event(event, payload) for event, payload in events[:-1])
+                chunk += format_event(events[-1][0], events[-1][1], self._cursor)
+                hub.count_sent(len(events))
+            if chunk:
+                last_write = time.monotonic()
+                yield chunk
+            # Finestra di coalescenza: le modifiche successive arrivano in un solo blocco
+            time.sleep(hub.coalesce)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._hub.unsubscribe()
+
+class StreamHub:
+    """Stato più recente per chiave e registro delle modifiche condivisi dai client SSE."""
+
+    def __init__(self, max_clients: int = None, coalesce: float = None, backlog: int = None,
+                 keepalive: float = None, max_duration: float = None, poll_interval: float = None,
+                 server_threads: int = None):
+        """
+        Inizializza l'hub.
+
+        Args:
+            max_clients: Stream aperti contemporaneamente (ognuno occupa un thread del server)
+                         prima del limite dovuto a server_threads
+            coalesce: Secondi minimi tra due blocchi di eventi inviati a un client
+            backlog: Modifiche conservate nel registro (oltre, i client lenti ricevono lo stato)
+            keepalive: Secondi senza eventi dopo i quali viene inviato un commento keep-alive
+            max_duration: Durata massima di uno stream, poi il client si riconnette
+            poll_interval: Intervallo di lettura dei campioni salvati da altri processi
+            server_threads: Thread del server WSGI del processo (default
+                            NETMASTER_WORKER_THREADS, esportato da wsgi_server)
+        """
+        self.server_threads = server_threads or int(os.getenv('NETMASTER_WORKER_THREADS', 8))
+        self.max_clients = stream_capacity(
+            self.server_threads, max_clients or int(os.getenv('NETMASTER_STREAM_MAX_CLIENTS', 16)))
+        self.coalesce = coalesce if coalesce is not None else \
+            int(os.getenv('NETMASTER_STREAM_COALESCE_MS', 250)) / 1000.0
+        self.backlog = backlog or int(os.getenv('NETMASTER_STREAM_BACKLOG', 5000))
+        self.keepalive = keepalive or 15.0
+        self.max_duration = max_duration or float(os.getenv('NETMASTER_STREAM_MAX_DURATION_S', 300))
+        self.poll_interval = poll_interval or 1.0
+        self.retry = 3.0
+
+        self._cond = threading.Condition()
+        self._seq = 0
+        # (evento, chiave) -> (sequenza, payload)
+        self._latest: Dict[Tuple[str, str], Tuple[int, dict]] = {}
+        self._log = deque(maxlen=self.backlog)
+        # agent_ip -> [timestamp ISO ultimo campione, istante Unix, stato pubblicato, hostname]
+        self._agents: Dict[str, list] = {}
+        self._clients = 0
+        self._stopping = False
+        self._next_sweep = 0.0
+        self._poll: Optional[Callable[[str], Iterable[tuple]]] = None
+        self._poll_since = ''
+        self._next_poll = 0.0
+        self._stats = {'published': 0, 'sent': 0, 'connections': 0, 'rejected': 0, 'overflows': 0}
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping
+
+    @property
+    def wait_interval(self) -> float:
+        """Attesa massima tra due manutenzioni (stato degli agent, lettura di agent_latest)."""
+        return min(SWEEP_INTERVAL_S, self.poll_interval) if self._poll else SWEEP_INTERVAL_S
+
+    # --- Pubblicazione (writer di ingestione) ---
+
+    def publish_rows(self, rows: Iterable[tuple]):
+        """
+        Pubblica le righe di system_data appena scritte (timestamp, agent_ip,
+        agent_name, cpu, memoria, disco, ...). I campioni non più recenti
+        dell'ultimo già pubblicato per lo stesso agent (backfill) sono ignorati.
+        """
+        with self._cond:
+            published = self._seq
+            for row in rows:
+                timestamp, agent_ip, agent_name, cpu, memory, disk = row[:6]
+                agent = self._agents.get(agent_ip)
+                if agent is not None and timestamp <= agent[0]:
+                    continue
+                unix = datetime.fromisoformat(timestamp).timestamp()
+                if agent is None:
+                    agent = self._agents[agent_ip] = [timestamp, unix, None, agent_name]
+                agent[0], agent[1], agent[3] = timestamp, unix, agent_name
+                self._publish('sample', agent_ip, {
+                    'timestamp': unix * 1000,
+                    'cpu': cpu,
+                    'memory': memory,
+                    'disk': disk,
+                    'agent_ip': agent_ip,
+                    'hostname': agent_name
+                })
+                self._set_status(agent_ip, agent, agent_status(time.time() - unix))
+            if self._seq != published:
+                self._cond.notify_all()
+
+    def publish_alert(self, agent_ip: str, metric: str, value: float, threshold: float):
+        """Pubblica il superamento di una soglia (uno per agent e metrica)."""
+        with self._cond:
+            self._publish('alert', f"{agent_ip}/{metric}", {
+                'agent_ip': agent_ip,
+                'metric': metric,
+                'value': value,
+                'threshold': threshold,
+                'timestamp': time.time()
+            })
+            self._cond.notify_all()
+
+    def _publish(self, event: str, key: str, payload: dict):
+        self._seq += 1
+        self._latest[(event, key)] = (self._seq, payload)
+        self._log.append((self._seq, (event, key)))
+        self._stats['published'] += 1
+
+    def _set_status(self, agent_ip: str, agent: list, status: str):
+        if agent[2] != status:
+            agent[2] = status
+            self._publish('agent', agent_ip, {
+                'agent_ip': agent_ip,
+                'hostname': agent[3],
+                'status': status,
+                'last_update': agent[1]
+            })
+
+    # --- Manutenzione (eseguita dai client connessi, una volta per intervallo) ---
+
+    def enable_polling(self, fetch: Callable[[str], Iterable[tuple]]):
+        """
+        Legge periodicamente i campioni salvati da altri processi con
+        fetch(since_iso) -> righe nello stesso formato di publish_rows.
+        """
+        with self._cond:
+            if self._poll is None:
+                self._poll = fetch
+                self._poll_since = datetime.now().isoformat()
+
+    def maintain(self, now: float = None):
+        """
+        Aggiorna lo stato degli agent che hanno smesso di inviare (O(agent),
+        al massimo ogni SWEEP_INTERVAL_S) e, se abilitata, legge agent_latest.
+        """
+        now = now if now is not None else time.time()
+        poll = None
+        with self._cond:
+            if now >= self._next_sweep:
+                self._next_sweep = now + SWEEP_INTERVAL_S
+                published = self._seq
+                for agent_ip, agent in self._agents.items():
+                    self._set_status(agent_ip, agent, agent_status(now - agent[1]))
+                if self._seq != published:
+                    self._cond.notify_all()
+            if self._poll is not None and now >= self._next_poll:
+                self._next_poll = now + self.poll_interval
+                poll, since = self._poll, self._poll_since
+        if poll is None:
+            return
+        try:
+            rows = list(poll(since))
+        except Exception as e:
+            logger.error(f"[STREAM] Errore nella lettura di agent_latest: {e}", exc_info=True)
+            return
+        if rows:
+            with self._cond:
+                self._poll_since = max(self._poll_since, max(row[0] for row in rows))
+            self.publish_rows(rows)
+
+    # --- Client ---
+
+    def subscribe(self, last_event_id: str = None) -> StreamSubscription:
+        """
+        Registra un client e restituisce il suo stream. Con Last-Event-ID
+        riprende dal cursore indicato; un cursore sconosciuto (server
+        riavviato o altro worker) chiede al client di ricaricare i dati.
+
+        Raises:
+            StreamFull: Se è stato raggiunto max_clients
+        """
+        with self._cond:
+            if self._stopping or self._clients >= self.max_clients:
+                self._stats['rejected'] += 1
+                raise StreamFull(f"Numero massimo di stream raggiunto ({self.max_clients})")
+            self._clients += 1
+            self._stats['connections'] += 1
+            cursor, resync = self._seq, False
+            if last_event_id:
+                try:
+                    requested = int(last_event_id)
+                except ValueError:
+                    requested = -1
+                if 0 <= requested <= self._seq:
+                    cursor = requested
+                else:
+                    resync = True
+        return StreamSubscription(self, cursor, resync)
+
+    def unsubscribe(self):
+        with self._cond:
+            self._clients -= 1
+
+    def wait(self, cursor: int, timeout: float) -> bool:
+        """Attende modifiche successive al cursore; False allo scadere del timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq != cursor or self._stopping,
+                                       timeout) and not self._stopping
+
+    def changes(self, cursor: int) -> Tuple[int, List[Tuple[str, dict]], bool]:
+        """
+        Restituisce (nuovo cursore, [(evento, payload)], overflow): l'ultimo
+        valore di ogni chiave cambiata dopo il cursore, in ordine di modifica.
+        """
+        with self._cond:
+            if cursor == self._seq:
+                return cursor, [], False
+            overflow = not self._log or self._log[0][0] > cursor + 1
+            if overflow:
+                # Registro superato: stato più recente di tutte le chiavi cambiate
+                self._stats['overflows'] += 1
+                keys = sorted((seq, key) for key, (seq, _) in self._latest.items() if seq > cursor)
+            else:
+                keys, seen = [], set()
+                for seq, key in reversed(self._log):
+                    if seq <= cursor:
+                        break
+                    if key not in seen:
+                        seen.add(key)
+                        keys.append((seq, key))
+                keys.reverse()
+            events = [(key[0], self._latest[key][1]) for _, key in keys]
+            return self._seq, events, overflow
+
+    def count_sent(self, events: int):
+        with self._cond:
+            self._stats['sent'] += events
+
+    def close(self):
+        """Chiude tutti gli stream (arresto del server)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """Restituisce le statistiche dell'hub."""
+        with self._cond:
+            result = dict(self._stats)
+            result['clients'] = self._clients
+            result['max_clients'] = self.max_clients
+            result['agents'] = len(self._agents)
+            result['sequence'] = self._seq
+            result['polling'] = self._poll is not None
+        return result
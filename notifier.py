@@ -0,0 +1,268 @@
+"""
+Modulo per l'invio asincrono delle notifiche email.
+Il controllo delle soglie accoda gli avvisi e un thread dedicato li invia:
+gli avvisi arrivati nello stesso intervallo sono raccolti in un'unica email
+riepilogativa, la connessione SMTP resta aperta tra un invio e l'altro, gli
+errori vengono ritentati con backoff esponenziale e lo stato di consegna di
+ogni avviso è registrato nella tabella notifications.
+"""
+
+import os
+import time
+import queue
+import smtplib
+import logging
+import threading
+from email.message import EmailMessage
+from typing import Callable, List, Optional
+
+import database
+
+logger = logging.getLogger(__name__)
+
+class NotificationDispatcher:
+    """Worker di invio delle notifiche email con connessione SMTP riutilizzata."""
+
+    def __init__(self, load_config: Optional[Callable[[], Optional[dict]]] = None,
+                 digest_interval: float = None, max_retries: int = None,
+                 backoff: float = None, max_size: int = 1000, smtp_timeout: float = 10.0):
+        """
+        Inizializza il dispatcher.
+
+        Args:
+            load_config: Funzione che restituisce la configurazione email
+                         (default: database.get_notification_config('email'))
+            digest_interval: Secondi di raccolta degli avvisi prima dell'invio
+            max_retries: Tentativi di invio prima di marcare gli avvisi come falliti
+            backoff: Attesa (secondi) prima del secondo tentativo, raddoppiata ai successivi
+            max_size: Numero massimo di avvisi in attesa
+            smtp_timeout: Timeout delle operazioni SMTP
+        """
+        self.load_config = load_config or (lambda: database.get_notification_config('email'))
+        self.digest_interval = digest_interval if digest_interval is not None else \
+            float(os.getenv('NETMASTER_NOTIFY_DIGEST_S', 30))
+        self.max_retries = max_retries or int(os.getenv('NETMASTER_NOTIFY_RETRIES', 3))
+        self.backoff = backoff if backoff is not None else float(os.getenv('NETMASTER_NOTIFY_BACKOFF_S', 2))
+        self.smtp_timeout = smtp_timeout
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._smtp = None
+        self._smtp_key = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'queued': 0,
+            'sent': 0,
+            'failed': 0,
+            'dropped': 0,
+            'emails': 0,
+            'connections': 0
+        }
+
+    def start(self):
+        """Avvia il thread di invio."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+        self._thread.start()
+        logger.info(f"[NOTIFY] Dispatcher avviato (riepilogo ogni {self.digest_interval}s, "
+                    f"{self.max_retries} tentativi)")
+
+    def stop(self, timeout: float = 30.0):
+        """Arresta il thread dopo aver inviato gli avvisi in coda."""
+        if not self._thread:
+            return
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(None)  # risveglia il worker in attesa sulla coda
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        self._close_connection()
+
+    def notify(self, agent_ip: str, metric: str, value: float, threshold: float,
+               subject: str, body: str) -> Optional[int]:
+        """
+        Registra l'avviso nella tabella notifications (stato 'queued') e lo accoda.
+
+        Returns:
+            int: Id della notifica, o None se non è stato possibile salvarla
+        """
+        notification_id = database.save_notification(agent_ip, metric, value, threshold, status='queued')
+        if notification_id is None:
+            return None
+        try:
+            self._queue.put_nowait({'id': notification_id, 'subject': subject, 'body': body})
+            self._increment('queued')
+        except queue.Full:
+            self._increment('dropped')
+            database.update_notification_status([notification_id], 'dropped', 0, 'Coda notifiche piena')
+            logger.error(f"[NOTIFY] Coda piena, avviso {notification_id} scartato")
+        return notification_id
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Attende che tutti gli avvisi accodati siano stati elaborati."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._queue.all_tasks_done:
+                if not self._queue.unfinished_tasks:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self) -> dict:
+        """Restituisce le statistiche del dispatcher."""
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['queue_size'] = self._queue.qsize()
+        return result
+
+    def _increment(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    # --- Connessione SMTP ---
+
+    @staticmethod
+    def _smtp_settings(config: dict) -> dict:
+        """Normalizza la configurazione email (formato piatto o annidato in 'config')."""
+        settings = config.get('config', config)
+        recipients = settings.get('recipients') or settings.get('to_email') or []
+        if isinstance(recipients, str):
+            recipients = [address.strip() for address in recipients.split(',') if address.strip()]
+        return {
+            'host': settings.get('smtp_server', 'smtp.gmail.com'),
+            'port': int(settings.get('smtp_port', 587)),
+            'username': settings.get('username'),
+            'password': settings.get('password'),
+            'sender': settings.get('sender') or settings.get('username') or 'netmaster@localhost',
+            'recipients': recipients,
+            'starttls': settings.get('starttls', True),
+        }
+
+    def _connection(self, settings: dict) -> smtplib.SMTP:
+        """Restituisce la connessione SMTP aperta, riaprendola se necessario."""
+        key = (settings['host'], settings['port'], settings['username'])
+        if self._smtp is not None and self._smtp_key == key:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close_connection()
+
+        if settings['port'] == 465:
+            smtp = smtplib.SMTP_SSL(settings['host'], settings['port'], timeout=self.smtp_timeout)
+        else:
+            smtp = smtplib.SMTP(settings['host'], settings['port'], timeout=self.smtp_timeout)
+            smtp.ehlo()
+            if settings['starttls'] and smtp.has_extn('starttls'):
+                smtp.starttls()
+                smtp.ehlo()
+        if settings['username'] and settings['password']:
+            smtp.login(settings['username'], settings['password'])
+
+        self._smtp, self._smtp_key = smtp, key
+        self._increment('connections')
+        return smtp
+
+    def _close_connection(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+        self._smtp_key = None
+
+    # --- Invio ---
+
+    @staticmethod
+    def _compose(alerts: List[dict]):
+        """Restituisce (oggetto, corpo) dell'email: l'avviso singolo o un riepilogo."""
+        if len(alerts) == 1:
+            return alerts[0]['subject'], alerts[0]['body']
+        subject = f"[NetMaster] Riepilogo: {len(alerts)} soglie superate"
+        body = "\n\n".join(alert['body'].strip() for alert in alerts)
+        return subject, body
+
+    def _deliver(self, alerts: List[dict]):
+        """Invia un riepilogo, ritentando con backoff, e registra l'esito."""
+        ids = [alert['id'] for alert in alerts]
+        config = self.load_config()
+        if not config:
+            database.update_notification_status(ids, 'disabled', 0, 'Notifiche email non configurate')
+            logger.warning("[NOTIFY] Notifiche email disabilitate o non configurate.")
+            return
+
+        settings = self._smtp_settings(config)
+        subject, body = self._compose(alerts)
+        message = EmailMessage()
+        message['Subject'] = subject
+        message['From'] = settings['sender']
+        message['To'] = ', '.join(settings['recipients'])
+        message.set_content(body)
+
+        error = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self._connection(settings).send_message(message)
+                database.update_notification_status(ids, 'sent', attempt)
+                self._increment('sent', len(ids))
+                self._increment('emails')
+                logger.info(f"[NOTIFY] Email inviata ({len(ids)} avvisi): {subject}")
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                error = str(e)
+                self._close_connection()
+                logger.warning(f"[NOTIFY] Tentativo {attempt}/{self.max_retries} fallito: {e}")
+                if attempt < self.max_retries:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+
+        database.update_notification_status(ids, 'failed', self.max_retries, error)
+        self._increment('failed', len(ids))
+        logger.error(f"[NOTIFY] Invio fallito per {len(ids)} avvisi: {error}")
+
+    def _collect_digest(self) -> List[dict]:
+        """Raccoglie gli avvisi arrivati entro digest_interval dal primo."""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        if first is None:
+            self._queue.task_done()
+            return []
+        alerts = [first]
+        deadline = time.monotonic() + self.digest_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if self._stopping.is_set() or remaining <= 0:
+                    alert = self._queue.get_nowait()
+                else:
+                    alert = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if alert is None:
+                self._queue.task_done()
+                break
+            alerts.append(alert)
+        return alerts
+
+    def _run(self):
+        """Ciclo principale del dispatcher."""
+        while not (self._stopping.is_set() and self._queue.empty()):
+            alerts = self._collect_digest()
+            if not alerts:
+                continue
+            try:
+                self._deliver(alerts)
+            except Exception as e:
+                logger.error(f"[NOTIFY] Errore imprevisto nel dispatcher: {e}", exc_info=True)
+            finally:
+                for _ in alerts:
+                    self._queue.task_done()
@@ -0,0 +1,65 @@
+"""
+Modulo per il partizionamento temporale dei dati grezzi di system_data.
+Ogni campione viene instradato in una tabella per giorno (system_data_dAAAAMMGG)
+o per settimana (system_data_wAAAAMMGG, dal lunedì), in base al suo timestamp:
+le query su un intervallo leggono solo le partizioni che lo intersecano e la
+conservazione elimina una partizione intera invece di cancellare riga per riga.
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+# Schemi di partizionamento: nome -> (prefisso, durata in giorni)
+SCHEMES = {
+    'day': ('d', 1),
+    'week': ('w', 7),
+}
+
+# Tabella di sistema che raccoglie i dati scritti prima del partizionamento
+# (e quelli con timestamp non ISO): viene sempre inclusa nelle letture.
+LEGACY_TABLE = 'system_data'
+
+TABLE_PREFIX = 'system_data_'
+
+def period_start(timestamp: str, scheme: str) -> date:
+    """Restituisce il primo giorno della partizione che contiene il timestamp."""
+    day = datetime.fromisoformat(timestamp).date()
+    if scheme == 'week':
+        day -= timedelta(days=day.weekday())
+    return day
+
+def partition_name(timestamp: str, scheme: str) -> Optional[str]:
+    """
+    Nome della tabella partizione per un timestamp ISO.
+    Restituisce None se il partizionamento è disattivato o il timestamp non è ISO.
+    """
+    if scheme not in SCHEMES:
+        return None
+    try:
+        start = period_start(timestamp, scheme)
+    except (TypeError, ValueError):
+        return None
+    return f"{TABLE_PREFIX}{SCHEMES[scheme][0]}{start.strftime('%Y%m%d')}"
+
+def partition_bounds(name: str) -> Tuple[str, str]:
+    """
+    Restituisce l'intervallo [inizio, fine) coperto da una partizione,
+    come timestamp ISO nello stesso formato dei dati salvati.
+    """
+    suffix = name[len(TABLE_PREFIX):]
+    days = next(length for prefix, length in SCHEMES.values() if prefix == suffix[0])
+    start = datetime.strptime(suffix[1:], '%Y%m%d')
+    return start.isoformat(), (start + timedelta(days=days)).isoformat()
+
+def is_partition(name: str) -> bool:
+    """Verifica che un nome di tabella sia una partizione valida (evita SQL injection)."""
+    if not name.startswith(TABLE_PREFIX):
+        return False
+    suffix = name[len(TABLE_PREFIX):]
+    if len(suffix) != 9 or suffix[0] not in {prefix for prefix, _ in SCHEMES.values()}:
+        return False
+    try:
+        datetime.strptime(suffix[1:], '%Y%m%d')
+    except ValueError:
+        return False
+    return True
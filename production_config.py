@@ -5,9 +5,13 @@ Configurazione ottimizzata per ambiente di produzione
 """
 
 import os
+import signal
 import logging
 from logging.handlers import RotatingFileHandler
 
+# Il server pre-fork usa os.fork() e SIGHUP, assenti su Windows
+PREFORK_SUPPORTED = hasattr(os, 'fork') and hasattr(signal, 'SIGHUP')
+
 class ProductionConfig:
     """Configurazione per ambiente di produzione."""
     
@@ -34,13 +38,21 @@ class ProductionConfig:
     LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
     
     # Performance Configuration
+    SERVER_MODE = os.getenv('NETMASTER_SERVER_MODE',
+                            'prefork' if PREFORK_SUPPORTED else 'threaded')  # prefork, threaded
     MAX_WORKERS = int(os.getenv('MAX_WORKERS', 4))
+    WORKER_THREADS = int(os.getenv('NETMASTER_WORKER_THREADS', 8))
+    KEEPALIVE_TIMEOUT = float(os.getenv('NETMASTER_KEEPALIVE_S', 5))
+    GRACEFUL_TIMEOUT = float(os.getenv('NETMASTER_GRACEFUL_TIMEOUT_S', 30))
     RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', 60))
+    RATE_LIMIT_BACKEND = os.getenv('NETMASTER_RATE_LIMIT_BACKEND', 'memory')  # memory, sqlite, redis
     REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', 30))
     
     # Monitoring Configuration
     AGENT_TIMEOUT = int(os.getenv('AGENT_TIMEOUT', 300))  # 5 minuti
     DATA_RETENTION_DAYS = int(os.getenv('DATA_RETENTION_DAYS', 30))
+    ROLLUP_RETENTION_MONTHS = int(os.getenv('ROLLUP_RETENTION_MONTHS', 12))
+    RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 3600))  # 1 ora
     ALERT_COOLDOWN = int(os.getenv('ALERT_COOLDOWN', 300))  # 5 minuti
     
     # Email Configuration (per notifiche)
@@ -92,6 +104,12 @@ class ProductionConfig:
             if not os.path.exists(ProductionConfig.SSL_KEY_PATH):
                 errors.append(f"Chiave SSL non trovata: {ProductionConfig.SSL_KEY_PATH}")
         
+        if ProductionConfig.SERVER_MODE not in ('prefork', 'threaded'):
+            errors.append(f"Modalità server non valida: {ProductionConfig.SERVER_MODE}")
+        elif ProductionConfig.SERVER_MODE == 'prefork' and not PREFORK_SUPPORTED:
+            errors.append("Modalità server prefork non supportata su questa piattaforma "
+                          "(richiede os.fork): usare NETMASTER_SERVER_MODE=threaded")
+        
         # Verifica directory
         required_dirs = ['logs', 'ssl', 'backups']
         for dir_name in required_dirs:
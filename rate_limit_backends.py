@@ -0,0 +1,381 @@
+"""
+Modulo per la condivisione dello stato del rate limiting tra più processi server.
+Definisce l'interfaccia dei backend (contatori a finestra scorrevole condivisi)
+con un'implementazione SQLite su file e una compatibile con Redis, e il
+SharedRateLimiter che li usa senza un accesso al backend per ogni richiesta:
+ogni processo prenota in anticipo un piccolo blocco di richieste (lease) e lo
+consuma localmente, restituendo periodicamente quelle non usate.
+"""
+
+import os
+import math
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+def window_start(now: float, size: int) -> int:
+    """Inizio (secondi epoch) della finestra fissa di `size` secondi che contiene now."""
+    return int(now - now % size)
+
+def grant_tokens(previous: int, current: int, now: float, size: int, limit: int, amount: int) -> int:
+    """
+    Numero di richieste concedibili (al massimo amount) secondo la stima a
+    finestra scorrevole: le richieste della finestra precedente pesano per la
+    frazione ancora sovrapposta all'ultima finestra di `size` secondi.
+    """
+    overlap = 1.0 - (now - window_start(now, size)) / size
+    available = limit - (previous * overlap + current)
+    return max(0, min(amount, int(math.floor(available))))
+
+class RateLimitBackend:
+    """Interfaccia dei backend di stato condiviso per il rate limiting."""
+
+    def acquire(self, key: str, size: int, now: float, limit: int, amount: int) -> int:
+        """
+        Prenota atomicamente fino a `amount` richieste per la chiave nella
+        finestra corrente, restituendo quante ne sono state concesse.
+        """
+        raise NotImplementedError
+
+    def release(self, key: str, size: int, start: int, amount: int):
+        """Restituisce richieste prenotate ma non usate nella finestra `start`."""
+        raise NotImplementedError
+
+    def purge(self, now: float):
+        """Elimina i contatori delle finestre scadute (se il backend non lo fa da sé)."""
+
+    def close(self):
+        """Chiude le connessioni del backend."""
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """Backend su file SQLite condiviso dai processi della stessa macchina."""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.getenv('NETMASTER_RATE_LIMIT_DB', os.path.join('data', 'ratelimit.db'))
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limit_counters (
+                    key TEXT NOT NULL,
+                    window_size INTEGER NOT NULL,
+                    window_start INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (key, window_size, window_start)
+                ) WITHOUT ROWID
+            ''')
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key, size, now, limit, amount):
+        start = window_start(now, size)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            counts = dict(conn.execute(
+                "SELECT window_start, count FROM rate_limit_counters "
+                "WHERE key = ? AND window_size = ? AND window_start IN (?, ?)",
+                (key, size, start, start - size)
+            ).fetchall())
+            granted = grant_tokens(counts.get(start - size, 0), counts.get(start, 0),
+                                   now, size, limit, amount)
+            if granted:
+                conn.execute(
+                    "INSERT INTO rate_limit_counters (key, window_size, window_start, count) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT(key, window_size, window_start) "
+                    "DO UPDATE SET count = count + excluded.count",
+                    (key, size, start, granted)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return granted
+
+    def release(self, key, size, start, amount):
+        self._connection().execute(
+            "UPDATE rate_limit_counters SET count = MAX(count - ?, 0) "
+            "WHERE key = ? AND window_size = ? AND window_start = ?",
+            (amount, key, size, start)
+        )
+
+    def purge(self, now):
+        # Le finestre più lunghe (un'ora) servono fino alla fine della successiva
+        self._connection().execute(
+            "DELETE FROM rate_limit_counters WHERE window_start < ? - 2 * window_size", (int(now),)
+        )
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class RespConnection:
+    """Client minimale del protocollo RESP di Redis (nessuna dipendenza esterna)."""
+
+    def __init__(self, host: str, port: int, password: str = None, db: int = 0, timeout: float = 2.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    def execute(self, *args):
+        """Invia un comando e restituisce la risposta decodificata."""
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = str(arg).encode('utf-8')
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connessione Redis chiusa")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RuntimeError(f"Errore Redis: {payload.decode()}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            return [self._read_reply() for _ in range(int(payload))]
+        raise RuntimeError(f"Risposta Redis non valida: {line!r}")
+
+    def close(self):
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Backend compatibile con Redis per limiti condivisi tra macchine diverse.
+    Usa solo INCRBY/DECRBY/GET/EXPIRE: la prenotazione incrementa il contatore
+    e restituisce subito l'eventuale eccedenza rispetto al limite.
+    """
+
+    PREFIX = 'netmaster:rl'
+
+    def __init__(self, url: str = None):
+        parsed = urlparse(url or os.getenv('NETMASTER_REDIS_URL', 'redis://127.0.0.1:6379/0'))
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self._local = threading.local()
+
+    def _connection(self) -> RespConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = RespConnection(self.host, self.port, self.password, self.db)
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, *args):
+        try:
+            return self._connection().execute(*args)
+        except (OSError, ConnectionError):
+            self.close()  # la prossima chiamata riapre la connessione
+            raise
+
+    def _key(self, key, size, start):
+        return f"{self.PREFIX}:{key}:{size}:{start}"
+
+    def acquire(self, key, size, now, limit, amount):
+        start = window_start(now, size)
+        current_key = self._key(key, size, start)
+        total = self._execute('INCRBY', current_key, amount)
+        if total == amount:
+            self._execute('EXPIRE', current_key, 2 * size)
+        previous = int(self._execute('GET', self._key(key, size, start - size)) or 0)
+        granted = grant_tokens(previous, total - amount, now, size, limit, amount)
+        if granted < amount:
+            self._execute('DECRBY', current_key, amount - granted)
+        return granted
+
+    def release(self, key, size, start, amount):
+        self._execute('DECRBY', self._key(key, size, start), amount)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class SharedRateLimiter:
+    """
+    Rate limiter per (IP, endpoint) con stato condiviso in un RateLimitBackend.
+
+    Espone la stessa interfaccia di security_validator.RateLimiter. Il backend
+    viene interrogato solo quando il blocco di richieste prenotate localmente
+    per una finestra è esaurito; ogni `sync_interval` secondi le prenotazioni
+    inutilizzate dei client inattivi vengono restituite al backend. In caso di
+    errore del backend si applica il limiter locale di riserva.
+    """
+
+    WINDOWS = (('minuto', 60), ('ora', 3600))
+
+    def __init__(self, backend: RateLimitBackend, lease_size: int = None,
+                 sync_interval: float = None, fallback=None):
+        """
+        Args:
+            backend: Backend di stato condiviso
+            lease_size: Richieste massime prenotate per volta (ridotte per limiti bassi)
+            sync_interval: Secondi tra due restituzioni delle prenotazioni inattive
+            fallback: Limiter locale usato se il backend non risponde
+        """
+        self.backend = backend
+        self.lease_size = lease_size or int(os.getenv('NETMASTER_RATE_LIMIT_LEASE', 10))
+        self.sync_interval = sync_interval or float(os.getenv('NETMASTER_RATE_LIMIT_SYNC_S', 5))
+        self.fallback = fallback
+        # {(chiave, finestra): [inizio finestra, richieste prenotate, ultimo uso]}
+        self._leases: Dict[Tuple[str, int], List] = {}
+        # {(chiave, finestra): istante fino al quale il backend ha negato nuove prenotazioni}
+        self._denied: Dict[Tuple[str, int], float] = {}
+        self.deny_interval = 1.0
+        self._lock = threading.Lock()
+        self._last_sync = time.time()
+        self._stats = {'local': 0, 'acquired': 0, 'limited': 0, 'backend_errors': 0}
+
+    def stats(self) -> dict:
+        """Restituisce le statistiche del limiter."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _increment(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _lease_amount(self, limit: int) -> int:
+        # Con limiti bassi prenota poco, così i processi non si sottraggono richieste a vicenda
+        return max(1, min(self.lease_size, limit // 10))
+
+    def check(self, ip: str, endpoint: str, requests_per_minute: int = 60,
+              requests_per_hour: int = 1000, current_time: float = None) -> Tuple[bool, str, int]:
+        """
+        Verifica e registra una richiesta.
+
+        Returns:
+            tuple: (is_limited, reason, retry_after)
+        """
+        now = current_time or time.time()
+        key = f"{ip}|{endpoint}"
+        limits = (requests_per_minute, requests_per_hour)
+        self._maybe_sync(now)
+
+        try:
+            for (name, size), limit in zip(self.WINDOWS, limits):
+                if not self._ensure_tokens(key, size, now, limit):
+                    self._increment('limited')
+                    retry_after = max(1, int(math.ceil(window_start(now, size) + size - now)))
+                    return True, f"Troppe richieste per {name} (limite {limit})", retry_after
+        except Exception as e:
+            self._increment('backend_errors')
+            logger.error(f"[RATE_LIMIT] Backend non disponibile, uso il limiter locale: {e}")
+            if self.fallback is not None:
+                return self.fallback.check(ip, endpoint, requests_per_minute, requests_per_hour, now)
+            return False, "", 0
+
+        with self._lock:
+            for _, size in self.WINDOWS:
+                lease = self._leases[(key, size)]
+                lease[1] -= 1
+                lease[2] = now
+        return False, "", 0
+
+    def is_rate_limited(self, ip: str, endpoint: str, requests_per_minute: int = 60,
+                        requests_per_hour: int = 1000) -> Tuple[bool, str]:
+        """Verifica se un IP ha superato i limiti di rate su un endpoint."""
+        is_limited, reason, _ = self.check(ip, endpoint, requests_per_minute, requests_per_hour)
+        return is_limited, reason
+
+    def _ensure_tokens(self, key: str, size: int, now: float, limit: int) -> bool:
+        """Garantisce almeno una richiesta prenotata localmente per la finestra corrente."""
+        start = window_start(now, size)
+        with self._lock:
+            lease = self._leases.get((key, size))
+            if lease is not None and lease[0] == start and lease[1] > 0:
+                self._stats['local'] += 1
+                return True
+            # Limite appena negato dal backend: non lo si interroga di nuovo per deny_interval
+            if self._denied.get((key, size), 0) > now:
+                return False
+
+        # Prenotazione dal backend fuori dal lock: gli altri thread non attendono la rete
+        granted = self.backend.acquire(key, size, now, limit, self._lease_amount(limit))
+        self._increment('acquired')
+        if not granted:
+            with self._lock:
+                self._denied[(key, size)] = min(now + self.deny_interval, start + size)
+            return False
+        with self._lock:
+            self._denied.pop((key, size), None)
+            lease = self._leases.get((key, size))
+            if lease is None or lease[0] != start:
+                self._leases[(key, size)] = [start, granted, now]
+            else:
+                lease[1] += granted
+        return True
+
+    def _maybe_sync(self, now: float):
+        """Restituisce al backend le prenotazioni dei client inattivi."""
+        with self._lock:
+            if now - self._last_sync < self.sync_interval:
+                return
+            self._last_sync = now
+            idle = [(key, lease) for key, lease in self._leases.items()
+                    if now - lease[2] >= self.sync_interval]
+            for key, _ in idle:
+                del self._leases[key]
+            for key in [key for key, until in self._denied.items() if until <= now]:
+                del self._denied[key]
+        try:
+            for (key, size), (start, tokens, _) in idle:
+                if tokens > 0 and start == window_start(now, size):
+                    self.backend.release(key, size, start, tokens)
+            self.backend.purge(now)
+        except Exception as e:
+            self._increment('backend_errors')
+            logger.error(f"[RATE_LIMIT] Errore durante la sincronizzazione: {e}")
+
+def create_backend(name: str = None) -> Optional[RateLimitBackend]:
+    """
+    Crea il backend indicato ('memory', 'sqlite', 'redis'); per 'memory'
+    restituisce None (stato locale al processo).
+    """
+    name = (name or os.getenv('NETMASTER_RATE_LIMIT_BACKEND', 'memory')).lower()
+    if name == 'sqlite':
+        return SQLiteRateLimitBackend()
+    if name == 'redis':
+        return RedisRateLimitBackend()
+    if name != 'memory':
+        logger.warning(f"[RATE_LIMIT] Backend sconosciuto '{name}', uso lo stato in memoria")
+    return None
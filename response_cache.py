@@ -0,0 +1,140 @@
+"""
+Modulo per la cache in memoria delle risposte degli endpoint della dashboard.
+Ogni scheda aperta interroga /api/stats, /api/realtime, /api/agents e
+/api/alerts a intervalli regolari: la cache conserva il corpo JSON già
+serializzato (con il suo ETag) per endpoint + parametri della query, così N
+utenti che guardano la dashboard costano circa una query per periodo.
+
+Una risposta resta valida al massimo `ttl` secondi. L'ingestione di nuovi
+campioni invalida la cache, ma una risposta più giovane di `min_age` secondi
+continua a essere servita: con gli agent che inviano di continuo le
+invalidazioni arrivano a ogni flush, e senza questo limite la cache non
+servirebbe mai due richieste. Le modifiche di soglie e configurazione la
+svuotano subito (invalidate(force=True)). Con il server pre-fork ogni worker
+ha la propria cache.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+class CachedResponse:
+    """Risposta serializzata: corpo, stato, header aggiuntivi ed ETag."""
+
+    __slots__ = ('body', 'status', 'headers', 'etag', 'created', 'generation')
+
+    def __init__(self, body: bytes, status: int, headers: Dict[str, str], created: float, generation: int):
+        self.body = body
+        self.status = status
+        self.headers = headers
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.created = created
+        self.generation = generation
+
+class ResponseCache:
+    """Cache LRU delle risposte con TTL e invalidazione all'ingestione."""
+
+    def __init__(self, ttl: float = None, min_age: float = None, max_entries: int = None):
+        """
+        Inizializza la cache.
+
+        Args:
+            ttl: Secondi massimi di validità di una risposta (0 disattiva la cache)
+            min_age: Secondi per cui una risposta resta valida anche dopo un'invalidazione
+            max_entries: Numero massimo di risposte conservate (le meno usate vengono scartate)
+        """
+        self.ttl = ttl if ttl is not None else float(os.getenv('NETMASTER_RESPONSE_CACHE_TTL', 5))
+        self.min_age = min_age if min_age is not None else float(os.getenv('NETMASTER_RESPONSE_CACHE_MIN_AGE', 2))
+        self.max_entries = max_entries or int(os.getenv('NETMASTER_RESPONSE_CACHE_MAX_ENTRIES', 256))
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, CachedResponse]' = OrderedDict()
+        # Chiavi in calcolo: le richieste concorrenti attendono invece di ripetere la query
+        self._pending: Dict[str, threading.Event] = {}
+        self._generation = 0
+        # Incrementato quando la cache viene svuotata: le risposte calcolate prima non vengono salvate
+        self._epoch = 0
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'invalidations': 0, 'evictions': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _fresh(self, entry: CachedResponse, now: float) -> bool:
+        age = now - entry.created
+        return age < self.ttl and (entry.generation == self._generation or age < self.min_age)
+
+    def get_or_compute(self, key: str,
+                       compute: Callable[[], Tuple[bytes, int, Dict[str, str]]]) -> Tuple[CachedResponse, bool]:
+        """
+        Restituisce la risposta in cache o la calcola con compute(), che
+        restituisce (corpo, stato, header). Solo le risposte 200 vengono
+        conservate; una sola richiesta per chiave esegue compute() alla volta.
+
+        Returns:
+            (risposta, True se servita dalla cache)
+        """
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._fresh(entry, now):
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry, True
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    self._stats['misses'] += 1
+                    generation, epoch = self._generation, self._epoch
+                    break
+                self._stats['waits'] += 1
+            # Un'altra richiesta sta calcolando la stessa risposta
+            pending.wait(timeout=30)
+
+        try:
+            body, status, headers = compute()
+            entry = CachedResponse(body, status, headers, now, generation)
+            if status == 200:
+                with self._lock:
+                    if epoch != self._epoch:
+                        return entry, False
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self._stats['evictions'] += 1
+            return entry, False
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.set()
+
+    def invalidate(self, force: bool = False):
+        """
+        Invalida le risposte in cache: chiamata dopo ogni scrittura di campioni.
+        Con force=True (modifica di soglie o configurazione) la cache viene svuotata.
+        """
+        with self._lock:
+            self._generation += 1
+            self._stats['invalidations'] += 1
+            if force:
+                self._entries.clear()
+                self._epoch += 1
+
+    def clear(self):
+        """Svuota completamente la cache."""
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+    def stats(self) -> dict:
+        """Restituisce le statistiche della cache."""
+        with self._lock:
+            result = dict(self._stats)
+            result['entries'] = len(self._entries)
+            result['ttl'] = self.ttl
+        return result
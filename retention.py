@@ -0,0 +1,168 @@
+"""
+Modulo per la politica di conservazione dei dati di monitoring.db.
+Elimina le partizioni di system_data interamente scadute con un DROP TABLE
+e, a piccoli blocchi (transazioni brevi, con pause tra un blocco e l'altro per
+non bloccare il writer di ingestione), le righe scadute della tabella non
+partizionata, delle notifiche e degli aggregati; quindi restituisce lo spazio
+libero al filesystem con il vacuum incrementale.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import database
+
+logger = logging.getLogger(__name__)
+
+class RetentionManager:
+    """
+    Gestore della conservazione dei dati con thread di pulizia in background.
+
+    I dati grezzi (system_data), le notifiche e gli aggregati a 1 minuto sono
+    conservati per `raw_days` giorni; gli aggregati a 5 minuti e 1 ora per
+    `rollup_months` mesi.
+    """
+
+    def __init__(self, raw_days: int = None, rollup_months: int = None,
+                 batch_size: int = 1000, interval: float = None,
+                 pause: float = 0.05, vacuum_pages: int = 1000):
+        """
+        Inizializza il gestore della conservazione.
+
+        Args:
+            raw_days: Giorni di conservazione dei dati grezzi
+            rollup_months: Mesi di conservazione degli aggregati 5m/1h
+            batch_size: Righe eliminate per transazione
+            interval: Secondi tra due esecuzioni del thread di pulizia
+            pause: Pausa (secondi) tra due blocchi per lasciare spazio all'ingestione
+            vacuum_pages: Pagine liberate per ogni passo di vacuum incrementale
+        """
+        self.raw_days = raw_days or int(os.getenv('DATA_RETENTION_DAYS', 30))
+        self.rollup_months = rollup_months or int(os.getenv('ROLLUP_RETENTION_MONTHS', 12))
+        self.batch_size = batch_size
+        self.interval = interval or int(os.getenv('RETENTION_INTERVAL', 3600))
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+
+        self.last_report = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _policies(self, now: datetime):
+        """Restituisce [(nome, query di selezione, parametri)] per ogni politica."""
+        raw_cutoff = (now - timedelta(days=self.raw_days)).isoformat()
+        rollup_cutoff = (now - timedelta(days=self.rollup_months * 30)).isoformat()
+        batch = self.batch_size
+        return [
+            ('system_data',
+             "DELETE FROM system_data WHERE id IN ("
+             "SELECT id FROM system_data WHERE timestamp < ? ORDER BY timestamp LIMIT ?)",
+             (raw_cutoff, batch)),
+            ('notifications',
+             "DELETE FROM notifications WHERE id IN ("
+             "SELECT id FROM notifications WHERE timestamp < ? LIMIT ?)",
+             (raw_cutoff, batch)),
+        ] + [
+            (f'metrics_rollup_{tier}',
+             "DELETE FROM metrics_rollup WHERE (tier, agent_ip, bucket_start) IN ("
+             "SELECT tier, agent_ip, bucket_start FROM metrics_rollup "
+             "WHERE tier = ? AND bucket_start < ? LIMIT ?)",
+             (tier, raw_cutoff if tier == '1m' else rollup_cutoff, batch))
+            for tier in ('1m', '5m', '1h')
+        ]
+
+    def _delete_in_batches(self, sql: str, params: tuple) -> int:
+        """Esegue una DELETE a blocchi fino a esaurimento delle righe da eliminare."""
+        total = 0
+        while not self._stopping.is_set():
+            with database.pooled_connection() as conn:
+                deleted = conn.execute(sql, params).rowcount
+            total += deleted
+            if deleted < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def _page_stats(self) -> Dict[str, int]:
+        with database.pooled_connection() as conn:
+            return {
+                'page_size': conn.execute("PRAGMA page_size").fetchone()[0],
+                'page_count': conn.execute("PRAGMA page_count").fetchone()[0],
+                'freelist_count': conn.execute("PRAGMA freelist_count").fetchone()[0],
+            }
+
+    def _incremental_vacuum(self):
+        """Restituisce al filesystem le pagine libere, a passi di vacuum_pages."""
+        with database.pooled_connection() as conn:
+            if not database.is_incremental_vacuum_enabled(conn):
+                # Migrazione 4 rimandata (database grande): le pagine libere
+                # restano nel file e vengono riusate dalle nuove scritture
+                return
+        while not self._stopping.is_set():
+            if self._page_stats()['freelist_count'] == 0:
+                break
+            with database.pooled_connection() as conn:
+                conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+            time.sleep(self.pause)
+
+    def run_once(self, now: Optional[datetime] = None) -> dict:
+        """
+        Esegue un ciclo completo di pulizia.
+
+        Returns:
+            dict: Partizioni eliminate, righe eliminate per tabella, byte recuperati e durata
+        """
+        start = time.perf_counter()
+        before = self._page_stats()
+
+        now = now or datetime.now()
+        dropped = database.drop_partitions_before((now - timedelta(days=self.raw_days)).isoformat())
+
+        deleted = {}
+        for name, sql, params in self._policies(now):
+            deleted[name] = self._delete_in_batches(sql, params)
+
+        self._incremental_vacuum()
+        after = self._page_stats()
+
+        report = {
+            'timestamp': time.time(),
+            'deleted': deleted,
+            'partitions_dropped': dropped,
+            'reclaimed_bytes': max(before['page_count'] - after['page_count'], 0) * after['page_size'],
+            'duration_s': round(time.perf_counter() - start, 3),
+        }
+        self.last_report = report
+        logger.info(f"[RETENTION] Eliminate {len(dropped)} partizioni e {sum(deleted.values())} righe {deleted}, "
+                    f"recuperati {report['reclaimed_bytes']} byte in {report['duration_s']}s")
+        return report
+
+    def start(self):
+        """Avvia il thread di pulizia periodica."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+        logger.info(f"[RETENTION] Avviata (dati grezzi {self.raw_days} giorni, "
+                    f"aggregati {self.rollup_months} mesi, ogni {self.interval}s)")
+
+    def stop(self, timeout: float = 10.0):
+        """Arresta il thread di pulizia."""
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"[RETENTION] Errore durante la pulizia: {e}", exc_info=True)
+            self._stopping.wait(self.interval)
@@ -0,0 +1,173 @@
+"""
+Modulo per il calcolo dei livelli di aggregazione (rollup) delle metriche.
+Mantiene per ogni agent aggregati a 1 minuto, 5 minuti e 1 ora
+(min/max/media/p95 di CPU, memoria e disco) in forma combinabile:
+conteggio, somma, minimo, massimo e istogramma a intervalli dell'1%,
+così ogni nuovo blocco di campioni si fonde con l'aggregato già salvato
+senza rileggere i dati grezzi.
+"""
+
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# Livelli di aggregazione: nome -> ampiezza del bucket in secondi
+TIERS = {
+    '1m': 60,
+    '5m': 300,
+    '1h': 3600,
+}
+
+METRICS = ('cpu', 'memory', 'disk')
+
+# Intervallo di raccolta di riferimento degli agent, usato per stimare
+# il numero di punti dei dati grezzi
+RAW_SAMPLE_INTERVAL = 60
+
+# Budget di default di punti restituiti ai grafici
+DEFAULT_MAX_POINTS = 2000
+
+# Numero di intervalli dell'istogramma per il calcolo del p95 (valori 0-100%)
+HISTOGRAM_BINS = 100
+
+def bucket_start(timestamp: str, tier: str) -> str:
+    """
+    Restituisce l'inizio del bucket (ISO, stesso formato dei dati grezzi)
+    che contiene il timestamp indicato.
+    """
+    dt = datetime.fromisoformat(timestamp)
+    width = TIERS[tier]
+    if width >= 3600:
+        start = dt.replace(minute=0, second=0, microsecond=0)
+    else:
+        minutes = width // 60
+        start = dt.replace(minute=dt.minute - dt.minute % minutes, second=0, microsecond=0)
+    return start.isoformat()
+
+def _histogram_bin(value: float) -> int:
+    return min(max(int(value), 0), HISTOGRAM_BINS - 1)
+
+def new_aggregate() -> dict:
+    """Crea un aggregato vuoto."""
+    aggregate = {'samples': 0}
+    for metric in METRICS:
+        aggregate[metric] = {'min': None, 'max': None, 'sum': 0.0, 'histogram': {}}
+    return aggregate
+
+def add_sample(aggregate: dict, cpu: float, memory: float, disk: float):
+    """Aggiunge un campione a un aggregato."""
+    aggregate['samples'] += 1
+    for metric, value in zip(METRICS, (cpu, memory, disk)):
+        stats = aggregate[metric]
+        stats['min'] = value if stats['min'] is None else min(stats['min'], value)
+        stats['max'] = value if stats['max'] is None else max(stats['max'], value)
+        stats['sum'] += value
+        key = str(_histogram_bin(value))
+        stats['histogram'][key] = stats['histogram'].get(key, 0) + 1
+
+def merge(target: dict, other: dict) -> dict:
+    """Fonde l'aggregato `other` in `target` e restituisce `target`."""
+    target['samples'] += other['samples']
+    for metric in METRICS:
+        a, b = target[metric], other[metric]
+        if b['min'] is not None:
+            a['min'] = b['min'] if a['min'] is None else min(a['min'], b['min'])
+            a['max'] = b['max'] if a['max'] is None else max(a['max'], b['max'])
+        a['sum'] += b['sum']
+        for key, count in b['histogram'].items():
+            a['histogram'][key] = a['histogram'].get(key, 0) + count
+    return target
+
+def percentile(histogram: Dict[str, int], samples: int, pct: float = 95.0,
+               lower: Optional[float] = None, upper: Optional[float] = None) -> float:
+    """
+    Stima un percentile dall'istogramma, interpolando all'interno
+    dell'intervallo dell'1% e limitando il risultato a [min, max].
+    """
+    if not samples:
+        return 0.0
+    rank = samples * pct / 100.0
+    seen = 0
+    value = float(HISTOGRAM_BINS)
+    for key in sorted(histogram, key=int):
+        count = histogram[key]
+        if seen + count >= rank:
+            value = int(key) + (rank - seen) / count
+            break
+        seen += count
+    if lower is not None:
+        value = max(value, lower)
+    if upper is not None:
+        value = min(value, upper)
+    return round(value, 2)
+
+def aggregate_rows(rows: List[tuple]) -> Dict[Tuple[str, str, str], dict]:
+    """
+    Raggruppa righe di system_data (formato build_system_data_row) in
+    aggregati per (tier, agent_ip, bucket_start).
+    """
+    aggregates = {}
+    for row in rows:
+        timestamp, agent_ip, cpu, memory, disk = row[0], row[1], row[3], row[4], row[5]
+        try:
+            starts = {tier: bucket_start(timestamp, tier) for tier in TIERS}
+        except (TypeError, ValueError):
+            continue  # timestamp non ISO: la riga resta solo nei dati grezzi
+        for tier, start in starts.items():
+            key = (tier, agent_ip, start)
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregate = aggregates[key] = new_aggregate()
+            add_sample(aggregate, cpu, memory, disk)
+    return aggregates
+
+def to_columns(aggregate: dict) -> dict:
+    """Converte un aggregato nelle colonne della tabella metrics_rollup."""
+    samples = aggregate['samples']
+    columns = {'samples': samples}
+    histograms = {}
+    for metric in METRICS:
+        stats = aggregate[metric]
+        columns[f'{metric}_min'] = stats['min']
+        columns[f'{metric}_max'] = stats['max']
+        columns[f'{metric}_sum'] = stats['sum']
+        columns[f'{metric}_avg'] = round(stats['sum'] / samples, 2) if samples else 0.0
+        columns[f'{metric}_p95'] = percentile(stats['histogram'], samples, 95.0,
+                                              stats['min'], stats['max'])
+        histograms[metric] = stats['histogram']
+    columns['histogram'] = json.dumps(histograms, separators=(',', ':'))
+    return columns
+
+def from_columns(row) -> dict:
+    """Ricostruisce un aggregato da una riga di metrics_rollup."""
+    histograms = json.loads(row['histogram'])
+    aggregate = {'samples': row['samples']}
+    for metric in METRICS:
+        aggregate[metric] = {
+            'min': row[f'{metric}_min'],
+            'max': row[f'{metric}_max'],
+            'sum': row[f'{metric}_sum'],
+            'histogram': histograms.get(metric, {}),
+        }
+    return aggregate
+
+def choose_tier(span_seconds: float, agent_count: int, max_points: int) -> str:
+    """
+    Sceglie il livello di dettaglio per un intervallo temporale.
+
+    Restituisce il livello più fine (a partire dai dati grezzi, 'raw') il cui
+    numero stimato di punti (agent x intervallo / ampiezza bucket) rientra in
+    max_points; se nessun livello rientra nel budget usa il più grossolano.
+    """
+    agents = max(agent_count, 1)
+    candidates = [('raw', RAW_SAMPLE_INTERVAL)] + sorted(TIERS.items(), key=lambda item: item[1])
+    for tier, width in candidates:
+        if agents * span_seconds / width <= max_points:
+            return tier
+    return candidates[-1][0]
+
+def span_seconds(start: Optional[str], end: Optional[str], default_hours: float = 24) -> float:
+    """Durata in secondi di un intervallo ISO (estremi opzionali)."""
+    end_dt = datetime.fromisoformat(end) if end else datetime.now()
+    start_dt = datetime.fromisoformat(start) if start else end_dt - timedelta(hours=default_hours)
+    return max((end_dt - start_dt).total_seconds(), 0)
@@ -4,14 +4,24 @@ Implementa sanitizzazione, rate limiting e validazione rigorosa dei dati.
 """
 
 import re
+import hmac
 import json
+import math
 import time
+import os
+import hashlib
 import logging
+import ipaddress
+import secrets
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Optional, List, Tuple
 from functools import wraps
 from flask import request, jsonify, g
 
+import rate_limit_backends
+
 logger = logging.getLogger(__name__)
 
 class SecurityError(Exception):
@@ -23,35 +33,95 @@ class ValidationError(Exception):
     pass
 
 class RateLimiter:
-    """Implementa rate limiting per IP."""
-    
+    """
+    Implementa rate limiting per (IP, endpoint) con contatori a finestra scorrevole.
+
+    Per ogni chiave e per ogni finestra (minuto, ora) sono mantenuti solo tre
+    valori: inizio della finestra corrente, richieste nella finestra corrente e
+    richieste nella precedente. Il numero di richieste nell'ultima finestra è
+    stimato pesando la finestra precedente per la frazione ancora sovrapposta,
+    quindi ogni verifica costa O(1) in tempo e memoria indipendentemente dal traffico.
+    """
+
+    # Finestre controllate: nome -> durata in secondi
+    WINDOWS = (('minuto', 60), ('ora', 3600))
+
     def __init__(self):
-        self.requests = {}  # {ip: [(timestamp, endpoint), ...]}
+        self.counters = {}  # {(ip, endpoint): [inizio, correnti, precedenti] per finestra}
         self.cleanup_interval = 300  # 5 minuti
         self.last_cleanup = time.time()
-    
-    def cleanup_old_requests(self):
-        """Rimuove le richieste vecchie per liberare memoria."""
-        current_time = time.time()
+        self._lock = threading.Lock()
+
+    def cleanup_old_requests(self, current_time: float = None):
+        """Rimuove le chiavi inattive da più di due finestre orarie."""
+        current_time = current_time or time.time()
         if current_time - self.last_cleanup < self.cleanup_interval:
             return
-        
-        cutoff_time = current_time - 3600  # Mantieni solo l'ultima ora
-        for ip in list(self.requests.keys()):
-            self.requests[ip] = [
-                (timestamp, endpoint) for timestamp, endpoint in self.requests[ip]
-                if timestamp > cutoff_time
-            ]
-            if not self.requests[ip]:
-                del self.requests[ip]
-        
+        longest = self.WINDOWS[-1][1]
+        for key in list(self.counters.keys()):
+            if current_time - self.counters[key][-1][0] >= 2 * longest:
+                del self.counters[key]
         self.last_cleanup = current_time
-    
-    def is_rate_limited(self, ip: str, endpoint: str, 
-                       requests_per_minute: int = 60, 
+
+    @staticmethod
+    def _advance(window: list, size: int, now: float):
+        """Fa scorrere la finestra [inizio, correnti, precedenti] fino all'istante now."""
+        elapsed = now - window[0]
+        if elapsed >= 2 * size:
+            window[:] = [now - now % size, 0, 0]
+        elif elapsed >= size:
+            window[:] = [window[0] + size, 0, window[1]]
+
+    @staticmethod
+    def _estimate(window: list, size: int, now: float) -> float:
+        """Stima delle richieste nell'ultima finestra di `size` secondi."""
+        overlap = 1.0 - (now - window[0]) / size
+        return window[2] * overlap + window[1]
+
+    @staticmethod
+    def _retry_after(window: list, size: int, now: float, limit: int) -> int:
+        """Secondi dopo i quali la stima scende sotto il limite."""
+        start, current, previous = window
+        if current >= limit or not previous:
+            wait = start + size - now
+        else:
+            wait = start + size * (1.0 - (limit - current) / previous) - now
+        return max(1, int(math.ceil(wait)))
+
+    def check(self, ip: str, endpoint: str, requests_per_minute: int = 60,
+              requests_per_hour: int = 1000, current_time: float = None) -> Tuple[bool, str, int]:
+        """
+        Verifica e registra una richiesta.
+
+        Returns:
+            tuple: (is_limited, reason, retry_after)
+        """
+        now = current_time or time.time()
+        limits = (requests_per_minute, requests_per_hour)
+        key = (ip, endpoint)
+        with self._lock:
+            self.cleanup_old_requests(now)
+            windows = self.counters.get(key)
+            if windows is None:
+                windows = self.counters[key] = [[now - now % size, 0, 0] for _, size in self.WINDOWS]
+
+            for (name, size), window, limit in zip(self.WINDOWS, windows, limits):
+                self._advance(window, size, now)
+                estimate = self._estimate(window, size, now)
+                if estimate >= limit:
+                    reason = f"Troppe richieste per {name} ({int(estimate)}/{limit})"
+                    return True, reason, self._retry_after(window, size, now, limit)
+
+            # Registra la richiesta
+            for window in windows:
+                window[1] += 1
+        return False, "", 0
+
+    def is_rate_limited(self, ip: str, endpoint: str,
+                       requests_per_minute: int = 60,
                        requests_per_hour: int = 1000) -> tuple[bool, str]:
         """
-        Verifica se un IP ha superato i limiti di rate.
+        Verifica se un IP ha superato i limiti di rate su un endpoint.
         
         Args:
             ip: Indirizzo IP
@@ -62,35 +132,152 @@ class RateLimiter:
         Returns:
             tuple: (is_limited, reason)
         """
-        self.cleanup_old_requests()
-        
-        current_time = time.time()
-        
-        if ip not in self.requests:
-            self.requests[ip] = []
-        
-        # Conta richieste nell'ultimo minuto
-        minute_ago = current_time - 60
-        minute_requests = sum(1 for timestamp, _ in self.requests[ip] 
-                             if timestamp > minute_ago)
-        
-        if minute_requests >= requests_per_minute:
-            return True, f"Troppo richieste per minuto ({minute_requests}/{requests_per_minute})"
-        
-        # Conta richieste nell'ultima ora
-        hour_ago = current_time - 3600
-        hour_requests = sum(1 for timestamp, _ in self.requests[ip] 
-                           if timestamp > hour_ago)
-        
-        if hour_requests >= requests_per_hour:
-            return True, f"Troppo richieste per ora ({hour_requests}/{requests_per_hour})"
-        
-        # Registra la richiesta
-        self.requests[ip].append((current_time, endpoint))
-        return False, ""
+        is_limited, reason, _ = self.check(ip, endpoint, requests_per_minute, requests_per_hour)
+        return is_limited, reason
+
+def create_rate_limiter(backend_name: str = None):
+    """
+    Crea il rate limiter del processo: locale (RateLimiter) oppure con stato
+    condiviso tra più processi server (NETMASTER_RATE_LIMIT_BACKEND=sqlite|redis).
+    """
+    backend = rate_limit_backends.create_backend(backend_name)
+    if backend is None:
+        return RateLimiter()
+    logger.info(f"[RATE_LIMIT] Stato condiviso su backend {type(backend).__name__}")
+    return rate_limit_backends.SharedRateLimiter(backend, fallback=RateLimiter())
 
 # Istanza globale del rate limiter
-rate_limiter = RateLimiter()
+rate_limiter = create_rate_limiter()
+
+def parse_trusted_proxies(value: str) -> List:
+    """
+    Converte l'elenco dei proxy fidati (IP o reti CIDR separati da virgola,
+    es. "127.0.0.1,10.0.0.0/8") nelle reti corrispondenti.
+    """
+    networks = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logger.warning(f"[RATE_LIMIT] Proxy fidato non valido ignorato: {item}")
+    return networks
+
+# Reverse proxy da cui accettare X-Forwarded-For (NETMASTER_TRUSTED_PROXIES).
+# Senza proxy configurati l'header è ignorato: è impostato liberamente dal client.
+TRUSTED_PROXIES = parse_trusted_proxies(os.getenv('NETMASTER_TRUSTED_PROXIES', ''))
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_address(remote_addr: Optional[str], forwarded_for: Optional[str] = None) -> str:
+    """
+    Restituisce l'indirizzo del client per rate limiting e log.
+
+    È l'indirizzo della connessione (remote_addr); solo se questo è un proxy
+    fidato viene letto X-Forwarded-For, risalendo la catena da destra fino al
+    primo hop non fidato: gli hop a sinistra sono scritti dal client e non
+    possono essere usati come chiave.
+    """
+    address = remote_addr or 'unknown'
+    if not forwarded_for or not _is_trusted_proxy(address):
+        return address
+    for hop in reversed(forwarded_for.split(',')):
+        hop = hop.strip()
+        if not hop:
+            continue
+        address = hop
+        if not _is_trusted_proxy(hop):
+            break
+    return address
+
+class CredentialCache:
+    """
+    Cache delle credenziali Basic già verificate con bcrypt.
+
+    Agent e dashboard ripresentano le stesse credenziali a ogni richiesta:
+    dopo la prima verifica bcrypt (lenta per costruzione) le successive sono
+    risolte con un HMAC-SHA256 delle credenziali, calcolato con una chiave
+    casuale generata all'avvio del processo. Sono memorizzati solo gli esiti
+    positivi, con scadenza (ttl) e numero massimo di voci (LRU), quindi le
+    password errate pagano sempre il costo completo di bcrypt.
+    """
+
+    def __init__(self, ttl: float = None, max_size: int = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv('NETMASTER_AUTH_CACHE_TTL', 300))
+        self.max_size = max_size or int(os.getenv('NETMASTER_AUTH_CACHE_SIZE', 1024))
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()  # {digest: scadenza}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def _digest(self, username: str, password: str, password_hash: str) -> bytes:
+        # L'hash memorizzato fa parte della chiave: cambiando la password le voci decadono
+        message = '\0'.join((username, password, password_hash)).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def verify(self, username: str, password: str, password_hash: str,
+               verifier: Callable[[str, str], bool]) -> bool:
+        """
+        Verifica le credenziali, usando verifier (bcrypt) solo se non sono in cache.
+
+        Args:
+            username: Nome utente presentato
+            password: Password presentata
+            password_hash: Hash bcrypt memorizzato
+            verifier: Funzione di verifica completa (username, password) -> bool
+        """
+        if self.cached(username, password, password_hash):
+            return True
+        if not verifier(username, password):
+            return False
+
+        digest = self._digest(username, password, password_hash)
+        with self._lock:
+            self._entries[digest] = time.monotonic() + self.ttl
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return True
+
+    def cached(self, username: str, password: str, password_hash: str) -> bool:
+        """
+        Verifica le credenziali solo in cache, senza mai invocare bcrypt.
+        Usato dal server asincrono per decidere se spostare la verifica fuori dall'event loop.
+        """
+        digest = self._digest(username, password, password_hash)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._entries.get(digest)
+            if expires is not None:
+                if expires > now:
+                    self._entries.move_to_end(digest)
+                    self._stats['hits'] += 1
+                    return True
+                del self._entries[digest]
+            self._stats['misses'] += 1
+        return False
+
+    def clear(self):
+        """Svuota la cache (ad esempio dopo un cambio di credenziali)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Restituisce le statistiche della cache."""
+        with self._lock:
+            result = dict(self._stats)
+            result['size'] = len(self._entries)
+        return result
+
+# Istanza globale della cache delle credenziali verificate
+credential_cache = CredentialCache()
 
 class InputValidator:
     """Validatore per input del server."""
@@ -267,15 +454,11 @@ def rate_limit(requests_per_minute: int = 60, requests_per_hour: int = 1000):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Ottieni IP del client
-            client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-            if client_ip:
-                client_ip = client_ip.split(',')[0].strip()
-            else:
-                client_ip = 'unknown'
+            # Ottieni IP del client (X-Forwarded-For solo dai proxy fidati)
+            client_ip = client_address(request.remote_addr, request.headers.get('X-Forwarded-For'))
             
             # Verifica rate limit
-            is_limited, reason = rate_limiter.is_rate_limited(
+            is_limited, reason, retry_after = rate_limiter.check(
                 client_ip, request.endpoint, requests_per_minute, requests_per_hour
             )
             
@@ -284,8 +467,8 @@ def rate_limit(requests_per_minute: int = 60, requests_per_hour: int = 1000):
                 return jsonify({
                     'error': 'Rate limit superato',
                     'message': reason,
-                    'retry_after': 60
-                }), 429
+                    'retry_after': retry_after
+                }), 429, {'Retry-After': str(retry_after)}
             
             return f(*args, **kwargs)
         return decorated_function
@@ -345,7 +528,7 @@ def log_security_event(event_type: str, details: str, severity: str = "WARNING")
         details: Dettagli dell'evento
         severity: Severità (INFO, WARNING, ERROR, CRITICAL)
     """
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+    client_ip = client_address(request.remote_addr, request.headers.get('X-Forwarded-For'))
     user_agent = request.headers.get('User-Agent', 'Unknown')
     
     log_message = f"[{event_type}] IP: {client_ip} | UA: {user_agent} | {details}"
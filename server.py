@@ -6,23 +6,32 @@ import os
 import sys
 import ssl
 import time
+import hmac
+import atexit
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import bcrypt
-import yagmail
 from flask import Flask, request, jsonify, make_response
 from logging.handlers import RotatingFileHandler
 
 # Importa il nuovo modulo per la gestione del database
 import database
+# Importa la coda di ingestione asincrona per /api/report
+import ingest
+# Importa i livelli di aggregazione per grafici e storico
+import rollup
+# Importa la politica di conservazione dei dati
+import retention
+# Importa il dispatcher asincrono delle notifiche email
+import notifier
 # Importa il nuovo modulo per la gestione sicura delle credenziali
 import credentials
 # Importa il nuovo modulo per la gestione SSL/TLS
 import ssl_manager
 # Importa il nuovo modulo per la validazione e sicurezza
 import security_validator
-from security_validator import rate_limit, validate_input, InputValidator
+from security_validator import rate_limit
 
 # --- Classi di Errore Personalizzate ---
 
@@ -86,25 +95,6 @@ def setup_logging():
 
 # --- Funzioni di Notifica ---
 
-def send_email_notification(subject, body):
-    """
-    Invia una notifica email utilizzando la configurazione salvata nel database.
-    """
-    try:
-        email_config = database.get_notification_config('email')
-        if not email_config or not email_config.get('enabled'):
-            logging.warning("Invio email saltato: configurazione non trovata o disabilitata.")
-            return False
-
-        config = email_config['config']
-        yag = yagmail.SMTP(config['username'], config['password'])
-        yag.send(to=config['to_email'], subject=subject, contents=body)
-        logging.info(f"Email di notifica inviata a {config['to_email']}.")
-        return True
-    except Exception as e:
-        logging.error(f"Errore critico durante l'invio dell'email: {e}", exc_info=True)
-        raise NotificationError(f"Impossibile inviare l'email: {e}")
-
 def check_thresholds_and_notify(data, agent_ip):
     """
     Controlla i dati rispetto alle soglie e invia notifiche se superate.
@@ -115,9 +105,8 @@ def check_thresholds_and_notify(data, agent_ip):
         if not thresholds:
             return
 
-        for metric, threshold_value, enabled in thresholds:
-            if not enabled:
-                continue
+        for threshold in thresholds:
+            metric, threshold_value = threshold['metric'], threshold['threshold']
 
             if metric in data and data[metric] > threshold_value:
                 if not database.has_recent_notification(agent_ip, metric, hours=1):
@@ -126,16 +115,7 @@ def check_thresholds_and_notify(data, agent_ip):
                         f"Valore: {data[metric]}, Soglia: {threshold_value}"
                     )
                     
-                    # Salva la notifica nel DB
-                    database.save_notification(
-                        agent_ip=agent_ip,
-                        metric=metric,
-                        value=data[metric],
-                        threshold=threshold_value,
-                        status='sent'
-                    )
-
-                    # Invia la notifica email
+                    # Salva la notifica nel DB e la accoda per l'invio email in background
                     subject = f"Allarme NetMaster: Soglia superata per {agent_ip}"
                     body = (
                         f"L'agent {agent_ip} ha superato la soglia per la metrica '{metric}'.\n"
@@ -143,12 +123,19 @@ def check_thresholds_and_notify(data, agent_ip):
                         f"Soglia impostata: {threshold_value}%\n"
                         f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
                     )
-                    send_email_notification(subject, body)
+                    notification_dispatcher.notify(agent_ip, metric, data[metric],
+                                                   threshold_value, subject, body)
 
     except Exception as e:
         logging.error(f"Errore durante il controllo delle soglie per {agent_ip}: {e}", exc_info=True)
 
 
+def process_ingested_batch(batch):
+    """Callback del writer di ingestione: controlla le soglie dei campioni salvati."""
+    for data, agent_ip in batch:
+        check_thresholds_and_notify(data, agent_ip)
+
+
 # --- Gestione Autenticazione ---
 
 def hash_password(password):
@@ -159,6 +146,19 @@ def verify_password(password, hashed):
     """Verifica se la password corrisponde all'hash memorizzato."""
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def check_credentials(username, password):
+    """
+    Verifica le credenziali Basic: bcrypt alla prima presentazione, poi
+    la cache delle credenziali già verificate (security_validator.credential_cache).
+    """
+    if USERNAME is None or PASSWORD_HASH is None:
+        return False
+    return security_validator.credential_cache.verify(
+        username, password, PASSWORD_HASH,
+        lambda user, pwd: hmac.compare_digest(user.encode('utf-8'), USERNAME.encode('utf-8'))
+                          and verify_password(pwd, PASSWORD_HASH)
+    )
+
 def load_credentials():
     """Carica le credenziali utilizzando il nuovo sistema sicuro."""
     try:
@@ -191,6 +191,33 @@ def load_credentials():
 setup_logging()
 database.init_db()  # Inizializza il database all'avvio
 
+# Dispatcher asincrono delle notifiche email
+notification_dispatcher = notifier.NotificationDispatcher()
+notification_dispatcher.start()
+atexit.register(notification_dispatcher.stop)
+
+# Coda di ingestione write-behind: salvataggio a blocchi in background
+ingest_queue = ingest.IngestQueue(on_flush=process_ingested_batch)
+ingest_queue.start()
+atexit.register(ingest_queue.stop)
+
+# Pulizia periodica dei dati scaduti (eliminazioni a blocchi + vacuum incrementale).
+# Con il server pre-fork (wsgi_server) la esegue solo il primo worker.
+retention_manager = retention.RetentionManager()
+if os.getenv('NETMASTER_WORKER_ID', '0') == '0':
+    retention_manager.start()
+atexit.register(retention_manager.stop)
+
+def shutdown_services():
+    """
+    Arresta i servizi in background e chiude il pool SQLite. Usata all'uscita del
+    server e dai worker pre-fork (wsgi_server), che escono con os._exit senza atexit.
+    """
+    ingest_queue.stop()
+    notification_dispatcher.stop()
+    retention_manager.stop()
+    database.close_all_connections()
+
 app = Flask(__name__)
 USERNAME, PASSWORD_HASH = load_credentials()
 
@@ -207,7 +234,7 @@ def requires_auth(f):
         if not auth or not auth.username or not auth.password:
             return handle_authentication_error(AuthenticationError("Credenziali di autenticazione richieste."))
         
-        if auth.username != USERNAME or not verify_password(auth.password, PASSWORD_HASH):
+        if not check_credentials(auth.username, auth.password):
             logging.warning(f"Tentativo di accesso fallito per l'utente: {auth.username}")
             return handle_authentication_error(AuthenticationError("Credenziali non valide."))
         
@@ -227,8 +254,8 @@ def handle_authentication_error(error):
 @app.errorhandler(ValidationError)
 def handle_validation_error(error):
     """Gestore per errori di validazione."""
-    logging.warning(f"Dati non validi ricevuti: {error.message}")
-    response = jsonify({'error': 'Dati non validi', 'message': error.message})
+    logging.warning(f"Dati non validi ricevuti: {error}")
+    response = jsonify({'error': 'Dati non validi', 'message': str(error)})
     response.status_code = 400
     return response
 
@@ -251,32 +278,43 @@ def validate_system_data(data):
 @app.route('/api/report', methods=['POST'])
 @requires_auth
 @rate_limit(requests_per_minute=120, requests_per_hour=2000)  # Limiti generosi per agent legittimi
-@validate_input(InputValidator.validate_system_data)
 def report():
-    """Endpoint per ricevere i dati di monitoraggio dagli agent con validazione rigorosa."""
+    """
+    Endpoint per ricevere i dati di monitoraggio dagli agent.
+    I dati sono validati con lo schema salvato da database.build_system_data_row
+    (lo stesso inviato dall'agent) e accodati al writer di ingestione.
+    """
     agent_ip = request.remote_addr
     
-    # I dati sono già stati validati dal decoratore @validate_input
-    data = g.validated_data
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValidationError("Dati JSON richiesti")
+    validate_system_data(data)
     
     try:
-        # Salva i dati validati nel database
-        database.save_system_data(data, agent_ip)
-        logging.info(f"[REPORT] Dati validati ricevuti e salvati da agent {agent_ip} (hostname: {data.get('hostname', 'unknown')})")
+        # Accoda i dati validati: salvataggio e controllo soglie avvengono nel writer
+        ingest_queue.submit(data, agent_ip)
+        logging.info(f"[REPORT] Dati validati ricevuti e accodati da agent {agent_ip} (hostname: {data['node']})")
         
         # Log delle metriche per monitoraggio
-        logging.debug(f"[METRICS] {agent_ip}: CPU={data['cpu_percent']}%, RAM={data['memory_percent']}%, DISK={data['disk_percent']}%")
-        
-        # Controlla le soglie e invia notifiche se necessario
-        check_thresholds_and_notify(data, agent_ip)
+        logging.debug(f"[METRICS] {agent_ip}: CPU={data['cpu_usage']}%, RAM={data['memory']}%, DISK={data['disk']}%")
         
         return jsonify({
             "status": "success", 
             "message": "Dati ricevuti e validati correttamente.",
-            "timestamp": data['timestamp'],
-            "hostname": data['hostname']
+            "hostname": data['node']
         }), 200
         
+    except ingest.IngestQueueFull as e:
+        logging.warning(f"[INGEST] Richiesta rifiutata da {agent_ip}: {e.message}")
+        response = jsonify({
+            "status": "error",
+            "message": e.message,
+            "retry_after": e.retry_after
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
     except Exception as e:
         logging.error(f"[ERROR] Errore durante l'elaborazione dei dati da {agent_ip}: {e}", exc_info=True)
         security_validator.log_security_event("DATA_PROCESSING_ERROR", f"Errore elaborazione dati: {e}", "ERROR")
@@ -339,20 +377,37 @@ def manage_notification_config():
 
 @app.route('/api/history', methods=['GET'])
 @requires_auth
-@validate_input
 @rate_limit(requests_per_minute=60, requests_per_hour=1000)
 def get_history():
     """
     Endpoint per recuperare lo storico dei dati di monitoraggio.
+    Con un intervallo start/end sceglie automaticamente tra dati grezzi e
+    aggregati 1m/5m/1h in base al budget max_points.
     """
     try:
         start_date = request.args.get('start')
         end_date = request.args.get('end')
+        agent_ip = request.args.get('agent')
+        max_points = request.args.get('max_points', rollup.DEFAULT_MAX_POINTS, type=int)
+        
+        tier = 'raw'
+        if start_date:
+            try:
+                tier = database.select_tier(start_date, end_date, max_points, agent_ip)
+            except ValueError:
+                return jsonify({'error': 'Intervallo di date non valido'}), 400
+        
+        if tier == 'raw':
+            history_data = database.get_history_points(agent_ip, start_date, end_date,
+                                                       limit=max_points if start_date else 100)
+        else:
+            history_data = database.get_rollup_data(tier, start_date, end_date, agent_ip)
+        # Stesso schema per tutti i livelli: timestamp in millisecondi
+        for record in history_data:
+            record['timestamp'] = record['timestamp'] * 1000
         
-        history_data = database.get_history(start_date, end_date)
-        
-        logging.info(f"Recuperato storico dati: {len(history_data)} record")
-        return jsonify(history_data)
+        logging.info(f"Recuperato storico dati: {len(history_data)} record (livello {tier})")
+        return jsonify(history_data), 200, {'X-NetMaster-Tier': tier}
         
     except Exception as e:
         logging.error(f"Errore nel recupero dello storico: {e}", exc_info=True)
@@ -363,7 +418,6 @@ def get_history():
 
 @app.route('/api/stats', methods=['GET'])
 @requires_auth
-@validate_input
 @rate_limit(requests_per_minute=30, requests_per_hour=500)
 def get_stats():
     """
@@ -405,7 +459,6 @@ def get_stats():
 
 @app.route('/api/realtime', methods=['GET'])
 @requires_auth
-@validate_input
 @rate_limit(requests_per_minute=60, requests_per_hour=1000)
 def get_realtime_data():
     """
@@ -418,8 +471,14 @@ def get_realtime_data():
         hours_map = {'1h': 1, '6h': 6, '24h': 24}
         hours = hours_map.get(timespan, 6)
         
-        # Recupera dati recenti
-        realtime_data = database.get_recent_data(hours)
+        # Sceglie dati grezzi o aggregati in base al budget di punti
+        max_points = request.args.get('max_points', rollup.DEFAULT_MAX_POINTS, type=int)
+        start = (datetime.now() - timedelta(hours=hours)).isoformat()
+        tier = database.select_tier(start, None, max_points)
+        if tier == 'raw':
+            realtime_data = database.get_recent_data(hours)
+        else:
+            realtime_data = database.get_rollup_data(tier, start)
         
         # Formatta i dati per i grafici
         formatted_data = []
@@ -432,8 +491,8 @@ def get_realtime_data():
                 'agent_ip': record.get('agent_ip', '')
             })
         
-        logging.info(f"Dati real-time recuperati: {len(formatted_data)} record per {timespan}")
-        return jsonify(formatted_data)
+        logging.info(f"Dati real-time recuperati: {len(formatted_data)} record per {timespan} (livello {tier})")
+        return jsonify(formatted_data), 200, {'X-NetMaster-Tier': tier}
         
     except Exception as e:
         logging.error(f"Errore nel recupero dei dati real-time: {e}", exc_info=True)
@@ -442,7 +501,6 @@ def get_realtime_data():
 
 @app.route('/api/agents', methods=['GET'])
 @requires_auth
-@validate_input
 @rate_limit(requests_per_minute=30, requests_per_hour=500)
 def get_agents():
     """
@@ -491,7 +549,6 @@ def get_agents():
 
 @app.route('/api/agents/<int:agent_id>', methods=['GET'])
 @requires_auth
-@validate_input
 @rate_limit(requests_per_minute=30, requests_per_hour=500)
 def get_agent(agent_id):
     """
@@ -513,7 +570,6 @@ def get_agent(agent_id):
 
 @app.route('/api/alerts', methods=['GET'])
 @requires_auth
-@validate_input
 @rate_limit(requests_per_minute=30, requests_per_hour=500)
 def get_alerts():
     """
@@ -536,7 +592,6 @@ def get_alerts():
 
 @app.route('/api/alerts/<alert_id>/dismiss', methods=['POST'])
 @requires_auth
-@validate_input
 @rate_limit(requests_per_minute=20, requests_per_hour=200)
 def dismiss_alert(alert_id):
     """
@@ -558,7 +613,6 @@ def dismiss_alert(alert_id):
 
 @app.route('/api/health', methods=['GET'])
 @requires_auth
-@validate_input
 @rate_limit(requests_per_minute=60, requests_per_hour=1000)
 def get_system_health():
     """
@@ -641,4 +695,5 @@ if __name__ == '__main__':
         logging.critical(f"Errore critico durante l'avvio del server: {e}", exc_info=True)
         sys.exit(1)
     finally:
+        shutdown_services()
         logging.info("Server NetMaster terminato.")
@@ -10,20 +10,29 @@ import os
 import sys
 import ssl
 import time
+import hmac
+import atexit
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import bcrypt
-import yagmail
-from flask import Flask, request, jsonify, send_from_directory
+from urllib.parse import urlencode
+from flask import Flask, Response, request, jsonify, send_from_directory
 from werkzeug.exceptions import BadRequest
 from logging.handlers import RotatingFileHandler
 
 # Importa moduli NetMaster
 import database
+import ingest
+import rollup
+import retention
+import notifier
 import credentials
 import ssl_manager
 import security_validator
+import wire_format
+import live_stream
+from response_cache import ResponseCache
 from security_validator import InputValidator
 
 # --- Classi di Errore Personalizzate ---
@@ -43,6 +52,48 @@ class ValidationError(Exception):
     """Eccezione personalizzata per errori di validazione dei dati."""
     pass
 
+# --- Funzioni di Validazione ---
+
+def validate_system_data(data):
+    """Valida i dati di sistema ricevuti dall'agent prima dell'accodamento."""
+    required_fields = ['cpu_usage', 'memory', 'disk', 'system', 'node', 'release', 'version']
+    for field in required_fields:
+        if field not in data:
+            raise ValidationError(f"Campo richiesto mancante: '{field}'")
+    
+    for field in ['cpu_usage', 'memory', 'disk']:
+        value = data[field]
+        if not isinstance(value, (int, float)) or not (0 <= value <= 100):
+            raise ValidationError(f"Il campo '{field}' deve essere un numero tra 0 e 100.")
+
+class UnknownAgentError(ValidationError):
+    """Eccezione sollevata per report compatti con agent_id non registrato."""
+    pass
+
+# Dimensione massima di un singolo report, anche dopo la decompressione
+REPORT_MAX_BYTES = 64 * 1024
+
+def expand_agent_facts(data):
+    """
+    Completa un report compatto (con 'agent_id' al posto dei dati statici)
+    con system, node, release e version registrati dall'host.
+    """
+    if not isinstance(data, dict) or 'agent_id' not in data:
+        return data
+    agent_id = data['agent_id']
+    if not isinstance(agent_id, int) or isinstance(agent_id, bool):
+        raise ValidationError("Il campo 'agent_id' deve essere un intero")
+    facts = database.get_agent_host(agent_id)
+    if facts is None:
+        raise UnknownAgentError(f"Agent {agent_id} non registrato")
+    for field, value in facts.items():
+        data.setdefault(field, value)
+    return data
+
+def validate_report(data):
+    """Espande un eventuale report compatto e lo valida."""
+    validate_system_data(expand_agent_facts(data))
+
 # --- Configurazione del Logging ---
 
 def setup_logging():
@@ -89,27 +140,20 @@ def setup_logging():
 
 # --- Funzioni di Notifica ---
 
-def send_email_notification(subject, body):
-    """Invia una notifica email utilizzando la configurazione salvata nel database."""
-    try:
-        email_config = database.get_notification_config('email')
-        if not email_config or not email_config.get('enabled', False):
-            logging.warning("Notifiche email disabilitate o non configurate.")
-            return False
-        
-        config = email_config['config']
-        yag = yagmail.SMTP(config['username'], config['password'], 
-                          host=config['smtp_server'], port=config['smtp_port'])
-        yag.send(to=config['recipients'], subject=subject, contents=body)
-        logging.info(f"Email inviata: {subject}")
-        return True
-        
-    except Exception as e:
-        logging.error(f"Errore invio email: {e}", exc_info=True)
-        raise NotificationError(f"Impossibile inviare email: {e}")
+# Mappa le metriche delle soglie ai campi del report inviato dagli agent
+THRESHOLD_METRIC_FIELDS = {
+    'cpu': 'cpu_usage',
+    'memory': 'memory',
+    'disk': 'disk'
+}
 
 def check_thresholds_and_notify(data, agent_ip):
-    """Controlla i dati rispetto alle soglie e invia notifiche se superate."""
+    """
+    Controlla i dati rispetto alle soglie e invia notifiche se superate.
+    Soglie e cooldown sono letti dalla cache in memoria del modulo database:
+    il database viene interrogato solo quando una notifica parte davvero,
+    e l'email viene inviata in background dal dispatcher delle notifiche.
+    """
     try:
         thresholds = database.get_thresholds_for_agent(agent_ip)
         
@@ -117,15 +161,8 @@ def check_thresholds_and_notify(data, agent_ip):
             metric = threshold['metric']
             threshold_value = threshold['threshold']
             
-            # Mappa le metriche ai valori nei dati
-            metric_mapping = {
-                'cpu': 'cpu_percent',
-                'memory': 'memory_percent', 
-                'disk': 'disk_percent'
-            }
-            
-            if metric in metric_mapping:
-                current_value = data.get(metric_mapping[metric], 0)
+            if metric in THRESHOLD_METRIC_FIELDS:
+                current_value = data.get(THRESHOLD_METRIC_FIELDS[metric], 0)
                 
                 if current_value > threshold_value:
                     # Verifica se è già stata inviata una notifica recente
@@ -141,13 +178,28 @@ def check_thresholds_and_notify(data, agent_ip):
                         Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
                         """
                         
-                        send_email_notification(subject, body)
-                        database.save_notification(agent_ip, metric, current_value, threshold_value)
+                        # Invio asincrono: registra l'avviso e lo accoda al dispatcher
+                        notification_dispatcher.notify(agent_ip, metric, current_value,
+                                                       threshold_value, subject, body)
+                        stream_hub.publish_alert(agent_ip, metric, current_value, threshold_value)
                         logging.warning(f"Soglia {metric} superata per {agent_ip}: {current_value}% > {threshold_value}%")
                         
     except Exception as e:
         logging.error(f"Errore nel controllo soglie: {e}", exc_info=True)
 
+def process_ingested_batch(batch):
+    """Callback del writer di ingestione: controlla le soglie dei campioni salvati."""
+    for data, agent_ip in batch:
+        check_thresholds_and_notify(data, agent_ip)
+
+def process_written_rows(rows):
+    """
+    Callback del writer dopo ogni scrittura: invalida le risposte in cache e
+    pubblica i nuovi campioni sullo stream della dashboard.
+    """
+    response_cache.invalidate()
+    stream_hub.publish_rows(rows)
+
 # --- Gestione Autenticazione ---
 
 def hash_password(password):
@@ -158,6 +210,19 @@ def verify_password(password, hashed):
     """Verifica se la password corrisponde all'hash memorizzato."""
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def check_credentials(username, password):
+    """
+    Verifica le credenziali Basic: bcrypt alla prima presentazione, poi
+    la cache delle credenziali già verificate (security_validator.credential_cache).
+    """
+    if USERNAME is None or PASSWORD_HASH is None:
+        return False
+    return security_validator.credential_cache.verify(
+        username, password, PASSWORD_HASH,
+        lambda user, pwd: hmac.compare_digest(user.encode('utf-8'), USERNAME.encode('utf-8'))
+                          and verify_password(pwd, PASSWORD_HASH)
+    )
+
 def load_credentials():
     """Carica le credenziali utilizzando il nuovo sistema sicuro."""
     try:
@@ -181,6 +246,44 @@ def load_credentials():
 setup_logging()
 database.init_db()
 
+# Dispatcher asincrono delle notifiche email (connessione SMTP riutilizzata)
+notification_dispatcher = notifier.NotificationDispatcher()
+notification_dispatcher.start()
+atexit.register(notification_dispatcher.stop)
+
+# Risposte degli endpoint della dashboard, invalidate a ogni scrittura di campioni
+response_cache = ResponseCache()
+
+# Stream push della dashboard (/api/stream), alimentato dal writer di ingestione
+# e da agent_latest per i campioni salvati da altri processi
+stream_hub = live_stream.StreamHub()
+stream_hub.enable_polling(database.get_latest_samples_since)
+atexit.register(stream_hub.close)
+
+# Coda di ingestione write-behind per /api/report
+ingest_queue = ingest.IngestQueue(on_flush=process_ingested_batch,
+                                  on_write=process_written_rows)
+ingest_queue.start()
+atexit.register(ingest_queue.stop)
+
+# Pulizia periodica dei dati scaduti (eliminazioni a blocchi + vacuum incrementale).
+# Con il server pre-fork (wsgi_server) la esegue solo il primo worker.
+retention_manager = retention.RetentionManager()
+if os.getenv('NETMASTER_WORKER_ID', '0') == '0':
+    retention_manager.start()
+atexit.register(retention_manager.stop)
+
+def shutdown_services():
+    """
+    Arresta i servizi in background e chiude il pool SQLite. Usata all'uscita del
+    server e dai worker pre-fork (wsgi_server), che escono con os._exit senza atexit.
+    """
+    ingest_queue.stop()
+    notification_dispatcher.stop()
+    stream_hub.close()
+    retention_manager.stop()
+    database.close_all_connections()
+
 # Carica credenziali
 USERNAME, PASSWORD_HASH = load_credentials()
 
@@ -214,7 +317,7 @@ def requires_auth(f):
                 'WWW-Authenticate': 'Basic realm="NetMaster"'
             }
         
-        if auth.username != USERNAME or not verify_password(auth.password, PASSWORD_HASH):
+        if not check_credentials(auth.username, auth.password):
             logging.warning(f"Tentativo di accesso con credenziali errate da {request.remote_addr}: {auth.username}")
             raise AuthenticationError("Credenziali non valide")
         
@@ -241,15 +344,11 @@ def handle_validation_error(error):
 # --- Rate Limiting Personalizzato ---
 
 def rate_limit_endpoint(requests_per_minute=60, requests_per_hour=1000):
-    """Decoratore per rate limiting personalizzato per ogni endpoint."""
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            # Implementazione semplificata del rate limiting
-            # In produzione, usare Redis o sistema più robusto
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
+    """
+    Decoratore per rate limiting personalizzato per ogni endpoint:
+    limiti per (IP, endpoint) con il rate limiter a finestra scorrevole di security_validator.
+    """
+    return security_validator.rate_limit(requests_per_minute, requests_per_hour)
 
 def validate_input_endpoint(f):
     """Decoratore per validazione input personalizzato."""
@@ -259,6 +358,64 @@ def validate_input_endpoint(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def cached_response(f):
+    """
+    Decoratore per gli endpoint GET della dashboard: serve il corpo JSON già
+    serializzato dalla response_cache (chiave: percorso + parametri ordinati),
+    con ETag e header X-NetMaster-Cache (HIT/MISS).
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET' or not response_cache.enabled:
+            return f(*args, **kwargs)
+        key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+
+        def compute():
+            response = app.make_response(f(*args, **kwargs))
+            headers = {name: value for name, value in response.headers.items()
+                       if name.startswith('X-NetMaster-')}
+            return response.get_data(), response.status_code, headers
+
+        entry, hit = response_cache.get_or_compute(key, compute)
+        response = Response(entry.body, status=entry.status, headers=entry.headers,
+                            mimetype='application/json')
+        if entry.status == 200:
+            response.headers['ETag'] = entry.etag
+        response.headers['X-NetMaster-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+    return decorated_function
+
+@app.after_request
+def conditional_get(response):
+    """
+    GET condizionale sugli endpoint API di lettura: ogni risposta 200 ha un
+    ETag e, se coincide con If-None-Match, viene restituito 304 senza corpo.
+    """
+    if (request.method == 'GET' and request.path.startswith('/api/')
+            and response.status_code == 200 and not response.direct_passthrough
+            and not response.is_streamed):
+        if 'ETag' not in response.headers:
+            response.add_etag()
+        response.make_conditional(request)
+    return response
+
+def parse_since(value):
+    """
+    Converte il parametro since, cioè l'header X-NetMaster-Cursor di una
+    risposta precedente: è la sequenza di scrittura del database, non il
+    timestamp dei campioni, così il delta include anche le righe con timestamp
+    vecchio scritte dopo (backfill, altri worker, ingestione asincrona).
+    """
+    if value is None or value == '':
+        return None
+    try:
+        cursor = int(value)
+    except ValueError:
+        raise ValidationError("Parametro since non valido")
+    if cursor < 0:
+        raise ValidationError("Parametro since non valido")
+    return cursor
+
 # --- Endpoint per File Statici ---
 
 @app.route('/')
@@ -287,39 +444,145 @@ def js_files(filename):
 
 # --- Endpoint API Principali ---
 
+def read_report_body():
+    """
+    Legge il corpo di un report: JSON (anche gzip/deflate) o frame binario.
+    Il JSON non compresso passa dal parser di Flask come in precedenza.
+    """
+    encoding = request.headers.get('Content-Encoding', '')
+    if request.mimetype != wire_format.CONTENT_TYPE_FRAME and not encoding:
+        return request.get_json()
+    if request.content_length and request.content_length > REPORT_MAX_BYTES:
+        raise ValidationError(f"Report troppo grande (massimo {REPORT_MAX_BYTES} byte)")
+    try:
+        return wire_format.decode_report(request.get_data(cache=False), request.mimetype,
+                                         encoding, REPORT_MAX_BYTES)
+    except wire_format.WireFormatError as e:
+        raise ValidationError(str(e))
+
 @app.route('/api/report', methods=['POST'])
 @requires_auth
 @rate_limit_endpoint(requests_per_minute=120, requests_per_hour=2000)
 @validate_input_endpoint
 def report():
-    """Endpoint per ricevere i dati di monitoraggio dagli agent."""
+    """
+    Endpoint per ricevere i dati di monitoraggio dagli agent.
+    I dati validati vengono accodati e salvati a blocchi dal writer di ingestione.
+    """
     try:
-        data = request.get_json()
+        data = read_report_body()
         if not data:
             raise ValidationError("Dati JSON richiesti")
+        validate_report(data)
         
         agent_ip = request.remote_addr
         
-        # Salva i dati nel database
-        database.save_system_data(data, agent_ip)
+        # Accoda i dati: salvataggio e controllo soglie avvengono nel writer
+        ingest_queue.submit(data, agent_ip)
         
-        # Controlla soglie e invia notifiche se necessario
-        check_thresholds_and_notify(data, agent_ip)
-        
-        logging.info(f"Dati ricevuti da {agent_ip}: CPU={data.get('cpu_percent', 0):.1f}%")
+        logging.info(f"Dati ricevuti da {agent_ip}: CPU={data.get('cpu_usage', 0):.1f}%")
         return jsonify({'status': 'success', 'message': 'Dati ricevuti correttamente'}), 200
         
+    except ingest.IngestQueueFull as e:
+        logging.warning(f"[INGEST] Richiesta rifiutata da {request.remote_addr}: {e.message}")
+        return jsonify({
+            'error': 'Server sovraccarico',
+            'message': e.message,
+            'retry_after': e.retry_after
+        }), 503, {'Retry-After': str(e.retry_after)}
+    except UnknownAgentError as e:
+        # L'agent deve ripetere la registrazione (es. database ricreato)
+        return jsonify({'error': 'Agent non registrato', 'message': str(e)}), 409
     except ValidationError as e:
         raise e
     except Exception as e:
         logging.error(f"Errore nella ricezione dati: {e}", exc_info=True)
         return jsonify({'error': 'Errore interno del server'}), 500
 
+@app.route('/api/report/batch', methods=['POST'])
+@requires_auth
+@rate_limit_endpoint(requests_per_minute=60, requests_per_hour=1000)
+def report_batch():
+    """
+    Endpoint per i campioni accumulati dagli agent durante un'interruzione.
+    Accetta una lista di campioni con timestamp (JSON, anche gzip); i campioni
+    validi vengono accodati in blocco, quelli non validi riportati per indice.
+    """
+    agent_ip = request.remote_addr
+    try:
+        if request.content_length and request.content_length > ingest.BATCH_MAX_BYTES:
+            raise ValidationError(f"Batch troppo grande (massimo {ingest.BATCH_MAX_BYTES} byte)")
+        now = datetime.now()
+        try:
+            payload = ingest.decode_batch_body(request.get_data(cache=False),
+                                               request.headers.get('Content-Encoding', ''))
+            samples, rejected = ingest.parse_batch(payload, validate_report, now)
+        except ingest.BatchError as e:
+            raise ValidationError(str(e))
+
+        if not samples:
+            return jsonify({
+                'error': 'Dati non validi',
+                'message': 'Nessun campione valido nel batch',
+                'rejected': rejected
+            }), 400
+
+        notify_after = (now - timedelta(seconds=ingest.BATCH_ALERT_WINDOW_S)).isoformat()
+        ingest_queue.submit_many(samples, agent_ip, notify_after)
+
+        logging.info(f"Batch ricevuto da {agent_ip}: {len(samples)} campioni accodati, "
+                     f"{len(rejected)} scartati")
+        return jsonify({
+            'status': 'success',
+            'accepted': len(samples),
+            'rejected': rejected
+        }), 200
+
+    except ingest.IngestQueueFull as e:
+        logging.warning(f"[INGEST] Batch rifiutato da {agent_ip}: {e.message}")
+        return jsonify({
+            'error': 'Server sovraccarico',
+            'message': e.message,
+            'retry_after': e.retry_after
+        }), 503, {'Retry-After': str(e.retry_after)}
+    except ValidationError as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Errore nella ricezione del batch: {e}", exc_info=True)
+        return jsonify({'error': 'Errore interno del server'}), 500
+
+@app.route('/api/agents/register', methods=['POST'])
+@requires_auth
+@rate_limit_endpoint(requests_per_minute=30, requests_per_hour=500)
+def register_agent():
+    """
+    Registra i dati statici di un host (system, node, release, version) e
+    restituisce l'agent_id con cui l'agent invia poi i report compatti.
+    """
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            raise ValidationError("Dati JSON richiesti")
+        for field in database.AGENT_HOST_FIELDS:
+            if not isinstance(data.get(field), str):
+                raise ValidationError(f"Campo richiesto mancante: '{field}'")
+        
+        agent_id = database.register_agent_host(request.remote_addr, data)
+        logging.info(f"Agent registrato da {request.remote_addr}: {data['node']} (agent_id={agent_id})")
+        return jsonify({'status': 'success', 'agent_id': agent_id}), 200
+        
+    except ValidationError as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Errore nella registrazione dell'agent: {e}", exc_info=True)
+        return jsonify({'error': 'Errore interno del server'}), 500
+
 # --- Endpoint Dashboard Web ---
 
 @app.route('/api/stats', methods=['GET'])
 @requires_auth
 @rate_limit_endpoint(requests_per_minute=30, requests_per_hour=500)
+@cached_response
 def get_stats():
     """Endpoint per ottenere statistiche aggregate del sistema."""
     try:
@@ -355,14 +618,31 @@ def get_stats():
 @app.route('/api/realtime', methods=['GET'])
 @requires_auth
 @rate_limit_endpoint(requests_per_minute=60, requests_per_hour=1000)
+@cached_response
 def get_realtime_data():
-    """Endpoint per ottenere dati real-time per i grafici."""
+    """
+    Endpoint per ottenere dati real-time per i grafici.
+    Per intervalli lunghi usa il livello di aggregazione più fine che rientra
+    nel budget max_points (indicato nell'header X-NetMaster-Tier).
+    Con since=<cursore> (header X-NetMaster-Cursor della risposta precedente)
+    restituisce solo i punti scritti dopo, o i bucket aggregati aggiornati:
+    il client li sostituisce per (timestamp, agent).
+    """
     try:
         timespan = request.args.get('timespan', '6h')
         hours_map = {'1h': 1, '6h': 6, '24h': 24}
         hours = hours_map.get(timespan, 6)
-        
-        realtime_data = database.get_recent_data(hours)
+        max_points = request.args.get('max_points', rollup.DEFAULT_MAX_POINTS, type=int)
+        since = parse_since(request.args.get('since'))
+        
+        start = (datetime.now() - timedelta(hours=hours)).isoformat()
+        tier = database.select_tier(start, None, max_points)
+        # Letto prima dei dati: al più qualche riga torna anche nel delta successivo
+        cursor = database.get_ingest_seq()
+        if tier == 'raw':
+            realtime_data = database.get_recent_data(hours, since)
+        else:
+            realtime_data = database.get_rollup_data(tier, start, since=since)
         
         formatted_data = []
         for record in realtime_data:
@@ -374,8 +654,12 @@ def get_realtime_data():
                 'agent_ip': record.get('agent_ip', '')
             })
         
-        return jsonify(formatted_data)
+        return jsonify(formatted_data), 200, {'X-NetMaster-Tier': tier,
+                                              'X-NetMaster-Cursor': str(cursor),
+                                              'X-NetMaster-Delta': '0' if since is None else '1'}
         
+    except ValidationError as e:
+        raise e
     except Exception as e:
         logging.error(f"Errore nel recupero dei dati real-time: {e}", exc_info=True)
         return jsonify({'error': 'Errore interno del server'}), 500
@@ -383,6 +667,7 @@ def get_realtime_data():
 @app.route('/api/agents', methods=['GET'])
 @requires_auth
 @rate_limit_endpoint(requests_per_minute=30, requests_per_hour=500)
+@cached_response
 def get_agents():
     """Endpoint per ottenere la lista degli agent attivi."""
     try:
@@ -391,15 +676,7 @@ def get_agents():
         agents = []
         for i, agent in enumerate(agents_data, 1):
             last_update = agent.get('timestamp', 0)
-            current_time = time.time()
-            time_diff = current_time - last_update
-            
-            if time_diff < 120:
-                status = 'online'
-            elif time_diff < 300:
-                status = 'warning'
-            else:
-                status = 'offline'
+            status = live_stream.agent_status(time.time() - last_update)
             
             agents.append({
                 'id': i,
@@ -410,6 +687,7 @@ def get_agents():
                 'disk_percent': agent.get('disk_percent', 0),
                 'processes': agent.get('processes', 0),
                 'uptime': agent.get('uptime', 0),
+                'metrics': agent.get('metrics', {}),
                 'platform': agent.get('platform', 'Unknown'),
                 'architecture': agent.get('architecture', 'Unknown'),
                 'last_update': last_update,
@@ -425,6 +703,7 @@ def get_agents():
 @app.route('/api/alerts', methods=['GET'])
 @requires_auth
 @rate_limit_endpoint(requests_per_minute=30, requests_per_hour=500)
+@cached_response
 def get_alerts():
     """Endpoint per ottenere gli avvisi attivi del sistema."""
     try:
@@ -439,6 +718,29 @@ def get_alerts():
         logging.error(f"Errore nel recupero degli avvisi: {e}", exc_info=True)
         return jsonify({'error': 'Errore interno del server'}), 500
 
+@app.route('/api/stream', methods=['GET'])
+@requires_auth
+@rate_limit_endpoint(requests_per_minute=30, requests_per_hour=500)
+def stream_events():
+    """
+    Stream Server-Sent Events per la dashboard: nuovi campioni ('sample'),
+    cambi di stato degli agent ('agent') e soglie superate ('alert'), a
+    blocchi coalescenti. Con l'header Last-Event-ID riprende dall'ultimo
+    evento ricevuto; 'resync' chiede al client di ricaricare i dati via REST.
+    """
+    try:
+        subscription = stream_hub.subscribe(request.headers.get('Last-Event-ID'))
+    except live_stream.StreamFull as e:
+        logging.warning(f"[STREAM] Stream rifiutato per {request.remote_addr}: {e.message}")
+        return jsonify({
+            'error': 'Troppi stream aperti',
+            'message': e.message,
+            'retry_after': e.retry_after
+        }), 503, {'Retry-After': str(e.retry_after)}
+    
+    return Response(subscription, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/health', methods=['GET'])
 @requires_auth
 @rate_limit_endpoint(requests_per_minute=60, requests_per_hour=1000)
@@ -453,6 +755,13 @@ def get_system_health():
             'server_uptime': time.time() - start_time,
             'database_status': 'connected',
             'ssl_enabled': False,  # Configurabile
+            'ingest': ingest_queue.stats(),
+            'threshold_cache': database.threshold_cache.stats(),
+            'response_cache': response_cache.stats(),
+            'stream': stream_hub.stats(),
+            'notifications': notification_dispatcher.stats(),
+            'auth_cache': security_validator.credential_cache.stats(),
+            'retention': retention_manager.last_report,
             'version': '1.0.0'
         }
         
@@ -465,16 +774,52 @@ def get_system_health():
 @app.route('/api/history', methods=['GET'])
 @requires_auth
 @rate_limit_endpoint(requests_per_minute=60, requests_per_hour=1000)
+@cached_response
 def get_history():
-    """Endpoint per recuperare lo storico dei dati di monitoraggio."""
+    """
+    Endpoint per recuperare lo storico dei dati di monitoraggio.
+    Con un intervallo start/end sceglie automaticamente tra dati grezzi e
+    aggregati 1m/5m/1h in base al budget max_points. Con since=<cursore>
+    (header X-NetMaster-Cursor) restituisce solo i punti scritti dopo, allo
+    stesso livello dell'intervallo: i dati grezzi in ordine di scrittura e al
+    più limit per risposta, con il cursore fermo all'ultimo punto inviato.
+    """
     try:
         start_date = request.args.get('start')
         end_date = request.args.get('end')
+        agent_ip = request.args.get('agent')
+        max_points = request.args.get('max_points', rollup.DEFAULT_MAX_POINTS, type=int)
+        since = parse_since(request.args.get('since'))
+        
+        tier = 'raw'
+        if start_date:
+            try:
+                tier = database.select_tier(start_date, end_date, max_points, agent_ip)
+            except ValueError:
+                raise ValidationError("Intervallo di date non valido")
+        
+        cursor = database.get_ingest_seq()
+        limit = max_points if start_date else 100
+        if tier == 'raw' and since is not None:
+            history_data, last_seq = database.get_history_delta_points(agent_ip, start_date, end_date,
+                                                                       limit, since)
+            if last_seq is not None:
+                # Delta troncato: il resto arriva dal poll successivo
+                cursor = last_seq
+        elif tier == 'raw':
+            history_data = database.get_history_points(agent_ip, start_date, end_date, limit)
+        else:
+            history_data = database.get_rollup_data(tier, start_date, end_date, agent_ip, since)
+        # Stesso schema per tutti i livelli: timestamp in millisecondi
+        for record in history_data:
+            record['timestamp'] = record['timestamp'] * 1000
         
-        history_data = database.get_history(start_date, end_date)
-        
-        return jsonify(history_data)
+        return jsonify(history_data), 200, {'X-NetMaster-Tier': tier,
+                                            'X-NetMaster-Cursor': str(cursor),
+                                            'X-NetMaster-Delta': '0' if since is None else '1'}
         
+    except ValidationError as e:
+        raise e
     except Exception as e:
         logging.error(f"Errore nel recupero dello storico: {e}", exc_info=True)
         return jsonify({'error': 'Errore interno del server'}), 500
@@ -498,6 +843,8 @@ def manage_thresholds():
             for agent_ip, metrics in data.items():
                 for metric, threshold in metrics.items():
                     database.save_threshold(agent_ip, metric, threshold, True)
+            # Gli avvisi dipendono dalle soglie: nessuna risposta in cache resta valida
+            response_cache.invalidate(force=True)
             
             return jsonify({'message': 'Soglie aggiornate con successo'})
             
@@ -580,4 +927,5 @@ if __name__ == '__main__':
         logging.critical(f"Errore critico durante l'avvio del server: {e}", exc_info=True)
         sys.exit(1)
     finally:
+        shutdown_services()
         logging.info("Server NetMaster terminato.")
@@ -200,18 +200,23 @@ class SSLManager:
             logger.error(f"[SSL] Errore nella creazione del contesto SSL: {e}")
             raise SSLError(f"Errore nella creazione del contesto SSL: {e}")
     
-    def get_client_ssl_context(self, verify_cert=False):
+    def get_client_ssl_context(self, verify_cert=False, context_class=None):
         """
         Crea un contesto SSL per il client (agent).
         
         Args:
             verify_cert: Se verificare il certificato del server
+            context_class: Sottoclasse di ssl.SSLContext da istanziare (opzionale)
             
         Returns:
             ssl.SSLContext: Contesto SSL per il client
         """
         try:
-            context = ssl.create_default_context()
+            if context_class is None:
+                context = ssl.create_default_context()
+            else:
+                context = context_class(ssl.PROTOCOL_TLS_CLIENT)
+                context.load_default_certs()
             
             if not verify_cert:
                 # Per certificati auto-firmati in sviluppo
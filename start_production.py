@@ -13,8 +13,13 @@ import time
 from datetime import datetime
 from production_config import ProductionConfig, get_production_config
 
-# Importa il server integrato
-from server_integrated import app, database
+import database
+import ssl_manager
+import wsgi_server
+
+# L'applicazione viene importata dai worker dopo il fork (modalità prefork)
+# o direttamente in start_server (modalità threaded).
+APP_TARGET = 'server_integrated:app'
 
 class ProductionServer:
     """Gestore server produzione NetMaster."""
@@ -100,9 +105,15 @@ class ProductionServer:
         if missing_vars:
             raise ValueError(f"Variabili d'ambiente mancanti: {', '.join(missing_vars)}")
         
-        # Verifica database
-        if not database.test_connection():
-            raise ValueError("Connessione database fallita")
+        # Verifica database (connessione chiusa subito: i worker aprono le proprie dopo il fork)
+        try:
+            database.init_db()
+            with database.pooled_connection() as conn:
+                conn.execute("SELECT 1").fetchone()
+        except Exception as e:
+            raise ValueError(f"Connessione database fallita: {e}")
+        finally:
+            database.close_all_connections()
         
         # Verifica SSL se abilitato
         if self.config.USE_HTTPS:
@@ -119,43 +130,70 @@ class ProductionServer:
             self.logger.info("🚀 AVVIO NETMASTER MONITORING SUITE - PRODUZIONE")
             self.logger.info(f"Host: {self.config.HOST}:{self.config.PORT}")
             self.logger.info(f"HTTPS: {'Abilitato' if self.config.USE_HTTPS else 'Disabilitato'}")
+            self.logger.info(f"Modalità server: {self.config.SERVER_MODE}")
             self.logger.info(f"Database: {self.config.DATABASE_PATH}")
             
             # Validazione ambiente
             self.validate_environment()
             
             # Setup componenti produzione
-            self.setup_signal_handlers()
             self.running = True
             self.setup_database_backup()
             
-            # Configurazione Flask per produzione
-            app.config['DEBUG'] = False
-            app.config['TESTING'] = False
+            ssl_context = self.create_ssl_context() if self.config.USE_HTTPS else None
             
-            # Avvio server
-            if self.config.USE_HTTPS:
-                # Server HTTPS
-                ssl_context = (self.config.SSL_CERT_PATH, self.config.SSL_KEY_PATH)
-                app.run(
-                    host=self.config.HOST,
-                    port=self.config.PORT,
-                    ssl_context=ssl_context,
-                    threaded=True
-                )
+            if self.config.SERVER_MODE == 'prefork':
+                self.run_prefork(ssl_context)
+                self.shutdown()
             else:
-                # Server HTTP
-                app.run(
-                    host=self.config.HOST,
-                    port=self.config.PORT,
-                    threaded=True
-                )
+                self.setup_signal_handlers()
+                self.run_threaded(ssl_context)
                 
         except Exception as e:
             self.logger.error(f"Errore avvio server: {e}", exc_info=True)
             self.shutdown()
             raise
     
+    def create_ssl_context(self):
+        """Crea il contesto TLS lato server con i certificati configurati."""
+        ssl_mgr = ssl_manager.SSLManager(os.path.dirname(self.config.SSL_CERT_PATH) or '.')
+        ssl_mgr.cert_file = self.config.SSL_CERT_PATH
+        ssl_mgr.key_file = self.config.SSL_KEY_PATH
+        return ssl_mgr.get_ssl_context()
+    
+    def run_prefork(self, ssl_context):
+        """Avvia il server pre-fork (worker multi-processo con pool di thread)."""
+        if self.config.MAX_WORKERS > 1 and self.config.RATE_LIMIT_BACKEND == 'memory':
+            self.logger.warning("Rate limiting 'memory' con più worker: i limiti sono per processo. "
+                                "Usare NETMASTER_RATE_LIMIT_BACKEND=sqlite o redis.")
+        
+        # SIGTERM/SIGINT (arresto) e SIGHUP (reload) sono gestiti dal master
+        wsgi_server.PreforkServer(
+            APP_TARGET,
+            host=self.config.HOST,
+            port=self.config.PORT,
+            workers=self.config.MAX_WORKERS,
+            threads=self.config.WORKER_THREADS,
+            keepalive=self.config.KEEPALIVE_TIMEOUT,
+            ssl_context=ssl_context,
+            graceful_timeout=self.config.GRACEFUL_TIMEOUT
+        ).run()
+    
+    def run_threaded(self, ssl_context):
+        """Avvia il server di sviluppo Flask (un processo, un thread per richiesta)."""
+        app = wsgi_server.load_app(APP_TARGET)
+        
+        # Configurazione Flask per produzione
+        app.config['DEBUG'] = False
+        app.config['TESTING'] = False
+        
+        app.run(
+            host=self.config.HOST,
+            port=self.config.PORT,
+            ssl_context=ssl_context,
+            threaded=True
+        )
+    
     def shutdown(self):
         """Shutdown graceful del server."""
         self.logger.info("Avvio shutdown NetMaster...")
@@ -7,6 +7,10 @@ class NetMasterAPI {
     constructor() {
         this.baseUrl = window.location.origin;
         this.credentials = null;
+        // Ultimo ETag, corpo e cursore per URL: le richieste GET inviano
+        // If-None-Match e su 304 riusano i dati già ricevuti
+        this.etagCache = new Map();
+        this.etagCacheSize = 50;
         this.init();
     }
     
@@ -37,15 +41,33 @@ class NetMasterAPI {
     }
     
     async makeRequest(endpoint, options = {}) {
+        return (await this.makeRequestWithCursor(endpoint, options)).data;
+    }
+    
+    async makeRequestWithCursor(endpoint, options = {}) {
+        // Restituisce { data, cursor }: cursor è l'header X-NetMaster-Cursor
+        // (sequenza di scrittura del server) da passare come since nel delta
         const url = `${this.baseUrl}${endpoint}`;
         const config = {
             headers: this.getAuthHeaders(),
             ...options
         };
+        const method = (config.method || 'GET').toUpperCase();
+        const cached = method === 'GET' ? this.etagCache.get(url) : null;
+        if (cached) {
+            config.headers['If-None-Match'] = cached.etag;
+        }
         
         try {
             const response = await fetch(url, config);
             
+            if (response.status === 304 && cached) {
+                // Nessuna modifica: il server non ha inviato il corpo
+                this.etagCache.delete(url);
+                this.etagCache.set(url, cached);
+                return { data: cached.data, cursor: cached.cursor };
+            }
+            
             if (!response.ok) {
                 if (response.status === 401) {
                     throw new Error('Autenticazione fallita');
@@ -57,25 +79,45 @@ class NetMasterAPI {
             }
             
             const contentType = response.headers.get('content-type');
+            let data;
             if (contentType && contentType.includes('application/json')) {
-                return await response.json();
+                data = await response.json();
             } else {
-                return await response.text();
+                data = await response.text();
             }
+            
+            const header = response.headers.get('X-NetMaster-Cursor');
+            const cursor = header !== null ? Number(header) : null;
+            const etag = response.headers.get('ETag');
+            if (method === 'GET' && etag) {
+                this.rememberETag(url, etag, data, cursor);
+            }
+            return { data, cursor };
         } catch (error) {
             console.error(`[NetMaster API] Errore richiesta ${endpoint}:`, error);
             throw error;
         }
     }
     
+    rememberETag(url, etag, data, cursor = null) {
+        // Mappa in ordine di utilizzo: oltre il limite scarta la voce meno recente
+        this.etagCache.delete(url);
+        this.etagCache.set(url, { etag, data, cursor });
+        if (this.etagCache.size > this.etagCacheSize) {
+            this.etagCache.delete(this.etagCache.keys().next().value);
+        }
+    }
+    
     // === ENDPOINT ESISTENTI ===
     
-    async getHistory(startDate = null, endDate = null) {
+    async getHistory(startDate = null, endDate = null, since = null) {
         let endpoint = '/api/history';
         const params = new URLSearchParams();
         
         if (startDate) params.append('start', startDate);
         if (endDate) params.append('end', endDate);
+        // Modalità delta: solo i punti scritti dopo il cursore ricevuto
+        if (since !== null) params.append('since', since);
         
         if (params.toString()) {
             endpoint += `?${params.toString()}`;
@@ -112,8 +154,23 @@ class NetMasterAPI {
         return await this.makeRequest('/api/stats', { method: 'GET' });
     }
     
-    async getRealTimeData(timespan = '6h') {
-        return await this.makeRequest(`/api/realtime?timespan=${timespan}`, { method: 'GET' });
+    async getRealTimeData(timespan = '6h', since = null) {
+        return (await this.getRealTimeUpdate(timespan, since)).data;
+    }
+    
+    async getRealTimeUpdate(timespan = '6h', since = null) {
+        // Restituisce { data, cursor }; con since (cursore della risposta
+        // precedente) solo i punti scritti dopo, anche con timestamp vecchio
+        let endpoint = `/api/realtime?timespan=${timespan}`;
+        if (since !== null) endpoint += `&since=${since}`;
+        try {
+            return await this.makeRequestWithCursor(endpoint, { method: 'GET' });
+        } catch (error) {
+            // I dati mock sostituiscono l'intera finestra, non un delta
+            if (since !== null) throw error;
+            console.warn('[NetMaster API] Usando dati mock per real-time:', error.message);
+            return { data: await this.getMockRealTimeData(), cursor: null };
+        }
     }
     
     async getAgents() {
@@ -136,6 +193,91 @@ class NetMasterAPI {
         return await this.makeRequest('/api/health', { method: 'GET' });
     }
     
+    // === STREAM LIVE (Server-Sent Events) ===
+    
+    openStream(onEvent, onStatus) {
+        // EventSource non permette di inviare l'header Authorization:
+        // lo stream text/event-stream viene letto con fetch
+        const controller = new AbortController();
+        let lastEventId = null;
+        let retry = 3000;
+        let stopped = false;
+        
+        const connect = async () => {
+            const headers = this.getAuthHeaders();
+            if (lastEventId !== null) {
+                // Riprende dall'ultimo evento ricevuto
+                headers['Last-Event-ID'] = lastEventId;
+            }
+            try {
+                const response = await fetch(`${this.baseUrl}/api/stream`, {
+                    headers,
+                    signal: controller.signal
+                });
+                if (!response.ok || !response.body) {
+                    throw new Error(`Errore HTTP ${response.status}`);
+                }
+                onStatus(true);
+                
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                        const message = this.parseStreamMessage(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                        if (message.retry) retry = message.retry;
+                        if (message.id !== null) lastEventId = message.id;
+                        if (message.event && message.data !== null) {
+                            onEvent(message.event, message.data);
+                        }
+                    }
+                }
+            } catch (error) {
+                if (stopped) return;
+                console.warn('[NetMaster API] Stream interrotto:', error.message);
+                onStatus(false);
+            }
+            // Fine dello stream (durata massima o errore): nuova connessione dopo retry ms
+            if (!stopped) setTimeout(connect, retry);
+        };
+        
+        connect();
+        return {
+            close: () => {
+                stopped = true;
+                controller.abort();
+            }
+        };
+    }
+    
+    parseStreamMessage(block) {
+        const message = { id: null, event: null, data: null, retry: null };
+        const data = [];
+        block.split('\n').forEach(line => {
+            if (!line || line.startsWith(':')) return;  // commento keep-alive
+            const separator = line.indexOf(':');
+            const field = separator >= 0 ? line.slice(0, separator) : line;
+            const value = separator >= 0 ? line.slice(separator + 1).replace(/^ /, '') : '';
+            if (field === 'id') message.id = value;
+            else if (field === 'event') message.event = value;
+            else if (field === 'data') data.push(value);
+            else if (field === 'retry') message.retry = parseInt(value) || null;
+        });
+        if (data.length) {
+            try {
+                message.data = JSON.parse(data.join('\n'));
+            } catch (error) {
+                console.warn('[NetMaster API] Evento stream non valido:', error.message);
+            }
+        }
+        return message;
+    }
+    
     // === METODI DI UTILITÀ ===
     
     async testConnection() {
@@ -312,10 +454,12 @@ class NetMasterAPI {
         }
     }
     
-    async getRealTimeDataWithFallback(timespan = '6h') {
+    async getRealTimeDataWithFallback(timespan = '6h', since = null) {
         try {
-            return await this.getRealTimeData(timespan);
+            return await this.getRealTimeData(timespan, since);
         } catch (error) {
+            // I dati mock sostituiscono l'intera finestra, non un delta
+            if (since !== null) throw error;
             console.warn('[NetMaster API] Usando dati mock per real-time:', error.message);
             return await this.getMockRealTimeData();
         }
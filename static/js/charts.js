@@ -277,7 +277,8 @@ class NetMasterCharts {
         // Converte i dati nel formato Chart.js
         const chartData = data.map(point => ({
             x: new Date(point.timestamp),
-            y: point[metric]
+            y: point[metric],
+            agent: point.agent_ip
         }));
         
         chart.data.datasets[0].data = chartData;
@@ -300,6 +301,65 @@ class NetMasterCharts {
         chart.update();
     }
     
+    // === AGGIORNAMENTO INCREMENTALE (modalità delta) ===
+    
+    appendChart(chartId, data, windowMs = null) {
+        const chart = this.charts[chartId];
+        if (!chart) {
+            console.warn(`[Charts] Grafico ${chartId} non trovato`);
+            return;
+        }
+        
+        const chartType = this.chartConfigs[chartId];
+        const metrics = chartType === 'history' ? ['cpu', 'memory', 'disk'] : [chartType];
+        
+        metrics.forEach((metric, index) => {
+            const newPoints = data.map(point => ({
+                x: new Date(point.timestamp),
+                y: point[metric + '_percent'] ?? point[metric] ?? 0,
+                agent: point.agent_ip
+            }));
+            this.mergePoints(chart.data.datasets[index], newPoints, windowMs);
+        });
+        
+        chart.update('none');
+    }
+    
+    mergePoints(dataset, newPoints, windowMs) {
+        // Delta e stream live arrivano in ordine di scrittura, non di tempo
+        // (backfill, più worker, bucket aggregati aggiornati): ogni punto va
+        // nella sua posizione e sostituisce quello dello stesso agent e istante
+        const points = dataset.data;
+        newPoints.forEach(point => {
+            const time = point.x.getTime();
+            let index = points.length;
+            while (index > 0 && points[index - 1].x.getTime() > time) {
+                index--;
+            }
+            let same = index - 1;
+            while (same >= 0 && points[same].x.getTime() === time && points[same].agent !== point.agent) {
+                same--;
+            }
+            if (same >= 0 && points[same].x.getTime() === time) {
+                points[same] = point;
+            } else {
+                points.splice(index, 0, point);
+            }
+        });
+        this.trimPoints(points, windowMs);
+    }
+    
+    trimPoints(points, windowMs) {
+        if (!windowMs) return;
+        // Scarta i punti usciti dalla finestra visualizzata
+        const cutoff = Date.now() - windowMs;
+        let drop = 0;
+        while (drop < points.length && points[drop].x.getTime() < cutoff) {
+            drop++;
+        }
+        if (drop) points.splice(0, drop);
+    }
+    
     updateDoughnutChart(chartId, percentage) {
         const chart = this.charts[chartId];
         if (!chart) return;
@@ -430,6 +490,13 @@ class NetMasterCharts {
         this.updateChart('memoryChart', data);
     }
     
+    appendRealTimeData(data, timespan = '6h') {
+        // Fonde i punti nuovi o aggiornati (delta since=<cursore> o stream live)
+        const hours = { '1h': 1, '6h': 6, '24h': 24 }[timespan] || 6;
+        this.appendChart('cpuChart', data, hours * 3600 * 1000);
+        this.appendChart('memoryChart', data, hours * 3600 * 1000);
+    }
+    
     updateHistoryChartData(data) {
         // Aggiorna il grafico storico
         this.updateChart('historyChart', data);
@@ -472,6 +539,10 @@ document.addEventListener('DOMContentLoaded', () => {
     setTimeout(() => {
         window.NetMasterCharts.initializeCharts();
         window.NetMasterCharts.setupChartControls();
+        // Con lo stream live non c'è un refresh periodico che riempia i grafici
+        if (window.dashboard) {
+            window.dashboard.loadChartData('cpuChart', window.dashboard.realtimeTimespan);
+        }
     }, 1000);
 });
 
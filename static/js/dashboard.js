@@ -10,6 +10,17 @@ class NetMasterDashboard {
         this.isConnected = false;
         this.currentSection = 'overview';
         this.charts = {};
+        // Cursore (X-NetMaster-Cursor) dell'ultima risposta real-time: i refresh
+        // successivi chiedono solo i punti scritti dopo (since=<cursore>)
+        this.realtimeTimespan = '6h';
+        this.realtimeCursor = null;
+        // Stream live (/api/stream): con lo stream connesso il polling è sospeso
+        this.stream = null;
+        this.streamConnected = false;
+        this.agents = [];
+        this.pendingSamples = [];
+        this.renderScheduled = false;
+        this.agentsStale = false;
         
         this.init();
     }
@@ -19,7 +30,8 @@ class NetMasterDashboard {
         this.setupNavigation();
         this.setupRefreshControls();
         this.startAutoRefresh();
-        this.loadInitialData();
+        // Lo stream parte dopo il caricamento iniziale e sostituisce il polling
+        this.loadInitialData().then(() => this.startLiveStream());
         
         console.log('[NetMaster] Dashboard inizializzata');
     }
@@ -151,12 +163,14 @@ class NetMasterDashboard {
             const stats = await NetMasterAPI.getStats();
             this.updateStatsCards(stats);
             
-            // Carica dati real-time per i grafici
-            const realtimeData = await NetMasterAPI.getRealTimeData();
-            this.updateCharts(realtimeData);
+            // Carica dati real-time per i grafici (solo i nuovi punti dopo il primo caricamento)
+            const since = this.realtimeCursor;
+            const update = await NetMasterAPI.getRealTimeUpdate(this.realtimeTimespan, since);
+            this.updateCharts(update.data, since !== null, update.cursor);
             
             // Carica lista agent
             const agents = await NetMasterAPI.getAgents();
+            this.agents = agents;
             this.updateAgentsTable(agents);
             
         } catch (error) {
@@ -168,6 +182,7 @@ class NetMasterDashboard {
     async loadAgentsData() {
         try {
             const agents = await NetMasterAPI.getAgents();
+            this.agents = agents;
             this.updateAgentsGrid(agents);
         } catch (error) {
             console.error('[NetMaster] Errore caricamento agent:', error);
@@ -256,6 +271,40 @@ class NetMasterDashboard {
         document.getElementById('agentCount').textContent = stats.total_agents || 0;
     }
     
+    updateCharts(data, isDelta = false, cursor = null) {
+        const charts = window.NetMasterCharts;
+        // I grafici vengono creati dopo il caricamento della pagina: finché
+        // non esistono il cursore non avanza e il prossimo refresh è completo
+        if (!charts || !charts.charts['cpuChart'] || !Array.isArray(data)) return;
+        
+        if (isDelta) {
+            charts.appendRealTimeData(data, this.realtimeTimespan);
+        } else {
+            charts.updateRealTimeCharts(data);
+        }
+        
+        // Senza cursore (es. dati mock) il prossimo refresh ricarica la finestra
+        this.realtimeCursor = cursor;
+    }
+    
+    async loadChartData(chartId, timespan) {
+        // Cambio di intervallo: ricarica l'intera finestra
+        this.realtimeTimespan = timespan;
+        this.realtimeCursor = null;
+        try {
+            const update = await NetMasterAPI.getRealTimeUpdate(timespan);
+            this.updateCharts(update.data, false, update.cursor);
+        } catch (error) {
+            console.error(`[NetMaster] Errore caricamento grafico ${chartId}:`, error);
+        }
+    }
+    
+    updateHistoryChart(data) {
+        if (window.NetMasterCharts && Array.isArray(data)) {
+            window.NetMasterCharts.updateHistoryChartData(data);
+        }
+    }
+    
     updateProgressBar(elementId, percentage) {
         const progressBar = document.getElementById(elementId);
         progressBar.style.width = `${Math.min(percentage, 100)}%`;
@@ -476,11 +525,151 @@ class NetMasterDashboard {
         }, this.refreshInterval);
     }
     
-    restartAutoRefresh() {
+    stopAutoRefresh() {
         if (this.refreshTimer) {
             clearInterval(this.refreshTimer);
+            this.refreshTimer = null;
         }
-        this.startAutoRefresh();
+    }
+    
+    restartAutoRefresh() {
+        this.stopAutoRefresh();
+        // Con lo stream connesso gli aggiornamenti arrivano in push
+        if (!this.streamConnected) {
+            this.startAutoRefresh();
+        }
+    }
+    
+    // === STREAM LIVE ===
+    
+    startLiveStream() {
+        if (!NetMasterAPI.openStream) return;
+        this.stream = NetMasterAPI.openStream(
+            (event, data) => this.handleStreamEvent(event, data),
+            connected => this.onStreamStatus(connected)
+        );
+    }
+    
+    onStreamStatus(connected) {
+        const wasConnected = this.streamConnected;
+        this.streamConnected = connected;
+        if (connected) {
+            // Stream attivo: niente polling
+            this.stopAutoRefresh();
+            this.updateConnectionStatus(true);
+        } else if (!this.refreshTimer) {
+            // Stream non disponibile (es. troppi client): si torna al polling
+            this.startAutoRefresh();
+            if (wasConnected) this.refreshData();
+        }
+    }
+    
+    handleStreamEvent(event, data) {
+        switch (event) {
+            case 'hello':
+                // Cursore sconosciuto al server (riavvio): ricarica via REST
+                if (data.resync) this.resyncData();
+                break;
+            case 'resync':
+                // Il server ha coalescato eventi persi: ricarica l'intera finestra
+                this.resyncData();
+                break;
+            case 'sample':
+                this.applySample(data);
+                break;
+            case 'agent':
+                this.applyAgentStatus(data);
+                break;
+            case 'alert':
+                this.showToast(`${data.agent_ip}: ${data.metric.toUpperCase()} al ${data.value.toFixed(1)}% ` +
+                               `(soglia: ${data.threshold}%)`, 'warning');
+                if (this.currentSection === 'alerts') this.loadAlertsData();
+                break;
+        }
+    }
+    
+    resyncData() {
+        this.realtimeCursor = null;
+        this.refreshData();
+    }
+    
+    findAgent(agentIp) {
+        return this.agents.find(agent => agent.ip_address === agentIp);
+    }
+    
+    applySample(sample) {
+        this.pendingSamples.push(sample);
+        const agent = this.findAgent(sample.agent_ip);
+        if (agent) {
+            agent.cpu_percent = sample.cpu;
+            agent.memory_percent = sample.memory;
+            agent.disk_percent = sample.disk;
+            agent.last_update = sample.timestamp / 1000;
+        }
+        this.scheduleRender(!agent);
+    }
+    
+    applyAgentStatus(update) {
+        const agent = this.findAgent(update.agent_ip);
+        if (agent) {
+            agent.status = update.status;
+            agent.last_update = update.last_update;
+        }
+        this.scheduleRender(!agent);
+    }
+    
+    scheduleRender(unknownAgent = false) {
+        // Nuovo agent non ancora in lista: i suoi dati statici arrivano via REST
+        if (unknownAgent) this.agentsStale = true;
+        if (this.renderScheduled) return;
+        this.renderScheduled = true;
+        // Un solo aggiornamento del DOM per blocco di eventi ricevuto
+        setTimeout(() => this.renderLiveData(), 0);
+    }
+    
+    async renderLiveData() {
+        this.renderScheduled = false;
+        
+        const samples = this.pendingSamples;
+        this.pendingSamples = [];
+        const charts = window.NetMasterCharts;
+        // Il cursore resta quello del REST: al ritorno al polling il delta
+        // ripete i campioni già ricevuti dallo stream, che vengono sostituiti
+        if (samples.length && charts && charts.charts['cpuChart'] && this.realtimeCursor !== null) {
+            charts.appendRealTimeData(samples, this.realtimeTimespan);
+        }
+        
+        if (this.agentsStale) {
+            this.agentsStale = false;
+            try {
+                this.agents = await NetMasterAPI.getAgents();
+            } catch (error) {
+                console.error('[NetMaster] Errore caricamento agent:', error);
+            }
+        }
+        
+        this.updateAgentsTable(this.agents);
+        this.updateStatsCards(this.computeStats(this.agents));
+        if (this.currentSection === 'agents') {
+            this.updateAgentsGrid(this.agents);
+        }
+        this.updateLastUpdateTime();
+    }
+    
+    computeStats(agents) {
+        // Stesso calcolo di /api/stats: agent con un campione negli ultimi 5 minuti
+        const cutoff = Date.now() / 1000 - 300;
+        const recent = agents.filter(agent => agent.last_update > cutoff);
+        const average = field => recent.length ?
+            recent.reduce((sum, agent) => sum + (agent[field] || 0), 0) / recent.length : 0;
+        return {
+            total_agents: recent.length,
+            avg_cpu: average('cpu_percent'),
+            avg_memory: average('memory_percent'),
+            avg_disk: average('disk_percent'),
+            active_alerts: recent.filter(agent =>
+                agent.cpu_percent > 75 || agent.memory_percent > 85 || agent.disk_percent > 90).length
+        };
     }
     
     async refreshData() {
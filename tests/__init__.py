@@ -5,7 +5,14 @@ Configurazione e utilities per i test automatizzati
 
 import os
 import sys
+import time
 import logging
+import threading
+import socketserver
+
+# I test simulano più agent e dashboard dal loopback come dietro un reverse proxy
+# fidato: X-Forwarded-For distingue i loro limiti di richieste
+os.environ.setdefault('NETMASTER_TRUSTED_PROXIES', '127.0.0.1')
 
 # Configurazione logging per test
 logging.basicConfig(
@@ -60,4 +67,176 @@ def cleanup_test_data():
     except Exception as e:
         print(f"[WARNING] Errore pulizia dati test: {e}")
 
+def wsgi_pid_app(environ, start_response):
+    """Applicazione WSGI minima per i test del server: risponde con il pid del worker."""
+    body = str(os.getpid()).encode()
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+    return [body]
+
+class LocalSMTPServer:
+    """
+    Server SMTP minimale in locale per i test delle notifiche.
+    Accetta qualsiasi autenticazione, registra i messaggi ricevuti e può
+    rifiutare i prossimi `fail_next` invii con un errore temporaneo (451).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+        self._lock = threading.Lock()
+        owner = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write((line + "\r\n").encode('utf-8'))
+
+            def handle(self):
+                with owner._lock:
+                    owner.connections += 1
+                self.reply("220 localhost NetMaster test SMTP")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode('utf-8', 'replace').strip()
+                    verb = command.split(' ', 1)[0].upper()
+                    if verb == 'EHLO':
+                        self.reply("250-localhost")
+                        self.reply("250 AUTH PLAIN LOGIN")
+                    elif verb == 'AUTH':
+                        if command.upper().startswith('AUTH LOGIN'):
+                            self.reply("334 VXNlcm5hbWU6")
+                            self.rfile.readline()
+                            self.reply("334 UGFzc3dvcmQ6")
+                            self.rfile.readline()
+                        self.reply("235 Authentication successful")
+                    elif verb in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                        self.reply("250 OK")
+                    elif verb == 'DATA':
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        while True:
+                            chunk = self.rfile.readline()
+                            if not chunk or chunk in (b".\r\n", b".\n"):
+                                break
+                            data.append(chunk.decode('utf-8', 'replace'))
+                        with owner._lock:
+                            failing = owner.fail_next > 0
+                            if failing:
+                                owner.fail_next -= 1
+                            else:
+                                owner.messages.append(''.join(data))
+                        self.reply("451 Temporary failure" if failing else "250 Message accepted")
+                    elif verb == 'QUIT':
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server((host, port), Handler)
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def config(self, recipients=('ops@example.com',)):
+        """Configurazione email da passare al dispatcher delle notifiche."""
+        return {
+            'smtp_server': self.host,
+            'smtp_port': self.port,
+            'username': 'netmaster',
+            'password': 'test',
+            'recipients': list(recipients),
+        }
+
+class LocalRedisServer:
+    """
+    Server minimale compatibile con il protocollo RESP di Redis per i test del
+    rate limiting condiviso: supporta PING, AUTH, SELECT, GET, INCRBY, DECRBY,
+    EXPIRE e conta i comandi ricevuti.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.data = {}
+        self.expires = {}
+        self.commands = 0
+        self._lock = threading.Lock()
+        owner = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def read_command(self):
+                header = self.rfile.readline()
+                if not header:
+                    return None
+                args = []
+                for _ in range(int(header[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2].decode('utf-8'))
+                return args
+
+            def handle(self):
+                while True:
+                    args = self.read_command()
+                    if args is None:
+                        return
+                    self.wfile.write(owner.execute(args))
+
+        class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server((host, port), Handler)
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+
+    def execute(self, args):
+        command = args[0].upper()
+        with self._lock:
+            self.commands += 1
+            key = args[1] if len(args) > 1 else None
+            if key in self.expires and self.expires[key] <= time.time():
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            if command in ('PING', 'AUTH', 'SELECT'):
+                return b"+OK\r\n" if command != 'PING' else b"+PONG\r\n"
+            if command == 'GET':
+                value = self.data.get(key)
+                if value is None:
+                    return b"$-1\r\n"
+                data = str(value).encode()
+                return b"$%d\r\n%s\r\n" % (len(data), data)
+            if command in ('INCRBY', 'DECRBY'):
+                amount = int(args[2]) * (1 if command == 'INCRBY' else -1)
+                self.data[key] = int(self.data.get(key, 0)) + amount
+                return b":%d\r\n" % self.data[key]
+            if command == 'EXPIRE':
+                if key not in self.data:
+                    return b":0\r\n"
+                self.expires[key] = time.time() + int(args[2])
+                return b":1\r\n"
+        return b"-ERR unknown command\r\n"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}/0"
+
 print("[INIT] NetMaster Test Suite inizializzata")
@@ -5,10 +5,19 @@ Test automatizzati per le API del server NetMaster
 """
 
 import unittest
+import logging
+import gzip
 import json
 import time
+import tempfile
 import requests
+import base64
+import signal
+import socket
+import asyncio
 import threading
+import subprocess
+import http.client
 from unittest.mock import patch, MagicMock
 import sys
 import os
@@ -18,7 +27,24 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import server_integrated
 import database
+import ingest
+import rollup
+import retention
+import notifier
 import credentials
+import security_validator
+import rate_limit_backends
+import wsgi_server
+import async_ingest
+import agent_buffer
+import agent_transport
+import agent_sampler
+import ssl_manager
+import wire_format
+import live_stream
+from response_cache import ResponseCache
+from datetime import datetime, timedelta
+from tests import LocalSMTPServer, LocalRedisServer, wsgi_pid_app
 
 class TestNetMasterAPI(unittest.TestCase):
     """Test suite per le API del server NetMaster"""
@@ -308,6 +334,443 @@ class TestNetMasterAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         
         print("[OK] Validazione JSON funziona correttamente")
+        
+    def test_13_report_ingest(self):
+        """Test endpoint /api/report con coda di ingestione"""
+        print("\n[TEST] Ingestione Report Agent")
+        
+        report = {
+            'cpu_usage': 12.5,
+            'memory': 40.0,
+            'disk': 55.0,
+            'system': 'Linux',
+            'node': 'TEST-INGEST',
+            'release': '6.0',
+            'version': '#1 SMP'
+        }
+        written_before = server_integrated.ingest_queue.stats()['written']
+        
+        response = requests.post(f'{self.base_url}/api/report',
+                                json=report,
+                                auth=self.auth,
+                                headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        
+        # Campo mancante: rifiutato prima dell'accodamento
+        incomplete = dict(report)
+        del incomplete['disk']
+        response = requests.post(f'{self.base_url}/api/report',
+                                json=incomplete,
+                                auth=self.auth,
+                                headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        
+        self.assertTrue(server_integrated.ingest_queue.flush(timeout=5))
+        self.assertEqual(server_integrated.ingest_queue.stats()['written'], written_before + 1)
+        
+        print("[OK] Report accodato e salvato dal writer")
+        
+    def test_14_realtime_tiers(self):
+        """Test scelta automatica del livello per /api/realtime"""
+        print("\n[TEST] Livelli Dati Real-time")
+        
+        response = requests.get(f'{self.base_url}/api/realtime',
+                               params={'timespan': '24h', 'max_points': 1},
+                               auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('X-NetMaster-Tier'), '1h')
+        
+        response = requests.get(f'{self.base_url}/api/realtime',
+                               params={'timespan': '1h', 'max_points': 1000000},
+                               auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('X-NetMaster-Tier'), 'raw')
+        
+        print("[OK] Livelli real-time corretti")
+        
+    def test_15_report_batch(self):
+        """Test endpoint /api/report/batch con gzip e correzione dell'orologio"""
+        print("\n[TEST] Report Batch")
+        
+        # Orologio dell'agent avanti di un'ora rispetto al server
+        skew = timedelta(hours=1)
+        agent_now = datetime.now() + skew
+        report = {
+            'cpu_usage': 99.0,
+            'memory': 40.0,
+            'disk': 55.0,
+            'system': 'Linux',
+            'node': 'TEST-BATCH',
+            'release': '6.0',
+            'version': '#1 SMP'
+        }
+        samples = [dict(report, timestamp=(agent_now - timedelta(minutes=30 - i)).isoformat())
+                   for i in range(3)]
+        samples.append(dict(report, cpu_usage=150, timestamp=agent_now.isoformat()))
+        samples.append(dict(report))
+        body = gzip.compress(json.dumps({'sent_at': agent_now.isoformat(), 'samples': samples}).encode())
+        
+        with patch.object(server_integrated, 'check_thresholds_and_notify') as check:
+            response = requests.post(f'{self.base_url}/api/report/batch', data=body, auth=self.auth,
+                                    headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+            self.assertEqual(response.status_code, 200)
+            result = response.json()
+            self.assertEqual(result['accepted'], 3)
+            self.assertEqual([item['index'] for item in result['rejected']], [3, 4])
+            self.assertTrue(server_integrated.ingest_queue.flush(timeout=5))
+            # Campioni di mezz'ora fa: salvati senza controllo soglie
+            check.assert_not_called()
+        
+        timestamps = []
+        start = (datetime.now() - timedelta(hours=2)).isoformat()
+        with database.pooled_connection() as conn:
+            for table in database.get_partition_tables(start, datetime.now().isoformat(), conn):
+                timestamps += [row[0] for row in conn.execute(
+                    f"SELECT timestamp FROM {table} WHERE agent_name = 'TEST-BATCH'")]
+                conn.execute(f"DELETE FROM {table} WHERE agent_name = 'TEST-BATCH'")
+        timestamps.sort()
+        self.assertEqual(len(timestamps), 3)
+        first = datetime.fromisoformat(timestamps[0])
+        self.assertLess(abs((first - (datetime.now() - timedelta(minutes=30))).total_seconds()), 60)
+        
+        # Nessun campione valido: rifiutato
+        response = requests.post(f'{self.base_url}/api/report/batch', json=[{'cpu_usage': 1}],
+                                auth=self.auth)
+        self.assertEqual(response.status_code, 400)
+        
+        print("[OK] Batch accodato con timestamp corretti")
+        
+    def test_16_compact_reports(self):
+        """Test registrazione host e report compatti (frame binario e JSON compresso)"""
+        print("\n[TEST] Report Compatti")
+        
+        facts = {'system': 'Linux', 'node': 'TEST-COMPACT', 'release': '6.0', 'version': '#1 SMP'}
+        response = requests.post(f'{self.base_url}/api/agents/register', json=facts, auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        agent_id = response.json()['agent_id']
+        # Registrazione idempotente
+        response = requests.post(f'{self.base_url}/api/agents/register', json=facts, auth=self.auth)
+        self.assertEqual(response.json()['agent_id'], agent_id)
+        
+        metrics = {'cpu_usage': 12.3, 'memory': 45.6, 'disk': 78.9}
+        frame = wire_format.encode_frame(agent_id, metrics)
+        self.assertEqual(len(frame), wire_format.FRAME.size)
+        self.assertEqual(wire_format.decode_frame(frame), dict(metrics, agent_id=agent_id))
+        written_before = server_integrated.ingest_queue.stats()['written']
+        
+        response = requests.post(f'{self.base_url}/api/report', data=frame, auth=self.auth,
+                                headers={'Content-Type': wire_format.CONTENT_TYPE_FRAME})
+        self.assertEqual(response.status_code, 200)
+        
+        compact = json.dumps(dict(metrics, agent_id=agent_id)).encode()
+        response = requests.post(f'{self.base_url}/api/report', data=wire_format.compress(compact, 'deflate'),
+                                auth=self.auth, headers={'Content-Type': 'application/json',
+                                                         'Content-Encoding': 'deflate'})
+        self.assertEqual(response.status_code, 200)
+        
+        # agent_id sconosciuto: l'agent deve registrarsi di nuovo
+        response = requests.post(f'{self.base_url}/api/report', auth=self.auth,
+                                data=wire_format.encode_frame(2 ** 31, metrics),
+                                headers={'Content-Type': wire_format.CONTENT_TYPE_FRAME})
+        self.assertEqual(response.status_code, 409)
+        response = requests.post(f'{self.base_url}/api/report', data=b'NM', auth=self.auth,
+                                headers={'Content-Type': wire_format.CONTENT_TYPE_FRAME})
+        self.assertEqual(response.status_code, 400)
+        
+        self.assertTrue(server_integrated.ingest_queue.flush(timeout=5))
+        self.assertEqual(server_integrated.ingest_queue.stats()['written'], written_before + 2)
+        with database.pooled_connection() as conn:
+            row = conn.execute("SELECT node, release, cpu_usage FROM agent_latest WHERE agent_name = 'TEST-COMPACT'").fetchone()
+            self.assertEqual(tuple(row), ('TEST-COMPACT', '6.0', 12.3))
+            for table in database.get_partition_tables(datetime.now().date().isoformat(), None, conn):
+                conn.execute(f"DELETE FROM {table} WHERE agent_name = 'TEST-COMPACT'")
+            conn.execute("DELETE FROM agent_hosts WHERE node = 'TEST-COMPACT'")
+        
+        print(f"[OK] Frame binario di {len(frame)} byte accettato (agent_id={agent_id})")
+
+    def test_17_response_cache(self):
+        """Test cache delle risposte della dashboard con ETag e invalidazione all'ingestione"""
+        print("\n[TEST] Cache delle Risposte")
+        
+        headers = {'X-Forwarded-For': '10.17.0.1'}
+        cache = server_integrated.response_cache
+        with patch.object(cache, 'min_age', 0):
+            first = requests.get(f'{self.base_url}/api/agents', auth=self.auth, headers=headers)
+            second = requests.get(f'{self.base_url}/api/agents', auth=self.auth, headers=headers)
+            self.assertEqual(second.status_code, 200)
+            self.assertEqual(second.headers['X-NetMaster-Cache'], 'HIT')
+            self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+            self.assertEqual(second.content, first.content)
+            
+            # Parametri diversi: risposte distinte, header dell'endpoint conservati
+            response = requests.get(f'{self.base_url}/api/realtime?timespan=24h', auth=self.auth, headers=headers)
+            self.assertEqual(response.headers['X-NetMaster-Cache'], 'MISS')
+            self.assertIn('X-NetMaster-Tier', response.headers)
+            response = requests.get(f'{self.base_url}/api/realtime?timespan=24h', auth=self.auth, headers=headers)
+            self.assertEqual(response.headers['X-NetMaster-Cache'], 'HIT')
+            self.assertIn('X-NetMaster-Tier', response.headers)
+            
+            # Un nuovo campione invalida le risposte in cache
+            report = {'cpu_usage': 17.0, 'memory': 40.0, 'disk': 55.0, 'system': 'Linux',
+                      'node': 'TEST-CACHE', 'release': '6.0', 'version': '#1 SMP'}
+            response = requests.post(f'{self.base_url}/api/report', json=report, auth=self.auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(server_integrated.ingest_queue.flush(timeout=5))
+            third = requests.get(f'{self.base_url}/api/agents', auth=self.auth, headers=headers)
+            self.assertEqual(third.headers['X-NetMaster-Cache'], 'MISS')
+            self.assertIn('TEST-CACHE', third.text)
+            self.assertNotEqual(third.headers['ETag'], first.headers['ETag'])
+        
+        # Richieste concorrenti sulla stessa chiave: una sola esegue la query
+        local = ResponseCache(ttl=5, min_age=1)
+        calls, release = [], threading.Event()
+        def compute():
+            calls.append(1)
+            release.wait(2)
+            return b'[]', 200, {}
+        threads = [threading.Thread(target=local.get_or_compute, args=('/api/stats?', compute)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(local.stats()['hits'] + local.stats()['misses'], 4)
+        
+        with database.pooled_connection() as conn:
+            for table in database.get_partition_tables(datetime.now().date().isoformat(), None, conn):
+                conn.execute(f"DELETE FROM {table} WHERE agent_name = 'TEST-CACHE'")
+        
+        print(f"[OK] Cache: {cache.stats()}")
+
+    def test_18_conditional_get_and_delta(self):
+        """Test GET condizionale (ETag/304) e modalità delta since=<cursore>"""
+        print("\n[TEST] GET Condizionale e Delta")
+
+        headers = {'X-Forwarded-For': '10.18.0.1'}
+        for endpoint in ('/api/stats', '/api/agents', '/api/health', '/api/thresholds'):
+            response = requests.get(f'{self.base_url}{endpoint}', auth=self.auth, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('ETag', response.headers)
+
+        response = requests.get(f'{self.base_url}/api/agents', auth=self.auth, headers=headers)
+        etag = response.headers['ETag']
+        conditional = requests.get(f'{self.base_url}/api/agents', auth=self.auth,
+                                   headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(conditional.status_code, 304)
+        self.assertEqual(conditional.content, b'')
+        self.assertEqual(conditional.headers['ETag'], etag)
+
+        # Delta: dopo l'ultimo punto ricevuto arrivano solo i campioni nuovi
+        report = {'cpu_usage': 18.0, 'memory': 40.0, 'disk': 55.0, 'system': 'Linux',
+                  'node': 'TEST-DELTA', 'release': '6.0', 'version': '#1 SMP'}
+        self.assertEqual(requests.post(f'{self.base_url}/api/report', json=report,
+                                       auth=self.auth).status_code, 200)
+        self.assertTrue(server_integrated.ingest_queue.flush(timeout=5))
+        full = requests.get(f'{self.base_url}/api/realtime?timespan=1h&max_points=100000',
+                            auth=self.auth, headers=headers)
+        self.assertEqual(full.headers['X-NetMaster-Tier'], 'raw')
+        self.assertEqual(full.headers['X-NetMaster-Delta'], '0')
+        cursor = full.headers['X-NetMaster-Cursor']
+        realtime = f'{self.base_url}/api/realtime?timespan=1h&max_points=100000'
+
+        delta = requests.get(f'{realtime}&since={cursor}', auth=self.auth, headers=headers)
+        self.assertEqual(delta.status_code, 200)
+        self.assertEqual(delta.headers['X-NetMaster-Delta'], '1')
+        self.assertEqual(delta.json(), [])
+
+        report['cpu_usage'] = 18.5
+        requests.post(f'{self.base_url}/api/report', json=report, auth=self.auth)
+        self.assertTrue(server_integrated.ingest_queue.flush(timeout=5))
+        with patch.object(server_integrated.response_cache, 'min_age', 0):
+            delta = requests.get(f'{realtime}&since={cursor}', auth=self.auth, headers=headers)
+        self.assertEqual([point['cpu'] for point in delta.json()], [18.5])
+
+        history = requests.get(f'{self.base_url}/api/history?since={cursor}', auth=self.auth, headers=headers)
+        self.assertEqual([record['cpu_percent'] for record in history.json()], [18.5])
+        for invalid in ('ieri', '-1'):
+            response = requests.get(f'{self.base_url}/api/history?since={invalid}', auth=self.auth, headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+        # Riga con timestamp più vecchio dell'ultimo punto, scritta dopo il
+        # delta (backfill o altro worker): arriva comunque al poll successivo
+        cursor = delta.headers['X-NetMaster-Cursor']
+        late = (datetime.now() - timedelta(minutes=30)).isoformat()
+        self.assertLess(late, datetime.fromtimestamp(delta.json()[0]['timestamp'] / 1000).isoformat())
+        self.assertTrue(database.save_system_data_batch(
+            [database.build_system_data_row(dict(report, cpu_usage=18.25), '10.18.0.2', late)]))
+        backfill = requests.get(f'{realtime}&since={cursor}', auth=self.auth, headers=headers)
+        self.assertEqual([(point['cpu'], point['agent_ip']) for point in backfill.json()],
+                         [(18.25, '10.18.0.2')])
+        self.assertGreater(int(backfill.headers['X-NetMaster-Cursor']), int(cursor))
+        history = requests.get(f'{self.base_url}/api/history?since={cursor}', auth=self.auth, headers=headers)
+        self.assertEqual([record['cpu_percent'] for record in history.json()], [18.25])
+
+        with database.pooled_connection() as conn:
+            for table in database.get_partition_tables(late, None, conn):
+                conn.execute(f"DELETE FROM {table} WHERE agent_name = 'TEST-DELTA'")
+            conn.execute("DELETE FROM agent_latest WHERE agent_ip = '10.18.0.2'")
+            conn.execute("DELETE FROM metrics_rollup WHERE agent_ip = '10.18.0.2'")
+
+        print(f"[OK] 304 e delta: {len(full.json())} punti completi, 1 nel delta")
+
+    def test_19_live_stream(self):
+        """Test stream SSE della dashboard alimentato dall'ingestione"""
+        print("\n[TEST] Stream Live")
+
+        headers = {'X-Forwarded-For': '10.19.0.1'}
+        stream = requests.get(f'{self.base_url}/api/stream', auth=self.auth, headers=headers,
+                              stream=True, timeout=10)
+        self.assertEqual(stream.status_code, 200)
+        self.assertTrue(stream.headers['Content-Type'].startswith('text/event-stream'))
+        self.assertNotIn('ETag', stream.headers)
+        lines = stream.iter_lines(decode_unicode=True)
+
+        def next_event(name):
+            event = None
+            for line in lines:
+                if line.startswith('event: '):
+                    event = line[7:]
+                elif line.startswith('data: ') and event == name:
+                    return json.loads(line[6:])
+            return None
+
+        self.assertIsNotNone(next_event('hello'))
+        report = {'cpu_usage': 19.0, 'memory': 40.0, 'disk': 55.0, 'system': 'Linux',
+                  'node': 'TEST-STREAM', 'release': '6.0', 'version': '#1 SMP'}
+        start = time.monotonic()
+        self.assertEqual(requests.post(f'{self.base_url}/api/report', json=report,
+                                       auth=self.auth).status_code, 200)
+        sample = next_event('sample')
+        while sample is not None and sample['hostname'] != 'TEST-STREAM':
+            sample = next_event('sample')
+        self.assertEqual(sample['cpu'], 19.0)
+        self.assertLess(time.monotonic() - start, 1.0)
+        stream.close()
+
+        # Coalescenza per chiave e stato completo quando il registro non basta
+        hub = live_stream.StreamHub(backlog=4, coalesce=0)
+        now = datetime.now()
+        rows = [((now + timedelta(seconds=i)).isoformat(), '10.0.0.1', 'A', float(i), 0.0, 0.0)
+                for i in range(3)]
+        hub.publish_rows(rows)
+        cursor, events, overflow = hub.changes(0)
+        self.assertFalse(overflow)
+        self.assertEqual([(event, payload.get('cpu')) for event, payload in events],
+                         [('agent', None), ('sample', 2.0)])
+        hub.publish_rows(rows)  # campioni già pubblicati: ignorati
+        self.assertEqual(hub.changes(cursor)[1], [])
+        hub.publish_rows([((now + timedelta(seconds=10 + i)).isoformat(), f'10.0.1.{i}', 'B', 1.0, 0.0, 0.0)
+                          for i in range(5)])
+        _, events, overflow = hub.changes(cursor)
+        self.assertTrue(overflow)
+        self.assertEqual(len(events), 10)
+
+        limited = live_stream.StreamHub(max_clients=1)
+        subscription = limited.subscribe()
+        with self.assertRaises(live_stream.StreamFull):
+            limited.subscribe()
+        subscription.close()
+        limited.subscribe('999').close()
+        self.assertEqual(limited.stats()['clients'], 0)
+
+        with database.pooled_connection() as conn:
+            for table in database.get_partition_tables(datetime.now().date().isoformat(), None, conn):
+                conn.execute(f"DELETE FROM {table} WHERE agent_name = 'TEST-STREAM'")
+
+        print(f"[OK] Stream: {server_integrated.stream_hub.stats()}")
+
+    def test_20_history_schema(self):
+        """Test stesso schema di /api/history per dati grezzi e aggregati"""
+        print("\n[TEST] Schema Storico tra Livelli")
+
+        rows = []
+        for i in range(60):
+            report = {'cpu_usage': float(i), 'memory': 50.0, 'disk': 10.0, 'system': 'Linux',
+                      'node': 'TEST-SCHEMA', 'release': '6.0', 'version': '#1'}
+            timestamp = f'2099-02-01T00:{i // 6:02d}:{(i * 10) % 60:02d}'
+            rows.append(database.build_system_data_row(report, '10.20.0.1', timestamp))
+        self.assertTrue(database.save_system_data_batch(rows))
+
+        headers = {'X-Forwarded-For': '10.20.0.2'}
+        short = requests.get(f'{self.base_url}/api/history', auth=self.auth, headers=headers,
+                             params={'agent': '10.20.0.1', 'start': '2099-02-01T00:00:00',
+                                     'end': '2099-02-01T00:05:00', 'max_points': 1000})
+        long = requests.get(f'{self.base_url}/api/history', auth=self.auth, headers=headers,
+                            params={'agent': '10.20.0.1', 'start': '2099-02-01T00:00:00',
+                                    'end': '2099-02-02T00:00:00', 'max_points': 10})
+        self.assertEqual(short.headers['X-NetMaster-Tier'], 'raw')
+        self.assertNotEqual(long.headers['X-NetMaster-Tier'], 'raw')
+
+        raw, aggregated = short.json(), long.json()
+        self.assertTrue(raw and aggregated)
+        self.assertEqual(set(raw[0]), set(aggregated[0]))
+        first = datetime(2099, 2, 1).timestamp() * 1000
+        self.assertEqual(raw[0]['timestamp'], first)
+        self.assertEqual(aggregated[0]['timestamp'], first)
+        self.assertEqual(raw[0]['cpu_percent'], raw[0]['cpu_p95'])
+        self.assertEqual([record['timestamp'] for record in raw],
+                         sorted(record['timestamp'] for record in raw))
+
+        with database.pooled_connection() as conn:
+            for table in ['system_data', 'agent_latest', 'metrics_rollup']:
+                conn.execute(f"DELETE FROM {table} WHERE agent_ip = '10.20.0.1'")
+        for table in database.get_partition_tables('2099-02-01T00:00:00', '2099-02-01T23:59:59')[1:]:
+            database.drop_partition(table)
+
+        print(f"[OK] Schema comune: {sorted(raw[0])}")
+
+    def test_21_delta_pagination(self):
+        """Test delta con più righe nuove del limite: nessuna riga saltata tra due poll"""
+        print("\n[TEST] Delta Oltre il Limite")
+
+        agent = '10.21.0.1'
+        headers = {'X-Forwarded-For': '10.21.0.2'}
+        url = f'{self.base_url}/api/history'
+        first = requests.get(url, auth=self.auth, headers=headers, params={'agent': agent})
+        cursor = first.headers['X-NetMaster-Cursor']
+
+        # Tre transazioni (60, 60 e 130 righe) in partizioni diverse: 250 righe
+        # scritte tra due poll con limite 100
+        now = datetime.now()
+        old = now - timedelta(days=3)
+        written = set()
+        for start, count, base in ((0, 60, now), (60, 60, old), (120, 130, now)):
+            rows = []
+            for i in range(start, start + count):
+                report = {'cpu_usage': float(i % 100), 'memory': 50.0, 'disk': 10.0, 'system': 'Linux',
+                          'node': 'TEST-PAGES', 'release': '6.0', 'version': '#1'}
+                timestamp = (base - timedelta(seconds=i)).replace(microsecond=0).isoformat()
+                rows.append(database.build_system_data_row(report, agent, timestamp))
+                written.add(datetime.fromisoformat(timestamp).timestamp() * 1000)
+            self.assertTrue(database.save_system_data_batch(rows))
+
+        pages = []
+        received = set()
+        for _ in range(5):
+            response = requests.get(url, auth=self.auth, headers=headers,
+                                    params={'agent': agent, 'since': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertGreaterEqual(int(response.headers['X-NetMaster-Cursor']), int(cursor))
+            cursor = response.headers['X-NetMaster-Cursor']
+            if not response.json():
+                break
+            pages.append(len(response.json()))
+            received.update(record['timestamp'] for record in response.json())
+
+        # Transazioni intere per pagina, l'ultima oltre il limite
+        self.assertEqual(pages, [120, 130])
+        self.assertEqual(received, written)
+        self.assertEqual(int(cursor), database.get_ingest_seq())
+
+        with database.pooled_connection() as conn:
+            for table in database.get_partition_tables(old.isoformat(), None, conn):
+                conn.execute(f"DELETE FROM {table} WHERE agent_ip = ?", (agent,))
+            conn.execute("DELETE FROM agent_latest WHERE agent_ip = ?", (agent,))
+            conn.execute("DELETE FROM metrics_rollup WHERE agent_ip = ?", (agent,))
+
+        print(f"[OK] {len(written)} righe ricevute in pagine da {pages}")
 
 class TestNetMasterDatabase(unittest.TestCase):
     """Test suite per il database NetMaster"""
@@ -355,6 +818,1105 @@ class TestNetMasterDatabase(unittest.TestCase):
         except Exception as e:
             self.fail(f"Errore verifica tabelle: {e}")
 
+    def test_03_connection_pool(self):
+        """Test riuso connessioni persistenti e modalità WAL"""
+        print("\n[TEST] Pool Connessioni Database")
+
+        with database.pooled_connection() as conn:
+            first = conn
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        with database.pooled_connection() as conn:
+            second = conn
+
+        self.assertIs(first, second)
+        self.assertEqual(journal_mode.lower(), 'wal')
+
+        # Un thread diverso riceve una connessione distinta
+        other = []
+        worker = threading.Thread(
+            target=lambda: other.append(database.get_pool().acquire()))
+        worker.start()
+        worker.join()
+        self.assertIsNot(other[0], first)
+
+        print(f"[OK] Pool connessioni: {database.get_pool().stats()}")
+
+    def test_04_schema_migrations(self):
+        """Test migrazioni schema e indici time-series"""
+        print("\n[TEST] Migrazioni Schema")
+
+        database.init_db()
+        with database.pooled_connection() as conn:
+            self.assertEqual(database.get_schema_version(conn), database.SCHEMA_VERSION)
+            indexes = {row['name'] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index'")}
+
+        for index in ['idx_system_data_agent_ts', 'idx_system_data_ts']:
+            self.assertIn(index, indexes)
+
+        print(f"[OK] Schema alla versione {database.SCHEMA_VERSION}")
+
+    def test_05_query_plans(self):
+        """Test EXPLAIN QUERY PLAN: nessuna scansione completa delle tabelle storiche"""
+        print("\n[TEST] Piani di Esecuzione Query")
+
+        regressions = database.find_query_plan_regressions()
+        self.assertEqual(regressions, {}, f"Query senza indice: {regressions}")
+
+        print(f"[OK] {len(database.get_query_plan_checks())} query verificate")
+
+    def test_06_agent_latest(self):
+        """Test tabella agent_latest aggiornata all'ingestione"""
+        print("\n[TEST] Ultimo Campione per Agent")
+
+        report = {'cpu_usage': 10.0, 'memory': 20.0, 'disk': 30.0, 'system': 'Linux',
+                  'node': 'TEST-LATEST', 'release': '6.0', 'version': '#1'}
+        newer = database.build_system_data_row(dict(report, cpu_usage=42.0), '10.9.9.9',
+                                               '2099-01-01T00:00:02')
+        older = database.build_system_data_row(report, '10.9.9.9', '2099-01-01T00:00:01')
+
+        # La riga più vecchia arriva dopo: non deve sovrascrivere quella recente
+        self.assertTrue(database.save_system_data_batch([newer]))
+        self.assertTrue(database.save_system_data_batch([older]))
+
+        agents = {agent['agent_ip']: agent for agent in database.get_active_agents()}
+        self.assertIn('10.9.9.9', agents)
+        self.assertEqual(agents['10.9.9.9']['cpu_percent'], 42.0)
+
+        with database.pooled_connection() as conn:
+            conn.execute("DELETE FROM system_data WHERE agent_ip = '10.9.9.9'")
+            conn.execute("DELETE FROM agent_latest WHERE agent_ip = '10.9.9.9'")
+        for table in database.get_partition_tables('2099-01-01T00:00:00', '2099-01-01T23:59:59')[1:]:
+            database.drop_partition(table)
+
+        print("[OK] agent_latest aggiornata correttamente")
+
+    def test_07_rollup_tiers(self):
+        """Test aggregati 1m/5m/1h mantenuti all'ingestione"""
+        print("\n[TEST] Aggregati Rollup")
+
+        rows = []
+        for i in range(100):
+            report = {'cpu_usage': float(i), 'memory': 50.0, 'disk': 10.0, 'system': 'Linux',
+                      'node': 'TEST-ROLLUP', 'release': '6.0', 'version': '#1'}
+            timestamp = f'2099-01-01T00:{(i * 10) // 60:02d}:{(i * 10) % 60:02d}'
+            rows.append(database.build_system_data_row(report, '10.8.8.8', timestamp))
+
+        # Due batch separati: il secondo si fonde con gli aggregati del primo
+        self.assertTrue(database.save_system_data_batch(rows[:50]))
+        self.assertTrue(database.save_system_data_batch(rows[50:]))
+
+        start = '2099-01-01T00:00:00'
+        minute = database.get_rollup_data('1m', start, agent_ip='10.8.8.8')
+        five = database.get_rollup_data('5m', start, agent_ip='10.8.8.8')
+        hour = database.get_rollup_data('1h', start, agent_ip='10.8.8.8')
+
+        self.assertEqual(len(minute), 17)
+        self.assertEqual(len(five), 4)
+        self.assertEqual(len(hour), 1)
+        self.assertEqual(hour[0]['samples'], 100)
+        self.assertEqual(hour[0]['cpu_min'], 0.0)
+        self.assertEqual(hour[0]['cpu_max'], 99.0)
+        self.assertAlmostEqual(hour[0]['cpu_percent'], 49.5)
+        self.assertAlmostEqual(hour[0]['cpu_p95'], 95.0, delta=1.0)
+
+        with database.pooled_connection() as conn:
+            for table in ['system_data', 'agent_latest', 'metrics_rollup']:
+                conn.execute(f"DELETE FROM {table} WHERE agent_ip = '10.8.8.8'")
+        for table in database.get_partition_tables('2099-01-01T00:00:00', '2099-01-01T23:59:59')[1:]:
+            database.drop_partition(table)
+
+        print("[OK] Aggregati calcolati correttamente")
+
+    def test_08_tier_selection(self):
+        """Test scelta del livello di aggregazione in base al budget di punti"""
+        print("\n[TEST] Scelta Livello Aggregazione")
+
+        day = 24 * 3600
+        self.assertEqual(rollup.choose_tier(3600, 1, 2000), 'raw')
+        self.assertEqual(rollup.choose_tier(6 * 3600, 10, 2000), '5m')
+        self.assertEqual(rollup.choose_tier(day, 50, 2000), '1h')
+        self.assertEqual(rollup.choose_tier(30 * day, 1000, 2000), '1h')
+
+        print("[OK] Livelli scelti correttamente")
+
+    def test_09_retention(self):
+        """Test eliminazione a blocchi dei dati scaduti e report di pulizia"""
+        print("\n[TEST] Conservazione Dati")
+
+        report = {'cpu_usage': 10.0, 'memory': 20.0, 'disk': 30.0, 'system': 'Linux',
+                  'node': 'TEST-RETENTION', 'release': '6.0', 'version': '#1'}
+        rows = [database.build_system_data_row(report, '10.7.7.7', f'2000-01-01T00:{i // 60:02d}:{i % 60:02d}')
+                for i in range(25)]
+        self.assertTrue(database.save_system_data_batch(rows))
+
+        self.assertEqual(database.get_partition_tables('2000-01-01T00:00:00', '2000-01-01T01:00:00'),
+                         ['system_data', 'system_data_d20000101'])
+
+        manager = retention.RetentionManager(raw_days=30, rollup_months=12, batch_size=10, pause=0)
+        result = manager.run_once()
+
+        self.assertIn('system_data_d20000101', result['partitions_dropped'])
+        self.assertGreaterEqual(result['deleted']['metrics_rollup_1h'], 1)
+        self.assertGreaterEqual(result['reclaimed_bytes'], 0)
+        self.assertIn('duration_s', result)
+        self.assertIs(manager.last_report, result)
+
+        with database.pooled_connection() as conn:
+            rollups = conn.execute(
+                "SELECT COUNT(*) FROM metrics_rollup WHERE agent_ip = '10.7.7.7'").fetchone()[0]
+            conn.execute("DELETE FROM agent_latest WHERE agent_ip = '10.7.7.7'")
+        self.assertEqual(rollups, 0)
+        self.assertEqual(database.get_history('10.7.7.7'), [])
+        self.assertEqual(database.get_partition_tables('2000-01-01T00:00:00', '2000-01-01T01:00:00'),
+                         ['system_data'])
+
+        print(f"[OK] Dati scaduti eliminati in {result['duration_s']}s")
+
+    def test_10_partition_routing(self):
+        """Test instradamento dei campioni nelle partizioni giornaliere"""
+        print("\n[TEST] Partizionamento Temporale")
+
+        report = {'cpu_usage': 10.0, 'memory': 20.0, 'disk': 30.0, 'system': 'Linux',
+                  'node': 'TEST-PARTITION', 'release': '6.0', 'version': '#1'}
+        rows = [database.build_system_data_row(report, '10.6.6.6', f'2098-03-0{day}T12:00:00')
+                for day in (1, 2, 3)]
+        self.assertTrue(database.save_system_data_batch(rows))
+
+        partitions = ['system_data_d20980301', 'system_data_d20980302', 'system_data_d20980303']
+        self.assertEqual(database.get_partition_tables('2098-03-01T00:00:00', '2098-03-03T23:59:59'),
+                         ['system_data'] + partitions)
+        # Un intervallo su un solo giorno legge solo la sua partizione
+        self.assertEqual(database.get_partition_tables('2098-03-02T00:00:00', '2098-03-02T23:59:59'),
+                         ['system_data', 'system_data_d20980302'])
+
+        history = database.get_history('10.6.6.6', '2098-03-01T00:00:00', '2098-03-03T23:59:59', limit=2)
+        self.assertEqual([row['timestamp'] for row in history],
+                         ['2098-03-03T12:00:00', '2098-03-02T12:00:00'])
+
+        with database.pooled_connection() as conn:
+            for table in ['agent_latest', 'metrics_rollup']:
+                conn.execute(f"DELETE FROM {table} WHERE agent_ip = '10.6.6.6'")
+        for table in partitions:
+            database.drop_partition(table)
+        self.assertEqual(database.get_history('10.6.6.6'), [])
+
+        print("[OK] Campioni instradati nelle partizioni corrette")
+
+    def test_11_threshold_cache(self):
+        """Test cache delle soglie e dei cooldown invalidata da save_threshold"""
+        print("\n[TEST] Cache Soglie")
+
+        cache = database.threshold_cache
+        self.assertTrue(database.save_threshold('10.5.5.5', 'cpu', 50.0, True))
+        self.assertEqual(database.get_thresholds_for_agent('10.5.5.5'),
+                         [{'metric': 'cpu', 'threshold': 50.0}])
+
+        # Letture successive servite dalla cache senza interrogare il database
+        misses = cache.stats()['misses']
+        for _ in range(10):
+            database.get_thresholds_for_agent('10.5.5.5')
+        self.assertEqual(cache.stats()['misses'], misses)
+
+        # La modifica di una soglia invalida la cache
+        self.assertTrue(database.save_threshold('10.5.5.5', 'cpu', 70.0, True))
+        self.assertEqual(database.get_thresholds_for_agent('10.5.5.5')[0]['threshold'], 70.0)
+
+        # Il cooldown parte al salvataggio della notifica
+        self.assertFalse(database.has_recent_notification('10.5.5.5', 'cpu'))
+        database.save_notification('10.5.5.5', 'cpu', 90.0, 70.0)
+        misses = cache.stats()['misses']
+        self.assertTrue(database.has_recent_notification('10.5.5.5', 'cpu'))
+        self.assertEqual(cache.stats()['misses'], misses)
+
+        with database.pooled_connection() as conn:
+            conn.execute("DELETE FROM thresholds WHERE agent_ip = '10.5.5.5'")
+            conn.execute("DELETE FROM notifications WHERE agent_ip = '10.5.5.5'")
+        cache.clear()
+
+        print("[OK] Soglie e cooldown serviti dalla cache")
+
+    def test_12_agent_metrics(self):
+        """Test metriche aggiuntive dei collector in agent_latest"""
+        print("\n[TEST] Metriche Aggiuntive per Agent")
+
+        report = {'cpu_usage': 10.0, 'memory': 20.0, 'disk': 30.0, 'system': 'Linux',
+                  'node': 'TEST-METRICS', 'release': '6.0', 'version': '#1',
+                  'processes': 123, 'uptime': 4567, 'load_avg': [0.5, 0.4, 0.3]}
+        first = database.build_system_data_row(report, '10.9.9.8', '2099-01-01T00:00:01')
+        # Report successivo senza i collector meno frequenti
+        second = database.build_system_data_row(
+            {'cpu_usage': 11.0, 'memory': 20.0, 'disk': 30.0, 'system': 'Linux', 'node': 'TEST-METRICS',
+             'release': '6.0', 'version': '#1', 'load_avg': [0.9, 0.5, 0.3]},
+            '10.9.9.8', '2099-01-01T00:00:02')
+        self.assertTrue(database.save_system_data_batch([first]))
+        self.assertTrue(database.save_system_data_batch([second]))
+
+        agents = {agent['agent_ip']: agent for agent in database.get_active_agents()}
+        agent = agents['10.9.9.8']
+        self.assertEqual(agent['processes'], 123)
+        self.assertEqual(agent['uptime'], 4567)
+        self.assertEqual(agent['metrics']['load_avg'], [0.9, 0.5, 0.3])
+
+        with database.pooled_connection() as conn:
+            conn.execute("DELETE FROM system_data WHERE agent_ip = '10.9.9.8'")
+            conn.execute("DELETE FROM agent_latest WHERE agent_ip = '10.9.9.8'")
+            tables = database.get_partition_tables('2099-01-01T00:00:00', '2099-01-01T23:59:59', conn)
+        for table in tables[1:]:
+            database.drop_partition(table)
+
+        print("[OK] Processi e uptime salvati e fusi con i report successivi")
+
+    def test_13_vacuum_migration(self):
+        """Test migrazione del vacuum incrementale rimandata sui database grandi"""
+        print("\n[TEST] Migrazione Vacuum Incrementale")
+
+        import sqlite3
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, 'vacuum.db'))
+            try:
+                conn.execute("CREATE TABLE dati (valore TEXT)")
+                conn.executemany("INSERT INTO dati VALUES (?)", [('x' * 1000,)] * 100)
+                conn.commit()
+
+                # Oltre la soglia: nessun VACUUM all'avvio, solo un avviso
+                with patch.object(database, 'VACUUM_MIGRATION_MAX_BYTES', 4096), \
+                     self.assertLogs(level='WARNING') as logs:
+                    database._migrate_incremental_vacuum(conn)
+                self.assertIn('enable-incremental-vacuum', logs.output[0])
+                self.assertFalse(database.is_incremental_vacuum_enabled(conn))
+
+                database._migrate_incremental_vacuum(conn)
+                self.assertTrue(database.is_incremental_vacuum_enabled(conn))
+            finally:
+                conn.close()
+
+        print("[OK] VACUUM completo solo entro la soglia di dimensione")
+
+class TestNetMasterIngest(unittest.TestCase):
+    """Test suite per la coda di ingestione asincrona"""
+    
+    def make_report(self, node):
+        return {
+            'cpu_usage': 10.0,
+            'memory': 20.0,
+            'disk': 30.0,
+            'system': 'Linux',
+            'node': node,
+            'release': '6.0',
+            'version': '#1'
+        }
+    
+    def test_01_batched_flush(self):
+        """Test salvataggio a blocchi e callback post-flush"""
+        print("\n[TEST] Flush a Blocchi")
+        
+        flushed = []
+        queue = ingest.IngestQueue(max_size=100, batch_size=10, flush_interval=0.05,
+                                   on_flush=flushed.extend)
+        queue.start()
+        try:
+            for i in range(25):
+                queue.submit(self.make_report(f'BATCH-{i}'), '10.0.0.1')
+            self.assertTrue(queue.flush(timeout=5))
+        finally:
+            queue.stop()
+        
+        stats = queue.stats()
+        self.assertEqual(stats['written'], 25)
+        self.assertGreaterEqual(stats['batches'], 3)
+        self.assertEqual(len(flushed), 25)
+        
+        print(f"[OK] Statistiche coda: {stats}")
+    
+    def test_02_backpressure_and_drain(self):
+        """Test rifiuto a coda piena e svuotamento allo shutdown"""
+        print("\n[TEST] Back-pressure e Drain")
+        
+        queue = ingest.IngestQueue(max_size=5, batch_size=5, flush_interval=0.05)
+        for i in range(5):
+            queue.submit(self.make_report(f'FULL-{i}'), '10.0.0.2')
+        
+        with self.assertRaises(ingest.IngestQueueFull) as ctx:
+            queue.submit(self.make_report('FULL-X'), '10.0.0.2')
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        
+        queue.start()
+        queue.stop()
+        stats = queue.stats()
+        self.assertEqual(stats['queue_size'], 0)
+        self.assertEqual(stats['written'], 5)
+        self.assertEqual(stats['rejected'], 1)
+        
+        print("[OK] Back-pressure e drain corretti")
+    
+    def test_03_submit_many_all_or_nothing(self):
+        """Test accodamento di un batch: tutto o niente, backfill senza callback"""
+        print("\n[TEST] Accodamento Batch")
+        
+        flushed = []
+        queue = ingest.IngestQueue(max_size=5, batch_size=5, flush_interval=0.05,
+                                   on_flush=flushed.extend)
+        now = datetime.now()
+        samples = [(self.make_report(f'MANY-{i}'), (now - timedelta(minutes=10 - i)).isoformat())
+                   for i in range(4)]
+        with self.assertRaises(ingest.IngestQueueFull):
+            queue.submit_many(samples * 2, '10.0.0.3')
+        self.assertEqual(queue.stats()['queue_size'], 0)
+        
+        queue.submit_many(samples, '10.0.0.3', notify_after=samples[2][1])
+        queue.start()
+        queue.stop()
+        self.assertEqual(queue.stats()['written'], 4)
+        self.assertEqual([data['node'] for data, _ in flushed], ['MANY-2', 'MANY-3'])
+        
+        print("[OK] Batch accodato per intero, backfill senza controllo soglie")
+    
+    def test_04_agent_buffer(self):
+        """Test buffer circolare su disco dell'agent"""
+        print("\n[TEST] Buffer Agent")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'buffer.db')
+            buffer = agent_buffer.SampleBuffer(path, max_samples=5)
+            for i in range(8):
+                buffer.append({'seq': i})
+            self.assertEqual(len(buffer), 5)
+            self.assertEqual(buffer.dropped, 3)
+            
+            pending = buffer.peek(2)
+            self.assertEqual([sample['seq'] for _, sample in pending], [3, 4])
+            buffer.remove([row_id for row_id, _ in pending])
+            buffer.close()
+            
+            # Il contenuto sopravvive al riavvio dell'agent
+            buffer = agent_buffer.SampleBuffer(path, max_samples=5)
+            self.assertEqual(len(buffer), 3)
+            self.assertEqual([sample['seq'] for _, sample in buffer.peek(10)], [5, 6, 7])
+            buffer.close()
+
+        print("[OK] Buffer circolare persistente")
+
+    def test_05_legacy_server_report(self):
+        """Test /api/report del server legacy: il report dell'agent viene accodato"""
+        print("\n[TEST] Report Server Legacy")
+
+        # server.py riconfigura il logging all'import: ripristina la configurazione dei test
+        root = logging.getLogger()
+        handlers, level = root.handlers[:], root.level
+        try:
+            import server
+        finally:
+            root.handlers[:] = handlers
+            root.setLevel(level)
+
+        queue = ingest.IngestQueue()  # writer non avviato: i campioni restano in coda
+        client = server.app.test_client()
+        auth = {'Authorization': 'Basic ' + base64.b64encode(b'admin:password').decode()}
+        with patch.object(server, 'ingest_queue', queue):
+            response = client.post('/api/report', json=self.make_report('LEGACY-01'), headers=auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['hostname'], 'LEGACY-01')
+
+            response = client.post('/api/report', json={'cpu_usage': 10.0}, headers=auth)
+            self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(queue.stats()['enqueued'], 1)
+        row, data, agent_ip = queue._queue.get_nowait()
+        self.assertEqual(row[1:6], (agent_ip, 'LEGACY-01', 10.0, 20.0, 30.0))
+
+        print("[OK] Report accodato dal server legacy")
+
+    def test_06_write_retry(self):
+        """Test nuovi tentativi su errore di scrittura e log dei campioni persi"""
+        print("\n[TEST] Tentativi di Scrittura")
+        
+        flushed = []
+        queue = ingest.IngestQueue(max_size=10, batch_size=10, flush_interval=0.05,
+                                   on_flush=flushed.extend, max_retries=3, backoff=0.01)
+        # "database is locked" transitorio: il batch passa al terzo tentativo
+        with patch.object(database, 'save_system_data_batch', side_effect=[False, False, True]) as save:
+            queue.submit(self.make_report('RETRY-1'), '10.0.0.6')
+            queue.submit(self.make_report('RETRY-2'), '10.0.0.7')
+            queue.start()
+            self.assertTrue(queue.flush(timeout=5))
+        self.assertEqual(save.call_count, 3)
+        stats = queue.stats()
+        self.assertEqual((stats['written'], stats['failed'], stats['retries']), (2, 0, 2))
+        self.assertEqual(len(flushed), 2)
+        
+        # Errore persistente: dopo max_retries il batch è scartato con un errore esplicito
+        with patch.object(database, 'save_system_data_batch', return_value=False) as save, \
+             self.assertLogs(ingest.logger, level='ERROR') as logs:
+            queue.submit(self.make_report('RETRY-3'), '10.0.0.8')
+            self.assertTrue(queue.flush(timeout=5))
+            queue.stop()
+        self.assertEqual(save.call_count, 3)
+        self.assertEqual(queue.stats()['failed'], 1)
+        self.assertEqual(len(flushed), 2)
+        self.assertIn('1 campioni persi', logs.output[-1])
+        self.assertIn('10.0.0.8', logs.output[-1])
+        
+        print(f"[OK] Statistiche coda: {queue.stats()}")
+
+class TestNetMasterNotifications(unittest.TestCase):
+    """Test suite per il dispatcher asincrono delle notifiche email"""
+
+    def setUp(self):
+        self.smtp = LocalSMTPServer().start()
+
+    def tearDown(self):
+        self.smtp.stop()
+        with database.pooled_connection() as conn:
+            conn.execute("DELETE FROM notifications WHERE agent_ip LIKE '10.4.4.%'")
+        database.threshold_cache.clear()
+
+    def get_statuses(self, ids):
+        with database.pooled_connection() as conn:
+            rows = conn.execute(
+                f"SELECT id, status, attempts FROM notifications WHERE id IN ({','.join('?' * len(ids))})",
+                ids
+            ).fetchall()
+        return {row['id']: (row['status'], row['attempts']) for row in rows}
+
+    def test_01_digest_and_connection_reuse(self):
+        """Test riepilogo degli avvisi e riuso della connessione SMTP"""
+        print("\n[TEST] Riepilogo Notifiche")
+
+        dispatcher = notifier.NotificationDispatcher(load_config=self.smtp.config,
+                                                     digest_interval=0.2, backoff=0.01)
+        dispatcher.start()
+        try:
+            ids = [dispatcher.notify(f'10.4.4.{i}', 'cpu', 95.0, 80.0, f'Avviso {i}', f'Corpo {i}')
+                   for i in range(3)]
+            self.assertTrue(dispatcher.flush(timeout=5))
+            ids.append(dispatcher.notify('10.4.4.9', 'disk', 99.0, 90.0, 'Avviso disco', 'Corpo disco'))
+            self.assertTrue(dispatcher.flush(timeout=5))
+        finally:
+            dispatcher.stop()
+
+        # Tre avvisi nello stesso intervallo -> una sola email, poi una seconda
+        self.assertEqual(len(self.smtp.messages), 2)
+        self.assertIn('Riepilogo: 3 soglie superate', self.smtp.messages[0])
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(dispatcher.stats()['emails'], 2)
+        self.assertTrue(all(status == ('sent', 1) for status in self.get_statuses(ids).values()))
+
+        print("[OK] Avvisi raggruppati con una sola connessione SMTP")
+
+    def test_02_retry_and_failure_status(self):
+        """Test ritentativi con backoff e stato di consegna fallita"""
+        print("\n[TEST] Ritentativi Notifiche")
+
+        dispatcher = notifier.NotificationDispatcher(load_config=self.smtp.config, digest_interval=0,
+                                                     max_retries=3, backoff=0.01)
+        dispatcher.start()
+        try:
+            self.smtp.fail_next = 1
+            retried = dispatcher.notify('10.4.4.1', 'cpu', 95.0, 80.0, 'Ritentato', 'Corpo')
+            self.assertTrue(dispatcher.flush(timeout=5))
+
+            self.smtp.fail_next = 3
+            failed = dispatcher.notify('10.4.4.2', 'cpu', 95.0, 80.0, 'Fallito', 'Corpo')
+            self.assertTrue(dispatcher.flush(timeout=5))
+        finally:
+            dispatcher.stop()
+
+        statuses = self.get_statuses([retried, failed])
+        self.assertEqual(statuses[retried], ('sent', 2))
+        self.assertEqual(statuses[failed], ('failed', 3))
+        self.assertEqual(len(self.smtp.messages), 1)
+
+        print("[OK] Stato di consegna registrato dopo i ritentativi")
+
+class TestNetMasterRateLimiter(unittest.TestCase):
+    """Test suite per il rate limiter a finestra scorrevole"""
+
+    def test_01_sliding_window(self):
+        """Test limiti per minuto con stima a finestra scorrevole"""
+        print("\n[TEST] Finestra Scorrevole")
+
+        limiter = security_validator.RateLimiter()
+        start = 1200.0  # inizio di una finestra di un minuto
+        results = [limiter.check('10.3.3.3', '/api/report', 5, 1000, start + i)[0] for i in range(6)]
+        self.assertEqual(results, [False] * 5 + [True])
+
+        # Endpoint e client diversi hanno contatori indipendenti
+        self.assertFalse(limiter.check('10.3.3.3', '/api/stats', 5, 1000, start + 6)[0])
+        self.assertFalse(limiter.check('10.3.3.4', '/api/report', 5, 1000, start + 6)[0])
+
+        # Nel minuto successivo la finestra precedente pesa per la parte ancora sovrapposta
+        self.assertFalse(limiter.check('10.3.3.3', '/api/report', 5, 1000, start + 61)[0])
+        limited, reason, retry_after = limiter.check('10.3.3.3', '/api/report', 5, 1000, start + 62)
+        self.assertTrue(limited)
+        self.assertIn('minuto', reason)
+        self.assertGreaterEqual(retry_after, 1)
+        self.assertFalse(limiter.check('10.3.3.3', '/api/report', 5, 1000, start + 90)[0])
+
+        # Stato di dimensione fissa per chiave, indipendente dal numero di richieste
+        self.assertEqual(len(limiter.counters), 3)
+        self.assertEqual(len(limiter.counters[('10.3.3.3', '/api/report')]), len(limiter.WINDOWS))
+
+        print("[OK] Limiti applicati con stato costante per client")
+
+    def test_02_thread_safety(self):
+        """Test conteggio esatto con richieste concorrenti"""
+        print("\n[TEST] Rate Limiter Concorrente")
+
+        limiter = security_validator.RateLimiter()
+        allowed = []
+
+        def worker():
+            for _ in range(50):
+                if not limiter.check('10.3.3.5', '/api/report', 100, 1000, 1200.0)[0]:
+                    allowed.append(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(allowed), 100)
+
+        print("[OK] Nessuna richiesta oltre il limite sotto concorrenza")
+
+    def run_shared_limit(self, backend_factory):
+        """Due limiter (come due processi) condividono un limite di 40 richieste/minuto."""
+        workers = [rate_limit_backends.SharedRateLimiter(backend_factory(), lease_size=10)
+                   for _ in range(2)]
+        allowed = 0
+        for i in range(100):
+            limited, _, _ = workers[i % 2].check('10.3.3.6', '/api/report', 40, 1000, 1200.0 + i * 0.1)
+            allowed += not limited
+        return workers, allowed
+
+    def test_03_sqlite_backend(self):
+        """Test limite condiviso tra processi con backend SQLite"""
+        print("\n[TEST] Rate Limit Condiviso (SQLite)")
+
+        path = os.path.join('data', 'test_ratelimit.db')
+        if os.path.exists(path):
+            os.remove(path)
+        workers, allowed = self.run_shared_limit(lambda: rate_limit_backends.SQLiteRateLimitBackend(path))
+        self.assertEqual(allowed, 40)
+        # Prenotazioni a blocchi: il backend è consultato molto meno di una volta per richiesta
+        self.assertLess(sum(worker.stats()['acquired'] for worker in workers), 40)
+        for worker in workers:
+            worker.backend.close()
+        os.remove(path)
+
+        print(f"[OK] {allowed}/100 richieste accettate tra due processi")
+
+    def test_04_redis_backend(self):
+        """Test limite condiviso con backend compatibile Redis"""
+        print("\n[TEST] Rate Limit Condiviso (Redis)")
+
+        redis = LocalRedisServer().start()
+        try:
+            workers, allowed = self.run_shared_limit(lambda: rate_limit_backends.RedisRateLimitBackend(redis.url))
+            self.assertEqual(allowed, 40)
+            self.assertLess(redis.commands, 100)
+            for worker in workers:
+                worker.backend.close()
+        finally:
+            redis.stop()
+
+        # Backend non raggiungibile: si applica il limiter locale di riserva
+        limiter = rate_limit_backends.SharedRateLimiter(
+            rate_limit_backends.RedisRateLimitBackend(redis.url), fallback=security_validator.RateLimiter())
+        self.assertFalse(limiter.check('10.3.3.7', '/api/report', 1, 1000, 1200.0)[0])
+        self.assertTrue(limiter.check('10.3.3.7', '/api/report', 1, 1000, 1200.5)[0])
+        self.assertEqual(limiter.stats()['backend_errors'], 2)
+
+        print(f"[OK] {allowed}/100 richieste accettate, {redis.commands} comandi Redis")
+
+    def test_05_client_address(self):
+        """Test chiave del rate limiting: X-Forwarded-For solo dai proxy fidati"""
+        print("\n[TEST] Indirizzo del Client")
+
+        client_address = security_validator.client_address
+        proxies = security_validator.parse_trusted_proxies('127.0.0.1, 10.0.0.0/8, non-valido')
+        self.assertEqual(len(proxies), 2)
+
+        with patch.object(security_validator, 'TRUSTED_PROXIES', []):
+            # Senza proxy fidati l'header è del client e viene ignorato
+            self.assertEqual(client_address('203.0.113.7', '1.2.3.4'), '203.0.113.7')
+            self.assertEqual(client_address(None), 'unknown')
+
+        with patch.object(security_validator, 'TRUSTED_PROXIES', proxies):
+            self.assertEqual(client_address('203.0.113.7', '1.2.3.4'), '203.0.113.7')
+            self.assertEqual(client_address('127.0.0.1', '198.51.100.4'), '198.51.100.4')
+            # Gli hop a sinistra sono scritti dal client: vale il primo non fidato da destra
+            self.assertEqual(client_address('127.0.0.1', '1.2.3.4, 198.51.100.4, 10.0.0.2'), '198.51.100.4')
+            self.assertEqual(client_address('127.0.0.1', '10.0.0.3, 10.0.0.2'), '10.0.0.3')
+            self.assertEqual(client_address('127.0.0.1'), '127.0.0.1')
+
+        print("[OK] X-Forwarded-For ignorato dai client non fidati")
+
+class TestNetMasterWSGIServer(unittest.TestCase):
+    """Test suite per il server WSGI di produzione"""
+
+    def get(self, conn):
+        conn.request('GET', '/')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        return int(response.read())
+
+    def test_01_keepalive_pool(self):
+        """Test pool di thread con connessioni keep-alive"""
+        print("\n[TEST] Pool di Thread e Keep-Alive")
+
+        server = wsgi_server.PoolWSGIServer('127.0.0.1', 0, wsgi_pid_app, threads=2, keepalive=2)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+            for _ in range(3):
+                self.assertEqual(self.get(conn), os.getpid())
+            conn.close()
+            # Tre richieste sulla stessa connessione TCP
+            self.assertEqual(server.stats()['connections'], 1)
+
+            # Più client che thread: le connessioni in eccesso attendono un thread libero
+            results = []
+            def client():
+                c = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+                c.request('GET', '/', headers={'Connection': 'close'})
+                results.append(c.getresponse().status)
+                c.close()
+            clients = [threading.Thread(target=client) for _ in range(6)]
+            for c in clients:
+                c.start()
+            for c in clients:
+                c.join()
+            self.assertEqual(results, [200] * 6)
+        finally:
+            self.assertTrue(server.stop(timeout=5))
+            server.server_close()
+            thread.join(5)
+
+        print("[OK] Richieste servite con connessioni riutilizzate")
+
+    def test_02_prefork_reload_and_stop(self):
+        """Test worker pre-fork, reload graceful (SIGHUP) e arresto (SIGTERM)"""
+        print("\n[TEST] Server Pre-Fork")
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        master = subprocess.Popen(
+            [sys.executable, 'wsgi_server.py', 'tests:wsgi_pid_app', '--bind', f'127.0.0.1:{port}',
+             '--workers', '2', '--threads', '2', '--graceful-timeout', '5'],
+            cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        def worker_pids(samples=20):
+            pids = set()
+            for _ in range(samples):
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                pids.add(self.get(conn))
+                conn.close()
+            return pids
+
+        try:
+            deadline = time.time() + 10
+            while True:
+                try:
+                    first = worker_pids()
+                    break
+                except (ConnectionError, OSError):
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.1)
+            self.assertNotIn(master.pid, first)
+
+            master.send_signal(signal.SIGHUP)
+            deadline = time.time() + 10
+            second = worker_pids()
+            while second & first and time.time() < deadline:
+                time.sleep(0.1)
+                second = worker_pids()
+            self.assertFalse(second & first)
+
+            master.send_signal(signal.SIGTERM)
+            self.assertEqual(master.wait(timeout=10), 0)
+        finally:
+            if master.poll() is None:
+                master.kill()
+                master.wait()
+
+        print(f"[OK] Worker {sorted(first)} sostituiti da {sorted(second)} con il reload")
+
+    def test_03_streams_leave_threads_for_api(self):
+        """Test stream SSE limitati ai thread del pool meno la riserva per le API"""
+        print("\n[TEST] Stream e Thread del Pool")
+
+        threads = 4
+        capacity = threads - live_stream.STREAM_RESERVED_THREADS
+        self.assertEqual(live_stream.StreamHub(server_threads=2).max_clients, 0)
+        hub = live_stream.StreamHub(server_threads=threads, keepalive=1.0)
+        self.assertEqual(hub.max_clients, capacity)
+
+        server = wsgi_server.PoolWSGIServer('127.0.0.1', 0, server_integrated.app, threads=threads, keepalive=0)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        base_url = f'http://127.0.0.1:{server.port}'
+        auth = ('admin', 'password')
+        streams = []
+        try:
+            with patch.object(server_integrated, 'stream_hub', hub):
+                # Una dashboard per thread: oltre la capacità la risposta è 503
+                for i in range(threads):
+                    streams.append(requests.get(f'{base_url}/api/stream', auth=auth, stream=True, timeout=10,
+                                                headers={'X-Forwarded-For': f'10.25.0.{i + 1}'}))
+                self.assertEqual([stream.status_code for stream in streams],
+                                 [200] * capacity + [503] * (threads - capacity))
+                self.assertEqual(streams[-1].headers['Retry-After'], '30')
+
+                # Con tutti gli stream aperti i report degli agent passano ancora
+                report = {'cpu_usage': 25.0, 'memory': 40.0, 'disk': 55.0, 'system': 'Linux',
+                          'node': 'TEST-RESERVE', 'release': '6.0', 'version': '#1 SMP'}
+                response = requests.post(f'{base_url}/api/report', json=report, auth=auth, timeout=5,
+                                         headers={'X-Forwarded-For': '10.25.0.9'})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(server_integrated.ingest_queue.flush(timeout=5))
+        finally:
+            for stream in streams:
+                stream.close()
+            hub.close()
+            self.assertTrue(server.stop(timeout=10))
+            server.server_close()
+            thread.join(5)
+
+        with database.pooled_connection() as conn:
+            for table in database.get_partition_tables(datetime.now().date().isoformat(), None, conn):
+                conn.execute(f"DELETE FROM {table} WHERE agent_name = 'TEST-RESERVE'")
+
+        print(f"[OK] {capacity} stream su {threads} thread, report accettato")
+
+    def test_04_platform_support_and_shutdown_hook(self):
+        """Test pre-fork solo dove esiste os.fork e arresto esplicito dei servizi"""
+        print("\n[TEST] Piattaforma e Arresto dei Worker")
+
+        import production_config
+        config = production_config.ProductionConfig
+        with patch.object(production_config, 'PREFORK_SUPPORTED', False), \
+             patch.object(config, 'SERVER_MODE', 'prefork'):
+            self.assertTrue(any('prefork non supportata' in error for error in config.validate_config()))
+        with patch.object(wsgi_server, 'PREFORK_SUPPORTED', False):
+            with self.assertRaises(RuntimeError):
+                wsgi_server.PreforkServer(wsgi_pid_app, '127.0.0.1', 0).run()
+
+        # I worker escono con os._exit: i servizi si arrestano con shutdown_services()
+        self.assertIs(wsgi_server.find_shutdown_hook(server_integrated.app), server_integrated.shutdown_services)
+        self.assertIs(wsgi_server.find_shutdown_hook('server_integrated:app'), server_integrated.shutdown_services)
+        self.assertIsNone(wsgi_server.find_shutdown_hook(wsgi_pid_app))
+
+        print("[OK] Pre-fork rifiutato senza os.fork, hook di arresto trovato")
+
+class TestNetMasterAsyncIngest(unittest.TestCase):
+    """Test suite per il server di ingestione asincrono"""
+
+    REPORT = {'cpu_usage': 12.5, 'memory': 40.0, 'disk': 55.0, 'system': 'Linux',
+              'node': 'TEST-ASYNC', 'release': '6.0', 'version': '#1 SMP'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.loop = asyncio.new_event_loop()
+        cls.thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.thread.start()
+        cls.server = async_ingest.AsyncIngestServer(server_integrated, host='127.0.0.1', port=0,
+                                                    idle_timeout=5)
+        asyncio.run_coroutine_threadsafe(cls.server.start(), cls.loop).result(5)
+        cls.auth = 'Basic ' + base64.b64encode(b'admin:password').decode()
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run_coroutine_threadsafe(cls.server.stop(), cls.loop).result(15)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join(5)
+        cls.loop.close()
+
+    def post(self, conn, payload, client_ip, auth=True, path='/api/report', method='POST'):
+        headers = {'Content-Type': 'application/json', 'X-Forwarded-For': client_ip}
+        if auth:
+            headers['Authorization'] = self.auth if auth is True else auth
+        conn.request(method, path, body=json.dumps(payload), headers=headers)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read()), response
+
+    def test_01_report_contract(self):
+        """Test stesso contratto di /api/report su una connessione keep-alive"""
+        print("\n[TEST] Ingestione Asincrona - Contratto")
+
+        enqueued = server_integrated.ingest_queue.stats()['enqueued']
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=10)
+
+        status, body, _ = self.post(conn, self.REPORT, '10.5.0.1')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['status'], 'success')
+        self.assertEqual(server_integrated.ingest_queue.stats()['enqueued'], enqueued + 1)
+
+        invalid = dict(self.REPORT, cpu_usage=150)
+        status, body, _ = self.post(conn, invalid, '10.5.0.1')
+        self.assertEqual(status, 400)
+        self.assertIn('cpu_usage', body['message'])
+
+        status, _, response = self.post(conn, self.REPORT, '10.5.0.1', auth=False)
+        self.assertEqual(status, 401)
+        self.assertIn('Basic', response.getheader('WWW-Authenticate'))
+        wrong = 'Basic ' + base64.b64encode(b'admin:sbagliata').decode()
+        self.assertEqual(self.post(conn, self.REPORT, '10.5.0.1', auth=wrong)[0], 401)
+
+        self.assertEqual(self.post(conn, self.REPORT, '10.5.0.1', method='GET')[0], 405)
+        self.assertEqual(self.post(conn, self.REPORT, '10.5.0.1', path='/api/stats')[0], 404)
+        conn.close()
+
+        # Tutte le richieste sulla stessa connessione
+        self.assertGreaterEqual(self.server.stats()['peak_connections'], 1)
+        self.assertEqual(self.server.stats()['requests'], 6)
+
+        print("[OK] Autenticazione, validazione ed esiti come l'endpoint Flask")
+
+    def test_02_many_idle_connections(self):
+        """Test molte connessioni keep-alive inattive gestite da un solo thread"""
+        print("\n[TEST] Ingestione Asincrona - Connessioni Concorrenti")
+
+        count = 1000
+        sockets = [socket.create_connection(('127.0.0.1', self.server.port)) for _ in range(count)]
+        try:
+            deadline = time.time() + 10
+            while self.server.stats()['connections'] < count and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(self.server.stats()['connections'], count)
+
+            body = json.dumps(self.REPORT).encode()
+            for i, sock in enumerate(sockets[::20]):
+                sock.sendall(b'POST /api/report HTTP/1.1\r\nHost: test\r\n'
+                             b'Authorization: ' + self.auth.encode() + b'\r\n'
+                             b'Content-Type: application/json\r\n'
+                             b'X-Forwarded-For: 10.5.1.' + str(i).encode() + b'\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            for sock in sockets[::20]:
+                sock.settimeout(10)
+                self.assertTrue(sock.recv(4096).startswith(b'HTTP/1.1 200'))
+        finally:
+            for sock in sockets:
+                sock.close()
+
+        print(f"[OK] {count} connessioni aperte, picco {self.server.stats()['peak_connections']}")
+
+    def test_03_host_lookup_off_loop(self):
+        """Test ricerca dell'host dei report compatti fuori dall'event loop"""
+        print("\n[TEST] Ingestione Asincrona - Report Compatti")
+
+        agent_id = database.register_agent_host('10.5.2.1', self.REPORT)
+        with database._agent_hosts_lock:
+            database._agent_hosts.pop(agent_id, None)
+        compact = {'agent_id': agent_id, 'cpu_usage': 12.0, 'memory': 34.0, 'disk': 56.0}
+
+        threads = []
+        lookup = database.get_agent_host
+        def recording_lookup(agent):
+            threads.append(threading.current_thread().name)
+            return lookup(agent)
+
+        offloaded = self.server.stats()['lookup_offloaded']
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=10)
+        with patch.object(database, 'get_agent_host', recording_lookup):
+            # Prima richiesta: host non in cache, query nel pool di ricerca
+            self.assertEqual(self.post(conn, compact, '10.5.2.1')[0], 200)
+            # Seconda: servita dalla cache senza lasciare l'event loop
+            self.assertEqual(self.post(conn, compact, '10.5.2.1')[0], 200)
+            # Agent sconosciuto: mai in cache, sempre fuori dall'event loop
+            self.assertEqual(self.post(conn, dict(compact, agent_id=10 ** 9), '10.5.2.1')[0], 409)
+        conn.close()
+
+        self.assertEqual(self.server.stats()['lookup_offloaded'], offloaded + 2)
+        self.assertEqual([name.split('_')[0] == 'ingest-lookup' for name in threads], [True, False, True])
+        self.assertTrue(server_integrated.ingest_queue.flush(timeout=5))
+
+        with database.pooled_connection() as conn:
+            for table in database.get_partition_tables(datetime.now().date().isoformat(), None, conn):
+                conn.execute(f"DELETE FROM {table} WHERE agent_ip = '127.0.0.1' AND cpu_usage = 12.0 "
+                             "AND memory_usage = 34.0 AND disk_usage = 56.0")
+            conn.execute("DELETE FROM agent_hosts WHERE agent_id = ?", (agent_id,))
+
+        print(f"[OK] {len(threads)} ricerche eseguite nel thread {threads[0]}")
+
+class TestNetMasterAgentTransport(unittest.TestCase):
+    """Test suite per la connessione persistente dell'agent"""
+
+    def test_01_keepalive_and_tls_resumption(self):
+        """Test riuso della connessione e ripresa della sessione TLS"""
+        print("\n[TEST] Sessione Persistente Agent")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ssl_mgr = ssl_manager.SSLManager(tmp)
+            ssl_mgr.generate_self_signed_cert('localhost')
+            server = wsgi_server.PoolWSGIServer('127.0.0.1', 0, wsgi_pid_app, threads=2, keepalive=0.3,
+                                                ssl_context=ssl_mgr.get_ssl_context(check_hostname=False))
+            thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+            thread.start()
+            transport = agent_transport.AgentTransport(verify_ssl=False)
+            try:
+                url = f'https://127.0.0.1:{server.port}/'
+                for _ in range(3):
+                    self.assertEqual(transport.post(url).status_code, 200)
+                # Tre richieste, un solo handshake
+                self.assertEqual(transport.stats()['tls_handshakes'], 1)
+
+                # Connessione chiusa dal server per inattività: la nuova riprende la sessione
+                time.sleep(0.8)
+                self.assertEqual(transport.post(url).status_code, 200)
+                stats = transport.stats()
+                self.assertEqual(stats['tls_handshakes'], 2)
+                self.assertEqual(stats['tls_resumed'], 1)
+                self.assertEqual(stats['sessions'], 1)
+                self.assertEqual(stats['ssl_contexts'], 1)
+            finally:
+                transport.close()
+                self.assertTrue(server.stop(timeout=5))
+                server.server_close()
+                thread.join(5)
+
+        print(f"[OK] Statistiche trasporto: {stats}")
+
+class TestNetMasterAgentSampler(unittest.TestCase):
+    """Test suite per il campionamento non bloccante dell'agent"""
+
+    def test_01_fixed_rate_ticker(self):
+        """Test scheduler a frequenza fissa con salto dei tick persi"""
+        print("\n[TEST] Scheduler a Frequenza Fissa")
+
+        ticker = agent_sampler.FixedRateTicker(0.05)
+        start = time.monotonic()
+        for _ in range(4):
+            ticker.wait()
+        # Nessuna deriva: quattro tick in circa 0.2s
+        self.assertAlmostEqual(time.monotonic() - start, 0.2, delta=0.04)
+
+        time.sleep(0.11)  # ciclo più lungo dell'intervallo
+        ticker.wait()
+        self.assertEqual(ticker.skipped, 2)
+
+        print(f"[OK] Tick saltati: {ticker.skipped}")
+
+    def test_02_subsecond_aggregation(self):
+        """Test campionamento sotto il secondo con min/max/media locali"""
+        print("\n[TEST] Aggregazione Locale")
+
+        sampler = agent_sampler.MetricSampler(sample_interval=0.02)
+        self.assertEqual(sampler.static_info, agent_sampler.read_static_info())
+        sampler.start()
+        try:
+            time.sleep(0.3)
+            begin = time.perf_counter()
+            report = sampler.collect()
+            # Nessuna attesa sulla CPU al momento dell'invio
+            self.assertLess(time.perf_counter() - begin, 0.1)
+        finally:
+            sampler.stop()
+
+        self.assertGreater(report['samples'], 5)
+        self.assertLessEqual(report['cpu_min'], report['cpu_usage'])
+        self.assertLessEqual(report['cpu_usage'], report['cpu_max'])
+        self.assertLessEqual(report['memory_min'], report['memory_max'])
+        for field in ('timestamp', 'disk', 'system', 'node', 'release', 'version'):
+            self.assertIn(field, report)
+
+        # Senza thread: un solo campione, media dall'ultima lettura
+        report = agent_sampler.MetricSampler().collect()
+        self.assertNotIn('samples', report)
+        self.assertTrue(0 <= report['cpu_usage'] <= 100)
+
+        print(f"[OK] {report['node']}: campionamento non bloccante")
+
+    def test_03_collector_registry(self):
+        """Test registro dei collector con intervallo, costo ed errori"""
+        print("\n[TEST] Registro dei Collector")
+
+        registry = agent_sampler.CollectorRegistry()
+        calls = {'fast': 0}
+
+        @registry.register('fast', cost='low')
+        def fast():
+            calls['fast'] += 1
+            return {'fast': calls['fast']}
+
+        @registry.register('slow', cost='high', interval=10)
+        def slow():
+            return {'slow': True}
+
+        @registry.register('broken', cost='medium')
+        def broken():
+            raise OSError("non disponibile")
+
+        with self.assertRaises(ValueError):
+            registry.register('bad', cost='free')(fast)
+
+        self.assertEqual(registry.collect(now=100.0), {'fast': 1, 'slow': True})
+        # Il collector costoso non gira prima del suo intervallo
+        self.assertEqual(registry.collect(now=105.0), {'fast': 2})
+        self.assertEqual(registry.collect(now=110.0), {'fast': 3, 'slow': True})
+
+        registry.configure({'slow': False, 'fast': 0})
+        self.assertEqual(registry.collect(now=200.0), {'fast': 4})
+
+        stats = registry.stats()
+        self.assertEqual(stats['fast']['runs'], 4)
+        self.assertEqual(stats['slow']['runs'], 2)
+        self.assertEqual(stats['broken']['errors'], 4)
+        self.assertGreaterEqual(stats['fast']['cpu_ms'], 0.0)
+
+        # Contatori cumulativi convertiti in velocità
+        rates = agent_sampler.RateCounter()
+        self.assertEqual(rates.update({'bytes': 1000}, now=1.0), {})
+        self.assertEqual(rates.update({'bytes': 3000}, now=3.0), {'bytes': 1000.0})
+
+        print(f"[OK] Collector eseguiti secondo intervallo: {stats['slow']['runs']} esecuzioni di 'slow'")
+
+    def test_04_overhead_budget(self):
+        """Test misura del costo dell'agent e riduzione oltre il budget"""
+        print("\n[TEST] Budget di Overhead dell'Agent")
+
+        overhead = agent_sampler.OverheadMonitor(max_cpu_percent=50.0, max_rss_mb=1)
+        with overhead.measure('collect'):
+            sum(range(200000))
+        with overhead.measure('send'):
+            time.sleep(0.02)
+        usage = overhead.snapshot()
+        for field in ('cpu_percent', 'rss_mb', 'collect_ms', 'collect_cpu_ms', 'send_ms', 'send_cpu_ms'):
+            self.assertIn(field, usage)
+        self.assertGreater(usage['collect_cpu_ms'], 0.0)
+        self.assertGreaterEqual(usage['send_ms'], 20.0)
+        self.assertLess(usage['send_cpu_ms'], usage['send_ms'])
+        self.assertIn('rss_mb', overhead.over_budget(usage))
+        # La finestra successiva riparte da zero
+        self.assertNotIn('send_ms', overhead.snapshot())
+
+        registry = agent_sampler.CollectorRegistry()
+        registry.register('cheap', cost='low')(dict)
+        registry.register('medium', cost='medium')(dict)
+        registry.register('expensive', cost='high')(dict)
+        sampler = agent_sampler.MetricSampler(sample_interval=15)
+        ticker = agent_sampler.FixedRateTicker(60)
+
+        steps = []
+        while True:
+            action = overhead.reduce(registry, sampler, ticker, 60)
+            if action is None:
+                break
+            steps.append(action)
+        # Prima i collector più costosi, poi il campionamento, infine la raccolta
+        self.assertEqual(steps[:2], ["collector expensive disattivato", "collector medium disattivato"])
+        self.assertTrue(registry['cheap'].enabled)
+        self.assertEqual(sampler.sample_interval, 60)
+        self.assertEqual(ticker.interval, 60 * agent_sampler.OverheadMonitor.MAX_INTERVAL_FACTOR)
+        self.assertEqual(overhead.reductions, steps)
+
+        print(f"[OK] {len(steps)} riduzioni: {', '.join(steps)}")
+
 class TestNetMasterCredentials(unittest.TestCase):
     """Test suite per il sistema credenziali"""
     
@@ -387,6 +1949,37 @@ class TestNetMasterCredentials(unittest.TestCase):
         except Exception as e:
             self.fail(f"Errore validazione credenziali: {e}")
 
+    def test_03_credential_cache(self):
+        """Test cache delle credenziali verificate con bcrypt"""
+        print("\n[TEST] Cache Credenziali")
+
+        calls = []
+        def verifier(username, password):
+            calls.append(username)
+            return password == 'secret'
+
+        cache = security_validator.CredentialCache(ttl=0.2, max_size=2)
+        for _ in range(5):
+            self.assertTrue(cache.verify('admin', 'secret', 'hash', verifier))
+        self.assertEqual(len(calls), 1)
+
+        # Gli esiti negativi non sono memorizzati
+        self.assertFalse(cache.verify('admin', 'wrong', 'hash', verifier))
+        self.assertFalse(cache.verify('admin', 'wrong', 'hash', verifier))
+        self.assertEqual(len(calls), 3)
+
+        # Un nuovo hash memorizzato invalida la voce; la cache resta limitata a max_size
+        self.assertTrue(cache.verify('admin', 'secret', 'new-hash', verifier))
+        self.assertTrue(cache.verify('other', 'secret', 'hash', verifier))
+        self.assertEqual(cache.stats()['size'], 2)
+
+        # Scaduto il ttl serve di nuovo la verifica completa
+        time.sleep(0.25)
+        self.assertTrue(cache.verify('other', 'secret', 'hash', verifier))
+        self.assertEqual(len(calls), 6)
+
+        print("[OK] bcrypt eseguito solo alla prima verifica")
+
 def run_test_suite():
     """Esegue l'intera suite di test"""
     print("\n" + "="*80)
@@ -401,6 +1994,13 @@ def run_test_suite():
     test_classes = [
         TestNetMasterAPI,
         TestNetMasterDatabase,
+        TestNetMasterIngest,
+        TestNetMasterNotifications,
+        TestNetMasterRateLimiter,
+        TestNetMasterWSGIServer,
+        TestNetMasterAsyncIngest,
+        TestNetMasterAgentTransport,
+        TestNetMasterAgentSampler,
         TestNetMasterCredentials
     ]
     
@@ -0,0 +1,104 @@
+"""
+Modulo per la cache in memoria delle soglie e dei periodi di cooldown delle notifiche.
+Il controllo delle soglie avviene a ogni campione ricevuto: la cache, indicizzata
+per (agent_ip, metrica), evita le due query SQLite per campione e viene
+invalidata da database.save_threshold. Un TTL limita comunque la durata dei dati
+in cache, così le modifiche fatte da altri processi vengono viste entro ttl secondi.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+class ThresholdCache:
+    """Cache delle soglie attive e dell'ultima notifica per (agent_ip, metrica)."""
+
+    def __init__(self, load_thresholds: Callable[[], Iterable[Tuple[str, str, float]]],
+                 load_last_notification: Callable[[str, str], Optional[str]],
+                 ttl: float = None):
+        """
+        Inizializza la cache.
+
+        Args:
+            load_thresholds: Funzione che restituisce tutte le soglie attive
+                             come (agent_ip, metrica, soglia)
+            load_last_notification: Funzione che restituisce il timestamp ISO
+                                    dell'ultima notifica per (agent_ip, metrica), o None
+            ttl: Secondi di validità dei dati in cache
+        """
+        self.load_thresholds = load_thresholds
+        self.load_last_notification = load_last_notification
+        self.ttl = ttl if ttl is not None else float(os.getenv('NETMASTER_THRESHOLD_CACHE_TTL', 60))
+
+        self._lock = threading.Lock()
+        self._thresholds: Optional[Dict[str, List[dict]]] = None
+        self._loaded_at = 0.0
+        self._last_notified: Dict[Tuple[str, str], Tuple[Optional[str], float]] = {}
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def thresholds_for(self, agent_ip: str) -> List[dict]:
+        """Restituisce le soglie attive di un agent come [{'metric', 'threshold'}]."""
+        now = time.monotonic()
+        with self._lock:
+            if self._thresholds is not None and now - self._loaded_at < self.ttl:
+                self._stats['hits'] += 1
+                return self._thresholds.get(agent_ip, [])
+            self._stats['misses'] += 1
+
+        index = {}
+        for ip, metric, threshold in self.load_thresholds():
+            index.setdefault(ip, []).append({'metric': metric, 'threshold': threshold})
+        with self._lock:
+            self._thresholds = index
+            self._loaded_at = now
+        return index.get(agent_ip, [])
+
+    def last_notification(self, agent_ip: str, metric: str) -> Optional[str]:
+        """Restituisce il timestamp ISO dell'ultima notifica per (agent_ip, metrica)."""
+        key = (agent_ip, metric)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._last_notified.get(key)
+            if cached is not None and now - cached[1] < self.ttl:
+                self._stats['hits'] += 1
+                return cached[0]
+            self._stats['misses'] += 1
+
+        timestamp = self.load_last_notification(agent_ip, metric)
+        with self._lock:
+            self._last_notified[key] = (timestamp, now)
+        return timestamp
+
+    def is_in_cooldown(self, agent_ip: str, metric: str, cutoff: str) -> bool:
+        """Verifica se l'ultima notifica per (agent_ip, metrica) è successiva a cutoff."""
+        last = self.last_notification(agent_ip, metric)
+        return last is not None and last > cutoff
+
+    def record_notification(self, agent_ip: str, metric: str, timestamp: str = None):
+        """Registra una notifica appena salvata (inizio del cooldown)."""
+        with self._lock:
+            self._last_notified[(agent_ip, metric)] = (
+                timestamp or datetime.now().isoformat(), time.monotonic()
+            )
+
+    def invalidate(self):
+        """Invalida le soglie in cache (chiamata dopo ogni modifica delle soglie)."""
+        with self._lock:
+            self._thresholds = None
+            self._stats['invalidations'] += 1
+
+    def clear(self):
+        """Svuota completamente la cache (soglie e cooldown)."""
+        with self._lock:
+            self._thresholds = None
+            self._last_notified.clear()
+
+    def stats(self) -> dict:
+        """Restituisce le statistiche della cache."""
+        with self._lock:
+            result = dict(self._stats)
+            result['agents'] = len(self._thresholds) if self._thresholds is not None else 0
+            result['cooldown_keys'] = len(self._last_notified)
+        return result
@@ -0,0 +1,113 @@
+"""
+Formati compatti dei report inviati dagli agent.
+Oltre al JSON classico il server accetta corpi compressi (Content-Encoding
+gzip o deflate) e un frame binario a dimensione fissa
+(Content-Type: application/vnd.netmaster.sample) che contiene solo
+agent_id e metriche: i dati statici dell'host (system, node, release,
+version) vengono inviati una sola volta alla registrazione e poi
+referenziati tramite agent_id.
+"""
+
+import json
+import struct
+import zlib
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_FRAME = 'application/vnd.netmaster.sample'
+
+# Frame binario little-endian: magic, versione, agent_id, cpu, memoria, disco (19 byte)
+FRAME = struct.Struct('<2sBIfff')
+FRAME_MAGIC = b'NM'
+FRAME_VERSION = 1
+
+# wbits di zlib per ciascuna Content-Encoding supportata
+_ENCODING_WBITS = {
+    'gzip': 31,
+    'x-gzip': 31,
+    'deflate': 15,
+}
+
+class WireFormatError(ValueError):
+    """Eccezione sollevata per corpi non decodificabili o troppo grandi."""
+    pass
+
+def compress(raw: bytes, content_encoding: str) -> bytes:
+    """Comprime un corpo con la Content-Encoding indicata (gzip o deflate)."""
+    wbits = _ENCODING_WBITS.get(content_encoding)
+    if wbits is None:
+        raise WireFormatError(f"Content-Encoding non supportato: {content_encoding}")
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    return compressor.compress(raw) + compressor.flush()
+
+def decompress(raw: bytes, content_encoding: str, max_bytes: int) -> bytes:
+    """
+    Decomprime un corpo secondo la sua Content-Encoding, senza mai espandere
+    più di `max_bytes` in memoria.
+
+    Raises:
+        WireFormatError: Se la codifica non è supportata, il corpo è corrotto
+            o supera max_bytes
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        if len(raw) > max_bytes:
+            raise WireFormatError(f"Corpo troppo grande (massimo {max_bytes} byte)")
+        return raw
+    wbits = _ENCODING_WBITS.get(encoding)
+    if wbits is None:
+        raise WireFormatError(f"Content-Encoding non supportato: {encoding}")
+    # Alcuni client inviano deflate senza intestazione zlib
+    for attempt in ((wbits, -15) if encoding == 'deflate' else (wbits,)):
+        decompressor = zlib.decompressobj(wbits=attempt)
+        try:
+            data = decompressor.decompress(raw, max_bytes + 1)
+        except zlib.error as e:
+            error = e
+            continue
+        if len(data) > max_bytes or decompressor.unconsumed_tail:
+            raise WireFormatError(f"Corpo troppo grande (massimo {max_bytes} byte decompressi)")
+        return data
+    raise WireFormatError(f"Corpo {encoding} non valido: {error}")
+
+def encode_frame(agent_id: int, data: dict) -> bytes:
+    """Codifica metriche e agent_id in un frame binario."""
+    return FRAME.pack(FRAME_MAGIC, FRAME_VERSION, agent_id,
+                      data['cpu_usage'], data['memory'], data['disk'])
+
+def decode_frame(raw: bytes) -> dict:
+    """
+    Decodifica un frame binario in un report compatto (con agent_id).
+
+    Raises:
+        WireFormatError: Se il frame non è valido
+    """
+    if len(raw) != FRAME.size:
+        raise WireFormatError(f"Frame di {len(raw)} byte, attesi {FRAME.size}")
+    magic, version, agent_id, cpu, memory, disk = FRAME.unpack(raw)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise WireFormatError("Frame non riconosciuto")
+    # float32 sul filo: due decimali bastano per delle percentuali
+    return {
+        'agent_id': agent_id,
+        'cpu_usage': round(cpu, 2),
+        'memory': round(memory, 2),
+        'disk': round(disk, 2),
+    }
+
+def decode_report(raw: bytes, content_type: str, content_encoding: str, max_bytes: int):
+    """
+    Decodifica il corpo di un report in base a Content-Type e Content-Encoding.
+
+    Returns:
+        Il report decodificato (dict per i frame, qualsiasi valore JSON altrimenti)
+
+    Raises:
+        WireFormatError: Se il corpo non è decodificabile
+    """
+    raw = decompress(raw, content_encoding, max_bytes)
+    if content_type == CONTENT_TYPE_FRAME:
+        return decode_frame(raw)
+    try:
+        return json.loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        raise WireFormatError("JSON non valido")
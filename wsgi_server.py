@@ -0,0 +1,555 @@
+"""
+Modulo per il server WSGI di produzione (pre-fork).
+Il processo master apre il socket di ascolto e avvia `workers` processi figli;
+ogni worker serve le richieste con un pool di `threads` thread, mantiene aperte
+le connessioni HTTP/1.1 (keep-alive) e, se configurato, termina il TLS con il
+contesto di ssl_manager. Un worker accetta una nuova connessione solo quando ha
+un thread libero, così le connessioni in eccesso restano nella coda del kernel
+e vengono prese dagli altri worker.
+
+Segnali gestiti dal master:
+    SIGTERM / SIGINT  arresto graceful (i worker completano le richieste in corso)
+    SIGHUP            reload graceful: avvia nuovi worker, poi arresta i vecchi
+
+Se l'applicazione è indicata come stringa 'modulo:attributo' viene importata
+dai worker dopo il fork: i servizi in background avviati all'import (coda di
+ingestione, notifiche, retention) girano così in ogni worker e il reload carica
+il codice aggiornato. Il worker esce con os._exit, che non esegue atexit: prima
+chiama la funzione shutdown_services() del modulo dell'applicazione, se esiste.
+
+Richiede os.fork() e SIGHUP: su Windows usare il server threaded.
+
+Uso da riga di comando:
+    python wsgi_server.py server_integrated:app --bind 0.0.0.0:5000 --workers 4 --threads 8
+"""
+
+import os
+import sys
+import time
+import errno
+import signal
+import socket
+import ssl
+import select
+import logging
+import argparse
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Union
+
+from werkzeug.exceptions import InternalServerError
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKLOG = 1024
+
+# Il pre-fork richiede os.fork() e SIGHUP (non disponibili su Windows)
+PREFORK_SUPPORTED = hasattr(os, 'fork') and hasattr(signal, 'SIGHUP')
+
+# Funzione del modulo dell'applicazione che arresta i servizi in background
+SHUTDOWN_HOOK = 'shutdown_services'
+
+def load_app(target: Union[str, Callable]) -> Callable:
+    """Restituisce l'applicazione WSGI, importandola se indicata come 'modulo:attributo'."""
+    if callable(target):
+        return target
+    module_name, _, attribute = target.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute or 'app')
+
+def find_shutdown_hook(target: Union[str, Callable]) -> Optional[Callable]:
+    """
+    Restituisce la funzione SHUTDOWN_HOOK del modulo che definisce l'applicazione
+    (per un'app Flask il modulo indicato da import_name), o None se assente.
+    """
+    if callable(target):
+        module_name = getattr(target, 'import_name', None) or getattr(target, '__module__', None)
+    else:
+        module_name = target.partition(':')[0]
+    module = sys.modules.get(module_name) if module_name else None
+    hook = getattr(module, SHUTDOWN_HOOK, None)
+    return hook if callable(hook) else None
+
+def create_listen_socket(host: str, port: int, backlog: int = DEFAULT_BACKLOG) -> socket.socket:
+    """Apre il socket di ascolto condiviso dai worker."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    # Più worker attendono sullo stesso socket: accept() non deve bloccare
+    # il worker che ha perso la connessione a favore di un altro.
+    sock.setblocking(False)
+    sock.set_inheritable(True)
+    return sock
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Handler werkzeug con keep-alive HTTP/1.1.
+
+    Il server di sviluppo di werkzeug chiude ogni connessione e, dopo ogni
+    risposta, scarta per 10 ms quanto arriva sul socket (che con il keep-alive
+    sarebbe la richiesta successiva). Qui il corpo con Content-Length viene
+    limitato e consumato dopo la risposta, così la richiesta successiva sulla
+    stessa connessione parte dal punto giusto; le richieste con corpo chunked
+    o con 'Connection: close' chiudono la connessione.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    keepalive = True
+    timeout = 5.0  # attesa della richiesta successiva (sostituito per server)
+
+    def handle_one_request(self):
+        if not self._wait_for_request():
+            self.close_connection = True
+            return
+        super().handle_one_request()
+
+    def _wait_for_request(self) -> bool:
+        """
+        Attende la prossima richiesta sulla connessione (la prima o la successiva in keep-alive).
+
+        Restituisce False (connessione da chiudere) allo scadere del timeout, se
+        il client ha chiuso o se il server è saturo: una connessione inattiva non
+        deve occupare un thread mentre altre connessioni attendono.
+        """
+        deadline = time.monotonic() + self.timeout
+        readable = False
+        while True:
+            # Lettura non bloccante: vede anche i dati già nel buffer di rfile o di TLS
+            self.connection.setblocking(False)
+            try:
+                if self.rfile.peek(1):
+                    return True
+            except ssl.SSLWantReadError:
+                pass
+            except OSError:
+                return False
+            finally:
+                self.connection.settimeout(self.timeout)
+            remaining = deadline - time.monotonic()
+            if readable or remaining <= 0:
+                return False  # readable senza dati: il client ha chiuso
+            readable = bool(select.select([self.connection], [], [], min(remaining, 0.1))[0])
+            if not readable and self.server.saturated():
+                return False
+
+    def make_environ(self):
+        environ = super().make_environ()
+        self._body = None
+        if not self.keepalive or 'wsgi.input_terminated' in environ:
+            self.close_connection = True
+        elif environ.get('CONTENT_LENGTH'):
+            try:
+                self._body = LimitedStream(self.rfile, int(environ['CONTENT_LENGTH']))
+                environ['wsgi.input'] = self._body
+            except ValueError:
+                self.close_connection = True
+        return environ
+
+    def run_wsgi(self):
+        if self.headers.get('Expect', '').lower().strip() == '100-continue':
+            self.wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        self.environ = environ = self.make_environ()
+        response = {'status': None, 'headers': None, 'sent': False, 'chunked': False}
+
+        def write(data: bytes):
+            if not response['sent']:
+                code, _, message = response['status'].partition(' ')
+                code = int(code)
+                self.send_response(code, message)
+                names = set()
+                for name, value in response['headers']:
+                    self.send_header(name, value)
+                    names.add(name.lower())
+                if 'content-length' not in names and environ['REQUEST_METHOD'] != 'HEAD' \
+                        and not 100 <= code < 200 and code not in (204, 304):
+                    response['chunked'] = True
+                    self.send_header('Transfer-Encoding', 'chunked')
+                if not self.close_connection and self.server.saturated():
+                    self.close_connection = True
+                if self.close_connection:
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                response['sent'] = True
+            if data:
+                if response['chunked']:
+                    data = b'%x\r\n%s\r\n' % (len(data), data)
+                self.wfile.write(data)
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info:
+                try:
+                    if response['sent']:
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            elif response['status'] is not None:
+                raise AssertionError("Headers already set")
+            response['status'], response['headers'] = status, headers
+            return write
+
+        def execute(app):
+            application_iter = app(environ, start_response)
+            try:
+                for data in application_iter:
+                    write(data)
+                if not response['sent']:
+                    write(b'')
+                if response['chunked']:
+                    self.wfile.write(b'0\r\n\r\n')
+            finally:
+                if hasattr(application_iter, 'close'):
+                    application_iter.close()
+
+        try:
+            execute(self.server.app)
+        except (ConnectionError, socket.timeout) as e:
+            self.close_connection = True
+            self.connection_dropped(e, environ)
+            return
+        except Exception:
+            self.close_connection = True
+            if self.server.passthrough_errors:
+                raise
+            logger.error(f"[WSGI] Errore durante la richiesta {self.requestline!r}", exc_info=True)
+            if not response['sent']:
+                response['status'] = None
+                execute(InternalServerError())
+            return
+
+        if self._body is not None and not self.close_connection:
+            self._body.exhaust()
+
+class PoolWSGIServer(BaseWSGIServer):
+    """Server WSGI con pool di thread limitato, keep-alive e handshake TLS nei thread."""
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app: Callable, threads: int = 8,
+                 keepalive: float = 5.0, ssl_context=None, fd: Optional[int] = None,
+                 multiprocess: bool = False):
+        """
+        Inizializza il server.
+
+        Args:
+            host: Indirizzo di ascolto
+            port: Porta di ascolto
+            app: Applicazione WSGI
+            threads: Thread del pool (connessioni servite contemporaneamente)
+            keepalive: Secondi di attesa della richiesta successiva sulla stessa
+                       connessione (0 disabilita il keep-alive)
+            ssl_context: ssl.SSLContext lato server, o None per HTTP
+            fd: Descrittore di un socket di ascolto già aperto (worker pre-fork)
+            multiprocess: Valore di wsgi.multiprocess
+        """
+        handler = type('KeepAliveRequestHandler', (KeepAliveRequestHandler,), {
+            'keepalive': keepalive > 0,
+            'timeout': keepalive if keepalive > 0 else KeepAliveRequestHandler.timeout,
+        })
+        self.multiprocess = multiprocess
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        # Il contesto non avvolge il socket di ascolto: l'handshake avviene nel
+        # thread del pool, così un client lento non blocca l'accept.
+        self.ssl_context = ssl_context
+        self.socket.setblocking(False)
+
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(threads)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {'connections': 0, 'active': 0, 'errors': 0}
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        """Accetta connessioni finché non viene chiamato stop()."""
+        while not self._stopping.is_set():
+            if not self._slots.acquire(timeout=poll_interval):
+                continue
+            try:
+                readable, _, _ = select.select([self.socket], [], [], poll_interval)
+                if not readable or self._stopping.is_set():
+                    self._slots.release()
+                    continue
+                conn, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                # Connessione già accettata da un altro worker
+                self._slots.release()
+                continue
+            except OSError as e:
+                self._slots.release()
+                if self._stopping.is_set():
+                    break
+                if e.errno in (errno.EMFILE, errno.ENFILE):
+                    logger.error(f"[WSGI] Limite di file aperti raggiunto: {e}")
+                    time.sleep(poll_interval)
+                    continue
+                raise
+            conn.setblocking(True)
+            self._increment('connections')
+            self._increment('active')
+            self._executor.submit(self._serve_connection, conn, address)
+
+    def _serve_connection(self, conn: socket.socket, address):
+        try:
+            if self.ssl_context is not None:
+                conn.settimeout(self.RequestHandlerClass.timeout or 30)
+                conn = self.ssl_context.wrap_socket(conn, server_side=True)
+            self.finish_request(conn, address)
+        except Exception:
+            self._increment('errors')
+            logger.debug(f"[WSGI] Connessione {address} terminata con errore", exc_info=True)
+        finally:
+            self.shutdown_request(conn)
+            self._increment('active', -1)
+            self._slots.release()
+
+    def saturated(self) -> bool:
+        """True se tutti i thread sono occupati e ci sono connessioni in attesa di accept."""
+        if self.stats()['active'] < self.threads:
+            return False
+        try:
+            return bool(select.select([self.socket], [], [], 0)[0])
+        except (OSError, ValueError):
+            return False
+
+    def stop(self, timeout: float = 30.0) -> bool:
+        """
+        Smette di accettare connessioni e attende quelle in corso.
+
+        Returns:
+            bool: True se tutte le connessioni sono terminate entro timeout
+        """
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.stats()['active'] == 0:
+                break
+            time.sleep(0.05)
+        drained = self.stats()['active'] == 0
+        self._executor.shutdown(wait=drained)
+        return drained
+
+    def stats(self) -> dict:
+        """Restituisce connessioni accettate, attive ed errori."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _increment(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+class PreforkServer:
+    """Processo master: apre il socket, avvia i worker e li sostituisce se terminano."""
+
+    def __init__(self, app: Union[str, Callable], host: str = '0.0.0.0', port: int = 5000,
+                 workers: int = None, threads: int = None, keepalive: float = None,
+                 ssl_context=None, graceful_timeout: float = None,
+                 backlog: int = DEFAULT_BACKLOG):
+        """
+        Inizializza il master.
+
+        Args:
+            app: Applicazione WSGI o stringa 'modulo:attributo' importata nei worker
+            host: Indirizzo di ascolto
+            port: Porta di ascolto
+            workers: Numero di processi worker
+            threads: Thread per worker
+            keepalive: Secondi di attesa keep-alive (0 disabilita)
+            ssl_context: ssl.SSLContext lato server, o None per HTTP
+            graceful_timeout: Secondi concessi ai worker per terminare le richieste in corso
+            backlog: Lunghezza della coda di connessioni del socket di ascolto
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or int(os.getenv('MAX_WORKERS', 4))
+        self.threads = threads or int(os.getenv('NETMASTER_WORKER_THREADS', 8))
+        self.keepalive = keepalive if keepalive is not None else \
+            float(os.getenv('NETMASTER_KEEPALIVE_S', 5))
+        self.ssl_context = ssl_context
+        self.graceful_timeout = graceful_timeout if graceful_timeout is not None else \
+            float(os.getenv('NETMASTER_GRACEFUL_TIMEOUT_S', 30))
+        self.backlog = backlog
+
+        self.socket = None
+        self._workers: Dict[int, int] = {}  # pid -> indice del worker
+        self._stopping = False
+        self._reload_requested = False
+
+    # --- Master ---
+
+    def bind(self):
+        """Apre il socket di ascolto (chiamato da run() se non già fatto)."""
+        if self.socket is None:
+            self.socket = create_listen_socket(self.host, self.port, self.backlog)
+            self.port = self.socket.getsockname()[1]
+        return self.socket
+
+    def run(self):
+        """Avvia i worker e resta in attesa dei segnali fino all'arresto."""
+        if not PREFORK_SUPPORTED:
+            raise RuntimeError("Server pre-fork non supportato su questa piattaforma (richiede os.fork)")
+        self.bind()
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        scheme = 'https' if self.ssl_context is not None else 'http'
+        logger.info(f"[WSGI] Master {os.getpid()} in ascolto su {scheme}://{self.host}:{self.port} "
+                    f"({self.workers} worker x {self.threads} thread, keep-alive {self.keepalive}s)")
+        for index in range(self.workers):
+            self._spawn_worker(index)
+
+        try:
+            while not self._stopping:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self._reload()
+                self._reap_workers(respawn=True)
+                time.sleep(0.2)
+        finally:
+            self._stop_workers(list(self._workers))
+            self.socket.close()
+            logger.info("[WSGI] Master arrestato")
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _spawn_worker(self, index: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                self._worker_main(index)
+            except BaseException:
+                logger.critical(f"[WSGI] Worker {index} terminato con errore", exc_info=True)
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self._workers[pid] = index
+        logger.info(f"[WSGI] Avviato worker {index} (pid {pid})")
+        return pid
+
+    def _reap_workers(self, respawn: bool):
+        """Raccoglie i worker terminati e, se richiesto, li sostituisce."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self._workers.pop(pid, None)
+            if index is None:
+                continue
+            if respawn and not self._stopping:
+                logger.warning(f"[WSGI] Worker {index} (pid {pid}) terminato "
+                               f"(stato {os.waitstatus_to_exitcode(status)}), riavvio")
+                self._spawn_worker(index)
+
+    def _reload(self):
+        """Avvia una nuova generazione di worker e arresta gradualmente la precedente."""
+        old = list(self._workers)
+        logger.info(f"[WSGI] Reload: sostituzione di {len(old)} worker")
+        for index in range(self.workers):
+            self._spawn_worker(index)
+        self._stop_workers(old)
+
+    def _stop_workers(self, pids):
+        """Invia SIGTERM ai worker e attende la loro uscita (SIGKILL dopo graceful_timeout)."""
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 1
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+                    self._workers.pop(pid, None)
+            time.sleep(0.05)
+        for pid in remaining:
+            logger.warning(f"[WSGI] Worker {pid} non terminato entro {self.graceful_timeout}s, SIGKILL")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self._workers.pop(pid, None)
+
+    # --- Worker ---
+
+    def _worker_main(self, index: int):
+        """Corpo del processo worker."""
+        os.environ['NETMASTER_WORKER_ID'] = str(index)
+        # L'applicazione dimensiona sul pool le risorse che occupano un thread (stream SSE)
+        os.environ['NETMASTER_WORKER_THREADS'] = str(self.threads)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        app = load_app(self.app)
+        server = PoolWSGIServer(self.host, self.port, app, threads=self.threads,
+                                keepalive=self.keepalive, ssl_context=self.ssl_context,
+                                fd=self.socket.fileno(), multiprocess=self.workers > 1)
+        signal.signal(signal.SIGTERM, lambda signum, frame: server._stopping.set())
+        server.serve_forever(poll_interval=0.2)
+
+        if not server.stop(self.graceful_timeout):
+            logger.warning(f"[WSGI] Worker {index}: connessioni ancora aperte allo scadere del timeout")
+        # os._exit non esegue atexit: la coda di ingestione, le notifiche e il
+        # pool SQLite dell'applicazione vengono arrestati esplicitamente
+        shutdown = find_shutdown_hook(app)
+        if shutdown is not None:
+            try:
+                shutdown()
+            except Exception:
+                logger.error(f"[WSGI] Worker {index}: errore nell'arresto dei servizi", exc_info=True)
+
+def main(argv=None):
+    """Avvio da riga di comando."""
+    parser = argparse.ArgumentParser(description='NetMaster - server WSGI pre-fork')
+    parser.add_argument('app', nargs='?', default='server_integrated:app',
+                        help="Applicazione WSGI come 'modulo:attributo'")
+    parser.add_argument('--bind', default='0.0.0.0:5000', help='Indirizzo host:porta')
+    parser.add_argument('--workers', type=int, default=None, help='Processi worker')
+    parser.add_argument('--threads', type=int, default=None, help='Thread per worker')
+    parser.add_argument('--keepalive', type=float, default=None, help='Secondi di keep-alive')
+    parser.add_argument('--graceful-timeout', type=float, default=None,
+                        help='Secondi concessi alle richieste in corso all\'arresto')
+    parser.add_argument('--certfile', help='Certificato TLS (abilita HTTPS)')
+    parser.add_argument('--keyfile', help='Chiave privata TLS')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(process)d - %(levelname)s - %(message)s')
+    host, _, port = args.bind.rpartition(':')
+
+    ssl_context = None
+    if args.certfile:
+        import ssl_manager
+        ssl_mgr = ssl_manager.SSLManager(os.path.dirname(args.certfile) or '.')
+        ssl_mgr.cert_file = args.certfile
+        ssl_mgr.key_file = args.keyfile or args.certfile
+        ssl_context = ssl_mgr.get_ssl_context()
+
+    sys.path.insert(0, os.getcwd())
+    PreforkServer(args.app, host=host.strip('[]') or '0.0.0.0', port=int(port),
+                  workers=args.workers, threads=args.threads, keepalive=args.keepalive,
+                  ssl_context=ssl_context, graceful_timeout=args.graceful_timeout).run()
+
+if __name__ == '__main__':
+    main()